@@ -0,0 +1,57 @@
+"""Helpers shared by the benchmark scripts."""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+def add_repo_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--repo",
+        type=Path,
+        default=REPO,
+        help="Checkout to benchmark, e.g. an older commit checked out with `git worktree add`. Defaults to this one.",
+    )
+
+
+def use_repo(repo: Path) -> None:
+    """Makes `mediaflow_proxy` importable from the given checkout."""
+    sys.path.insert(0, str(repo.resolve()))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args: list, repo: Path, port: int, env: Optional[dict] = None) -> subprocess.Popen:
+    """Starts a server process with `mediaflow_proxy` importable from `repo`, and waits until it accepts connections."""
+    process_env = {**os.environ, "PYTHONPATH": str(repo.resolve()), **(env or {})}
+    process = subprocess.Popen([sys.executable, *args], cwd=repo, env=process_env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}: {args}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Server did not start: {args}")
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
@@ -0,0 +1,172 @@
+"""
+Cost of the application's middleware stack on streamed responses.
+
+Two measurements:
+
+- end to end: a local origin serves a file in 64 KiB chunks, the application runs under uvicorn, and the file is
+  downloaded through `/proxy/stream`, all over loopback. Reports the throughput and the CPU time of the proxy
+  process per GB.
+- dispatch: a route streaming 64 KiB chunks is added to the application and driven through its ASGI stack with a
+  no-op `send`, next to the same route on an application without middlewares. Reports the time per chunk, which
+  isolates what the middlewares add to every chunk.
+
+Run from the repository root:
+
+    python benchmarks/asgi_middleware.py
+    git worktree add /tmp/before <commit> && python benchmarks/asgi_middleware.py --repo /tmp/before
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+import psutil
+
+from _util import add_repo_argument, free_port, start_server, stop_server, use_repo
+
+CHUNK_SIZE = 64 * 1024
+
+
+def serve_origin(port: int, size_mib: int) -> None:
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.responses import StreamingResponse
+    from starlette.routing import Route
+
+    chunk = b"x" * CHUNK_SIZE
+    size = size_mib * 1024 * 1024
+
+    async def file(request):
+        async def body():
+            for _ in range(size // CHUNK_SIZE):
+                yield chunk
+
+        headers = {"content-length": str(size), "content-type": "video/mp4"}
+        return StreamingResponse(body(), headers=headers)
+
+    uvicorn.run(Starlette(routes=[Route("/file.mp4", file)]), port=port, log_level="warning")
+
+
+def end_to_end(repo, size_mib: int, runs: int) -> tuple[float, float]:
+    origin_port, proxy_port = free_port(), free_port()
+    origin = start_server([__file__, "--serve-origin", str(origin_port), "--size", str(size_mib)], repo, origin_port)
+    proxy = start_server(
+        ["-m", "uvicorn", "mediaflow_proxy.main:app", "--port", str(proxy_port), "--log-level", "warning"],
+        repo,
+        proxy_port,
+        {"API_PASSWORD": "", "LOG_LEVEL": "WARNING"},
+    )
+    try:
+        proxy_process = psutil.Process(proxy.pid)
+        url = f"http://127.0.0.1:{proxy_port}/proxy/stream"
+        params = {"d": f"http://127.0.0.1:{origin_port}/file.mp4"}
+        best_rate, best_cpu = 0.0, float("inf")
+        with httpx.Client(timeout=60) as client:
+            for _ in range(runs):
+                cpu_before = sum(proxy_process.cpu_times()[:2])
+                started = time.perf_counter()
+                received = 0
+                with client.stream("GET", url, params=params) as response:
+                    response.raise_for_status()
+                    for data in response.iter_raw(1024 * 1024):
+                        received += len(data)
+                elapsed = time.perf_counter() - started
+                cpu = sum(proxy_process.cpu_times()[:2]) - cpu_before
+                best_rate = max(best_rate, received / elapsed / 1e6)
+                best_cpu = min(best_cpu, cpu / (received / 1e9))
+        return best_rate, best_cpu
+    finally:
+        stop_server(proxy)
+        stop_server(origin)
+
+
+async def dispatch(app, chunks: int) -> float:
+    """Returns the seconds per chunk of a streamed response driven through the ASGI stack of `app`."""
+    received = 0
+
+    async def receive():
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal received
+        if message["type"] == "http.response.body":
+            received += len(message.get("body", b""))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/proxy/benchmark",
+        "raw_path": b"/proxy/benchmark",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 1),
+        "server": ("localhost", 80),
+    }
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    elapsed = time.perf_counter() - started
+    assert received == chunks * CHUNK_SIZE, received
+    return elapsed / chunks
+
+
+def dispatch_costs(chunks: int, runs: int) -> tuple[float, float]:
+    from fastapi import FastAPI
+    from starlette.responses import StreamingResponse
+
+    from mediaflow_proxy.main import app
+
+    chunk = b"x" * CHUNK_SIZE
+
+    async def stream():
+        async def body():
+            for _ in range(chunks):
+                yield chunk
+
+        return StreamingResponse(body())
+
+    bare = FastAPI()
+    for target in (app, bare):
+        target.add_api_route("/proxy/benchmark", stream)
+        # Ahead of the static files mounted at the root
+        target.router.routes.insert(0, target.router.routes.pop())
+
+    async def measure():
+        return [min([await dispatch(target, chunks) for _ in range(runs)]) for target in (app, bare)]
+
+    return tuple(asyncio.run(measure()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_repo_argument(parser)
+    parser.add_argument("--size", type=int, default=1024, help="MiB downloaded per end to end run. Default: 1024.")
+    parser.add_argument("--chunks", type=int, default=20000, help="Chunks per dispatch run. Default: 20000.")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per measurement, the best is kept. Default: 3.")
+    parser.add_argument("--serve-origin", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_origin:
+        serve_origin(args.serve_origin, args.size)
+        return
+
+    use_repo(args.repo)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    rate, cpu = end_to_end(args.repo, args.size, args.runs)
+    print(f"end to end /proxy/stream: {rate:7.0f} MB/s, proxy CPU {cpu:.2f} s/GB")
+    with_middlewares, without = dispatch_costs(args.chunks, args.runs)
+    print(
+        f"dispatch per 64 KiB chunk: {with_middlewares * 1e6:6.2f} us with the middlewares, "
+        f"{without * 1e6:6.2f} us without ({(with_middlewares - without) * 1e6:.2f} us added)"
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
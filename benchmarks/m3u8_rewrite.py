@@ -0,0 +1,87 @@
+"""
+Time taken by `M3U8Processor` to rewrite large IPTV playlists.
+
+An `m3u_plus` playlist of `#EXTINF` and `.ts` lines is streamed through `process_m3u8_streaming` in 64 KiB chunks,
+as a `/proxy/hls/manifest.m3u8` request with proxy headers would, and the rewrite time per entry is reported.
+
+Run from the repository root:
+
+    python benchmarks/m3u8_rewrite.py
+    git worktree add /tmp/before <commit> && python benchmarks/m3u8_rewrite.py --repo /tmp/before
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import time
+
+from _util import add_repo_argument, use_repo
+
+PLAYLIST_URL = "http://iptv.example.com:8080/get.php?type=m3u_plus"
+QUERY_STRING = (
+    "d=http%3A%2F%2Fiptv.example.com%3A8080%2Fget.php%3Ftype%3Dm3u_plus&api_password=secret"
+    "&h_user-agent=VLC%2F3.0&h_referer=http%3A%2F%2Fexample.com%2F&r_content-type=audio"
+)
+
+
+def playlist(entries: int) -> bytes:
+    lines = ["#EXTM3U"]
+    for i in range(entries):
+        lines.append(
+            f'#EXTINF:-1 tvg-id="ch{i}" tvg-name="Channel {i}" tvg-logo="http://logo.example.com/{i}.png" '
+            f'group-title="Group {i % 20}",Channel {i}'
+        )
+        lines.append(f"http://iptv.example.com:8080/live/user/pass/{i}.ts")
+    return ("\n".join(lines) + "\n").encode()
+
+
+async def chunks(content: bytes, size: int = 64 * 1024):
+    for offset in range(0, len(content), size):
+        yield content[offset : offset + size]
+
+
+async def rewrite(content: bytes) -> tuple[float, str]:
+    from starlette.requests import Request
+
+    from mediaflow_proxy.main import app
+    from mediaflow_proxy.utils.m3u8_processor import M3U8Processor
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "scheme": "http",
+        "server": ("localhost", 8888),
+        "path": "/proxy/hls/manifest.m3u8",
+        "root_path": "",
+        "query_string": QUERY_STRING.encode(),
+        "headers": [(b"host", b"localhost:8888")],
+        "app": app,
+        "router": app.router,
+    }
+    processor = M3U8Processor(Request(scope))
+    started = time.perf_counter()
+    output = [part async for part in processor.process_m3u8_streaming(chunks(content), PLAYLIST_URL)]
+    return time.perf_counter() - started, "".join(output)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_repo_argument(parser)
+    parser.add_argument("--entries", type=int, nargs="+", default=[5000, 50000], help="Playlist sizes to rewrite.")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per playlist, the best is kept. Default: 5.")
+    args = parser.parse_args()
+
+    use_repo(args.repo)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    for entries in args.entries:
+        content = playlist(entries)
+        results = [asyncio.run(rewrite(content)) for _ in range(args.runs)]
+        best = min(elapsed for elapsed, _ in results)
+        digest = hashlib.md5(results[0][1].encode()).hexdigest()[:12]
+        print(f"{entries:7,} entries: {best * 1000:8.1f} ms ({best / entries * 1e6:5.1f} us/entry), output {digest}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Throughput and CPU cost of `EnhancedStreamingResponse` for bodies produced in small chunks.
+
+A server process streams a body made of chunks of a given size through `EnhancedStreamingResponse` under uvicorn,
+and the body is downloaded over loopback. Each upstream chunk size is measured with the output merging disabled
+(`STREAM_OUTPUT_CHUNK_SIZE=0`) and with the configured merging. Reports the throughput and the CPU time of the
+server process per GB.
+
+Run from the repository root:
+
+    python benchmarks/stream_output.py
+"""
+
+import argparse
+import sys
+import time
+
+import httpx
+import psutil
+
+from _util import add_repo_argument, free_port, start_server, stop_server
+
+
+def serve(port: int, chunk_size: int, size_mib: int) -> None:
+    import uvicorn
+    from fastapi import FastAPI
+
+    from mediaflow_proxy.utils.http_utils import EnhancedStreamingResponse
+
+    app = FastAPI()
+    chunk = b"x" * chunk_size
+    count = size_mib * 1024 * 1024 // chunk_size
+
+    @app.get("/stream")
+    async def stream():
+        async def body():
+            for _ in range(count):
+                yield chunk
+
+        return EnhancedStreamingResponse(body(), headers={"content-type": "video/mp4"})
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", http="h11")
+
+
+def measure(repo, chunk_size: int, size_mib: int, runs: int, env: dict) -> tuple[float, float]:
+    port = free_port()
+    args = [__file__, "--serve", str(port), "--chunk-size", str(chunk_size), "--size", str(size_mib)]
+    server = start_server(args, repo, port, {"LOG_LEVEL": "WARNING", **env})
+    try:
+        process = psutil.Process(server.pid)
+        best_rate, best_cpu = 0.0, float("inf")
+        with httpx.Client(timeout=60) as client:
+            for _ in range(runs):
+                cpu_before = sum(process.cpu_times()[:2])
+                started = time.perf_counter()
+                received = 0
+                with client.stream("GET", f"http://127.0.0.1:{port}/stream") as response:
+                    for data in response.iter_raw(1024 * 1024):
+                        received += len(data)
+                elapsed = time.perf_counter() - started
+                cpu = sum(process.cpu_times()[:2]) - cpu_before
+                assert received == size_mib * 1024 * 1024 // chunk_size * chunk_size, received
+                best_rate = max(best_rate, received / elapsed / 1e6)
+                best_cpu = min(best_cpu, cpu / (received / 1e9))
+        return best_rate, best_cpu
+    finally:
+        stop_server(server)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_repo_argument(parser)
+    parser.add_argument("--size", type=int, default=1024, help="MiB downloaded per run. Default: 1024.")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per measurement, the best is kept. Default: 3.")
+    parser.add_argument(
+        "--chunk-sizes", type=int, nargs="+", default=[4096, 16384, 65536], help="Upstream chunk sizes in bytes."
+    )
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    parser.add_argument("--chunk-size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.chunk_size, args.size)
+        return
+
+    print(f"{'upstream chunk':>14}  {'merging disabled':>26}  {'merging enabled':>26}")
+    for chunk_size in args.chunk_sizes:
+        results = [
+            measure(args.repo, chunk_size, args.size, args.runs, env) for env in ({"STREAM_OUTPUT_CHUNK_SIZE": "0"}, {})
+        ]
+        columns = "  ".join(f"{rate:8.0f} MB/s, CPU {cpu:5.2f} s/GB" for rate, cpu in results)
+        print(f"{chunk_size // 1024:>10} KiB  {columns}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
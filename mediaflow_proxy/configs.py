@@ -1,4 +1,4 @@
-from typing import Dict, Literal, Optional, Union
+from typing import Callable, Dict, Literal, Optional, Union
 
 import httpx
 from pydantic import BaseModel, Field
@@ -27,41 +27,59 @@ class TransportConfig(BaseSettings):
         default_factory=dict, description="Pattern-based route configuration"
     )
     timeout: int = Field(60, description="Timeout for HTTP requests in seconds")
+    max_connections: int = Field(200, description="Maximum number of pooled connections per transport route")
+    max_keepalive_connections: int = Field(
+        50, description="Maximum number of idle keep-alive connections kept per transport route"
+    )
+    keepalive_expiry: float = Field(30.0, description="Seconds an idle keep-alive connection is kept open")
+    max_connections_per_host: int = Field(
+        0, description="Maximum concurrent upstream connections per origin host (0 disables the limit)"
+    )
+    host_connection_limits: Dict[str, int] = Field(
+        default_factory=dict, description="Per origin host overrides of max_connections_per_host"
+    )
+    enable_http2: bool = Field(False, description="Negotiate HTTP/2 with origins that support it (requires h2)")
 
     def get_mounts(
-        self, async_http: bool = True
+        self,
+        async_http: bool = True,
+        transport_factory: Optional[Callable[[Optional[str], bool], httpx.AsyncBaseTransport]] = None,
     ) -> Dict[str, Optional[Union[httpx.HTTPTransport, httpx.AsyncHTTPTransport]]]:
         """
         Get a dictionary of httpx mount points to transport instances.
+
+        Args:
+            async_http (bool): Whether to build async transports. Defaults to True.
+            transport_factory (Callable, optional): Builds the transport for a (proxy_url, verify) route.
+                Used to share pooled transports between mounts. Defaults to a new transport per mount.
         """
         mounts = {}
         transport_cls = httpx.AsyncHTTPTransport if async_http else httpx.HTTPTransport
         global_verify = not self.disable_ssl_verification_globally
 
+        def make_transport(proxy: Optional[str], verify: bool):
+            if transport_factory:
+                return transport_factory(proxy, verify)
+            return transport_cls(verify=verify, proxy=proxy)
+
         # Configure specific routes
         for pattern, route in self.transport_routes.items():
-            mounts[pattern] = transport_cls(
-                verify=route.verify_ssl if global_verify else False,
-                proxy=route.proxy_url or self.proxy_url if route.proxy else None,
+            mounts[pattern] = make_transport(
+                route.proxy_url or self.proxy_url if route.proxy else None,
+                route.verify_ssl if global_verify else False,
             )
 
         # Hardcoded configuration for jxoplay.xyz domain - SSL verification disabled
-        mounts["all://jxoplay.xyz"] = transport_cls(
-            verify=False, proxy=self.proxy_url if self.all_proxy else None
-        )
-
-        mounts["all://dlhd.dad"] = transport_cls(
-            verify=False, proxy=self.proxy_url if self.all_proxy else None
-        )
-        
-        mounts["all://*.newkso.ru"] = transport_cls(
-            verify=False, proxy=self.proxy_url if self.all_proxy else None
-        )
+        mounts["all://jxoplay.xyz"] = make_transport(self.proxy_url if self.all_proxy else None, False)
+
+        mounts["all://dlhd.dad"] = make_transport(self.proxy_url if self.all_proxy else None, False)
+
+        mounts["all://*.newkso.ru"] = make_transport(self.proxy_url if self.all_proxy else None, False)
 
         # Apply global settings for proxy and SSL
         default_proxy_url = self.proxy_url if self.all_proxy else None
         if default_proxy_url or not global_verify:
-            mounts["all://"] = transport_cls(proxy=default_proxy_url, verify=global_verify)
+            mounts["all://"] = make_transport(default_proxy_url, global_verify)
 
         # Set default proxy for all routes if enabled
         # This part is now handled above to combine proxy and SSL settings
@@ -77,9 +95,37 @@ class TransportConfig(BaseSettings):
 
 class Settings(BaseSettings):
     api_password: str | None = None  # The password for protecting the API endpoints.
+    encryption_token_format: Literal["cbc", "compact"] = "cbc"  # Format of the generated encrypted tokens.
+    encryption_token_cache_size: int = 4096  # Number of decoded encrypted tokens to keep per worker; 0 disables.
     log_level: str = "INFO"  # The logging level to use.
     transport_config: TransportConfig = Field(default_factory=TransportConfig)  # Configuration for httpx transport.
     enable_streaming_progress: bool = False  # Whether to enable streaming progress tracking.
+    stream_reconnect_attempts: int = 3  # Consecutive range reconnects to resume an interrupted upstream stream.
+    stream_reconnect_backoff: float = 0.5  # Seconds before the first reconnect, doubled on each further attempt.
+    stream_output_chunk_size: int = 64 * 1024  # Bytes small response chunks are merged into; 0 disables merging.
+    stream_output_max_delay: float = 0.02  # Seconds a response chunk may wait to be merged with the next ones.
+    stream_parallel_connections: int = 1  # Concurrent range requests per /proxy/stream response; 1 disables.
+    stream_parallel_chunk_size: int = 4 * 1024 * 1024  # Initial bytes per range request, then adapted to throughput.
+    stream_parallel_buffer_size: int = 64 * 1024 * 1024  # Maximum bytes downloaded ahead of the client per stream.
+    stream_parallel_max_per_origin: int = 16  # Maximum concurrent parallel range requests per origin.
+    stream_range_cache_max_size: int = 0  # Disk bytes for cached /proxy/stream byte ranges; 0 disables.
+    stream_range_cache_revalidate_interval: int = 600  # Seconds cached ranges are served without asking the origin.
+    stream_range_cache_ignored_params: list[str] = [  # Volatile query parameters left out of the range cache keys.
+        "token",
+        "expires",
+        "exp",
+        "signature",
+        "sig",
+        "Policy",
+        "Key-Pair-Id",
+        "X-Amz-Algorithm",
+        "X-Amz-Credential",
+        "X-Amz-Date",
+        "X-Amz-Expires",
+        "X-Amz-SignedHeaders",
+        "X-Amz-Signature",
+        "X-Amz-Security-Token",
+    ]
     disable_home_page: bool = False  # Whether to disable the home page UI.
     disable_docs: bool = False  # Whether to disable the API documentation (Swagger UI).
     disable_speedtest: bool = False  # Whether to disable the speedtest UI.
@@ -87,18 +133,43 @@ class Settings(BaseSettings):
     m3u8_content_routing: Literal["mediaflow", "stremio", "direct"] = (
         "mediaflow"  # Routing strategy for M3U8 content URLs: "mediaflow", "stremio", or "direct"
     )
+    manifest_cache_max_size: int = 32 * 1024 * 1024  # Bytes of rewritten HLS and MPD manifests per worker; 0 disables.
+    hls_channel_sessions: bool = False  # Whether live HLS playlists are followed once per worker for all viewers.
+    hls_channel_idle_timeout: int = 30  # Seconds without requests after which a live channel session ends.
+    hls_channel_live_edge_segments: int = 3  # Segments at the live edge downloaded when a channel session starts.
+    hls_channel_max_memory: int = 256 * 1024 * 1024  # Bytes of channel session downloads kept in memory per worker.
     enable_hls_prebuffer: bool = False  # Whether to enable HLS pre-buffering for improved streaming performance.
     hls_prebuffer_segments: int = 5  # Number of segments to pre-buffer ahead.
     hls_prebuffer_cache_size: int = 50  # Maximum number of segments to cache in memory.
     hls_prebuffer_max_memory_percent: int = 80  # Maximum percentage of system memory to use for HLS pre-buffer cache.
     hls_prebuffer_emergency_threshold: int = 90  # Emergency threshold percentage to trigger aggressive cache cleanup.
+    hls_prebuffer_idle_timeout: int = 60  # Seconds without requests after which a playlist stops being pre-buffered.
+    hls_prebuffer_max_concurrency_per_origin: int = 4  # Maximum concurrent pre-buffer downloads per origin host.
     enable_dash_prebuffer: bool = False  # Whether to enable DASH pre-buffering for improved streaming performance.
     dash_prebuffer_segments: int = 5  # Number of segments to pre-buffer ahead.
     dash_prebuffer_cache_size: int = 50  # Maximum number of segments to cache in memory.
     dash_prebuffer_max_memory_percent: int = 80  # Maximum percentage of system memory to use for DASH pre-buffer cache.
     dash_prebuffer_emergency_threshold: int = 90  # Emergency threshold percentage to trigger aggressive cache cleanup.
+    prebuffer_cache_max_bytes: int = 256 * 1024 * 1024  # Maximum bytes of pre-buffered HLS and DASH segments.
+    prebuffer_playlist_max_bytes: int = 64 * 1024 * 1024  # Maximum bytes of pre-buffered segments per playlist.
+    prebuffer_memory_sample_interval: float = 1.0  # Minimum seconds between two samples of the host memory usage.
     mpd_live_init_cache_ttl: int = 0  # TTL (seconds) for live init segment cache; 0 disables caching.
     mpd_live_playlist_depth: int = 8  # Number of recent segments to expose per live playlist variant.
+    mpd_part_target_duration: float = 1.0  # LL-HLS part duration for live DASH with availabilityTimeOffset; 0 disables.
+    mpd_segment_cache_size: int = 100 * 1024 * 1024  # Bytes of processed DASH segments to cache; 0 disables.
+    mpd_compact_segment_urls: bool = False  # Reference a server-side stream context from MPD playlist segment URLs.
+    mpd_stream_context_ttl: int = 24 * 3600  # Seconds a stream context referenced by segment URLs stays valid.
+    decrypt_executor: Literal["thread", "process", "inline"] = "thread"  # Where DRM decryption runs.
+    decrypt_max_workers: int = 0  # Number of decryption workers; 0 uses the number of CPUs.
+    decrypt_max_queue: int = 32  # Decryption jobs allowed to wait for a worker before callers are held back.
+    decrypt_audio_batch_size: int = 8  # Maximum number of small audio jobs decrypted in one dispatch; 1 disables.
+    decrypt_audio_batch_max_bytes: int = 262144  # Audio jobs up to this size (bytes) are eligible for batching.
+    decrypt_audio_batch_window: float = 0.005  # Seconds to wait for more audio jobs before dispatching a batch.
+    cache_backend: Literal["memory", "shm", "redis"] = "memory"  # Storage for the memory tier of the caches.
+    cache_shm_size: int = 64 * 1024 * 1024  # Maximum size (bytes) of each shared memory cache file.
+    cache_shm_dir: str = "/dev/shm"  # Directory of the shared memory cache files.
+    redis_url: str | None = None  # URL of the Redis-compatible server used by the "redis" cache backend.
+    cache_file_max_size: int = 1024 * 1024 * 1024  # Maximum size (bytes) of each on-disk cache.
 
     user_agent: str = (
         "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36"  # The user agent to use for HTTP requests.
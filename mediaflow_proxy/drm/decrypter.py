@@ -8,6 +8,10 @@ from collections import namedtuple
 import array
 
 CENCSampleAuxiliaryDataFormat = namedtuple("CENCSampleAuxiliaryDataFormat", ["is_encrypted", "iv", "sub_samples"])
+TrackEncryptionInfo = namedtuple(
+    "TrackEncryptionInfo",
+    ["scheme_type", "is_protected", "per_sample_iv_size", "kid", "constant_iv", "crypt_byte_block", "skip_byte_block"],
+)
 
 
 class MP4Atom:
@@ -173,6 +177,8 @@ class MP4Decrypter:
         current_key (Optional[bytes]): Current decryption key.
         trun_sample_sizes (array.array): Array of sample sizes from the 'trun' box.
         current_sample_info (list): List of sample information from the 'senc' box.
+        current_encryption (Optional[TrackEncryptionInfo]): Encryption parameters of the current track fragment.
+        track_encryption (dict[int, TrackEncryptionInfo]): Encryption parameters per track ID, from the 'tenc' box.
         encryption_overhead (int): Total size of encryption-related boxes.
     """
 
@@ -187,7 +193,10 @@ class MP4Decrypter:
         self.current_key = None
         self.trun_sample_sizes = array.array("I")
         self.current_sample_info = []
+        self.current_encryption = None
+        self.track_encryption = {}
         self.encryption_overhead = 0
+        self._current_track_id = None
 
     def decrypt_segment(self, combined_segment: bytes) -> bytes:
         """
@@ -314,6 +323,7 @@ class MP4Decrypter:
         for atom in atoms:
             if atom.atom_type == b"tfhd":
                 tfhd = atom
+                self.current_encryption = self.track_encryption.get(struct.unpack_from(">I", tfhd.data, 4)[0])
                 new_traf_data.extend(atom.pack())
             elif atom.atom_type == b"trun":
                 sample_count = self._process_trun(atom)
@@ -346,21 +356,32 @@ class MP4Decrypter:
         if not self.current_key or not self.current_sample_info:
             return mdat  # Return original mdat if we don't have decryption info
 
-        decrypted_samples = bytearray()
         mdat_data = mdat.data
-        position = 0
+        sample_sizes = self._get_sample_sizes(0, len(self.current_sample_info), len(mdat_data))
+        decrypted_samples = self._decrypt_samples(
+            mdat_data, self.current_sample_info, sample_sizes, self.current_key, self.current_encryption
+        )
 
-        for i, info in enumerate(self.current_sample_info):
-            if position >= len(mdat_data):
-                break  # No more data to process
+        return MP4Atom(b"mdat", len(decrypted_samples) + 8, decrypted_samples)
 
-            sample_size = self.trun_sample_sizes[i] if i < len(self.trun_sample_sizes) else len(mdat_data) - position
-            sample = mdat_data[position : position + sample_size]
-            position += sample_size
-            decrypted_sample = self._process_sample(sample, info, self.current_key)
-            decrypted_samples.extend(decrypted_sample)
+    def _get_sample_sizes(self, start: int, end: int, available: int) -> array.array:
+        """
+        Returns the sizes of samples `start` to `end` of the current track fragment.
 
-        return MP4Atom(b"mdat", len(decrypted_samples) + 8, decrypted_samples)
+        A sample without a size in the 'trun' box takes up the rest of the available data.
+
+        Args:
+            start (int): Index of the first sample.
+            end (int): Index after the last sample.
+            available (int): Number of bytes available for these samples.
+
+        Returns:
+            array.array: The sample sizes.
+        """
+        sample_sizes = array.array("I", self.trun_sample_sizes[start:end])
+        if len(sample_sizes) < end - start:
+            sample_sizes.append(max(0, available - sum(sample_sizes)))
+        return sample_sizes
 
     def _parse_senc(self, senc: MP4Atom, sample_count: int) -> list[CENCSampleAuxiliaryDataFormat]:
         """
@@ -383,13 +404,17 @@ class MP4Decrypter:
             sample_count = struct.unpack_from(">I", data, position)[0]
             position += 4
 
+        encryption = self.current_encryption
+        iv_size = encryption.per_sample_iv_size if encryption else 8
+        constant_iv = encryption.constant_iv if encryption and not iv_size else b""
+
         sample_info = []
         for _ in range(sample_count):
-            if position + 8 > len(data):
+            if position + iv_size > len(data):
                 break
 
-            iv = data[position : position + 8].tobytes()
-            position += 8
+            iv = data[position : position + iv_size].tobytes() if iv_size else constant_iv
+            position += iv_size
 
             sub_samples = []
             if flags & 0x000002 and position + 2 <= len(data):  # Check if subsample information is present
@@ -420,51 +445,157 @@ class MP4Decrypter:
         """
         if len(self.key_map) == 1:
             return next(iter(self.key_map.values()))
-        key = self.key_map.get(track_id.pack(4, "big"))
+        encryption = self.track_encryption.get(track_id)
+        key = self.key_map.get(encryption.kid) if encryption else None
         if not key:
             raise ValueError(f"No key found for track ID {track_id}")
         return key
 
     @staticmethod
-    def _process_sample(
-        sample: memoryview, sample_info: CENCSampleAuxiliaryDataFormat, key: bytes
-    ) -> Union[memoryview, bytearray, bytes]:
+    def _decrypt_samples(
+        samples: Union[memoryview, bytes, bytearray],
+        sample_info: list[CENCSampleAuxiliaryDataFormat],
+        sample_sizes: array.array,
+        key: bytes,
+        encryption: Optional[TrackEncryptionInfo] = None,
+    ) -> bytearray:
         """
-        Processes and decrypts a sample using the provided sample information and decryption key.
-        This includes handling sub-sample encryption if present.
+        Decrypts consecutive samples stored back to back, as in an 'mdat' payload.
+
+        The protected byte ranges of all samples are computed up front, gathered into one contiguous buffer per
+        cipher run, decrypted with a single cipher call and scattered back into one preallocated output buffer.
+        For 'cenc' (AES-CTR) a run is a sample, extended over the following samples while their IVs continue the
+        counter. For 'cbcs' (AES-CBC with a crypt/skip block pattern) all samples are decrypted with a single ECB
+        call, the CBC chaining being undone by XORing with the preceding cipher blocks.
 
         Args:
-            sample (memoryview): The sample data.
-            sample_info (CENCSampleAuxiliaryDataFormat): The sample auxiliary data format with encryption information.
+            samples (Union[memoryview, bytes, bytearray]): The sample data.
+            sample_info (list[CENCSampleAuxiliaryDataFormat]): Encryption information per sample.
+            sample_sizes (array.array): Size of each sample.
             key (bytes): The decryption key.
+            encryption (Optional[TrackEncryptionInfo]): Track encryption parameters, 'cenc' if unknown.
 
         Returns:
-            Union[memoryview, bytearray, bytes]: The decrypted sample.
+            bytearray: The decrypted data, any bytes after the last sample are left untouched.
         """
-        if not sample_info.is_encrypted:
-            return sample
-
-        # pad IV to 16 bytes
-        iv = sample_info.iv + b"\x00" * (16 - len(sample_info.iv))
-        cipher = AES.new(key, AES.MODE_CTR, initial_value=iv, nonce=b"")
+        output = bytearray(samples)
+        data = memoryview(samples)
+        is_cbcs = encryption is not None and encryption.scheme_type == b"cbcs"
+        crypt_blocks = encryption.crypt_byte_block if is_cbcs else 0
+        skip_blocks = encryption.skip_byte_block if is_cbcs else 0
+
+        # Protected ranges as (offset, length), and cipher runs as (first range, last range, iv)
+        offsets = array.array("Q")
+        lengths = array.array("Q")
+        runs = []
+        run_end_counter = None
 
-        if not sample_info.sub_samples:
-            # If there are no sub_samples, decrypt the entire sample
-            return cipher.decrypt(sample)
-
-        result = bytearray()
-        offset = 0
-        for clear_bytes, encrypted_bytes in sample_info.sub_samples:
-            result.extend(sample[offset : offset + clear_bytes])
-            offset += clear_bytes
-            result.extend(cipher.decrypt(sample[offset : offset + encrypted_bytes]))
-            offset += encrypted_bytes
-
-        # If there's any remaining data, treat it as encrypted
-        if offset < len(sample):
-            result.extend(cipher.decrypt(sample[offset:]))
+        position = 0
+        for info, sample_size in zip(sample_info, sample_sizes):
+            sample_start, sample_end = position, min(position + sample_size, len(data))
+            position += sample_size
+            if not info.is_encrypted or sample_start >= sample_end:
+                continue
+
+            # Protected regions of the sample, the data after the last sub-sample is treated as encrypted
+            regions = []
+            offset = sample_start
+            for clear_bytes, encrypted_bytes in info.sub_samples:
+                offset += clear_bytes
+                regions.append((offset, min(encrypted_bytes, max(0, sample_end - offset))))
+                offset += encrypted_bytes
+            if offset < sample_end:
+                regions.append((offset, sample_end - offset))
+
+            iv = info.iv + b"\x00" * (16 - len(info.iv))
+            if is_cbcs:
+                # The CBC chain restarts with the IV at the start of every protected region
+                for region_start, region_length in regions:
+                    first_range = len(offsets)
+                    full_blocks = region_length // 16
+                    if not crypt_blocks or not skip_blocks:
+                        if full_blocks:
+                            offsets.append(region_start)
+                            lengths.append(full_blocks * 16)
+                    else:
+                        for block in range(0, full_blocks, crypt_blocks + skip_blocks):
+                            offsets.append(region_start + block * 16)
+                            lengths.append(min(crypt_blocks, full_blocks - block) * 16)
+                    if len(offsets) > first_range:
+                        runs.append((first_range, len(offsets), iv))
+                continue
+
+            first_range = len(offsets)
+            for region_start, region_length in regions:
+                if region_length:
+                    offsets.append(region_start)
+                    lengths.append(region_length)
+            if len(offsets) == first_range:
+                continue
+
+            sample_length = sum(lengths[first_range:])
+            counter = int.from_bytes(iv, "big")
+            if run_end_counter == counter:
+                # The IV continues the counter of the previous sample, decrypt both with the same cipher
+                runs[-1] = (runs[-1][0], len(offsets), runs[-1][2])
+            else:
+                runs.append((first_range, len(offsets), iv))
+            run_end_counter = counter + sample_length // 16 if sample_length % 16 == 0 else None
+
+        if not runs:
+            return output
+
+        if is_cbcs:
+            ciphertext = b"".join(data[offsets[i] : offsets[i] + lengths[i]] for i in range(len(offsets)))
+            # Each plaintext block is the decrypted block XOR the previous cipher block, or the IV for the first one
+            chain_boundaries = []
+            gathered_position = 0
+            for first_range, last_range, iv in runs:
+                run_length = sum(lengths[first_range:last_range])
+                chain_boundaries.append((gathered_position, gathered_position + run_length, iv))
+                gathered_position += run_length
+            ciphertext_view = memoryview(ciphertext)
+            previous_blocks = b"".join(
+                part
+                for chain_start, chain_end, iv in chain_boundaries
+                for part in (iv, ciphertext_view[chain_start : chain_end - 16])
+            )
+            decrypted = AES.new(key, AES.MODE_ECB).decrypt(ciphertext)
+            plaintext = (int.from_bytes(decrypted, "little") ^ int.from_bytes(previous_blocks, "little")).to_bytes(
+                len(decrypted), "little"
+            )
+            ciphertext_view.release()
+            MP4Decrypter._scatter(output, plaintext, offsets, lengths, 0, len(offsets))
+            return output
+
+        output_view = memoryview(output)
+        for first_range, last_range, iv in runs:
+            cipher = AES.new(key, AES.MODE_CTR, initial_value=iv, nonce=b"")
+            if last_range - first_range == 1:
+                start, end = offsets[first_range], offsets[first_range] + lengths[first_range]
+                cipher.decrypt(data[start:end], output=output_view[start:end])
+                continue
+            plaintext = cipher.decrypt(
+                b"".join(data[offsets[i] : offsets[i] + lengths[i]] for i in range(first_range, last_range))
+            )
+            MP4Decrypter._scatter(output, plaintext, offsets, lengths, first_range, last_range)
+
+        output_view.release()
+        return output
 
-        return result
+    @staticmethod
+    def _scatter(
+        output: bytearray, plaintext: bytes, offsets: array.array, lengths: array.array, first: int, last: int
+    ) -> None:
+        """
+        Writes contiguous decrypted data back to the protected ranges `first` to `last` of the output.
+        """
+        plaintext = memoryview(plaintext)
+        position = 0
+        for i in range(first, last):
+            start, length = offsets[i], lengths[i]
+            output[start : start + length] = plaintext[position : position + length]
+            position += length
 
     def _process_trun(self, trun: MP4Atom) -> int:
         """
@@ -563,7 +694,11 @@ class MP4Decrypter:
         new_trak_data = bytearray()
 
         for atom in iter(parser.read_atom, None):
-            if atom.atom_type == b"mdia":
+            if atom.atom_type == b"tkhd":
+                # The track ID follows the creation and modification times, which are 64 bit in version 1
+                self._current_track_id = struct.unpack_from(">I", atom.data, 20 if atom.data[0] == 1 else 12)[0]
+                new_trak_data.extend(atom.pack())
+            elif atom.atom_type == b"mdia":
                 new_mdia = self._process_mdia(atom)
                 new_trak_data.extend(new_mdia.pack())
             else:
@@ -694,6 +829,9 @@ class MP4Decrypter:
             if atom.atom_type in {b"sinf", b"schi", b"tenc", b"schm"}:
                 if atom.atom_type == b"sinf":
                     codec_format = self._extract_codec_format(atom)
+                    encryption = self._parse_sinf(atom)
+                    if encryption and self._current_track_id is not None:
+                        self.track_encryption[self._current_track_id] = encryption
                 continue  # Skip encryption-related atoms
             new_entry_data.extend(atom.pack())
 
@@ -718,6 +856,282 @@ class MP4Decrypter:
                 return atom.data
         return None
 
+    @staticmethod
+    def _parse_sinf(sinf: MP4Atom) -> Optional[TrackEncryptionInfo]:
+        """
+        Parses the protection scheme ('schm') and the track encryption ('tenc') parameters of a 'sinf' atom.
+
+        Args:
+            sinf (MP4Atom): The 'sinf' atom to parse.
+
+        Returns:
+            Optional[TrackEncryptionInfo]: The track encryption parameters or None if there is no 'tenc' box.
+        """
+        scheme_type = b"cenc"
+        tenc = None
+        parser = MP4Parser(sinf.data)
+        for atom in iter(parser.read_atom, None):
+            if atom.atom_type == b"schm":
+                scheme_type = bytes(atom.data[4:8])
+            elif atom.atom_type == b"schi":
+                tenc = next((a for a in MP4Parser(atom.data).list_atoms() if a.atom_type == b"tenc"), None)
+
+        if tenc is None or len(tenc.data) < 24:
+            return None
+
+        data = tenc.data
+        crypt_byte_block, skip_byte_block = (data[5] >> 4, data[5] & 0x0F) if data[0] >= 1 else (0, 0)
+        is_protected, per_sample_iv_size = data[6], data[7]
+        constant_iv = b""
+        if is_protected and per_sample_iv_size == 0 and len(data) > 24:
+            constant_iv = bytes(data[25 : 25 + data[24]])
+        return TrackEncryptionInfo(
+            scheme_type,
+            bool(is_protected),
+            per_sample_iv_size,
+            bytes(data[8:24]),
+            constant_iv,
+            crypt_byte_block,
+            skip_byte_block,
+        )
+
+
+class MP4StreamDecrypter:
+    """
+    Incremental decrypter for CENC encrypted fragmented MP4 media segments.
+
+    Segment bytes are fed as they arrive from upstream. Boxes preceding the first 'moof' are held back
+    until its encryption overhead is known, every 'moof' is rewritten and emitted as soon as it is complete,
+    and 'mdat' payloads are decrypted and emitted sample by sample without buffering the whole segment.
+    """
+
+    def __init__(self, key_map: dict[bytes, bytes]):
+        """
+        Initializes the MP4StreamDecrypter with a key map.
+
+        Args:
+            key_map (dict[bytes, bytes]): Mapping of track IDs to decryption keys.
+        """
+        self.decrypter = MP4Decrypter(key_map)
+        self._buffer = bytearray()
+        self._pending_atoms: list[MP4Atom] = []
+        self._seen_moof = False
+        self._mdat_remaining: Optional[int] = None  # None outside an 'mdat', -1 for an 'mdat' running to the end
+        self._sample_index = 0
+        self._decrypt_samples = False
+
+    def process_init(self, init_segment: bytes) -> bytes:
+        """
+        Processes the initialization segment, removing the encryption related boxes.
+
+        Args:
+            init_segment (bytes): Initialization segment data.
+
+        Returns:
+            bytes: Processed initialization segment.
+        """
+        if not init_segment:
+            return b""
+        return self.decrypter.decrypt_segment(init_segment)
+
+    def feed(self, chunk: Union[bytes, bytearray, memoryview]) -> bytes:
+        """
+        Feeds the next chunk of the media segment.
+
+        Args:
+            chunk (Union[bytes, bytearray, memoryview]): The next chunk of segment data.
+
+        Returns:
+            bytes: Output that is ready to be sent, possibly empty.
+        """
+        self._buffer += chunk
+        output = bytearray()
+        consumed = self._drain(output)
+        if consumed:
+            del self._buffer[:consumed]
+        return bytes(output)
+
+    def flush(self) -> bytes:
+        """
+        Flushes any remaining data once the upstream segment has ended.
+
+        Returns:
+            bytes: The remaining output.
+        """
+        output = bytearray()
+        if self._mdat_remaining is not None and self._buffer:
+            # Truncated or open-ended 'mdat': treat the remainder as the final sample
+            decrypter = self.decrypter
+            if self._decrypt_samples and self._sample_index < len(decrypter.current_sample_info):
+                output += decrypter._decrypt_samples(
+                    self._buffer,
+                    decrypter.current_sample_info[self._sample_index : self._sample_index + 1],
+                    array.array("I", [len(self._buffer)]),
+                    decrypter.current_key,
+                    decrypter.current_encryption,
+                )
+            else:
+                output += self._buffer
+        else:
+            self._flush_pending_atoms(output)
+            output += self._buffer
+        self._buffer.clear()
+        self._mdat_remaining = None
+        return bytes(output)
+
+    def _drain(self, output: bytearray) -> int:
+        """
+        Processes as much buffered data as possible.
+
+        Args:
+            output (bytearray): Buffer receiving the processed output.
+
+        Returns:
+            int: Number of buffered bytes consumed.
+        """
+        buffer = memoryview(self._buffer)
+        position = 0
+        try:
+            while True:
+                if self._mdat_remaining is not None:
+                    consumed = self._drain_mdat(buffer, position, output)
+                    if not consumed:
+                        break
+                    position += consumed
+                    continue
+
+                header = self._read_header(buffer, position)
+                if header is None:
+                    break
+                atom_type, size, header_size = header
+
+                if atom_type == b"mdat":
+                    self._flush_pending_atoms(output)
+                    output += buffer[position : position + header_size]
+                    position += header_size
+                    self._start_mdat(size - header_size if size else -1)
+                    continue
+
+                if len(buffer) - position < size:
+                    break
+                atom = MP4Atom(atom_type, size, buffer[position + header_size : position + size])
+                position += size
+                self._process_atom(atom, output)
+        finally:
+            buffer.release()
+        return position
+
+    @staticmethod
+    def _read_header(buffer: memoryview, position: int) -> Optional[tuple[bytes, int, int]]:
+        """
+        Reads a box header if it is fully available.
+
+        Returns:
+            Optional[tuple[bytes, int, int]]: The box type, total size (0 if open-ended) and header size.
+        """
+        available = len(buffer) - position
+        if available < 8:
+            return None
+        size, atom_type = struct.unpack_from(">I4s", buffer, position)
+        header_size = 8
+        if size == 1:
+            if available < 16:
+                return None
+            size = struct.unpack_from(">Q", buffer, position + 8)[0]
+            header_size = 16
+        if size == 0 and atom_type != b"mdat":
+            raise ValueError(f"Unsupported open-ended {atom_type!r} box in media segment")
+        if size and size < header_size:
+            raise ValueError(f"Invalid size {size} for {atom_type!r} box")
+        return atom_type, size, header_size
+
+    def _process_atom(self, atom: MP4Atom, output: bytearray) -> None:
+        """
+        Processes a complete non-'mdat' top level box.
+        """
+        if atom.atom_type == b"moof":
+            processed_moof = self.decrypter._process_moof(atom)
+            self._seen_moof = True
+            self._flush_pending_atoms(output)
+            output += processed_moof.pack()
+        elif not self._seen_moof:
+            # 'sidx' depends on the encryption overhead of the following 'moof', hold everything back until then
+            self._pending_atoms.append(MP4Atom(atom.atom_type, atom.size, bytes(atom.data)))
+        elif atom.atom_type == b"sidx":
+            output += self.decrypter._process_sidx(atom).pack()
+        elif atom.atom_type == b"moov":
+            output += self.decrypter._process_moov(atom).pack()
+        else:
+            output += atom.pack()
+
+    def _flush_pending_atoms(self, output: bytearray) -> None:
+        for atom in self._pending_atoms:
+            if atom.atom_type == b"sidx" and self._seen_moof:
+                atom = self.decrypter._process_sidx(atom)
+            output += atom.pack()
+        self._pending_atoms.clear()
+
+    def _start_mdat(self, payload_size: int) -> None:
+        self._mdat_remaining = payload_size if payload_size else None
+        self._sample_index = 0
+        self._decrypt_samples = bool(self.decrypter.current_key and self.decrypter.current_sample_info)
+
+    def _drain_mdat(self, buffer: memoryview, position: int, output: bytearray) -> int:
+        """
+        Decrypts and emits the complete samples available in the buffer.
+
+        Returns:
+            int: Number of buffered bytes consumed.
+        """
+        available = len(buffer) - position
+        if self._mdat_remaining != -1:
+            available = min(available, self._mdat_remaining)
+        if available <= 0:
+            return 0
+
+        consumed = 0
+        if self._decrypt_samples:
+            decrypter = self.decrypter
+            sample_info = decrypter.current_sample_info
+            sample_sizes = decrypter.trun_sample_sizes
+            first_sample = index = self._sample_index
+            while index < len(sample_info):
+                if index < len(sample_sizes):
+                    sample_size = sample_sizes[index]
+                elif self._mdat_remaining != -1:
+                    sample_size = self._mdat_remaining - consumed
+                else:
+                    break  # Size unknown until the open-ended 'mdat' ends, see flush()
+                if sample_size > available - consumed:
+                    break
+                consumed += sample_size
+                index += 1
+
+            if index > first_sample:
+                # Decrypt all complete samples in a single batch
+                output += decrypter._decrypt_samples(
+                    buffer[position : position + consumed],
+                    sample_info[first_sample:index],
+                    decrypter._get_sample_sizes(first_sample, index, consumed),
+                    decrypter.current_key,
+                    decrypter.current_encryption,
+                )
+                self._sample_index = index
+
+            if index >= len(sample_info):
+                # Bytes not described by the sample info are passed through untouched
+                output += buffer[position + consumed : position + available]
+                consumed = available
+        else:
+            output += buffer[position : position + available]
+            consumed = available
+
+        if self._mdat_remaining != -1:
+            self._mdat_remaining -= consumed
+            if self._mdat_remaining == 0:
+                self._mdat_remaining = None
+        return consumed
+
 
 def decrypt_segment(init_segment: bytes, segment_content: bytes, key_id: str, key: str) -> bytes:
     """
@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from mediaflow_proxy.configs import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _run_batch(calls: list[tuple[Callable, tuple]]) -> list[tuple[bool, Any]]:
+    """
+    Runs a batch of calls in a single executor dispatch.
+
+    Exceptions are captured per call so that one failing job does not fail the whole batch.
+
+    Args:
+        calls (list[tuple[Callable, tuple]]): The functions and their positional arguments.
+
+    Returns:
+        list[tuple[bool, Any]]: A (succeeded, result or exception) pair per call.
+    """
+    results = []
+    for func, args in calls:
+        try:
+            results.append((True, func(*args)))
+        except Exception as e:
+            results.append((False, e))
+    return results
+
+
+class DecryptionExecutor:
+    """
+    Runs CPU bound DRM decryption off the event loop.
+
+    Jobs are dispatched to a thread pool (PyCryptodome releases the GIL while decrypting) or a process pool.
+    At most `max_workers + max_queue` dispatches are outstanding at any time; further callers wait for a slot,
+    which propagates backpressure to the upstream reads feeding them. Small jobs, such as audio segments, can be
+    grouped into a single dispatch to amortise the hand-off overhead.
+    """
+
+    def __init__(
+        self,
+        mode: str = "thread",
+        max_workers: int = 0,
+        max_queue: int = 32,
+        batch_size: int = 8,
+        batch_max_bytes: int = 256 * 1024,
+        batch_window: float = 0.005,
+    ):
+        """
+        Initializes the DecryptionExecutor.
+
+        Args:
+            mode (str): "thread", "process" or "inline" (run on the event loop). Defaults to "thread".
+            max_workers (int): Number of workers, 0 to use the number of CPUs. Defaults to 0.
+            max_queue (int): Number of dispatches allowed to wait for a free worker. Defaults to 32.
+            batch_size (int): Maximum number of small jobs grouped in one dispatch, 1 disables batching.
+            batch_max_bytes (int): Jobs up to this size are eligible for batching. Defaults to 256 KiB.
+            batch_window (float): Seconds to wait for more small jobs before dispatching a batch.
+        """
+        self.mode = mode
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max(0, max_queue)
+        self.batch_size = max(1, batch_size)
+        self.batch_max_bytes = batch_max_bytes
+        self.batch_window = batch_window
+
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._batch: list[tuple[Callable, tuple, asyncio.Future]] = []
+        self._batch_handle: Optional[asyncio.TimerHandle] = None
+        self._batch_tasks: set[asyncio.Task] = set()
+
+        # Metrics
+        self._waiting = 0
+        self._in_flight = 0
+        self._max_queue_depth = 0
+        self._jobs = 0
+        self._batches = 0
+        self._batched_jobs = 0
+        self._segment_latencies: deque[float] = deque(maxlen=256)
+
+    @property
+    def supports_streaming(self) -> bool:
+        """Whether stateful, incremental decryption can run on this executor (not possible across processes)."""
+        return self.mode != "process"
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of dispatches waiting for a worker."""
+        return self._waiting + max(0, self._in_flight - self.max_workers)
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.mode == "process":
+                # Spawn rather than fork, forking a process running an event loop and open sockets is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="decrypt")
+        return self._executor
+
+    async def run(self, func: Callable, *args, size: int = 0, batchable: bool = False) -> Any:
+        """
+        Runs a decryption job and returns its result.
+
+        Args:
+            func (Callable): The function to run. Must be picklable in process mode.
+            *args: Positional arguments for the function.
+            size (int): Size of the job in bytes, used to decide whether it may be batched.
+            batchable (bool): Whether the job may be grouped with other small jobs (e.g. audio segments).
+
+        Returns:
+            Any: The result of the function.
+        """
+        self._jobs += 1
+        if self.mode == "inline":
+            return func(*args)
+
+        if batchable and self.batch_size > 1 and size <= self.batch_max_bytes:
+            future = asyncio.get_running_loop().create_future()
+            self._batch.append((func, args, future))
+            if len(self._batch) >= self.batch_size:
+                self._flush_batch()
+            elif self._batch_handle is None:
+                self._batch_handle = asyncio.get_running_loop().call_later(self.batch_window, self._flush_batch)
+            return await future
+
+        return await self._dispatch(func, *args)
+
+    def _flush_batch(self):
+        if self._batch_handle is not None:
+            self._batch_handle.cancel()
+            self._batch_handle = None
+        batch, self._batch = self._batch, []
+        if batch:
+            task = asyncio.create_task(self._dispatch_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _dispatch_batch(self, batch: list[tuple[Callable, tuple, asyncio.Future]]):
+        self._batches += 1
+        self._batched_jobs += len(batch)
+        try:
+            if len(batch) == 1:
+                func, args, _ = batch[0]
+                results = [(True, await self._dispatch(func, *args))]
+            else:
+                results = await self._dispatch(_run_batch, [(func, args) for func, args, _ in batch])
+        except Exception as e:
+            results = [(False, e)] * len(batch)
+
+        for (_, _, future), (succeeded, result) in zip(batch, results):
+            if future.done():
+                continue
+            if succeeded:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    async def _dispatch(self, func: Callable, *args) -> Any:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers + self.max_queue)
+
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        self._in_flight += 1
+        self._max_queue_depth = max(self._max_queue_depth, self.queue_depth)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+
+    def record_segment(self, mimetype: str, latency: float):
+        """
+        Records the decryption latency of a segment and logs it along with the current queue depth.
+
+        Args:
+            mimetype (str): The MIME type of the segment.
+            latency (float): Time in seconds spent decrypting the segment, including queueing.
+        """
+        self._segment_latencies.append(latency)
+        logger.info(f"Decryption of {mimetype} segment took {latency:.4f} seconds (queue depth: {self.queue_depth})")
+
+    def get_stats(self) -> dict:
+        """
+        Returns decryption executor statistics.
+
+        Returns:
+            dict: The executor statistics.
+        """
+        latencies = sorted(self._segment_latencies)
+        return {
+            "mode": self.mode,
+            "max_workers": self.max_workers,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self._max_queue_depth,
+            "in_flight": self._in_flight,
+            "jobs": self._jobs,
+            "batches": self._batches,
+            "batched_jobs": self._batched_jobs,
+            "segment_latency_avg": sum(latencies) / len(latencies) if latencies else 0.0,
+            "segment_latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+        }
+
+    def shutdown(self):
+        """Shuts down the worker pool."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+decrypt_executor = DecryptionExecutor(
+    mode=settings.decrypt_executor,
+    max_workers=settings.decrypt_max_workers,
+    max_queue=settings.decrypt_max_queue,
+    batch_size=settings.decrypt_audio_batch_size,
+    batch_max_bytes=settings.decrypt_audio_batch_max_bytes,
+    batch_window=settings.decrypt_audio_batch_window,
+)
@@ -6,7 +6,7 @@ import httpx
 import logging
 
 from mediaflow_proxy.configs import settings
-from mediaflow_proxy.utils.http_utils import create_httpx_client, DownloadError
+from mediaflow_proxy.utils.http_utils import get_http_client, DownloadError
 
 logger = logging.getLogger(__name__)
 
@@ -70,32 +70,33 @@ class BaseExtractor(ABC):
 
         while attempt < retries:
             try:
-                async with create_httpx_client(timeout=timeout_cfg) as client:
-                    response = await client.request(
-                        method,
-                        url,
-                        headers=request_headers,
-                        **kwargs,
-                    )
-
-                    if raise_on_status:
+                client = get_http_client()
+                response = await client.request(
+                    method,
+                    url,
+                    headers=request_headers,
+                    timeout=timeout_cfg,
+                    **kwargs,
+                )
+
+                if raise_on_status:
+                    try:
+                        response.raise_for_status()
+                    except httpx.HTTPStatusError as e:
+                        # Provide a short body preview for debugging
+                        body_preview = ""
                         try:
-                            response.raise_for_status()
-                        except httpx.HTTPStatusError as e:
-                            # Provide a short body preview for debugging
-                            body_preview = ""
-                            try:
-                                body_preview = e.response.text[:500]
-                            except Exception:
-                                body_preview = "<unreadable body>"
-                            logger.debug(
-                                "HTTPStatusError for %s (status=%s) -- body preview: %s",
-                                url,
-                                e.response.status_code,
-                                body_preview,
-                            )
-                            raise DownloadError(e.response.status_code, f"HTTP error {e.response.status_code} while requesting {url}")
-                    return response
+                            body_preview = e.response.text[:500]
+                        except Exception:
+                            body_preview = "<unreadable body>"
+                        logger.debug(
+                            "HTTPStatusError for %s (status=%s) -- body preview: %s",
+                            url,
+                            e.response.status_code,
+                            body_preview,
+                        )
+                        raise DownloadError(e.response.status_code, f"HTTP error {e.response.status_code} while requesting {url}")
+                return response
 
             except DownloadError:
                 # Do not retry on explicit HTTP status errors (they are intentional)
@@ -6,7 +6,6 @@ from typing import Any, Dict, Optional, List
 from urllib.parse import urlparse, quote_plus, urljoin
 
 
-import httpx
 
 
 from mediaflow_proxy.extractors.base import BaseExtractor, ExtractorError
@@ -39,7 +38,7 @@ class DLHDExtractor(BaseExtractor):
 
     async def _make_request(self, url: str, method: str = "GET", headers: Optional[Dict] = None, **kwargs) -> Any:
         """Override to disable SSL verification for this extractor and use fetch_with_retry if available."""
-        from mediaflow_proxy.utils.http_utils import create_httpx_client, fetch_with_retry
+        from mediaflow_proxy.utils.http_utils import get_http_client, fetch_with_retry
 
 
         timeout = kwargs.pop("timeout", 15)
@@ -47,14 +46,14 @@ class DLHDExtractor(BaseExtractor):
         backoff_factor = kwargs.pop("backoff_factor", 0.5)
 
 
-        async with create_httpx_client(verify=False, timeout=httpx.Timeout(timeout)) as client:
-            try:
-                return await fetch_with_retry(client, method, url, headers or {}, timeout=timeout)
-            except Exception:
-                logger.debug("fetch_with_retry failed or unavailable; falling back to direct request for %s", url)
-                response = await client.request(method, url, headers=headers or {}, timeout=timeout)
-                response.raise_for_status()
-                return response
+        client = get_http_client(verify=False)
+        try:
+            return await fetch_with_retry(client, method, url, headers or {}, timeout=timeout)
+        except Exception:
+            logger.debug("fetch_with_retry failed or unavailable; falling back to direct request for %s", url)
+            response = await client.request(method, url, headers=headers or {}, timeout=timeout)
+            response.raise_for_status()
+            return response
 
 
     async def _extract_lovecdn_stream(self, iframe_url: str, iframe_content: str, headers: dict) -> Dict[str, Any]:
@@ -176,15 +175,15 @@ class DLHDExtractor(BaseExtractor):
             'Priority': 'u=1, i',
         })
         
-        from mediaflow_proxy.utils.http_utils import create_httpx_client
+        from mediaflow_proxy.utils.http_utils import get_http_client
         try:
-            async with create_httpx_client(verify=False) as client:
-                # Note: using 'files' instead of 'data' to ensure multipart/form-data Content-Type
-                auth_resp = await client.post(auth_url, files=multipart_data, headers=auth_headers, timeout=12)
-                auth_resp.raise_for_status()
-                auth_data = auth_resp.json()
-                if not (auth_data.get("valid") or auth_data.get("success")):
-                    raise ExtractorError(f"Initial auth failed with response: {auth_data}")
+            client = get_http_client(verify=False)
+            # Note: using 'files' instead of 'data' to ensure multipart/form-data Content-Type
+            auth_resp = await client.post(auth_url, files=multipart_data, headers=auth_headers, timeout=12)
+            auth_resp.raise_for_status()
+            auth_data = auth_resp.json()
+            if not (auth_data.get("valid") or auth_data.get("success")):
+                raise ExtractorError(f"Initial auth failed with response: {auth_data}")
             logger.info("New auth flow: Initial auth successful.")
         except Exception as e:
             raise ExtractorError(f"New auth flow failed during initial auth POST: {e}")
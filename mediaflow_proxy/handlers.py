@@ -1,6 +1,12 @@
+import asyncio
 import base64
+import hashlib
 import logging
-from urllib.parse import urlparse, parse_qs
+import re
+import time
+from collections import OrderedDict
+from typing import AsyncIterable
+from urllib.parse import urlencode, urlparse, parse_qs
 
 import httpx
 import tenacity
@@ -8,33 +14,64 @@ from fastapi import Request, Response, HTTPException
 from starlette.background import BackgroundTask
 
 from .const import SUPPORTED_RESPONSE_HEADERS
-from .mpd_processor import process_manifest, process_playlist, process_segment
+from .mpd_processor import (
+    process_manifest,
+    process_playlist,
+    process_segment_stream,
+    iter_processed_segment,
+    iter_segment_part,
+    low_latency_timeline,
+    wait_for_playlist_update,
+)
 from .schemas import HLSManifestParams, MPDManifestParams, MPDPlaylistParams, MPDSegmentParams
-from .utils.cache_utils import get_cached_mpd, get_cached_init_segment
+from .utils.cache_utils import (
+    get_cached_mpd,
+    get_cached_init_segment,
+    get_mpd_digest,
+    SharedStream,
+    SingleFlight,
+    DECRYPTED_SEGMENT_CACHE,
+)
 from .utils.http_utils import (
     Streamer,
     DownloadError,
-    download_file_with_retry,
     request_with_retry,
     EnhancedStreamingResponse,
     ProxyRequestHeaders,
-    create_httpx_client,
+    get_http_client,
 )
+from .utils.hls_channels import HLSChannelManager, hls_channels
 from .utils.m3u8_processor import M3U8Processor
+from .utils.manifest_cache import ManifestCache, manifest_cache
 from .utils.mpd_utils import pad_base64
+from .utils.range_cache import stream_range_cache
 from .configs import settings
 
 logger = logging.getLogger(__name__)
 
+# Segments currently being downloaded and processed, shared by all requests for the same segment
+_inflight_segments: dict[str, SharedStream] = {}
+_inflight_segment_tasks: set[asyncio.Task] = set()
+# LL-HLS blocking playlist reloads awaiting the origin, shared by the viewers waiting for the same update
+PLAYLIST_RELOAD_FLIGHTS = SingleFlight("playlist_reload")
+# PART-TARGET of the playlists served by blocking reloads, by URL, bounding the time the origin may hold a reload
+_reload_part_targets: "OrderedDict[str, float]" = OrderedDict()
+RELOAD_PART_TARGETS_MAX_SIZE = 1024
+RELOAD_DEFAULT_PART_TARGET = 2.0
+RELOAD_HOLD_PART_TARGETS = 3
+_PART_TARGET_PATTERN = re.compile(r"^#EXT-X-PART-INF:.*PART-TARGET=([0-9]*\.?[0-9]+)", re.MULTILINE)
+
 
 async def setup_client_and_streamer() -> tuple[httpx.AsyncClient, Streamer]:
     """
     Set up an HTTP client and a streamer.
 
+    The client is the process-wide shared client, so the streamer reuses pooled upstream connections.
+
     Returns:
         tuple: An httpx.AsyncClient instance and a Streamer instance.
     """
-    client = create_httpx_client()
+    client = get_http_client()
     return client, Streamer(client)
 
 
@@ -86,20 +123,57 @@ async def handle_hls_stream_proxy(
     proxy_headers.request.update({"range": content_range})
 
     try:
-        # Auto-detect and resolve Vavoo links
-        if "vavoo.to" in hls_params.destination:
+        # Auto-detect and resolve Vavoo links, unless a live channel session already follows the resolved playlist
+        session_url = None
+        if hls_channels is not None and "vavoo.to" in hls_params.destination:
+            session_url = hls_channels.resolve(hls_params.destination, proxy_headers.request)
+        if session_url is not None:
+            hls_params.destination = session_url
+        elif "vavoo.to" in hls_params.destination:
             try:
                 from mediaflow_proxy.extractors.vavoo import VavooExtractor
                 vavoo_extractor = VavooExtractor(proxy_headers.request)
                 resolved_data = await vavoo_extractor.extract(hls_params.destination)
                 resolved_url = resolved_data["destination_url"]
                 logger.info(f"Auto-resolved Vavoo URL: {hls_params.destination} -> {resolved_url}")
+                if hls_channels is not None:
+                    hls_channels.add_alias(hls_params.destination, proxy_headers.request, resolved_url)
                 # Update destination with resolved URL
                 hls_params.destination = resolved_url
             except Exception as e:
                 logger.warning(f"Failed to auto-resolve Vavoo URL: {e}")
                 # Continue with original URL if resolution fails
 
+        # LL-HLS delivery directives, such as the blocking reload of `_HLS_msn` and `_HLS_part` or the delta update
+        # of `_HLS_skip`, are answered by the origin
+        directives = {key: value for key, value in request.query_params.items() if key.startswith("_HLS_")}
+        if directives:
+            destination = hls_params.destination
+            destination += ("&" if "?" in destination else "?") + urlencode(directives)
+            response = await fetch_playlist_reload(destination, hls_params.destination, proxy_headers.request)
+            if response.status_code >= 400:
+                # Refused directives, such as a 400 for an `_HLS_msn` too far ahead, are the client's to handle
+                return Response(
+                    content=response.content,
+                    status_code=response.status_code,
+                    media_type=response.headers.get("content-type"),
+                    headers=proxy_headers.response,
+                )
+            return await serve_playlist(
+                (response.text, str(response.url)), destination, proxy_headers, request,
+                hls_params.key_url, hls_params.force_playlist_proxy, hls_params.key_only_proxy, hls_params.no_proxy,
+                cache=False,
+            )
+
+        # Segments, init sections and keys of a live channel session are downloaded once for all its viewers
+        if hls_channels is not None and content_range == "bytes=0-":
+            resource = await hls_channels.get_resource(
+                hls_params.destination, proxy_headers.request, HLSChannelManager.viewer_id(request)
+            )
+            if resource is not None:
+                content, content_type = resource
+                return Response(content=content, media_type=content_type, headers=proxy_headers.response)
+
         # If force_playlist_proxy is enabled, skip detection and directly process as m3u8
         if hls_params.force_playlist_proxy:
             return await fetch_and_process_m3u8(
@@ -127,11 +201,13 @@ async def handle_hls_stream_proxy(
                 hls_params.key_url, hls_params.force_playlist_proxy, hls_params.key_only_proxy, hls_params.no_proxy
             )
 
+        # Segments and LL-HLS parts are written as they arrive, see `EnhancedStreamingResponse.output_chunk_size`
         return EnhancedStreamingResponse(
             streamer.stream_content(),
             status_code=streamer.response.status_code,
             headers=response_headers,
             background=BackgroundTask(streamer.close),
+            output_chunk_size=0,
         )
     except Exception as e:
         await streamer.close()
@@ -142,6 +218,8 @@ async def handle_stream_request(
     method: str,
     video_url: str,
     proxy_headers: ProxyRequestHeaders,
+    parallel: bool = False,
+    cache_ranges: bool = False,
 ) -> Response:
     """
     Handle general stream requests.
@@ -152,6 +230,8 @@ async def handle_stream_request(
         method (str): The HTTP method (e.g., 'GET' or 'HEAD').
         video_url (str): The URL of the video to stream.
         proxy_headers (ProxyRequestHeaders): Headers to be used in the proxy request.
+        parallel (bool): Whether the body may be downloaded over parallel range requests. Defaults to False.
+        cache_ranges (bool): Whether the body may be served from and written to the range cache. Defaults to False.
 
     Returns:
         Union[Response, EnhancedStreamingResponse]: Either a HEAD response with headers or a streaming response.
@@ -173,6 +253,17 @@ async def handle_stream_request(
                 logger.warning(f"Failed to auto-resolve Vavoo URL: {e}")
                 # Continue with original URL if resolution fails
 
+        range_cache = stream_range_cache if cache_ranges and method == "GET" else None
+        if range_cache is not None:
+            cached = await range_cache.serve(video_url, proxy_headers.request)
+            if cached is not None:
+                status_code, headers, content = cached
+                return EnhancedStreamingResponse(
+                    content,
+                    headers=prepare_response_headers(httpx.Headers(headers), proxy_headers.response),
+                    status_code=status_code,
+                )
+
         await streamer.create_streaming_response(video_url, proxy_headers.request)
         response_headers = prepare_response_headers(streamer.response.headers, proxy_headers.response)
 
@@ -182,8 +273,13 @@ async def handle_stream_request(
             return Response(headers=response_headers, status_code=streamer.response.status_code)
         else:
             # For GET requests, return the streaming response
+            content = streamer.stream_content_parallel() if parallel else streamer.stream_content()
+            if range_cache is not None:
+                resource = await range_cache.validate(video_url, streamer)
+                if resource is not None:
+                    content = range_cache.write(resource, streamer.start_byte, content, streamer)
             return EnhancedStreamingResponse(
-                streamer.stream_content(),
+                content,
                 headers=response_headers,
                 status_code=streamer.response.status_code,
                 background=BackgroundTask(streamer.close),
@@ -224,7 +320,7 @@ async def proxy_stream(method: str, destination: str, proxy_headers: ProxyReques
     Returns:
         Response: The HTTP response with the streamed content.
     """
-    return await handle_stream_request(method, destination, proxy_headers)
+    return await handle_stream_request(method, destination, proxy_headers, parallel=True, cache_ranges=True)
 
 
 async def fetch_and_process_m3u8(
@@ -254,9 +350,34 @@ async def fetch_and_process_m3u8(
         Response: The HTTP response with the processed m3u8 playlist.
     """
     try:
+        whole_playlist = proxy_headers.request.get("range", "bytes=0-") == "bytes=0-"
+
+        # Latest playlist of the live channel session following it, shared by all its viewers
+        channel_playlist = None
+        if hls_channels is not None and whole_playlist:
+            channel_playlist = hls_channels.get_playlist(
+                url, proxy_headers.request, HLSChannelManager.viewer_id(request)
+            )
+        if channel_playlist is not None:
+            await streamer.close()
+            return await serve_playlist(
+                channel_playlist, url, proxy_headers, request, key_url, force_playlist_proxy, key_only_proxy, no_proxy
+            )
+
+        # Previous rewrite of the playlist, only for requests of the whole playlist
+        cache_key = cached = None
+        if manifest_cache is not None and whole_playlist:
+            cache_key = manifest_cache.key(request, url)
+            cached = manifest_cache.get(cache_key)
+
         # Create streaming response if not already created
         if not streamer.response:
-            await streamer.create_streaming_response(url, proxy_headers.request)
+            if cached is not None:
+                # Ask the origin whether the playlist changed since it was rewritten
+                request_headers = {**proxy_headers.request, **ManifestCache.conditional_headers(cached.source)}
+                await streamer.create_streaming_response(url, request_headers, allow_not_modified=True)
+            else:
+                await streamer.create_streaming_response(url, proxy_headers.request)
 
         # Initialize processor and response headers
         processor = M3U8Processor(request, key_url, force_playlist_proxy, key_only_proxy, no_proxy)
@@ -267,9 +388,24 @@ async def fetch_and_process_m3u8(
         }
         response_headers.update(proxy_headers.response)
 
+        validators = ManifestCache.validators(streamer.response.headers)
+        if cached is not None and (streamer.response.status_code == 304 or validators == cached.source):
+            # The playlist did not change, serve its previous rewrite
+            await streamer.close()
+            if settings.enable_hls_prebuffer:
+                processor.start_prebuffer(str(streamer.response.url))
+            return manifest_cache.respond(request, cached, response_headers, "application/vnd.apple.mpegurl")
+
         # Create streaming response with on-the-fly processing
+        upstream = streamer.stream_content()
+        if hls_channels is not None and whole_playlist and streamer.response.status_code == 200:
+            # Start a channel session if this is a live media playlist
+            upstream = hls_channels.observe(url, proxy_headers.request, str(streamer.response.url), upstream)
+        content = processor.process_m3u8_streaming(upstream, str(streamer.response.url))
+        if cache_key is not None and validators is not None and streamer.response.status_code != 304:
+            content = manifest_cache.tee(cache_key, validators, content)
         return EnhancedStreamingResponse(
-            processor.process_m3u8_streaming(streamer.stream_content(), str(streamer.response.url)),
+            content,
             headers=response_headers,
             background=BackgroundTask(streamer.close),
         )
@@ -278,6 +414,97 @@ async def fetch_and_process_m3u8(
         return handle_exceptions(e)
 
 
+async def serve_playlist(
+    playlist: tuple[str, str],
+    url: str,
+    proxy_headers: ProxyRequestHeaders,
+    request: Request,
+    key_url: str = None,
+    force_playlist_proxy: bool = None,
+    key_only_proxy: bool = False,
+    no_proxy: bool = False,
+    cache: bool = True,
+) -> Response:
+    """
+    Serves a playlist downloaded in full, rewritten for the request.
+
+    Args:
+        playlist (tuple[str, str]): The playlist and its URL after redirects.
+        url (str): The URL of the m3u8 playlist.
+        proxy_headers (ProxyRequestHeaders): The headers to include in the request.
+        request (Request): The incoming HTTP request.
+        key_url (str, optional): The HLS Key URL to replace the original key URL. Defaults to None.
+        force_playlist_proxy (bool, optional): Force all playlist URLs to be proxied through MediaFlow. Defaults to None.
+        key_only_proxy (bool, optional): Only proxy the key URL, leaving segment URLs direct. Defaults to False.
+        no_proxy (bool, optional): If True, returns the manifest without proxying any URLs. Defaults to False.
+        cache (bool, optional): Whether to keep the rewrite in the manifest cache. Defaults to True.
+
+    Returns:
+        Response: The HTTP response with the processed m3u8 playlist.
+    """
+    content, final_url = playlist
+    response_headers = {
+        "content-disposition": "inline",
+        "accept-ranges": "none",
+        "content-type": "application/vnd.apple.mpegurl",
+    }
+    response_headers.update(proxy_headers.response)
+
+    # The playlist text is the version of the origin content the cached rewrite depends on
+    cache_key = entry = None
+    if manifest_cache is not None and cache:
+        cache_key = manifest_cache.key(request, url)
+        entry = manifest_cache.get(cache_key, content)
+    if entry is None:
+        processor = M3U8Processor(request, key_url, force_playlist_proxy, key_only_proxy, no_proxy)
+        # Same output as the streaming rewrite, which keeps the final line break
+        body = (await processor.process_m3u8(content, final_url) + "\n").encode("utf-8")
+        if cache_key is None:
+            return ManifestCache.not_modified_or(
+                request, Response(content=body, media_type="application/vnd.apple.mpegurl", headers=response_headers)
+            )
+        entry = manifest_cache.put(cache_key, content, body)
+    return manifest_cache.respond(request, entry, response_headers, "application/vnd.apple.mpegurl")
+
+
+async def fetch_playlist_reload(url: str, playlist_url: str, headers: dict) -> httpx.Response:
+    """
+    Downloads a playlist for an LL-HLS blocking reload, sharing the request with the viewers waiting for the same
+    playlist update.
+
+    The origin holds the request until the requested segment or part is available, so it is sent once, without
+    retries, and may be held for `RELOAD_HOLD_PART_TARGETS` times the part target of the playlist.
+
+    Args:
+        url (str): The URL of the playlist, with its delivery directives.
+        playlist_url (str): The URL of the playlist without delivery directives.
+        headers (dict): The headers to include in the request.
+
+    Returns:
+        httpx.Response: The response of the origin, error statuses included.
+
+    Raises:
+        DownloadError: 504 if the origin held the request for longer than expected.
+    """
+
+    async def reload() -> httpx.Response:
+        part_target = _reload_part_targets.get(playlist_url, RELOAD_DEFAULT_PART_TARGET)
+        timeout = httpx.Timeout(settings.transport_config.timeout, read=RELOAD_HOLD_PART_TARGETS * part_target)
+        try:
+            response = await get_http_client().get(url, headers=headers, follow_redirects=True, timeout=timeout)
+        except httpx.TimeoutException:
+            raise DownloadError(504, f"Timeout while awaiting the blocking reload of {url}")
+        match = _PART_TARGET_PATTERN.search(response.text) if response.status_code < 400 else None
+        if match and float(match.group(1)) > 0:
+            _reload_part_targets[playlist_url] = float(match.group(1))
+            _reload_part_targets.move_to_end(playlist_url)
+            if len(_reload_part_targets) > RELOAD_PART_TARGETS_MAX_SIZE:
+                _reload_part_targets.popitem(last=False)
+        return response
+
+    return await PLAYLIST_RELOAD_FLIGHTS.do((url, tuple(sorted(headers.items()))), reload)
+
+
 async def handle_drm_key_data(key_id, key, drm_info):
     """
     Handles the DRM key data, retrieving the key ID and key from the DRM info if not provided.
@@ -335,7 +562,8 @@ async def get_manifest(
 
     if drm_info and not drm_info.get("isDrmProtected"):
         # For non-DRM protected MPD, we still create an HLS manifest
-        return await process_manifest(request, mpd_dict, proxy_headers, None, None)
+        response = await process_manifest(request, mpd_dict, proxy_headers, None, None)
+        return ManifestCache.not_modified_or(request, response)
 
     key_id, key = await handle_drm_key_data(manifest_params.key_id, manifest_params.key, drm_info)
 
@@ -345,7 +573,8 @@ async def get_manifest(
     if key and len(key) != 32:
         key = base64.urlsafe_b64decode(pad_base64(key)).hex()
 
-    return await process_manifest(request, mpd_dict, proxy_headers, key_id, key)
+    response = await process_manifest(request, mpd_dict, proxy_headers, key_id, key)
+    return ManifestCache.not_modified_or(request, response)
 
 
 async def get_playlist(
@@ -373,7 +602,28 @@ async def get_playlist(
         )
     except DownloadError as e:
         raise HTTPException(status_code=e.status_code, detail=f"Failed to download MPD: {e.message}")
-    return await process_playlist(request, mpd_dict, playlist_params.profile_id, proxy_headers)
+
+    # LL-HLS playlists list the parts available at the time of the request, and support blocking reloads
+    profile = next((p for p in mpd_dict["profiles"] if p["id"] == playlist_params.profile_id), None)
+    timeline = low_latency_timeline(mpd_dict, profile) if profile is not None else None
+    if timeline is not None:
+        msn = request.query_params.get("_HLS_msn")
+        if msn is not None:
+            await wait_for_playlist_update(timeline, msn, request.query_params.get("_HLS_part"))
+        return await process_playlist(request, mpd_dict, playlist_params.profile_id, proxy_headers)
+
+    # Previous output for the same request and manifest, unless the segments it lists depend on the current time
+    digest = get_mpd_digest(playlist_params.destination)
+    if manifest_cache is None or digest is None:
+        return await process_playlist(request, mpd_dict, playlist_params.profile_id, proxy_headers)
+    cache_key = manifest_cache.key(request, playlist_params.destination)
+    cached = manifest_cache.get(cache_key, digest)
+    if cached is not None:
+        return manifest_cache.respond(request, cached, proxy_headers.response, "application/vnd.apple.mpegurl")
+
+    response = await process_playlist(request, mpd_dict, playlist_params.profile_id, proxy_headers)
+    response.body_iterator = manifest_cache.tee(cache_key, digest, response.body_iterator)
+    return response
 
 
 async def get_segment(
@@ -390,21 +640,28 @@ async def get_segment(
     Returns:
         Response: The HTTP response with the processed segment.
     """
+    if segment_params.part is not None:
+        return await get_segment_part(segment_params, proxy_headers)
+    if settings.mpd_segment_cache_size > 0:
+        return await get_shared_segment(segment_params, proxy_headers)
+
     try:
-        live_cache_ttl = settings.mpd_live_init_cache_ttl if segment_params.is_live else None
-        init_content = await get_cached_init_segment(
-            segment_params.init_url,
-            proxy_headers.request,
-            cache_token=segment_params.key_id,
-            ttl=live_cache_ttl,
-        )
-        segment_content = await download_file_with_retry(segment_params.segment_url, proxy_headers.request)
+        init_content = await _get_init_segment(segment_params, proxy_headers)
+    except Exception as e:
+        return handle_exceptions(e)
+
+    _, streamer = await setup_client_and_streamer()
+    # Segments do not change, an interrupted download is retried from the start when the origin lacks ranges
+    streamer.restartable = True
+    try:
+        await streamer.create_streaming_response(segment_params.segment_url, proxy_headers.request)
     except Exception as e:
+        await streamer.close()
         return handle_exceptions(e)
 
-    return await process_segment(
+    return await process_segment_stream(
         init_content,
-        segment_content,
+        streamer,
         segment_params.mime_type,
         proxy_headers,
         segment_params.key_id,
@@ -412,6 +669,169 @@ async def get_segment(
     )
 
 
+async def _get_init_segment(segment_params: MPDSegmentParams, proxy_headers: ProxyRequestHeaders) -> bytes:
+    live_cache_ttl = settings.mpd_live_init_cache_ttl if segment_params.is_live else None
+    return await get_cached_init_segment(
+        segment_params.init_url,
+        proxy_headers.request,
+        cache_token=segment_params.key_id,
+        ttl=live_cache_ttl,
+    )
+
+
+async def get_shared_segment(segment_params: MPDSegmentParams, proxy_headers: ProxyRequestHeaders):
+    """
+    Serves a processed media segment from the decrypted segment cache.
+
+    On a miss, concurrent requests for the same segment share a single upstream download and decryption,
+    each of them streaming the output as it is produced. The result is cached for the segment duration times
+    the live playlist depth, the time the segment stays listed in the generated playlists.
+
+    Args:
+        segment_params (MPDSegmentParams): The parameters for the segment request.
+        proxy_headers (ProxyRequestHeaders): The headers to include in the request.
+
+    Returns:
+        Response: The HTTP response with the processed segment.
+    """
+    cache_key = _segment_cache_key(segment_params)
+    cached_content = await DECRYPTED_SEGMENT_CACHE.get(cache_key)
+    if cached_content is not None:
+        return Response(content=cached_content, media_type=segment_params.mime_type, headers=proxy_headers.response)
+
+    try:
+        shared_stream = await _subscribe_shared_segment(cache_key, segment_params, proxy_headers)
+    except Exception as e:
+        return handle_exceptions(e)
+
+    return EnhancedStreamingResponse(
+        _iter_shared_segment(shared_stream, shared_stream.iter_chunks()),
+        media_type=segment_params.mime_type,
+        headers=proxy_headers.response,
+        output_chunk_size=0,
+    )
+
+
+async def get_segment_part(segment_params: MPDSegmentParams, proxy_headers: ProxyRequestHeaders):
+    """
+    Serves an LL-HLS partial segment of a media segment, see `iter_segment_part`.
+
+    The segment is downloaded and processed once into a shared stream, like in `get_shared_segment`, while each
+    request streams the chunks of its part as they arrive, so that a part is sent while it is being produced.
+
+    Args:
+        segment_params (MPDSegmentParams): The parameters for the segment request.
+        proxy_headers (ProxyRequestHeaders): The headers to include in the request.
+
+    Returns:
+        Response: The HTTP response with the processed part.
+    """
+    cache_key = _segment_cache_key(segment_params)
+    cached_content = await DECRYPTED_SEGMENT_CACHE.get(cache_key)
+    part_args = (segment_params.part, segment_params.parts or 1, segment_params.duration or 1.0)
+    if cached_content is not None:
+
+        async def chunks():
+            yield cached_content
+
+        content = iter_segment_part(chunks(), *part_args)
+    else:
+        try:
+            shared_stream = await _subscribe_shared_segment(cache_key, segment_params, proxy_headers)
+        except Exception as e:
+            return handle_exceptions(e)
+        content = _iter_shared_segment(shared_stream, iter_segment_part(shared_stream.iter_chunks(), *part_args))
+
+    return EnhancedStreamingResponse(
+        content, media_type=segment_params.mime_type, headers=proxy_headers.response, output_chunk_size=0
+    )
+
+
+def _segment_cache_key(segment_params: MPDSegmentParams) -> str:
+    """Returns the key of a processed segment, which also depends on the key it is decrypted with."""
+    key_hash = hashlib.blake2b(segment_params.key.encode(), digest_size=16).hexdigest() if segment_params.key else ""
+    return f"{segment_params.segment_url}|{segment_params.key_id or ''}|{key_hash}"
+
+
+async def _subscribe_shared_segment(
+    cache_key: str, segment_params: MPDSegmentParams, proxy_headers: ProxyRequestHeaders
+) -> SharedStream:
+    """
+    Subscribes to the shared stream of a segment, starting its download if needed, and waits for its upstream.
+
+    The subscription is released by `_iter_shared_segment`, or here when the upstream cannot be opened.
+    """
+    shared_stream = _inflight_segments.get(cache_key)
+    if shared_stream is None or shared_stream.abandoned:
+        shared_stream = _inflight_segments[cache_key] = SharedStream()
+        task = asyncio.create_task(_produce_shared_segment(cache_key, shared_stream, segment_params, proxy_headers))
+        shared_stream.producer = task
+        _inflight_segment_tasks.add(task)
+        task.add_done_callback(_inflight_segment_tasks.discard)
+    shared_stream.subscribe()
+    try:
+        await shared_stream.wait_ready()
+    except BaseException:
+        shared_stream.release(disconnected=True)
+        raise
+    return shared_stream
+
+
+async def _iter_shared_segment(shared_stream: SharedStream, content: AsyncIterable[bytes]):
+    """Yields the content read from a shared stream, releasing the subscription once done or disconnected."""
+    completed = False
+    try:
+        async for chunk in content:
+            yield chunk
+        completed = True
+    finally:
+        shared_stream.release(disconnected=not completed)
+
+
+async def _produce_shared_segment(
+    cache_key: str,
+    shared_stream: SharedStream,
+    segment_params: MPDSegmentParams,
+    proxy_headers: ProxyRequestHeaders,
+):
+    """Downloads and processes a segment into a shared stream, then caches the result."""
+    try:
+        init_content = await _get_init_segment(segment_params, proxy_headers)
+        if segment_params.available_at:
+            # LL-HLS parts are requested before the origin starts serving their segment, at most one segment early
+            delay = segment_params.available_at - time.time()
+            if delay > 0:
+                await asyncio.sleep(min(delay, segment_params.duration or 0))
+        _, streamer = await setup_client_and_streamer()
+        streamer.restartable = True
+        try:
+            await streamer.create_streaming_response(segment_params.segment_url, proxy_headers.request)
+            shared_stream.set_ready()
+            async for chunk in iter_processed_segment(
+                init_content or b"",
+                streamer,
+                segment_params.mime_type,
+                segment_params.key_id,
+                segment_params.key,
+            ):
+                shared_stream.append(chunk)
+        finally:
+            await streamer.close()
+        shared_stream.finish()
+
+        if segment_params.duration:
+            ttl = segment_params.duration * max(settings.mpd_live_playlist_depth, 1)
+            await DECRYPTED_SEGMENT_CACHE.set(cache_key, shared_stream.getvalue(), ttl=ttl)
+    except Exception as e:
+        logger.error(f"Error processing segment {segment_params.segment_url}: {e}")
+        shared_stream.finish(e)
+    finally:
+        if not shared_stream.done:
+            shared_stream.finish(RuntimeError("Segment processing was cancelled"))
+        if _inflight_segments.get(cache_key) is shared_stream:
+            del _inflight_segments[cache_key]
+
+
 async def get_public_ip():
     """
     Retrieves the public IP address of the MediaFlow proxy.
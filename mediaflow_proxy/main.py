@@ -1,23 +1,38 @@
 import asyncio
 import logging
+from contextlib import asynccontextmanager
 from importlib import resources
 
-from fastapi import FastAPI, Depends, Security, HTTPException
+from fastapi import FastAPI, Depends, Security, HTTPException, Request
 from fastapi.security import APIKeyQuery, APIKeyHeader
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import RedirectResponse
+from starlette.responses import JSONResponse, RedirectResponse
 from starlette.staticfiles import StaticFiles
 
 from mediaflow_proxy.configs import settings
+from mediaflow_proxy.drm.executor import decrypt_executor
 from mediaflow_proxy.middleware import UIAccessControlMiddleware
 from mediaflow_proxy.routes import proxy_router, extractor_router, speedtest_router, playlist_builder_router
 from mediaflow_proxy.schemas import GenerateUrlRequest, GenerateMultiUrlRequest, MultiUrlRequestItem
 from mediaflow_proxy.utils.crypto_utils import EncryptionHandler, EncryptionMiddleware
-from mediaflow_proxy.utils.http_utils import encode_mediaflow_proxy_url
+from mediaflow_proxy.utils.hls_channels import hls_channels
+from mediaflow_proxy.utils.http_utils import encode_mediaflow_proxy_url, http_client_registry
 from mediaflow_proxy.utils.base64_utils import encode_url_to_base64, decode_base64_url, is_base64_url
 
 logging.basicConfig(level=settings.log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Owns process-wide resources such as the shared upstream connection pool."""
+    yield
+    if hls_channels is not None:
+        await hls_channels.close()
+    await http_client_registry.aclose()
+    decrypt_executor.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 api_password_query = APIKeyQuery(name="api_password", auto_error=False)
 api_password_header = APIKeyHeader(name="api_password", auto_error=False)
 app.add_middleware(
@@ -31,6 +46,16 @@ app.add_middleware(EncryptionMiddleware)
 app.add_middleware(UIAccessControlMiddleware)
 
 
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request: Request, exc: Exception):
+    """Returns a JSON error for exceptions raised before the response has started."""
+    logging.error("An error occurred while processing the request, error: %s", exc, exc_info=exc)
+    return JSONResponse(
+        content={"error": "An error occurred while processing the request, check the server for logs"},
+        status_code=500,
+    )
+
+
 async def verify_api_key(api_key: str = Security(api_password_query), api_key_alt: str = Security(api_password_header)):
     """
     Verifies the API key for the request.
@@ -1,25 +1,33 @@
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi import Response
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from mediaflow_proxy.configs import settings
 
 
-class UIAccessControlMiddleware(BaseHTTPMiddleware):
+class UIAccessControlMiddleware:
     """Middleware that controls access to UI components based on settings."""
 
-    async def dispatch(self, request: Request, call_next):
-        path = request.url.path
+    def __init__(self, app: ASGIApp):
+        self.app = app
 
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and self.is_blocked(scope["path"]):
+            await Response(status_code=403, content="Forbidden")(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def is_blocked(path: str) -> bool:
         # Block access to home page
         if settings.disable_home_page and (path == "/" or path == "/index.html"):
-            return Response(status_code=403, content="Forbidden")
+            return True
 
         # Block access to API docs
         if settings.disable_docs and (path == "/docs" or path == "/redoc" or path.startswith("/openapi")):
-            return Response(status_code=403, content="Forbidden")
+            return True
 
         # Block access to speedtest UI
         if settings.disable_speedtest and path.startswith("/speedtest"):
-            return Response(status_code=403, content="Forbidden")
+            return True
 
-        return await call_next(request)
+        return False
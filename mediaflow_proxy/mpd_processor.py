@@ -1,18 +1,122 @@
 import asyncio
 import logging
 import math
+import struct
 import time
 
+from typing import AsyncGenerator, AsyncIterable, Iterator, Optional
+from urllib.parse import quote_plus
+
 from fastapi import Request, Response, HTTPException
+from starlette.background import BackgroundTask
 
-from mediaflow_proxy.drm.decrypter import decrypt_segment
+from mediaflow_proxy.drm.decrypter import decrypt_segment, MP4Parser, MP4StreamDecrypter
+from mediaflow_proxy.drm.executor import decrypt_executor
+from mediaflow_proxy.utils.cache_utils import register_stream_context
 from mediaflow_proxy.utils.crypto_utils import encryption_handler
-from mediaflow_proxy.utils.http_utils import encode_mediaflow_proxy_url, get_original_scheme, ProxyRequestHeaders
+from mediaflow_proxy.utils.http_utils import (
+    encode_mediaflow_proxy_url,
+    get_original_scheme,
+    ProxyRequestHeaders,
+    Streamer,
+    EnhancedStreamingResponse,
+)
 from mediaflow_proxy.utils.dash_prebuffer import dash_prebuffer
+from mediaflow_proxy.utils.mpd_utils import SegmentSequence, format_segment_url
 from mediaflow_proxy.configs import settings
 
 logger = logging.getLogger(__name__)
 
+# Number of lines per chunk when streaming a generated HLS playlist
+PLAYLIST_STREAM_BATCH_SIZE = 512
+# LL-HLS partial segments stay listed for this many target durations from the live edge
+PART_LISTING_TARGET_DURATIONS = 3
+
+
+class LowLatencyTimeline:
+    """
+    Wall clock timing of the LL-HLS partial segments of a live DASH representation served as chunked CMAF.
+
+    The origin serves a segment `availabilityTimeOffset` seconds before its end, while it is still being produced,
+    and its CMAF chunks are split into parts of `part_duration` seconds. Segments following the last one of the
+    manifest are expected every segment duration, so that parts can be listed between two manifest refreshes.
+    """
+
+    def __init__(self, segments: SegmentSequence, availability_time_offset: float, part_target: float):
+        """
+        Args:
+            segments (SegmentSequence): The segments of the representation, see `SegmentSequence.extend`.
+            availability_time_offset (float): The availability time offset of the representation in seconds.
+            part_target (float): The maximum part duration in seconds.
+        """
+        self.segments = segments
+        self.availability_time_offset = availability_time_offset
+        self.segment_duration = segments.extinf(-1)
+        self.part_count = max(math.ceil(self.segment_duration / part_target - 0.001), 1)
+        self.part_duration = self.segment_duration / self.part_count
+
+    def start(self, number: int) -> float:
+        """Returns the wall clock start time of a segment as a Unix timestamp."""
+        return self.segments.end_timestamp() + (number - self.segments.numbers[-1] - 1) * self.segment_duration
+
+    def available_at(self, number: int) -> float:
+        """Returns the Unix time from which the origin serves a segment."""
+        return self.start(number) + max(self.segment_duration - self.availability_time_offset, 0)
+
+    def listed_at(self, number: int, part: Optional[int] = None) -> float:
+        """Returns the Unix time from which a part, or the whole segment if None, is listed in the playlist."""
+        if part is None:
+            return self.start(number) + self.segment_duration
+        return max(self.start(number) + (part + 1) * self.part_duration, self.available_at(number))
+
+
+def low_latency_timeline(mpd_dict: dict, profile: dict) -> Optional[LowLatencyTimeline]:
+    """
+    Returns the LL-HLS timing of a profile, or None if its playlist lists whole segments only: VOD, no
+    availability time offset (segments are only served once complete), or LL-HLS disabled.
+    """
+    segments = profile.get("segments")
+    if (
+        not mpd_dict["isLive"]
+        or settings.mpd_part_target_duration <= 0
+        or profile.get("availabilityTimeOffset", 0) <= 0
+        or not segments
+        or segments.end_timestamp() is None
+        or not segments.durations[-1]
+    ):
+        return None
+    return LowLatencyTimeline(
+        segments.extend(time.time()), profile["availabilityTimeOffset"], settings.mpd_part_target_duration
+    )
+
+
+async def wait_for_playlist_update(timeline: LowLatencyTimeline, msn: str, part: Optional[str] = None) -> None:
+    """
+    Holds an LL-HLS blocking playlist reload until the requested segment, or part of it, is listed.
+
+    Args:
+        timeline (LowLatencyTimeline): The timing of the parts of the playlist.
+        msn (str): The `_HLS_msn` directive, the media sequence number of the awaited segment.
+        part (str, optional): The `_HLS_part` directive, the index of the awaited part of that segment.
+
+    Raises:
+        HTTPException: If the directives are invalid, or the update is too far in the future.
+    """
+    try:
+        number = int(msn)
+        part_index = int(part) if part is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid _HLS_msn or _HLS_part")
+    if part_index is not None and part_index >= timeline.part_count:
+        # A part past the last one of the segment is the first part of the next segment
+        number, part_index = number + 1, 0
+
+    delay = timeline.listed_at(number, part_index) - time.time()
+    if delay > PART_LISTING_TARGET_DURATIONS * math.ceil(timeline.segment_duration):
+        raise HTTPException(status_code=400, detail="Requested playlist update is too far in the future")
+    if delay > 0:
+        await asyncio.sleep(delay)
+
 
 async def process_manifest(
     request: Request, mpd_dict: dict, proxy_headers: ProxyRequestHeaders, key_id: str = None, key: str = None
@@ -64,7 +168,7 @@ async def process_playlist(
         proxy_headers (ProxyRequestHeaders): The headers to include in the request.
 
     Returns:
-        Response: The HLS playlist as an HTTP response.
+        Response: The HLS playlist as a streaming HTTP response.
 
     Raises:
         HTTPException: If the profile is not found in the MPD manifest.
@@ -73,42 +177,288 @@ async def process_playlist(
     if not matching_profiles:
         raise HTTPException(status_code=404, detail="Profile not found")
 
-    hls_content = build_hls_playlist(mpd_dict, matching_profiles, request)
-    return Response(content=hls_content, media_type="application/vnd.apple.mpegurl", headers=proxy_headers.response)
+    context_ids = None
+    if settings.mpd_compact_segment_urls:
+        # Segment URLs only reference the parameters they share, registered once per profile
+        context_ids = {}
+        for profile in matching_profiles:
+            if profile["segments"]:
+                query_params, _ = segment_query_params(mpd_dict, profile, request)
+                query_params.pop("api_password", None)
+                context_ids[profile["id"]] = await register_stream_context(
+                    {"params": query_params, "media": profile["segments"].media}
+                )
+
+    # Stream the playlist as it is generated, long VOD playlists start reaching the client right away
+    return EnhancedStreamingResponse(
+        stream_hls_playlist(mpd_dict, matching_profiles, request, context_ids),
+        media_type="application/vnd.apple.mpegurl",
+        headers=proxy_headers.response,
+    )
 
 
-async def process_segment(
-    init_content: bytes,
-    segment_content: bytes,
+async def process_segment_stream(
+    init_content: Optional[bytes],
+    streamer: Streamer,
     mimetype: str,
     proxy_headers: ProxyRequestHeaders,
     key_id: str = None,
     key: str = None,
-) -> Response:
+) -> EnhancedStreamingResponse:
     """
-    Processes and decrypts a media segment.
+    Streams a media segment to the client, decrypting it on the fly if necessary.
+
+    The segment is never buffered as a whole: each 'moof' and every complete sample of the following 'mdat' is
+    forwarded as soon as it has been received and decrypted.
 
     Args:
-        init_content (bytes): The initialization segment content.
-        segment_content (bytes): The media segment content.
+        init_content (Optional[bytes]): The initialization segment content.
+        streamer (Streamer): The streamer with an open upstream response for the media segment.
         mimetype (str): The MIME type of the segment.
         proxy_headers (ProxyRequestHeaders): The headers to include in the request.
         key_id (str, optional): The DRM key ID. Defaults to None.
         key (str, optional): The DRM key. Defaults to None.
 
     Returns:
-        Response: The decrypted segment as an HTTP response.
+        EnhancedStreamingResponse: The (decrypted) segment as a streaming HTTP response.
+    """
+    return EnhancedStreamingResponse(
+        iter_processed_segment(init_content or b"", streamer, mimetype, key_id, key),
+        media_type=mimetype,
+        headers=proxy_headers.response,
+        background=BackgroundTask(streamer.close),
+        output_chunk_size=0,
+    )
+
+
+async def iter_processed_segment(
+    init_content: bytes, streamer: Streamer, mimetype: str, key_id: str = None, key: str = None
+) -> AsyncGenerator[bytes, None]:
     """
-    if key_id and key:
-        # For DRM protected content
-        now = time.time()
-        decrypted_content = decrypt_segment(init_content, segment_content, key_id, key)
-        logger.info(f"Decryption of {mimetype} segment took {time.time() - now:.4f} seconds")
-    else:
-        # For non-DRM protected content, we just concatenate init and segment content
-        decrypted_content = init_content + segment_content
+    Yields the init segment followed by the media segment, decrypting them if a key is given.
 
-    return Response(content=decrypted_content, media_type=mimetype, headers=proxy_headers.response)
+    Args:
+        init_content (bytes): The initialization segment content.
+        streamer (Streamer): The streamer with an open upstream response for the media segment.
+        mimetype (str): The MIME type of the segment.
+        key_id (str, optional): The DRM key ID. Defaults to None.
+        key (str, optional): The DRM key. Defaults to None.
+
+    Yields:
+        bytes: The processed segment content.
+    """
+    if not (key_id and key):
+        # For non-DRM protected content, we just send the init content followed by the segment content
+        if init_content:
+            yield init_content
+        async for chunk in streamer.stream_content():
+            yield chunk
+        return
+
+    if not decrypt_executor.supports_streaming:
+        # Decrypter state cannot be shared with worker processes, decrypt the whole segment in a single job
+        segment_content = bytearray()
+        async for chunk in streamer.stream_content():
+            segment_content += chunk
+        now = time.perf_counter()
+        yield await decrypt_executor.run(
+            decrypt_segment,
+            init_content,
+            bytes(segment_content),
+            key_id,
+            key,
+            size=len(segment_content),
+            batchable=mimetype.startswith("audio/"),
+        )
+        decrypt_executor.record_segment(mimetype, time.perf_counter() - now)
+        return
+
+    decrypter = MP4StreamDecrypter({bytes.fromhex(key_id): bytes.fromhex(key)})
+    decryption_time = 0.0
+
+    now = time.perf_counter()
+    output = await decrypt_executor.run(decrypter.process_init, init_content, size=len(init_content))
+    decryption_time += time.perf_counter() - now
+    if output:
+        yield output
+
+    # Chunks of a segment are never batched: each waits for the previous one, a batch window would delay them all
+    async for chunk in streamer.stream_content():
+        now = time.perf_counter()
+        output = await decrypt_executor.run(decrypter.feed, chunk, size=len(chunk))
+        decryption_time += time.perf_counter() - now
+        if output:
+            yield output
+
+    now = time.perf_counter()
+    output = await decrypt_executor.run(decrypter.flush)
+    decryption_time += time.perf_counter() - now
+    if output:
+        yield output
+    decrypt_executor.record_segment(mimetype, decryption_time)
+
+
+class CMAFPartSplitter:
+    """
+    Splits a processed fragmented MP4 segment, the init segment followed by the media segment, into LL-HLS partial
+    segments on CMAF chunk boundaries, without buffering the chunks.
+
+    Each 'moof' is assigned to a part from its decode time relative to the first one, and the following 'mdat' is
+    passed through as it arrives. The init segment boxes are marked with part -1, as every part starts with them.
+    'sidx' boxes, which index the whole segment, are dropped, and other boxes are sent with the next chunk.
+    """
+
+    def __init__(self, part_duration: float, part_count: int):
+        """
+        Args:
+            part_duration (float): The duration of a part in seconds.
+            part_count (int): The number of parts of the segment.
+        """
+        self.part_duration = part_duration
+        self.part_count = part_count
+        self.part = 0
+        self._timescale: Optional[int] = None
+        self._first_decode_time: Optional[int] = None
+        self._buffer = bytearray()
+        self._pending = bytearray()
+        self._mdat_remaining: Optional[int] = None  # None outside an 'mdat', -1 for an 'mdat' running to the end
+
+    def feed(self, data: bytes) -> list[tuple[int, bytes]]:
+        """
+        Feeds the next chunk of the segment.
+
+        Args:
+            data (bytes): The next chunk of the segment.
+
+        Returns:
+            list[tuple[int, bytes]]: The parts and content of the output ready to be sent.
+        """
+        self._buffer += data
+        output = []
+        position = 0
+        buffer = self._buffer
+        while position < len(buffer):
+            if self._mdat_remaining is not None:
+                end = len(buffer) if self._mdat_remaining == -1 else min(len(buffer), position + self._mdat_remaining)
+                output.append((self.part, bytes(buffer[position:end])))
+                if self._mdat_remaining != -1:
+                    self._mdat_remaining -= end - position
+                    if self._mdat_remaining == 0:
+                        self._mdat_remaining = None
+                position = end
+                continue
+
+            if len(buffer) - position < 8:
+                break
+            size, box_type = struct.unpack_from(">I4s", buffer, position)
+            header_size = 8
+            if size == 1:
+                if len(buffer) - position < 16:
+                    break
+                size = struct.unpack_from(">Q", buffer, position + 8)[0]
+                header_size = 16
+
+            if box_type == b"mdat":
+                output.append((self.part, bytes(self._pending) + bytes(buffer[position : position + header_size])))
+                self._pending.clear()
+                self._mdat_remaining = size - header_size if size else -1
+                if self._mdat_remaining == 0:
+                    self._mdat_remaining = None
+                position += header_size
+                continue
+
+            if size < header_size:
+                raise ValueError(f"Invalid size {size} for {box_type!r} box")
+            if len(buffer) - position < size:
+                break
+            box = bytes(buffer[position : position + size])
+            payload = memoryview(box)[header_size:]
+            position += size
+            if box_type in (b"ftyp", b"moov"):
+                if box_type == b"moov":
+                    self._timescale = self._parse_timescale(payload)
+                output.append((-1, box))
+            elif box_type == b"moof":
+                self.part = self._part_of(payload)
+                output.append((self.part, bytes(self._pending) + box))
+                self._pending.clear()
+            elif box_type != b"sidx":
+                self._pending += box
+
+        del buffer[:position]
+        return output
+
+    def flush(self) -> list[tuple[int, bytes]]:
+        """Returns the remaining output once the segment has ended."""
+        output = [(self.part, bytes(self._pending) + bytes(self._buffer))] if self._pending or self._buffer else []
+        self._pending.clear()
+        self._buffer.clear()
+        return output
+
+    def _part_of(self, moof: memoryview) -> int:
+        """Returns the part of a CMAF chunk from the decode time of its 'moof'."""
+        decode_time = self._parse_decode_time(moof)
+        if decode_time is None or not self._timescale:
+            return self.part
+        if self._first_decode_time is None:
+            self._first_decode_time = decode_time
+        offset = (decode_time - self._first_decode_time) / self._timescale
+        return max(min(int(offset / self.part_duration + 0.001), self.part_count - 1), self.part)
+
+    @staticmethod
+    def _child(payload: memoryview, box_type: bytes) -> Optional[memoryview]:
+        for atom in MP4Parser(payload).list_atoms():
+            if atom.atom_type == box_type:
+                return atom.data
+        return None
+
+    @classmethod
+    def _parse_timescale(cls, moov: memoryview) -> Optional[int]:
+        """Returns the media timescale of the first track of a 'moov'."""
+        trak = cls._child(moov, b"trak")
+        mdia = cls._child(trak, b"mdia") if trak is not None else None
+        mdhd = cls._child(mdia, b"mdhd") if mdia is not None else None
+        if mdhd is None or len(mdhd) < 24:
+            return None
+        return struct.unpack_from(">I", mdhd, 20 if mdhd[0] == 1 else 12)[0]
+
+    @classmethod
+    def _parse_decode_time(cls, moof: memoryview) -> Optional[int]:
+        """Returns the base media decode time of the first track fragment of a 'moof'."""
+        traf = cls._child(moof, b"traf")
+        tfdt = cls._child(traf, b"tfdt") if traf is not None else None
+        if tfdt is None or len(tfdt) < 8:
+            return None
+        if tfdt[0] == 1:
+            return struct.unpack_from(">Q", tfdt, 4)[0] if len(tfdt) >= 12 else None
+        return struct.unpack_from(">I", tfdt, 4)[0]
+
+
+async def iter_segment_part(
+    chunks: AsyncIterable[bytes], part: int, part_count: int, duration: float
+) -> AsyncGenerator[bytes, None]:
+    """
+    Yields an LL-HLS partial segment of a processed segment, see `CMAFPartSplitter`, as its chunks arrive.
+
+    Args:
+        chunks (AsyncIterable[bytes]): The processed segment, the init segment followed by the media segment.
+        part (int): The index of the part.
+        part_count (int): The number of parts of the segment.
+        duration (float): The segment duration in seconds.
+
+    Yields:
+        bytes: The init segment followed by the chunks of the part.
+    """
+    splitter = CMAFPartSplitter(duration / part_count, part_count)
+    async for chunk in chunks:
+        for index, data in splitter.feed(chunk):
+            if index > part:
+                return
+            if index == part or index == -1:
+                yield data
+    for index, data in splitter.flush():
+        if index == part:
+            yield data
 
 
 def build_hls(mpd_dict: dict, request: Request, key_id: str = None, key: str = None) -> str:
@@ -179,7 +529,90 @@ def build_hls_playlist(mpd_dict: dict, profiles: list[dict], request: Request) -
     Returns:
         str: The HLS playlist as a string.
     """
-    hls = ["#EXTM3U", "#EXT-X-VERSION:6"]
+    return "\n".join(iter_hls_playlist(mpd_dict, profiles, request))
+
+
+async def stream_hls_playlist(
+    mpd_dict: dict,
+    profiles: list[dict],
+    request: Request,
+    context_ids: Optional[dict] = None,
+    batch_size: int = PLAYLIST_STREAM_BATCH_SIZE,
+) -> AsyncGenerator[str, None]:
+    """
+    Streams an HLS playlist from the MPD manifest for specific profiles, in batches of lines.
+
+    Args:
+        mpd_dict (dict): The MPD manifest data.
+        profiles (list[dict]): The profiles to include in the playlist.
+        request (Request): The incoming HTTP request.
+        context_ids (dict, optional): Stream context IDs by profile ID, see `iter_hls_playlist`.
+        batch_size (int, optional): The number of lines per chunk.
+
+    Yields:
+        str: Chunks of the HLS playlist.
+    """
+    separator = ""
+    batch = []
+    for line in iter_hls_playlist(mpd_dict, profiles, request, context_ids):
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield separator + "\n".join(batch)
+            separator = "\n"
+            batch = []
+            # Let other requests run between batches of a long playlist
+            await asyncio.sleep(0)
+    if batch:
+        yield separator + "\n".join(batch)
+
+
+def segment_query_params(mpd_dict: dict, profile: dict, request: Request) -> tuple[dict, bool]:
+    """
+    Builds the query parameters shared by the segment URLs of a profile.
+
+    Args:
+        mpd_dict (dict): The MPD manifest data.
+        profile (dict): The profile of the segments.
+        request (Request): The incoming HTTP request.
+
+    Returns:
+        tuple[dict, bool]: The query parameters and whether the segment URLs must be encrypted.
+    """
+    query_params = dict(request.query_params)
+    query_params.pop("profile_id", None)
+    query_params.pop("d", None)
+    # LL-HLS delivery directives only apply to the playlist being requested
+    [query_params.pop(key) for key in list(query_params.keys()) if key.startswith("_HLS_")]
+    has_encrypted = query_params.pop("has_encrypted", False)
+    query_params.update(
+        {
+            "init_url": profile["initUrl"],
+            "mime_type": profile["mimeType"],
+            "is_live": "true" if mpd_dict.get("isLive") else "false",
+        }
+    )
+    return query_params, bool(has_encrypted)
+
+
+def iter_hls_playlist(
+    mpd_dict: dict, profiles: list[dict], request: Request, context_ids: Optional[dict] = None
+) -> Iterator[str]:
+    """
+    Generates the lines of an HLS playlist from the MPD manifest for specific profiles.
+
+    Args:
+        mpd_dict (dict): The MPD manifest data.
+        profiles (list[dict]): The profiles to include in the playlist.
+        request (Request): The incoming HTTP request.
+        context_ids (dict, optional): Stream context IDs by profile ID. Segment URLs of these profiles only carry
+            the context ID, the segment number (and time) and the duration, the segment endpoint restores the
+            other parameters from the context.
+
+    Yields:
+        str: The lines of the HLS playlist.
+    """
+    yield "#EXTM3U"
+    yield "#EXT-X-VERSION:6"
 
     added_segments = 0
 
@@ -192,6 +625,11 @@ def build_hls_playlist(mpd_dict: dict, profiles: list[dict], request: Request) -
             logger.warning(f"No segments found for profile {profile['id']}")
             continue
 
+        # Live chunked CMAF representations also list the parts of their latest segments, see `LowLatencyTimeline`
+        timeline = low_latency_timeline(mpd_dict, profile)
+        if timeline is not None:
+            segments = timeline.segments
+
         if mpd_dict["isLive"]:
             depth = max(settings.mpd_live_playlist_depth, 1)
             trimmed_segments = segments[-depth:]
@@ -200,69 +638,119 @@ def build_hls_playlist(mpd_dict: dict, profiles: list[dict], request: Request) -
 
         # Add headers for only the first profile
         if index == 0:
-            first_segment = trimmed_segments[0]
-            extinf_values = [f["extinf"] for f in trimmed_segments if "extinf" in f]
-            target_duration = math.ceil(max(extinf_values)) if extinf_values else 3
-
-            # Align HLS media sequence with MPD-provided numbering when available
-            mpd_start_number = profile.get("segment_template_start_number")
-            sequence = first_segment.get("number")
-
-            if sequence is None:
-                # Fallback to MPD template start number
-                if mpd_start_number is not None:
-                    sequence = mpd_start_number
-                else:
-                    # As a last resort, derive from timeline information
-                    time_val = first_segment.get("time")
-                    duration_val = first_segment.get("duration_mpd_timescale")
-                    if time_val is not None and duration_val and duration_val > 0:
-                        sequence = math.floor(time_val / duration_val)
-                    else:
-                        sequence = 1
-
-            hls.extend(
-                [
-                    f"#EXT-X-TARGETDURATION:{target_duration}",
-                    f"#EXT-X-MEDIA-SEQUENCE:{sequence}",
-                ]
-            )
-            if mpd_dict["isLive"]:
-                hls.append("#EXT-X-PLAYLIST-TYPE:EVENT")
-            else:
-                hls.append("#EXT-X-PLAYLIST-TYPE:VOD")
-
-        init_url = profile["initUrl"]
+            target_duration = math.ceil(trimmed_segments.max_extinf()) or 3
 
-        query_params = dict(request.query_params)
-        query_params.pop("profile_id", None)
-        query_params.pop("d", None)
-        has_encrypted = query_params.pop("has_encrypted", False)
+            # Align HLS media sequence with MPD-provided numbering
+            sequence = trimmed_segments.numbers[0]
 
-        for segment in trimmed_segments:
-            program_date_time = segment.get("program_date_time")
-            if program_date_time:
-                hls.append(f"#EXT-X-PROGRAM-DATE-TIME:{program_date_time}")
-            hls.append(f'#EXTINF:{segment["extinf"]:.3f},')
-            query_params.update(
-                {
-                    "init_url": init_url,
-                    "segment_url": segment["media"],
-                    "mime_type": profile["mimeType"],
-                    "is_live": "true" if mpd_dict.get("isLive") else "false",
-                }
+            yield f"#EXT-X-TARGETDURATION:{target_duration}"
+            yield f"#EXT-X-MEDIA-SEQUENCE:{sequence}"
+            if timeline is not None:
+                yield (
+                    f"#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,"
+                    f"PART-HOLD-BACK={PART_LISTING_TARGET_DURATIONS * timeline.part_duration:.3f}"
+                )
+                yield f"#EXT-X-PART-INF:PART-TARGET={timeline.part_duration:.3f}"
+            # Live playlists slide over the latest segments, neither EVENT nor VOD allows removing segments
+            if not mpd_dict["isLive"]:
+                yield "#EXT-X-PLAYLIST-TYPE:VOD"
+
+        query_params, has_encrypted = segment_query_params(mpd_dict, profile, request)
+        context_id = context_ids.get(profile["id"]) if context_ids else None
+        if context_id:
+            # Only the credentials stay in the URL, a single token per profile when encrypted
+            context_params = {"ctx": context_id}
+            if "api_password" in query_params:
+                context_params["api_password"] = query_params["api_password"]
+            context_url = encode_mediaflow_proxy_url(
+                proxy_url,
+                query_params=context_params,
+                encryption_handler=encryption_handler if has_encrypted else None,
             )
-            hls.append(
-                encode_mediaflow_proxy_url(
+            context_url += "&n=" if "?" in context_url else "?n="
+            uses_time = trimmed_segments.uses_time
+        elif not has_encrypted:
+            # Every segment URL shares the same query string, only the segment URL and duration are appended
+            segment_url_prefix = encode_mediaflow_proxy_url(proxy_url, query_params=query_params) + "&segment_url="
+
+        if timeline is not None:
+
+            def part_uri(number: int, time_value: int, part: int) -> str:
+                """Returns the URI of a part of a segment."""
+                extinf = f"{timeline.segment_duration:.3f}"
+                available_at = f"{timeline.available_at(number):.3f}"
+                if context_id:
+                    time_param = f"&t={time_value}" if uses_time else ""
+                    segment_uri = f"{context_url}{number}{time_param}&duration={extinf}"
+                elif has_encrypted:
+                    return encode_mediaflow_proxy_url(
+                        proxy_url,
+                        query_params={
+                            **query_params,
+                            "segment_url": format_segment_url(trimmed_segments.media, number, time_value),
+                            "duration": extinf,
+                            "part": part,
+                            "parts": timeline.part_count,
+                            "available_at": available_at,
+                        },
+                        encryption_handler=encryption_handler,
+                    )
+                else:
+                    segment_url = format_segment_url(trimmed_segments.media, number, time_value)
+                    segment_uri = f"{segment_url_prefix}{quote_plus(segment_url)}&duration={extinf}"
+                return f"{segment_uri}&part={part}&parts={timeline.part_count}&available_at={available_at}"
+
+            def part_lines(number: int, time_value: int, parts: range) -> Iterator[str]:
+                """Yields the EXT-X-PART lines of parts of a segment."""
+                for part in parts:
+                    independent = ",INDEPENDENT=YES" if part == 0 and profile["startWithSAP"] else ""
+                    yield (
+                        f"#EXT-X-PART:DURATION={timeline.part_duration:.3f},"
+                        f'URI="{part_uri(number, time_value, part)}"{independent}'
+                    )
+
+            now = time.time()
+            first_part_segment = len(trimmed_segments) - PART_LISTING_TARGET_DURATIONS
+
+        # Format each line straight from the segment columns, without building a dict per segment
+        for i in range(len(trimmed_segments)):
+            if timeline is not None and i >= first_part_segment:
+                yield from part_lines(
+                    trimmed_segments.numbers[i], trimmed_segments.times[i], range(timeline.part_count)
+                )
+            program_date_time = trimmed_segments.program_date_time(i)
+            if program_date_time:
+                yield f"#EXT-X-PROGRAM-DATE-TIME:{program_date_time}"
+            extinf = f"{trimmed_segments.extinf(i):.3f}"
+            yield f"#EXTINF:{extinf},"
+            if context_id:
+                if uses_time:
+                    yield f"{context_url}{trimmed_segments.numbers[i]}&t={trimmed_segments.times[i]}&duration={extinf}"
+                else:
+                    yield f"{context_url}{trimmed_segments.numbers[i]}&duration={extinf}"
+            elif has_encrypted:
+                yield encode_mediaflow_proxy_url(
                     proxy_url,
-                    query_params=query_params,
-                    encryption_handler=encryption_handler if has_encrypted else None,
+                    query_params={**query_params, "segment_url": trimmed_segments.media_url(i), "duration": extinf},
+                    encryption_handler=encryption_handler,
                 )
-            )
+            else:
+                yield f"{segment_url_prefix}{quote_plus(trimmed_segments.media_url(i))}&duration={extinf}"
             added_segments += 1
 
+        if timeline is not None:
+            # Parts of the segment being produced, and a hint for the next one so that clients request it early
+            number = trimmed_segments.numbers[-1] + 1
+            time_value = trimmed_segments.times[-1] + trimmed_segments.durations[-1]
+            listed = 0
+            while listed < timeline.part_count and timeline.listed_at(number, listed) <= now:
+                listed += 1
+            yield from part_lines(number, time_value, range(listed))
+            if listed == timeline.part_count:
+                number, time_value, listed = number + 1, time_value + trimmed_segments.durations[-1], 0
+            yield f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{part_uri(number, time_value, listed)}"'
+
     if not mpd_dict["isLive"]:
-        hls.append("#EXT-X-ENDLIST")
+        yield "#EXT-X-ENDLIST"
 
     logger.info(f"Added {added_segments} segments to HLS playlist")
-    return "\n".join(hls)
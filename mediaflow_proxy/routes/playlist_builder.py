@@ -5,9 +5,8 @@ from typing import Iterator, Dict, Optional
 from fastapi import APIRouter, Request, HTTPException, Query
 from fastapi.responses import StreamingResponse
 from starlette.responses import RedirectResponse
-import httpx
 from mediaflow_proxy.configs import settings
-from mediaflow_proxy.utils.http_utils import get_original_scheme
+from mediaflow_proxy.utils.http_utils import get_original_scheme, get_http_client
 import asyncio
 
 logger = logging.getLogger(__name__)
@@ -181,8 +180,8 @@ async def async_download_m3u_playlist(url: str) -> list[str]:
     }
     lines = []
     try:
-         async with httpx.AsyncClient(verify=True, timeout=30, follow_redirects=True) as client:
-             async with client.stream('GET', url, headers=headers) as response:
+         client = get_http_client()
+         async with client.stream('GET', url, headers=headers, timeout=30, follow_redirects=True) as response:
                 response.raise_for_status()
                 async for line_bytes in response.aiter_lines():
                     if isinstance(line_bytes, bytes):
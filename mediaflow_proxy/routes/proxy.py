@@ -1,5 +1,5 @@
 from typing import Annotated
-from urllib.parse import quote, unquote
+from urllib.parse import quote, unquote, urlencode
 import re
 import logging
 import httpx
@@ -8,6 +8,7 @@ from collections import defaultdict
 
 from fastapi import Request, Depends, APIRouter, Query, HTTPException
 from fastapi.responses import Response, RedirectResponse
+from starlette.datastructures import QueryParams
 
 from mediaflow_proxy.handlers import (
     handle_hls_stream_proxy,
@@ -24,22 +25,39 @@ from mediaflow_proxy.schemas import (
     HLSManifestParams,
     MPDManifestParams,
 )
+from mediaflow_proxy.drm.executor import decrypt_executor
 from mediaflow_proxy.utils.http_utils import (
     get_proxy_headers,
     ProxyRequestHeaders,
-    create_httpx_client,
+    get_http_client,
+    Streamer,
+    EnhancedStreamingResponse,
 )
 from mediaflow_proxy.utils.base64_utils import process_potential_base64_url
+from mediaflow_proxy.utils.cache_utils import (
+    EXTRACTOR_CACHE,
+    SingleFlight,
+    get_cached_extractor_result,
+    get_stream_context,
+    set_cache_extractor_result,
+)
+from mediaflow_proxy.utils.mpd_utils import format_segment_url
 
 proxy_router = APIRouter()
 
-# DLHD extraction cache: {original_url: {"data": extraction_result, "timestamp": time.time()}}
-_dlhd_extraction_cache = {}
+# Extraction results are kept in the extractor cache, shared between workers with a shared cache backend:
+# {"dlhd:<original_url>": {"data": extraction_result, "timestamp": time.time()}}
+_dlhd_cache_prefix = "dlhd:"
 _dlhd_cache_duration = 600  # 10 minutes in seconds
 
-_sportsonline_extraction_cache = {}
+_sportsonline_cache_prefix = "sportsonline:"
 _sportsonline_cache_duration = 600  # 10 minutes in seconds
 
+# Query parameters a compact MPD segment URL may carry, every other parameter comes from its stream context
+STREAM_CONTEXT_REQUEST_PARAMS = frozenset(
+    {"ctx", "n", "t", "duration", "part", "parts", "available_at", "api_password", "has_encrypted"}
+)
+
 
 def sanitize_url(url: str) -> str:
     """
@@ -136,12 +154,11 @@ def extract_drm_params_from_url(url: str) -> tuple[str, str, str]:
     return clean_url, key_id, key
 
 
-def _invalidate_dlhd_cache(destination: str):
+async def _invalidate_dlhd_cache(destination: str):
     """Invalidate DLHD cache for a specific destination URL."""
-    if destination in _dlhd_extraction_cache:
-        del _dlhd_extraction_cache[destination]
-        logger = logging.getLogger(__name__)
-        logger.info(f"DLHD cache invalidated for: {destination}")
+    await EXTRACTOR_CACHE.delete(_dlhd_cache_prefix + destination)
+    logger = logging.getLogger(__name__)
+    logger.info(f"DLHD cache invalidated for: {destination}")
 
 
 async def _check_and_extract_dlhd_stream(
@@ -185,16 +202,11 @@ async def _check_and_extract_dlhd_stream(
     
     # Check cache first (unless force_refresh is True)
     current_time = time.time()
-    if not force_refresh and destination in _dlhd_extraction_cache:
-        cached_entry = _dlhd_extraction_cache[destination]
+    cached_entry = None if force_refresh else await get_cached_extractor_result(_dlhd_cache_prefix + destination)
+    if cached_entry is not None:
         cache_age = current_time - cached_entry["timestamp"]
-        
-        if cache_age < _dlhd_cache_duration:
-            logger.info(f"Using cached DLHD data (age: {cache_age:.1f}s)")
-            return cached_entry["data"]
-        else:
-            logger.info(f"DLHD cache expired (age: {cache_age:.1f}s), re-extracting...")
-            del _dlhd_extraction_cache[destination]
+        logger.info(f"Using cached DLHD data (age: {cache_age:.1f}s)")
+        return cached_entry["data"]
     
     # Extract stream data
     try:
@@ -205,10 +217,9 @@ async def _check_and_extract_dlhd_stream(
         logger.info(f"DLHD extraction successful. Stream URL: {result.get('destination_url')}")
         
         # Cache the result
-        _dlhd_extraction_cache[destination] = {
-            "data": result,
-            "timestamp": current_time
-        }
+        await set_cache_extractor_result(
+            _dlhd_cache_prefix + destination, {"data": result, "timestamp": current_time}, ttl=_dlhd_cache_duration
+        )
         logger.info(f"DLHD data cached for {_dlhd_cache_duration}s")
         
         return result
@@ -256,21 +267,20 @@ async def _check_and_extract_sportsonline_stream(
     logger.info(f"Sportsonline link detected: {destination}")
 
     current_time = time.time()
-    if not force_refresh and destination in _sportsonline_extraction_cache:
-        cached_entry = _sportsonline_extraction_cache[destination]
-        if current_time - cached_entry["timestamp"] < _sportsonline_cache_duration:
-            logger.info(f"Using cached Sportsonline data (age: {current_time - cached_entry['timestamp']:.1f}s)")
-            return cached_entry["data"]
-        else:
-            logger.info("Sportsonline cache expired, re-extracting...")
-            del _sportsonline_extraction_cache[destination]
+    cache_key = _sportsonline_cache_prefix + destination
+    cached_entry = None if force_refresh else await get_cached_extractor_result(cache_key)
+    if cached_entry is not None:
+        logger.info(f"Using cached Sportsonline data (age: {current_time - cached_entry['timestamp']:.1f}s)")
+        return cached_entry["data"]
 
     try:
         logger.info(f"Extracting Sportsonline stream data from: {destination}")
         extractor = ExtractorFactory.get_extractor("Sportsonline", proxy_headers.request)
         result = await extractor.extract(destination)
         logger.info(f"Sportsonline extraction successful. Stream URL: {result.get('destination_url')}")
-        _sportsonline_extraction_cache[destination] = {"data": result, "timestamp": current_time}
+        await set_cache_extractor_result(
+            cache_key, {"data": result, "timestamp": current_time}, ttl=_sportsonline_cache_duration
+        )
         logger.info(f"Sportsonline data cached for {_sportsonline_cache_duration}s")
         return result
     except (ExtractorError, DownloadError, Exception) as e:
@@ -389,26 +399,23 @@ async def _handle_hls_with_dlhd_retry(
         from mediaflow_proxy.utils.hls_utils import parse_hls_playlist
         from mediaflow_proxy.utils.m3u8_processor import M3U8Processor
 
-        async with create_httpx_client(
-            headers=proxy_headers.request,
-            follow_redirects=True,
-        ) as client:
-            try:
-                response = await client.get(hls_params.destination)
-                response.raise_for_status()
-                playlist_content = response.text
-            except httpx.HTTPStatusError as e:
-                raise HTTPException(
-                    status_code=502,
-                    detail=f"Failed to fetch HLS manifest from origin: {e.response.status_code} {e.response.reason_phrase}",
-                ) from e
-            except httpx.TimeoutException as e:
-                raise HTTPException(
-                    status_code=504,
-                    detail=f"Timeout while fetching HLS manifest: {e}",
-                ) from e
-            except httpx.RequestError as e:
-                raise HTTPException(status_code=502, detail=f"Network error fetching HLS manifest: {e}") from e
+        client = get_http_client()
+        try:
+            response = await client.get(hls_params.destination, headers=proxy_headers.request, follow_redirects=True)
+            response.raise_for_status()
+            playlist_content = response.text
+        except httpx.HTTPStatusError as e:
+            raise HTTPException(
+                status_code=502,
+                detail=f"Failed to fetch HLS manifest from origin: {e.response.status_code} {e.response.reason_phrase}",
+            ) from e
+        except httpx.TimeoutException as e:
+            raise HTTPException(
+                status_code=504,
+                detail=f"Timeout while fetching HLS manifest: {e}",
+            ) from e
+        except httpx.RequestError as e:
+            raise HTTPException(status_code=502, detail=f"Network error fetching HLS manifest: {e}") from e
         
         streams = parse_hls_playlist(playlist_content, base_url=hls_params.destination)
         if not streams:
@@ -510,6 +517,7 @@ async def hls_segment_proxy(
     Returns:
         Response: The HTTP response with the segment content.
     """
+    from mediaflow_proxy.utils.hls_channels import HLSChannelManager, hls_channels
     from mediaflow_proxy.utils.hls_prebuffer import hls_prebuffer
     from mediaflow_proxy.configs import settings
 
@@ -522,9 +530,19 @@ async def hls_segment_proxy(
         if key.startswith("h_"):
             headers[key[2:]] = value
 
+    # Segments of a live channel session are downloaded once for all its viewers
+    if hls_channels is not None and proxy_headers.request.get("range", "bytes=0-") == "bytes=0-":
+        resource = await hls_channels.get_resource(
+            segment_url, proxy_headers.request, HLSChannelManager.viewer_id(request)
+        )
+        if resource is not None:
+            content, content_type = resource
+            return Response(content=content, media_type=content_type or "video/mp2t", headers=proxy_headers.response)
+
     # Try to get segment from pre-buffer cache first
     if settings.enable_hls_prebuffer:
-        cached_segment = await hls_prebuffer.get_segment(segment_url, headers)
+        # Client identity for the pre-buffer scheduler, which prefetches ahead of the furthest active viewer
+        cached_segment = await hls_prebuffer.get_segment(segment_url, headers, HLSChannelManager.viewer_id(request))
         if cached_segment:
             # Avvia prebuffer dei successivi in background
             asyncio.create_task(hls_prebuffer.prebuffer_from_segment(segment_url, headers))
@@ -716,7 +734,52 @@ async def playlist_endpoint(
     return await get_playlist(request, playlist_params, proxy_headers)
 
 
-@proxy_router.get("/mpd/segment.mp4")
+async def expand_stream_context(request: Request) -> None:
+    """
+    Expand a compact MPD segment URL into the full segment parameters.
+
+    The parameters shared by the segments of a playlist are restored from the stream context registered when the
+    playlist was generated, and the segment URL is formatted from the segment number and time. Runs before the
+    segment parameters and proxy headers are parsed from the query.
+
+    The request may only add the segment parameters listed in `STREAM_CONTEXT_REQUEST_PARAMS`, so that a client
+    cannot make the proxy send the hidden headers of the context to another URL.
+
+    Args:
+        request (Request): The incoming HTTP request.
+
+    Raises:
+        HTTPException: 400 for parameters the context does not accept, 404 for an unknown or expired context.
+    """
+    context_id = request.query_params.get("ctx")
+    if not context_id:
+        return
+
+    unexpected_params = set(request.query_params.keys()) - STREAM_CONTEXT_REQUEST_PARAMS
+    if unexpected_params:
+        detail = f"Unexpected parameters for a stream context: {', '.join(sorted(unexpected_params))}"
+        raise HTTPException(status_code=400, detail=detail)
+
+    context = await get_stream_context(context_id)
+    if context is None:
+        raise HTTPException(status_code=404, detail="Stream context not found or expired, reload the playlist")
+
+    query_params = {**request.query_params, **context["params"]}
+    query_params.pop("ctx")
+    try:
+        number = int(query_params.pop("n"))
+        time_value = query_params.pop("t", None)
+        query_params["segment_url"] = format_segment_url(
+            context["media"], number, int(time_value) if time_value is not None else None
+        )
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid segment number or time")
+
+    request.scope["query_string"] = urlencode(query_params).encode()
+    request._query_params = QueryParams(query_params)
+
+
+@proxy_router.get("/mpd/segment.mp4", dependencies=[Depends(expand_stream_context)])
 async def segment_endpoint(
     segment_params: Annotated[MPDSegmentParams, Query()],
     proxy_headers: Annotated[ProxyRequestHeaders, Depends(get_proxy_headers)],
@@ -743,3 +806,34 @@ async def get_mediaflow_proxy_public_ip():
         Response: The HTTP response with the public IP address in the form of a JSON object. {"ip": "xxx.xxx.xxx.xxx"}
     """
     return await get_public_ip()
+
+
+@proxy_router.get("/stats")
+async def get_mediaflow_proxy_stats():
+    """
+    Retrieves the runtime statistics of this worker: streamed responses, upstream reconnects, coalesced fetches,
+    decryption and the enabled caches.
+
+    Returns:
+        Response: The HTTP response with the statistics in the form of a JSON object, disabled features are omitted.
+    """
+    from mediaflow_proxy.utils.hls_channels import hls_channels
+    from mediaflow_proxy.utils.manifest_cache import manifest_cache
+    from mediaflow_proxy.utils.prebuffer_cache import prebuffer_cache
+    from mediaflow_proxy.utils.range_cache import stream_range_cache
+
+    stats = {
+        "responses": EnhancedStreamingResponse.get_stats(),
+        "upstream": Streamer.get_stats(),
+        "single_flight": SingleFlight.get_all_stats(),
+        "decryption": decrypt_executor.get_stats(),
+        "prebuffer_cache": prebuffer_cache.get_stats(),
+    }
+    for name, component in (
+        ("manifest_cache", manifest_cache),
+        ("range_cache", stream_range_cache),
+        ("hls_channels", hls_channels),
+    ):
+        if component is not None:
+            stats[name] = component.get_stats()
+    return stats
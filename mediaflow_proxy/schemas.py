@@ -105,6 +105,12 @@ class MPDSegmentParams(GenericParams):
     key_id: Optional[str] = Field(None, description="The DRM key ID (optional).")
     key: Optional[str] = Field(None, description="The DRM key (optional).")
     is_live: Optional[bool] = Field(None, alias="is_live", description="Whether the parent MPD is live.")
+    duration: Optional[float] = Field(None, description="The segment duration in seconds (optional).")
+    part: Optional[int] = Field(None, ge=0, description="The index of the LL-HLS partial segment to serve (optional).")
+    parts: Optional[int] = Field(None, ge=1, description="The number of partial segments of the segment (optional).")
+    available_at: Optional[float] = Field(
+        None, description="The Unix time from which the origin serves the segment (optional)."
+    )
 
 
 class ExtractorURLParams(GenericParams):
@@ -0,0 +1,422 @@
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional, Union
+from urllib.parse import urlparse, unquote
+
+from mediaflow_proxy.configs import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CacheValue = Union[bytes, bytearray, memoryview]
+
+
+class CacheBackend(ABC):
+    """Storage backend for cached byte values with a time to live."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        """Returns the value stored for `key`, or None if it is missing or expired."""
+
+    @abstractmethod
+    async def set(self, key: str, data: CacheValue, ttl: float) -> bool:
+        """Stores `data` under `key` for `ttl` seconds. Returns whether the value was stored."""
+
+    @abstractmethod
+    async def delete(self, key: str) -> bool:
+        """Removes `key`. Returns whether the backend could be reached."""
+
+    async def close(self) -> None:
+        """Releases the resources held by the backend."""
+
+
+class MemoryCacheBackend(CacheBackend):
+    """In-process LRU backend, bounded in bytes. Not shared between workers."""
+
+    def __init__(self, max_size: int):
+        # Imported here, cache_utils builds its caches on top of this module
+        from mediaflow_proxy.utils.cache_utils import CacheEntry, LRUMemoryCache
+
+        self.memory_cache = LRUMemoryCache(maxsize=max_size)
+        self._entry_type = CacheEntry
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self.memory_cache.get(key)
+        return entry.data if entry is not None else None
+
+    async def set(self, key: str, data: CacheValue, ttl: float) -> bool:
+        now = time.time()
+        entry = self._entry_type(data=data, expires_at=now + ttl, access_count=0, last_access=now, size=len(data))
+        self.memory_cache.set(key, entry)
+        return True
+
+    async def delete(self, key: str) -> bool:
+        self.memory_cache.remove(key)
+        return True
+
+
+class SharedMemoryCacheBackend(CacheBackend):
+    """
+    Host-wide backend stored in a memory-mapped file (on /dev/shm by default) shared by all workers.
+
+    The file holds a header, an open addressing index of fixed size slots and a data area used as a ring
+    buffer: values are appended at the write position, wrapping around to the start, and index entries whose
+    data gets overwritten are dropped. Access is serialised between processes with POSIX record locks, taken
+    without blocking the event loop: when another worker holds the lock, the access waits for it in a thread.
+    """
+
+    _MAGIC = b"MFC1"
+    _HEADER = struct.Struct(">4sIQQ")  # magic, slot count, data size, write position
+    _SLOT = struct.Struct(">16sQQd")  # key hash, data offset, data length, expiry timestamp (0 = free)
+    _HEADER_SIZE = 64
+    _MAX_PROBES = 8
+
+    def __init__(self, namespace: str, size: int, directory: Optional[str] = None):
+        """
+        Initializes the shared memory backend.
+
+        Args:
+            namespace (str): Name of the cache, used for the file name.
+            size (int): Size of the data area in bytes.
+            directory (str, optional): Directory of the backing file. Defaults to `settings.cache_shm_dir`.
+
+        Raises:
+            OSError: If the backing file cannot be created or its space cannot be reserved.
+        """
+        if fcntl is None:
+            raise OSError("The shared memory cache backend requires POSIX file locking")
+
+        self.path = os.path.join(directory or settings.cache_shm_dir, f"mediaflow_{namespace}.cache")
+        self.data_size = size
+        self.slot_count = max(1024, size // (64 * 1024))
+        self._data_start = self._HEADER_SIZE + self.slot_count * self._SLOT.size
+        self._file_size = self._data_start + self.data_size
+        self._pid = None
+        self._fd = None
+        self._mmap: Optional[mmap.mmap] = None
+        # Record locks do not exclude the threads of a process from each other
+        self._thread_lock = threading.Lock()
+        self._open()
+
+    def _open(self) -> None:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size != self._file_size:
+                    os.ftruncate(fd, 0)
+                    # Reserve the space up front, tmpfs raises SIGBUS when writing past its capacity
+                    os.posix_fallocate(fd, 0, self._file_size)
+                mapped = mmap.mmap(fd, self._file_size)
+                magic, slot_count, data_size, _ = self._HEADER.unpack_from(mapped, 0)
+                if magic != self._MAGIC or slot_count != self.slot_count or data_size != self.data_size:
+                    mapped[: self._data_start] = bytes(self._data_start)
+                    self._HEADER.pack_into(mapped, 0, self._MAGIC, self.slot_count, self.data_size, 0)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd, self._mmap, self._pid = fd, mapped, os.getpid()
+
+    def _ensure_open(self) -> None:
+        # Record locks belong to a process, workers forked after creation need their own descriptor
+        if self._pid != os.getpid():
+            self._mmap = None
+            self._open()
+
+    async def _locked(self, lock_type: int, func, *args):
+        """Runs `func` holding the file lock, in a thread if the lock is not immediately available."""
+        if self._pid != os.getpid():
+            await asyncio.get_running_loop().run_in_executor(None, self._ensure_open)
+        if self._thread_lock.acquire(blocking=False):
+            try:
+                try:
+                    fcntl.lockf(self._fd, lock_type | fcntl.LOCK_NB)
+                except OSError:
+                    pass  # Held by another worker
+                else:
+                    try:
+                        return func(*args)
+                    finally:
+                        fcntl.lockf(self._fd, fcntl.LOCK_UN)
+            finally:
+                self._thread_lock.release()
+        return await asyncio.get_running_loop().run_in_executor(None, self._wait_and_run, lock_type, func, *args)
+
+    def _wait_and_run(self, lock_type: int, func, *args):
+        with self._thread_lock:
+            fcntl.lockf(self._fd, lock_type)
+            try:
+                return func(*args)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _hash(key: str) -> bytes:
+        return hashlib.md5(key.encode()).digest()
+
+    def _probe(self, key_hash: bytes):
+        start = int.from_bytes(key_hash[:8], "big") % self.slot_count
+        for i in range(min(self._MAX_PROBES, self.slot_count)):
+            index = (start + i) % self.slot_count
+            yield index, self._HEADER_SIZE + index * self._SLOT.size
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._locked(fcntl.LOCK_SH, self._get, self._hash(key))
+
+    def _get(self, key_hash: bytes) -> Optional[bytes]:
+        mapped = self._mmap
+        for _, slot_offset in self._probe(key_hash):
+            slot_hash, offset, length, expires_at = self._SLOT.unpack_from(mapped, slot_offset)
+            if slot_hash == key_hash and expires_at:
+                if expires_at < time.time():
+                    return None
+                start = self._data_start + offset
+                return mapped[start : start + length]
+        return None
+
+    async def set(self, key: str, data: CacheValue, ttl: float) -> bool:
+        length = len(data)
+        if length > self.data_size or length == 0:
+            return False
+        return await self._locked(fcntl.LOCK_EX, self._set, self._hash(key), data, ttl)
+
+    def _set(self, key_hash: bytes, data: CacheValue, ttl: float) -> bool:
+        length = len(data)
+        mapped = self._mmap
+        now = time.time()
+        write_position = self._HEADER.unpack_from(mapped, 0)[3]
+        if write_position + length > self.data_size:
+            write_position = 0
+        self._drop_overlapping(write_position, write_position + length)
+
+        start = self._data_start + write_position
+        mapped[start : start + length] = data
+
+        # Reuse the key's slot, else a free or expired one, else evict the one expiring first
+        target = None
+        for _, slot_offset in self._probe(key_hash):
+            slot_hash, _, _, expires_at = self._SLOT.unpack_from(mapped, slot_offset)
+            if slot_hash == key_hash or expires_at < now:
+                target = slot_offset
+                break
+            if target is None or expires_at < self._SLOT.unpack_from(mapped, target)[3]:
+                target = slot_offset
+        self._SLOT.pack_into(mapped, target, key_hash, write_position, length, now + ttl)
+        self._HEADER.pack_into(mapped, 0, self._MAGIC, self.slot_count, self.data_size, write_position + length)
+        return True
+
+    def _drop_overlapping(self, start: int, end: int) -> None:
+        """Frees the slots whose data lies in the range about to be overwritten."""
+        mapped = self._mmap
+        slot_size = self._SLOT.size
+        for slot_offset in range(self._HEADER_SIZE, self._data_start, slot_size):
+            _, offset, length, expires_at = self._SLOT.unpack_from(mapped, slot_offset)
+            if expires_at and offset < end and offset + length > start:
+                mapped[slot_offset : slot_offset + slot_size] = bytes(slot_size)
+
+    async def delete(self, key: str) -> bool:
+        return await self._locked(fcntl.LOCK_EX, self._delete, self._hash(key))
+
+    def _delete(self, key_hash: bytes) -> bool:
+        mapped = self._mmap
+        for _, slot_offset in self._probe(key_hash):
+            if self._SLOT.unpack_from(mapped, slot_offset)[0] == key_hash:
+                mapped[slot_offset : slot_offset + self._SLOT.size] = bytes(self._SLOT.size)
+        return True
+
+    async def close(self) -> None:
+        if self._mmap is not None and self._pid == os.getpid():
+            self._mmap.close()
+            os.close(self._fd)
+        self._mmap = None
+        self._pid = None
+
+
+class RedisError(Exception):
+    """Error reply from a Redis-compatible server."""
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Backend for Redis-compatible servers (Redis, Valkey, KeyDB, Dragonfly...), shared between hosts.
+
+    Speaks the RESP protocol directly with a small pool of connections, only GET, SET with PX, DEL, AUTH
+    and SELECT are used. The cache is best effort: connection errors are logged and treated as misses.
+    """
+
+    def __init__(self, url: str, namespace: str, pool_size: int = 8, timeout: float = 5.0):
+        """
+        Initializes the Redis backend.
+
+        Args:
+            url (str): Server URL, redis://[[username]:password@]host[:port][/db] or rediss:// for TLS.
+            namespace (str): Prefix of the keys stored by this cache.
+            pool_size (int): Maximum number of idle connections kept open. Defaults to 8.
+            timeout (float): Timeout in seconds for connecting and for each command. Defaults to 5.
+        """
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.ssl = parsed.scheme == "rediss"
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = f"mediaflow:{namespace}:"
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    async def _connect(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl or None), self.timeout
+        )
+        try:
+            if self.password:
+                auth = ("AUTH", self.username, self.password) if self.username else ("AUTH", self.password)
+                await self._command(reader, writer, *auth)
+            if self.db:
+                await self._command(reader, writer, "SELECT", str(self.db))
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    @staticmethod
+    def _encode(*args: Union[str, CacheValue]) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            value = arg.encode() if isinstance(arg, str) else arg
+            parts += [b"$%d\r\n" % len(value), value, b"\r\n"]
+        return b"".join(parts)
+
+    async def _read_reply(self, reader: asyncio.StreamReader):
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by the server")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload
+        if prefix == b"-":
+            raise RedisError(payload.decode(errors="replace"))
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            return (await reader.readexactly(length + 2))[:-2]
+        if prefix == b"*":
+            count = int(payload)
+            return None if count < 0 else [await self._read_reply(reader) for _ in range(count)]
+        raise ConnectionError(f"Unexpected reply from the server: {line[:32]!r}")
+
+    async def _command(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, *args):
+        writer.write(self._encode(*args))
+        await writer.drain()
+        return await asyncio.wait_for(self._read_reply(reader), self.timeout)
+
+    async def execute(self, *args: Union[str, CacheValue]):
+        """
+        Sends a command on a pooled connection and returns its reply.
+
+        Raises:
+            RedisError: If the server replies with an error.
+            OSError: If the server cannot be reached.
+        """
+        connection = self._idle.pop() if self._idle else await self._connect()
+        try:
+            reply = await self._command(*connection, *args)
+        except RedisError:
+            self._release(connection)
+            raise
+        except BaseException:
+            connection[1].close()
+            raise
+        self._release(connection)
+        return reply
+
+    def _release(self, connection: tuple[asyncio.StreamReader, asyncio.StreamWriter]) -> None:
+        if len(self._idle) < self.pool_size:
+            self._idle.append(connection)
+        else:
+            connection[1].close()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        try:
+            return await self.execute("GET", self.prefix + key)
+        except (OSError, RedisError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            logger.warning(f"Redis cache GET failed: {e}")
+            return None
+
+    async def set(self, key: str, data: CacheValue, ttl: float) -> bool:
+        try:
+            await self.execute("SET", self.prefix + key, data, "PX", str(max(1, int(ttl * 1000))))
+            return True
+        except (OSError, RedisError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            logger.warning(f"Redis cache SET failed: {e}")
+            return False
+
+    async def delete(self, key: str) -> bool:
+        try:
+            await self.execute("DEL", self.prefix + key)
+            return True
+        except (OSError, RedisError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            logger.warning(f"Redis cache DEL failed: {e}")
+            return False
+
+    async def close(self) -> None:
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+def create_cache_backend(namespace: str, max_size: int) -> CacheBackend:
+    """
+    Creates the cache backend selected by `settings.cache_backend`.
+
+    Falls back to the in-process backend if the shared memory backend cannot be set up.
+
+    Args:
+        namespace (str): Name of the cache, keeps the keys of different caches apart.
+        max_size (int): Maximum size in bytes for the in-process and shared memory backends.
+
+    Returns:
+        CacheBackend: The cache backend.
+    """
+    if max_size <= 0:
+        return MemoryCacheBackend(max_size)
+    if settings.cache_backend == "redis":
+        if settings.redis_url:
+            return RedisCacheBackend(settings.redis_url, namespace)
+        logger.warning("CACHE_BACKEND is redis but REDIS_URL is not set, using the in-process cache")
+    elif settings.cache_backend == "shm":
+        try:
+            return SharedMemoryCacheBackend(namespace, min(max_size, settings.cache_shm_size))
+        except OSError as e:
+            logger.warning(f"Shared memory cache unavailable for {namespace} ({e}), using the in-process cache")
+    return MemoryCacheBackend(max_size)
+
+
+def create_shared_cache_backend(namespace: str, max_size: int) -> Optional[CacheBackend]:
+    """
+    Creates the configured cache backend if it is shared between workers, for use as a second tier
+    behind an in-process cache.
+
+    Returns:
+        Optional[CacheBackend]: The shared backend, or None if the in-process backend is configured.
+    """
+    backend = create_cache_backend(namespace, max_size)
+    return None if isinstance(backend, MemoryCacheBackend) else backend
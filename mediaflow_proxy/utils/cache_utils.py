@@ -1,8 +1,8 @@
 import asyncio
+import base64
 import hashlib
 import json
 import logging
-import os
 import tempfile
 import threading
 import time
@@ -10,16 +10,20 @@ from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, Union, Any
+from typing import AsyncGenerator, Awaitable, Callable, Hashable, Optional, TypeVar, Union, Any
 
-import aiofiles
-import aiofiles.os
-
-from mediaflow_proxy.utils.http_utils import download_file_with_retry, DownloadError
-from mediaflow_proxy.utils.mpd_utils import parse_mpd, parse_mpd_dict
+from mediaflow_proxy.configs import settings
+from mediaflow_proxy.utils.cache_backends import CacheBackend, MemoryCacheBackend, create_cache_backend
+from mediaflow_proxy.utils.crypto_utils import encryption_handler
+from mediaflow_proxy.utils.http_utils import download_file_with_retry, request_with_retry, DownloadError
+from mediaflow_proxy.utils.manifest_cache import ManifestCache
+from mediaflow_proxy.utils.mpd_utils import MPDModel, parse_mpd
+from mediaflow_proxy.utils.slab_store import SlabStore
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 
 @dataclass
 class CacheEntry:
@@ -58,6 +62,10 @@ class LRUMemoryCache:
 
     def set(self, key: str, entry: CacheEntry) -> None:
         with self._lock:
+            if entry.size > self.maxsize:
+                # Never evict the whole cache for an entry that cannot fit anyway
+                return
+
             if key in self._cache:
                 old_entry = self._cache[key]
                 self._current_size -= old_entry.size
@@ -78,7 +86,12 @@ class LRUMemoryCache:
 
 
 class HybridCache:
-    """High-performance hybrid cache combining memory and file storage."""
+    """
+    High-performance hybrid cache combining a memory tier and file storage.
+
+    The memory tier is the configured cache backend: in-process, shared memory or Redis-compatible.
+    The file tier is a log-structured slab store bounded by `max_file_size`.
+    """
 
     def __init__(
         self,
@@ -86,28 +99,20 @@ class HybridCache:
         ttl: int,
         max_memory_size: int = 100 * 1024 * 1024,  # 100MB default
         executor_workers: int = 4,
+        max_file_size: Optional[int] = None,
     ):
         self.cache_dir = Path(tempfile.gettempdir()) / cache_dir_name
         self.ttl = ttl
-        self.memory_cache = LRUMemoryCache(maxsize=max_memory_size)
+        self.backend: CacheBackend = create_cache_backend(cache_dir_name, max_memory_size)
         self._executor = ThreadPoolExecutor(max_workers=executor_workers)
-        self._lock = asyncio.Lock()
-
-        # Initialize cache directories
-        self._init_cache_dirs()
-
-    def _init_cache_dirs(self):
-        """Initialize sharded cache directories."""
-        os.makedirs(self.cache_dir, exist_ok=True)
+        self.file_store = SlabStore(
+            self.cache_dir, max_size=max_file_size or settings.cache_file_max_size, executor=self._executor
+        )
 
     def _get_md5_hash(self, key: str) -> str:
         """Get the MD5 hash of a cache key."""
         return hashlib.md5(key.encode()).hexdigest()
 
-    def _get_file_path(self, key: str) -> Path:
-        """Get the file path for a cache key."""
-        return self.cache_dir / key
-
     async def get(self, key: str, default: Any = None) -> Optional[bytes]:
         """
         Get value from cache, trying memory first then file.
@@ -120,46 +125,21 @@ class HybridCache:
             Cached value or default if not found
         """
         key = self._get_md5_hash(key)
-        # Try memory cache first
-        entry = self.memory_cache.get(key)
-        if entry is not None:
-            return entry.data
-
-        # Try file cache
-        try:
-            file_path = self._get_file_path(key)
-            async with aiofiles.open(file_path, "rb") as f:
-                metadata_size = await f.read(8)
-                metadata_length = int.from_bytes(metadata_size, "big")
-                metadata_bytes = await f.read(metadata_length)
-                metadata = json.loads(metadata_bytes.decode())
-
-                # Check expiration
-                if metadata["expires_at"] < time.time():
-                    await self.delete(key)
-                    return default
-
-                # Read data
-                data = await f.read()
-
-                # Update memory cache in background
-                entry = CacheEntry(
-                    data=data,
-                    expires_at=metadata["expires_at"],
-                    access_count=metadata["access_count"] + 1,
-                    last_access=time.time(),
-                    size=len(data),
-                )
-                self.memory_cache.set(key, entry)
-
-                return data
-
-        except FileNotFoundError:
-            return default
-        except Exception as e:
-            logger.error(f"Error reading from cache: {e}")
+        # Try memory tier first
+        data = await self.backend.get(key)
+        if data is not None:
+            return data
+
+        # Try file tier
+        entry = await self.file_store.get(key)
+        if entry is None:
             return default
 
+        data = bytes(entry.data)
+        # Promote to the memory tier for the remaining lifetime
+        await self.backend.set(key, data, entry.expires_at - time.time())
+        return data
+
     async def set(self, key: str, data: Union[bytes, bytearray, memoryview], ttl: Optional[int] = None) -> bool:
         """
         Set value in both memory and file cache.
@@ -181,74 +161,34 @@ class HybridCache:
 
         if ttl_seconds <= 0:
             # Explicit request to avoid caching - remove any previous entry and return success
-            self.memory_cache.remove(key)
-            try:
-                file_path = self._get_file_path(key)
-                await aiofiles.os.remove(file_path)
-            except FileNotFoundError:
-                pass
-            except Exception as e:
-                logger.error(f"Error removing cache file: {e}")
+            await self.backend.delete(key)
+            await self.file_store.delete(key)
             return True
 
-        expires_at = time.time() + ttl_seconds
-
-        # Create cache entry
-        entry = CacheEntry(data=data, expires_at=expires_at, access_count=0, last_access=time.time(), size=len(data))
-
-        # Update memory cache
-        self.memory_cache.set(key, entry)
-        file_path = self._get_file_path(key)
-        temp_path = file_path.with_suffix(".tmp")
-
-        # Update file cache
-        try:
-            metadata = {"expires_at": expires_at, "access_count": 0, "last_access": time.time()}
-            metadata_bytes = json.dumps(metadata).encode()
-            metadata_size = len(metadata_bytes).to_bytes(8, "big")
+        # Update memory tier
+        await self.backend.set(key, data, ttl_seconds)
 
-            async with aiofiles.open(temp_path, "wb") as f:
-                await f.write(metadata_size)
-                await f.write(metadata_bytes)
-                await f.write(data)
-
-            await aiofiles.os.rename(temp_path, file_path)
-            return True
-
-        except Exception as e:
-            logger.error(f"Error writing to cache: {e}")
-            try:
-                await aiofiles.os.remove(temp_path)
-            except:
-                pass
-            return False
+        # Update file tier
+        return await self.file_store.set(key, data, time.time() + ttl_seconds)
 
     async def delete(self, key: str) -> bool:
         """Delete item from both caches."""
         hashed_key = self._get_md5_hash(key)
-        self.memory_cache.remove(hashed_key)
-
-        try:
-            file_path = self._get_file_path(hashed_key)
-            await aiofiles.os.remove(file_path)
-            return True
-        except FileNotFoundError:
-            return True
-        except Exception as e:
-            logger.error(f"Error deleting from cache: {e}")
-            return False
+        await self.backend.delete(hashed_key)
+        await self.file_store.delete(hashed_key)
+        return True
 
 
 class AsyncMemoryCache:
-    """Async wrapper around LRUMemoryCache."""
+    """Memory-only cache stored in the configured cache backend."""
 
-    def __init__(self, max_memory_size: int):
-        self.memory_cache = LRUMemoryCache(maxsize=max_memory_size)
+    def __init__(self, max_memory_size: int, name: str = "memory_cache"):
+        self.backend: CacheBackend = create_cache_backend(name, max_memory_size)
 
     async def get(self, key: str, default: Any = None) -> Optional[bytes]:
         """Get value from cache."""
-        entry = self.memory_cache.get(key)
-        return entry.data if entry is not None else default
+        data = await self.backend.get(key)
+        return data if data is not None else default
 
     async def set(self, key: str, data: Union[bytes, bytearray, memoryview], ttl: Optional[int] = None) -> bool:
         """Set value in cache."""
@@ -256,15 +196,9 @@ class AsyncMemoryCache:
             ttl_seconds = 3600 if ttl is None else ttl
 
             if ttl_seconds <= 0:
-                self.memory_cache.remove(key)
-                return True
-
-            expires_at = time.time() + ttl_seconds
-            entry = CacheEntry(
-                data=data, expires_at=expires_at, access_count=0, last_access=time.time(), size=len(data)
-            )
-            self.memory_cache.set(key, entry)
-            return True
+                return await self.backend.delete(key)
+
+            return await self.backend.set(key, data, ttl_seconds)
         except Exception as e:
             logger.error(f"Error setting cache value: {e}")
             return False
@@ -272,13 +206,155 @@ class AsyncMemoryCache:
     async def delete(self, key: str) -> bool:
         """Delete item from cache."""
         try:
-            self.memory_cache.remove(key)
-            return True
+            return await self.backend.delete(key)
         except Exception as e:
             logger.error(f"Error deleting from cache: {e}")
             return False
 
 
+class SharedStream:
+    """
+    Buffers a single upstream stream so that any number of readers can consume it concurrently.
+
+    The producer appends chunks as they are produced; every reader receives all chunks from the start,
+    waiting for new ones until the producer finishes. Readers register with `subscribe`, so that the producer
+    task is cancelled once the last of them disconnects before the stream is complete.
+    """
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+        self.size = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.producer: Optional[asyncio.Task] = None
+        self.subscribers = 0
+        self.abandoned = False
+        self._ready = asyncio.Event()
+        self._changed = asyncio.Event()
+
+    def subscribe(self) -> None:
+        """Registers a reader, to be released with `release` once it stops reading."""
+        self.subscribers += 1
+
+    def release(self, disconnected: bool) -> None:
+        """
+        Releases a reader, cancelling the producer when the last reader disconnected before the stream completed.
+
+        Args:
+            disconnected (bool): Whether the reader stopped before receiving everything it needed.
+        """
+        self.subscribers -= 1
+        if disconnected and self.subscribers == 0 and not self.done and self.producer is not None:
+            self.abandoned = True
+            self.producer.cancel()
+
+    def set_ready(self) -> None:
+        """Marks the upstream as successfully opened, releasing readers waiting in `wait_ready`."""
+        self._ready.set()
+
+    async def wait_ready(self) -> None:
+        """
+        Waits until the upstream has been opened.
+
+        Raises:
+            BaseException: The error that prevented the upstream from being opened.
+        """
+        await self._ready.wait()
+        if self.error is not None and not self.chunks:
+            raise self.error
+
+    def append(self, chunk: bytes) -> None:
+        """Appends a chunk and wakes up waiting readers."""
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """Marks the stream as complete, optionally with the error that ended it."""
+        self.done = True
+        self.error = error
+        self._ready.set()
+        self._notify()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def iter_chunks(self) -> AsyncGenerator[bytes, None]:
+        """Yields every chunk of the stream from the start, waiting for the producer as needed."""
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+    def getvalue(self) -> bytes:
+        """Returns the buffered content."""
+        return b"".join(self.chunks)
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent async fetches sharing the same key.
+
+    The first caller for a key starts the fetch; callers arriving while it is in flight wait for the same
+    result, or the same exception. The fetch runs as its own task, so a cancelled caller does not cancel
+    it for the others.
+    """
+
+    _instances: list["SingleFlight"] = []
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self.executions = 0
+        self.coalesced = 0
+        SingleFlight._instances.append(self)
+
+    async def do(self, key: Hashable, fetch: Callable[[], Awaitable[T]]) -> T:
+        """
+        Runs `fetch` unless a fetch for `key` is already in flight, and returns its result.
+
+        Args:
+            key (Hashable): The key identifying the fetch, usually the cache key.
+            fetch (Callable[[], Awaitable[T]]): Starts the fetch.
+
+        Returns:
+            T: The result of the fetch.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+            logger.debug(f"Joined in-flight {self.name} fetch for {key}")
+        return await asyncio.shield(task)
+
+    def _on_done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved in case every caller went away
+
+    def get_stats(self) -> dict:
+        """Returns the number of fetches executed, coalesced and currently in flight."""
+        return {"executions": self.executions, "coalesced": self.coalesced, "in_flight": len(self._inflight)}
+
+    @classmethod
+    def get_all_stats(cls) -> dict:
+        """Returns the statistics of every single-flight group by name."""
+        return {instance.name: instance.get_stats() for instance in cls._instances}
+
+
 # Create cache instances
 INIT_SEGMENT_CACHE = HybridCache(
     cache_dir_name="init_segment_cache",
@@ -288,13 +364,38 @@ INIT_SEGMENT_CACHE = HybridCache(
 
 MPD_CACHE = AsyncMemoryCache(
     max_memory_size=100 * 1024 * 1024,  # 100MB for MPD files
+    name="mpd_cache",
+)
+
+INIT_SEGMENT_FLIGHTS = SingleFlight("init_segment")
+MPD_FLIGHTS = SingleFlight("mpd")
+
+# Parsed MPDs by URL, per worker, so that cached manifests are not parsed again on every request
+MPD_MODELS: "OrderedDict[str, MPDModel]" = OrderedDict()
+MPD_MODELS_MAX_SIZE = 64
+
+DECRYPTED_SEGMENT_CACHE = AsyncMemoryCache(
+    max_memory_size=settings.mpd_segment_cache_size,  # Processed (decrypted) DASH media segments
+    name="decrypted_segment_cache",
 )
 
 EXTRACTOR_CACHE = HybridCache(
     cache_dir_name="extractor_cache",
     ttl=5 * 60,  # 5 minutes
     max_memory_size=50 * 1024 * 1024,
+    max_file_size=64 * 1024 * 1024,  # Small JSON results, keep the preallocated slabs small
+)
+
+# Parameters shared by the segments of generated MPD playlists, in files so that every worker can resolve them.
+# They are encrypted with the API password, contexts holding DRM keys or upstream headers without one are kept
+# in STREAM_CONTEXT_SECRETS instead, by the worker generating the playlist only.
+STREAM_CONTEXT_CACHE = HybridCache(
+    cache_dir_name="stream_context_cache",
+    ttl=settings.mpd_stream_context_ttl,
+    max_memory_size=16 * 1024 * 1024,
+    max_file_size=64 * 1024 * 1024,
 )
+STREAM_CONTEXT_SECRETS = MemoryCacheBackend(16 * 1024 * 1024)
 
 
 # Specific cache implementations
@@ -323,16 +424,34 @@ async def get_cached_init_segment(
         # Remove any previously cached entry when caching is disabled
         await INIT_SEGMENT_CACHE.delete(cache_key)
 
+    async def fetch_init_segment() -> bytes:
+        content = await download_file_with_retry(init_url, headers)
+        if content and use_cache:
+            await INIT_SEGMENT_CACHE.set(cache_key, content, ttl=ttl)
+        return content
+
     try:
-        init_content = await download_file_with_retry(init_url, headers)
-        if init_content and use_cache:
-            await INIT_SEGMENT_CACHE.set(cache_key, init_content, ttl=ttl)
-        return init_content
+        return await INIT_SEGMENT_FLIGHTS.do(cache_key, fetch_init_segment)
     except Exception as e:
         logger.error(f"Error downloading init segment: {e}")
         return None
 
 
+def _get_mpd_model(mpd_url: str, mpd_json: bytes, mpd_dict: Optional[dict] = None) -> MPDModel:
+    """Get the parsed MPD of a URL, updated to the given manifest if it changed."""
+    model = MPD_MODELS.get(mpd_url)
+    if model is None:
+        model = MPD_MODELS[mpd_url] = MPDModel(mpd_url)
+        if len(MPD_MODELS) > MPD_MODELS_MAX_SIZE:
+            MPD_MODELS.popitem(last=False)
+    else:
+        MPD_MODELS.move_to_end(mpd_url)
+
+    if model.version != mpd_json:
+        model.update(mpd_json, mpd_dict if mpd_dict is not None else json.loads(mpd_json))
+    return model
+
+
 async def get_cached_mpd(
     mpd_url: str,
     headers: dict,
@@ -344,20 +463,34 @@ async def get_cached_mpd(
     cached_data = await MPD_CACHE.get(mpd_url)
     if cached_data is not None:
         try:
-            mpd_dict = json.loads(cached_data)
-            return parse_mpd_dict(mpd_dict, mpd_url, parse_drm, parse_segment_profile_id)
+            return _get_mpd_model(mpd_url, cached_data).parse(parse_drm, parse_segment_profile_id)
         except json.JSONDecodeError:
             await MPD_CACHE.delete(mpd_url)
 
-    # Download and parse if not cached
+    async def fetch_mpd() -> bytes:
+        # Ask the origin whether the last downloaded manifest changed, rather than downloading and parsing it again
+        model = MPD_MODELS.get(mpd_url)
+        revalidate = model is not None and model.validators is not None
+        request_headers = {**headers, **ManifestCache.conditional_headers(model.validators)} if revalidate else headers
+        response = await request_with_retry("GET", mpd_url, request_headers, allow_not_modified=revalidate)
+
+        if response.status_code == 304 and model is not None and model.version is not None:
+            logger.debug(f"MPD not modified: {mpd_url}")
+            mpd_json = model.version
+        else:
+            mpd_dict = parse_mpd(response.content)
+            mpd_json = json.dumps(mpd_dict).encode()
+            model = _get_mpd_model(mpd_url, mpd_json, mpd_dict)
+            model.validators = ManifestCache.validators(response.headers)
+
+        # Cache the original MPD dict, the manifest is parsed once by the caller
+        await MPD_CACHE.set(mpd_url, mpd_json, ttl=model.minimum_update_period)
+        return mpd_json
+
+    # Download and parse if not cached, concurrent misses share a single download
     try:
-        mpd_content = await download_file_with_retry(mpd_url, headers)
-        mpd_dict = parse_mpd(mpd_content)
-        parsed_dict = parse_mpd_dict(mpd_dict, mpd_url, parse_drm, parse_segment_profile_id)
-
-        # Cache the original MPD dict
-        await MPD_CACHE.set(mpd_url, json.dumps(mpd_dict).encode(), ttl=parsed_dict.get("minimumUpdatePeriod"))
-        return parsed_dict
+        mpd_json = await MPD_FLIGHTS.do(mpd_url, fetch_mpd)
+        return _get_mpd_model(mpd_url, mpd_json).parse(parse_drm, parse_segment_profile_id)
     except DownloadError as error:
         logger.error(f"Error downloading MPD: {error}")
         raise error
@@ -366,6 +499,17 @@ async def get_cached_mpd(
         raise error
 
 
+def get_mpd_digest(mpd_url: str) -> Optional[bytes]:
+    """
+    Returns the digest of the manifest last returned by `get_cached_mpd` for the URL in this worker, if any.
+
+    None as well for live manifests whose segments depend on the current time, as output generated from them changes
+    while the manifest does not.
+    """
+    model = MPD_MODELS.get(mpd_url)
+    return model.digest if model is not None and not model.uses_wall_clock else None
+
+
 async def get_cached_extractor_result(key: str) -> Optional[dict]:
     """Get extractor result from cache."""
     cached_data = await EXTRACTOR_CACHE.get(key)
@@ -377,10 +521,46 @@ async def get_cached_extractor_result(key: str) -> Optional[dict]:
     return None
 
 
-async def set_cache_extractor_result(key: str, result: dict) -> bool:
-    """Cache extractor result."""
+async def set_cache_extractor_result(key: str, result: dict, ttl: Optional[int] = None) -> bool:
+    """Cache extractor result, optionally overriding the default TTL."""
     try:
-        return await EXTRACTOR_CACHE.set(key, json.dumps(result).encode())
+        return await EXTRACTOR_CACHE.set(key, json.dumps(result).encode(), ttl=ttl)
     except Exception as e:
         logger.error(f"Error caching extractor result: {e}")
         return False
+
+
+async def register_stream_context(context: dict) -> str:
+    """
+    Register a stream context and return its ID.
+
+    The ID is derived from the content, so the playlists of a stream share one context however often they are
+    generated. Each registration stores the context again, so it stays valid for the TTL after the latest playlist.
+
+    Contexts are encrypted when an API password is set. Otherwise, those holding DRM keys or upstream headers are
+    kept in the memory of this worker rather than written to the cache files or a shared backend.
+    """
+    context_json = json.dumps(context, sort_keys=True).encode()
+    context_id = base64.urlsafe_b64encode(hashlib.blake2b(context_json, digest_size=12).digest()).decode()
+    if encryption_handler:
+        await STREAM_CONTEXT_CACHE.set(context_id, encryption_handler.encrypt_data(context).encode())
+    elif any(name in ("key", "key_id") or name.startswith("h_") for name in context["params"]):
+        await STREAM_CONTEXT_SECRETS.set(context_id, context_json, STREAM_CONTEXT_CACHE.ttl)
+    else:
+        await STREAM_CONTEXT_CACHE.set(context_id, context_json)
+    return context_id
+
+
+async def get_stream_context(context_id: str) -> Optional[dict]:
+    """Get a registered stream context, None if unknown or expired."""
+    cached_data = await STREAM_CONTEXT_SECRETS.get(context_id)
+    if cached_data is None:
+        cached_data = await STREAM_CONTEXT_CACHE.get(context_id)
+    if cached_data is not None:
+        try:
+            if encryption_handler:
+                return encryption_handler.decode_token(cached_data.decode())
+            return json.loads(cached_data)
+        except ValueError:
+            await STREAM_CONTEXT_CACHE.delete(context_id)
+    return None
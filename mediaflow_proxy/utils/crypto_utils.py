@@ -1,8 +1,10 @@
 import base64
+import hashlib
+import hmac
 import json
 import logging
 import time
-import traceback
+from collections import OrderedDict
 from typing import Optional
 from urllib.parse import urlencode
 
@@ -10,37 +12,98 @@ from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
 from Crypto.Util.Padding import pad, unpad
 from fastapi import HTTPException, Request
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import QueryParams
 from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from mediaflow_proxy.configs import settings
 
 
 class EncryptionHandler:
-    def __init__(self, secret_key: str):
+    # Marks tokens in the compact format, never found in the URL-safe base64 of the legacy AES-CBC tokens
+    COMPACT_PREFIX = "c."
+    COMPACT_NONCE_SIZE = 12
+    COMPACT_TAG_SIZE = 16
+
+    def __init__(self, secret_key: str, token_format: Optional[str] = None):
         self.secret_key = secret_key.encode("utf-8").ljust(32)[:32]
+        self.token_format = token_format or settings.encryption_token_format
+        # Separate keys for the encryption and the authentication of compact tokens
+        self._compact_key = hmac.digest(self.secret_key, b"mediaflow-token-encryption", "sha256")
+        self._compact_mac_key = hmac.digest(self.secret_key, b"mediaflow-token-authentication", "sha256")
+        # Produces the CTR keystream without creating a cipher per token, which dominates the cost of small tokens
+        self._compact_block_cipher = AES.new(self._compact_key, AES.MODE_ECB)
 
     def encrypt_data(self, data: dict, expiration: int = None, ip: str = None) -> str:
         if expiration:
             data["exp"] = int(time.time()) + expiration
         if ip:
             data["ip"] = ip
+        if self.token_format == "compact":
+            return self._encrypt_compact(data)
         json_data = json.dumps(data).encode("utf-8")
         iv = get_random_bytes(16)
         cipher = AES.new(self.secret_key, AES.MODE_CBC, iv)
         encrypted_data = cipher.encrypt(pad(json_data, AES.block_size))
         return base64.urlsafe_b64encode(iv + encrypted_data).decode("utf-8").rstrip("=")
 
-    def decrypt_data(self, token: str, client_ip: str) -> dict:
-        try:
-            padding_needed = (4 - len(token) % 4) % 4
-            encrypted_token_b64_padded = token + ("=" * padding_needed)
-            encrypted_data = base64.urlsafe_b64decode(encrypted_token_b64_padded.encode("utf-8"))
+    def _encrypt_compact(self, data: dict) -> str:
+        """
+        Encrypts with AES-CTR then authenticates with a truncated HMAC-SHA256, which avoids the padding of CBC and
+        rejects tampered tokens before they are parsed.
+        """
+        json_data = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        nonce = get_random_bytes(self.COMPACT_NONCE_SIZE)
+        encrypted_data = nonce + self._apply_keystream(nonce, json_data)
+        tag = hmac.digest(self._compact_mac_key, encrypted_data, "sha256")[: self.COMPACT_TAG_SIZE]
+        return self.COMPACT_PREFIX + base64.urlsafe_b64encode(encrypted_data + tag).decode("utf-8").rstrip("=")
+
+    def _apply_keystream(self, nonce: bytes, data: bytes) -> bytes:
+        """XORs data with the AES-CTR keystream of the nonce followed by a 32-bit big-endian block counter."""
+        blocks = b"".join(nonce + i.to_bytes(4, "big") for i in range((len(data) + 15) // 16))
+        keystream = self._compact_block_cipher.encrypt(blocks)[: len(data)]
+        return (int.from_bytes(data, "big") ^ int.from_bytes(keystream, "big")).to_bytes(len(data), "big")
+
+    def decode_token(self, token: str) -> dict:
+        """
+        Decrypts a token of either format without verifying its expiration and IP address.
+
+        Raises:
+            ValueError: If the token is malformed or was not produced with this key.
+        """
+        compact = token.startswith(self.COMPACT_PREFIX)
+        if compact:
+            token = token[len(self.COMPACT_PREFIX) :]
+        padding_needed = (4 - len(token) % 4) % 4
+        encrypted_data = base64.urlsafe_b64decode((token + ("=" * padding_needed)).encode("utf-8"))
+
+        if compact:
+            encrypted_data, tag = encrypted_data[: -self.COMPACT_TAG_SIZE], encrypted_data[-self.COMPACT_TAG_SIZE :]
+            expected_tag = hmac.digest(self._compact_mac_key, encrypted_data, "sha256")[: self.COMPACT_TAG_SIZE]
+            if not hmac.compare_digest(tag, expected_tag):
+                raise ValueError("Invalid token signature")
+            nonce = encrypted_data[: self.COMPACT_NONCE_SIZE]
+            decrypted_data = self._apply_keystream(nonce, encrypted_data[self.COMPACT_NONCE_SIZE :])
+        else:
             iv = encrypted_data[:16]
             cipher = AES.new(self.secret_key, AES.MODE_CBC, iv)
             decrypted_data = unpad(cipher.decrypt(encrypted_data[16:]), AES.block_size)
-            data = json.loads(decrypted_data)
 
+        data = json.loads(decrypted_data)
+        if not isinstance(data, dict):
+            raise ValueError("Invalid token payload")
+        return data
+
+    @staticmethod
+    def verify_data(data: dict, client_ip: str) -> dict:
+        """
+        Checks the expiration and IP address of a decoded token and returns its data without them.
+
+        Raises:
+            HTTPException: 401 if the token has expired, 403 if it was issued for another IP address.
+        """
+        if "exp" in data or "ip" in data:
+            data = data.copy()
             if "exp" in data:
                 if data["exp"] < time.time():
                     raise HTTPException(status_code=401, detail="Token has expired")
@@ -51,84 +114,139 @@ class EncryptionHandler:
                     raise HTTPException(status_code=403, detail="IP address mismatch")
                 del data["ip"]  # Remove IP from the data
 
-            return data
-        except Exception as e:
+        return data
+
+    def decrypt_data(self, token: str, client_ip: str) -> dict:
+        try:
+            data = self.decode_token(token)
+        except Exception:
             raise HTTPException(status_code=401, detail="Invalid or expired token")
+        return self.verify_data(data, client_ip)
+
+
+class _DecodedToken:
+    __slots__ = ("data", "query_string")
+
+    def __init__(self, data: dict, query_string: str):
+        # Decrypted data, still holding the expiration and IP address verified on every use
+        self.data = data
+        # Query string of the data once verified, followed by the has_encrypted flag
+        self.query_string = query_string
 
 
-class EncryptionMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app):
-        super().__init__(app)
+class EncryptionMiddleware:
+    """
+    Decrypts the token found at the beginning of the path (`/_token_<token>/...`) or in the `token` query parameter
+    and replaces it with the decrypted query parameters.
+
+    Implemented as a plain ASGI middleware that only edits the scope, so response bodies are passed through as is.
+    """
+
+    def __init__(self, app: ASGIApp, token_cache_size: Optional[int] = None):
+        self.app = app
         self.encryption_handler = encryption_handler
+        # Players send the same token for every segment of a stream, decoded tokens are kept by digest in LRU order
+        self.token_cache_size = settings.encryption_token_cache_size if token_cache_size is None else token_cache_size
+        self._token_cache: "OrderedDict[bytes, _DecodedToken]" = OrderedDict()
+
+    def decode_token(self, token: str, client_ip: str) -> tuple[dict, str]:
+        """
+        Decrypts and verifies a token, reusing the result of a previous request carrying the same token.
+
+        Returns:
+            tuple[dict, str]: The decrypted data and its query string, including the has_encrypted flag.
+
+        Raises:
+            HTTPException: If the token is invalid, has expired or was issued for another IP address.
+        """
+        key = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+        entry = self._token_cache.get(key)
+        if entry is None:
+            try:
+                data = self.encryption_handler.decode_token(token)
+            except Exception:
+                raise HTTPException(status_code=401, detail="Invalid or expired token")
+            params = self.encryption_handler.verify_data(data, client_ip)
+            entry = _DecodedToken(data, urlencode({**params, "has_encrypted": True}))
+            if self.token_cache_size > 0:
+                self._token_cache[key] = entry
+                if len(self._token_cache) > self.token_cache_size:
+                    self._token_cache.popitem(last=False)
+            return params, entry.query_string
+
+        self._token_cache.move_to_end(key)
+        try:
+            params = self.encryption_handler.verify_data(entry.data, client_ip)
+        except HTTPException as e:
+            if e.status_code == 401:
+                del self._token_cache[key]  # Expired tokens never become valid again
+            raise
+        return params, entry.query_string
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.encryption_handler:
+            await self.app(scope, receive, send)
+            return
 
-    async def dispatch(self, request: Request, call_next):
-        path = request.url.path
+        path = scope["path"]
         token_marker = "/_token_"
         encrypted_token = None
 
         # Check for token in path
-        if path.startswith(token_marker) and self.encryption_handler:
-            try:
-                # Extract token from the beginning of the path
-                token_start = len(token_marker)
-                token_end = path.find("/", token_start)
-
-                if token_end == -1:  # No trailing slash
-                    encrypted_token = path[token_start:]
-                    remaining_path = ""
-                else:
-                    encrypted_token = path[token_start:token_end]
-                    remaining_path = path[token_end:]
+        if path.startswith(token_marker):
+            # Extract token from the beginning of the path
+            token_start = len(token_marker)
+            token_end = path.find("/", token_start)
 
-                # Modify the path to remove the token part
-                request.scope["path"] = remaining_path
+            if token_end == -1:  # No trailing slash
+                encrypted_token = path[token_start:]
+                remaining_path = ""
+            else:
+                encrypted_token = path[token_start:token_end]
+                remaining_path = path[token_end:]
 
-                # Update the raw path as well
-                request.scope["raw_path"] = remaining_path.encode()
+            # Modify the path to remove the token part
+            scope["path"] = remaining_path
 
-            except Exception as e:
-                logging.error(f"Error processing token in path: {str(e)}")
-                return JSONResponse(content={"error": f"Invalid token in path: {str(e)}"}, status_code=400)
+            # Update the raw path as well
+            scope["raw_path"] = remaining_path.encode()
 
         # Check for token in query parameters (original method)
-        if not encrypted_token:  # Only check if we didn't already find a token in the path
-            encrypted_token = request.query_params.get("token")
+        query_params = None
+        if not encrypted_token and b"token" in scope["query_string"]:
+            query_params = QueryParams(scope["query_string"])
+            encrypted_token = query_params.get("token")
 
         # Process the token if found (from either source)
-        if encrypted_token and self.encryption_handler:
+        if encrypted_token:
             try:
-                client_ip = self.get_client_ip(request)
-                decrypted_data = self.encryption_handler.decrypt_data(encrypted_token, client_ip)
-
-                # Modify request query parameters with decrypted data
-                query_params = dict(request.query_params)
-                if "token" in query_params:
-                    query_params.pop("token")  # Remove the encrypted token from query params
-
-                query_params.update(decrypted_data)  # Add decrypted data to query params
-                query_params["has_encrypted"] = True
-
-                # Create a new request scope with updated query parameters
-                new_query_string = urlencode(query_params)
-                request.scope["query_string"] = new_query_string.encode()
-                request._query_params = query_params
-
+                client_ip = self.get_client_ip(Request(scope))
+                decrypted_data, decrypted_query_string = self.decode_token(encrypted_token, client_ip)
             except HTTPException as e:
-                return JSONResponse(content={"error": str(e.detail)}, status_code=e.status_code)
+                response = JSONResponse(content={"error": str(e.detail)}, status_code=e.status_code)
+                await response(scope, receive, send)
+                return
             except Exception as e:
                 logging.error(f"Error decrypting token: {str(e)}")
-                return JSONResponse(content={"error": f"Invalid token: {str(e)}"}, status_code=400)
+                response = JSONResponse(content={"error": f"Invalid token: {str(e)}"}, status_code=400)
+                await response(scope, receive, send)
+                return
 
-        try:
-            response = await call_next(request)
-        except Exception:
-            exc = traceback.format_exc(chain=False)
-            logging.error("An error occurred while processing the request, error: %s", exc)
-            return JSONResponse(
-                content={"error": "An error occurred while processing the request, check the server for logs"},
-                status_code=500,
-            )
-        return response
+            # Keep the request query parameters not overridden by the decrypted data, without the token
+            new_query_string = decrypted_query_string
+            if scope["query_string"]:
+                if query_params is None:
+                    query_params = QueryParams(scope["query_string"])
+                remaining_params = {
+                    key: value for key, value in query_params.items() if key != "token" and key not in decrypted_data
+                }
+                if remaining_params:
+                    new_query_string = f"{urlencode(remaining_params)}&{new_query_string}"
+
+            # Modify request query parameters with decrypted data
+            scope["query_string"] = new_query_string.encode()
+
+        await self.app(scope, receive, send)
 
     @staticmethod
     def get_client_ip(request: Request) -> Optional[str]:
@@ -1,13 +1,18 @@
 import logging
-import psutil
 from typing import Dict, Optional, List
 from urllib.parse import urljoin
 import xmltodict
-from mediaflow_proxy.utils.http_utils import create_httpx_client
+from mediaflow_proxy.utils.http_utils import get_http_client
+from mediaflow_proxy.utils.cache_backends import CacheBackend, create_shared_cache_backend
+from mediaflow_proxy.utils.cache_utils import SingleFlight
+from mediaflow_proxy.utils.prebuffer_cache import prebuffer_cache
 from mediaflow_proxy.configs import settings
 
 logger = logging.getLogger(__name__)
 
+# Seconds a segment stays in the shared cache, long enough for every worker serving the stream to pick it up
+SHARED_SEGMENT_TTL = 60
+
 
 class DASHPreBuffer:
     """
@@ -19,7 +24,7 @@ class DASHPreBuffer:
         Initialize the DASH pre-buffer system.
         
         Args:
-            max_cache_size (int): Maximum number of segments to cache (uses config if None)
+            max_cache_size (int): Deprecated, the cache is limited in bytes by PREBUFFER_CACHE_MAX_BYTES
             prebuffer_segments (int): Number of segments to pre-buffer ahead (uses config if None)
         """
         self.max_cache_size = max_cache_size or settings.dash_prebuffer_cache_size
@@ -27,28 +32,42 @@ class DASHPreBuffer:
         self.max_memory_percent = settings.dash_prebuffer_max_memory_percent
         self.emergency_threshold = settings.dash_prebuffer_emergency_threshold
         
-        # Cache for different types of DASH content
-        self.segment_cache: Dict[str, bytes] = {}
-        self.init_segment_cache: Dict[str, bytes] = {}
+        # Cache for different types of DASH content, segments share the byte-budgeted HLS pre-buffer cache
+        self.segment_cache = prebuffer_cache
         self.manifest_cache: Dict[str, dict] = {}
+
+        # Manifest and segment number of each known segment, None for init segments
+        self.segment_positions: Dict[str, tuple[str, Optional[int]]] = {}
         
         # Track segment URLs for each adaptation set
         self.adaptation_segments: Dict[str, List[str]] = {}
-        self.client = create_httpx_client()
+
+        # In-flight downloads, shared between pre-buffering and client requests
+        self._segment_flights = SingleFlight("dash_prebuffer_segment")
+
+        # Second tier shared between workers, created on first use
+        self._shared_cache: Optional[CacheBackend] = None
+        self._shared_cache_created = False
+
+    @property
+    def shared_cache(self) -> Optional[CacheBackend]:
+        """
+        The second cache tier shared between workers, None with the in-process cache backend. Created on first use,
+        so that its shared memory is only reserved when pre-buffering is enabled.
+        """
+        if not self._shared_cache_created and settings.enable_dash_prebuffer:
+            self._shared_cache_created = True
+            self._shared_cache = create_shared_cache_backend("dash_prebuffer", settings.cache_shm_size)
+        return self._shared_cache
     
     def _get_memory_usage_percent(self) -> float:
         """
-        Get current memory usage percentage.
+        Get current memory usage percentage, sampled at most once per PREBUFFER_MEMORY_SAMPLE_INTERVAL.
         
         Returns:
             float: Memory usage percentage
         """
-        try:
-            memory = psutil.virtual_memory()
-            return memory.percent
-        except Exception as e:
-            logger.warning(f"Failed to get memory usage: {e}")
-            return 0.0
+        return self.segment_cache.memory_percent()
     
     def _check_memory_threshold(self) -> bool:
         """
@@ -66,20 +85,11 @@ class DASHPreBuffer:
         """
         if self._check_memory_threshold():
             logger.warning("Emergency DASH cache cleanup triggered due to high memory usage")
-            
-            # Clear 50% of segment cache
-            segment_cache_size = len(self.segment_cache)
-            segment_keys_to_remove = list(self.segment_cache.keys())[:segment_cache_size // 2]
-            for key in segment_keys_to_remove:
-                del self.segment_cache[key]
-            
-            # Clear 50% of init segment cache
-            init_cache_size = len(self.init_segment_cache)
-            init_keys_to_remove = list(self.init_segment_cache.keys())[:init_cache_size // 2]
-            for key in init_keys_to_remove:
-                del self.init_segment_cache[key]
-            
-            logger.info(f"Emergency cleanup removed {len(segment_keys_to_remove)} segments and {len(init_keys_to_remove)} init segments from cache")
+
+            # Halve the cache, starting with segments already played
+            removed = self.segment_cache.shrink(0.5)
+
+            logger.info(f"Emergency cleanup removed {removed} segments from cache")
     
     async def prebuffer_dash_manifest(self, mpd_url: str, headers: Dict[str, str]) -> None:
         """
@@ -135,6 +145,7 @@ class DASHPreBuffer:
                     init_segment = adaptation_set.get('SegmentTemplate', {}).get('@initialization')
                     if init_segment:
                         init_url = urljoin(base_url, init_segment)
+                        self.segment_positions[init_url] = (base_url, None)
                         await self._download_init_segment(init_url, headers)
                     
                     # Extract segment template
@@ -165,16 +176,7 @@ class DASHPreBuffer:
                 logger.warning(f"Memory usage {memory_percent}% exceeds limit {self.max_memory_percent}%, skipping init segment download")
                 return
             
-            response = await self.client.get(init_url, headers=headers)
-            response.raise_for_status()
-            
-            # Cache the init segment
-            self.init_segment_cache[init_url] = response.content
-            
-            # Check for emergency cleanup
-            if self._check_memory_threshold():
-                self._emergency_cache_cleanup()
-            
+            await self._segment_flights.do(init_url, lambda: self._fetch_segment(init_url, headers, is_init=True))
             logger.debug(f"Cached init segment: {init_url}")
             
         except Exception as e:
@@ -204,6 +206,7 @@ class DASHPreBuffer:
                 segment_number = start_number + i
                 segment_url = media_template.replace('$Number$', str(segment_number))
                 full_url = urljoin(base_url, segment_url)
+                self.segment_positions[full_url] = (base_url, segment_number)
                 
                 await self._download_segment(full_url, headers)
                 
@@ -225,10 +228,11 @@ class DASHPreBuffer:
                 segments = [segments]
             
             # Pre-buffer first few segments
-            for segment in segments[:self.prebuffer_segments]:
+            for index, segment in enumerate(segments[:self.prebuffer_segments]):
                 segment_url = segment.get('@src')
                 if segment_url:
                     full_url = urljoin(base_url, segment_url)
+                    self.segment_positions[full_url] = (base_url, index)
                     await self._download_segment(full_url, headers)
                     
         except Exception as e:
@@ -249,26 +253,46 @@ class DASHPreBuffer:
                 logger.warning(f"Memory usage {memory_percent}% exceeds limit {self.max_memory_percent}%, skipping segment download")
                 return
             
-            response = await self.client.get(segment_url, headers=headers)
-            response.raise_for_status()
-            
-            # Cache the segment
-            self.segment_cache[segment_url] = response.content
-            
-            # Check for emergency cleanup
-            if self._check_memory_threshold():
-                self._emergency_cache_cleanup()
-            # Maintain cache size
-            elif len(self.segment_cache) > self.max_cache_size:
-                # Remove oldest entries (simple FIFO)
-                oldest_key = next(iter(self.segment_cache))
-                del self.segment_cache[oldest_key]
-                
+            await self._segment_flights.do(segment_url, lambda: self._fetch_segment(segment_url, headers))
             logger.debug(f"Cached DASH segment: {segment_url}")
             
         except Exception as e:
             logger.warning(f"Failed to download DASH segment {segment_url}: {e}")
     
+    async def _fetch_segment(self, segment_url: str, headers: Dict[str, str], is_init: bool = False) -> bytes:
+        """
+        Get a segment from the shared cache or download it, and cache it.
+
+        Args:
+            segment_url (str): URL of the segment to download
+            headers (Dict[str, str]): Headers to use for request
+            is_init (bool): Whether it is an init segment, never evicted for being behind the playhead
+
+        Returns:
+            bytes: The segment data
+        """
+        segment_data = await self.shared_cache.get(segment_url) if self.shared_cache else None
+        if segment_data is None:
+            response = await self.client.get(segment_url, headers=headers)
+            response.raise_for_status()
+            segment_data = response.content
+            if self.shared_cache:
+                await self.shared_cache.set(segment_url, segment_data, SHARED_SEGMENT_TTL)
+
+        mpd_url, position = self.segment_positions.get(segment_url, (None, None))
+        self.segment_cache.put(segment_url, segment_data, mpd_url, None if is_init else position)
+
+        # Check for emergency cleanup
+        self._emergency_cache_cleanup()
+
+        return segment_data
+
+    def _update_playhead(self, segment_url: str) -> None:
+        """Record a client request for a known media segment."""
+        mpd_url, position = self.segment_positions.get(segment_url, (None, None))
+        if position is not None:
+            self.segment_cache.update_playhead(mpd_url, position)
+
     async def get_segment(self, segment_url: str, headers: Dict[str, str]) -> Optional[bytes]:
         """
         Get a segment from cache or download it.
@@ -281,14 +305,11 @@ class DASHPreBuffer:
             Optional[bytes]: Cached segment data or None if not available
         """
         # Check segment cache first
-        if segment_url in self.segment_cache:
+        segment_data = self.segment_cache.get(segment_url)
+        if segment_data is not None:
             logger.debug(f"DASH cache hit for segment: {segment_url}")
-            return self.segment_cache[segment_url]
-        
-        # Check init segment cache
-        if segment_url in self.init_segment_cache:
-            logger.debug(f"DASH cache hit for init segment: {segment_url}")
-            return self.init_segment_cache[segment_url]
+            self._update_playhead(segment_url)
+            return segment_data
         
         # Check memory usage before downloading
         memory_percent = self._get_memory_usage_percent()
@@ -296,27 +317,15 @@ class DASHPreBuffer:
             logger.warning(f"Memory usage {memory_percent}% exceeds limit {self.max_memory_percent}%, skipping download")
             return None
         
-        # Download if not in cache
+        # Download if not in cache, joining a download already in flight for the same URL
         try:
-            response = await self.client.get(segment_url, headers=headers)
-            response.raise_for_status()
-            segment_data = response.content
-            
             # Determine if it's an init segment or regular segment
-            if 'init' in segment_url.lower() or segment_url.endswith('.mp4'):
-                self.init_segment_cache[segment_url] = segment_data
-            else:
-                self.segment_cache[segment_url] = segment_data
-            
-            # Check for emergency cleanup
-            if self._check_memory_threshold():
-                self._emergency_cache_cleanup()
-            # Maintain cache size
-            elif len(self.segment_cache) > self.max_cache_size:
-                oldest_key = next(iter(self.segment_cache))
-                del self.segment_cache[oldest_key]
-            
+            is_init = 'init' in segment_url.lower() or segment_url.endswith('.mp4')
+            segment_data = await self._segment_flights.do(
+                segment_url, lambda: self._fetch_segment(segment_url, headers, is_init=is_init)
+            )
             logger.debug(f"Downloaded and cached DASH segment: {segment_url}")
+            self._update_playhead(segment_url)
             return segment_data
             
         except Exception as e:
@@ -358,15 +367,21 @@ class DASHPreBuffer:
     
     def clear_cache(self) -> None:
         """Clear the DASH cache."""
-        self.segment_cache.clear()
-        self.init_segment_cache.clear()
+        for mpd_url in self.manifest_cache:
+            self.segment_cache.remove_group(mpd_url)
         self.manifest_cache.clear()
+        self.segment_positions.clear()
         self.adaptation_segments.clear()
         logger.info("DASH pre-buffer cache cleared")
     
+    @property
+    def client(self):
+        """Shared upstream client; pooled connections are owned by the application lifespan."""
+        return get_http_client()
+
     async def close(self) -> None:
         """Close the pre-buffer system."""
-        await self.client.aclose()
+        self.clear_cache()
 
 
 # Global DASH pre-buffer instance
@@ -0,0 +1,419 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import AsyncGenerator, AsyncIterable, Dict, List, Optional, Tuple
+
+from fastapi import Request
+
+from mediaflow_proxy.configs import settings
+from mediaflow_proxy.const import SUPPORTED_REQUEST_HEADERS
+from mediaflow_proxy.utils.crypto_utils import EncryptionMiddleware
+from mediaflow_proxy.utils.http_utils import get_http_client
+from mediaflow_proxy.utils.m3u8_processor import M3U8Processor
+from mediaflow_proxy.utils.manifest_cache import ManifestCache
+
+logger = logging.getLogger(__name__)
+
+# Playlists larger than this are not followed, live media playlists are a few kilobytes
+MAX_PLAYLIST_SIZE = 1024 * 1024
+# Consecutive failed refreshes after which a session is closed, its viewers then reach the origin themselves
+MAX_REFRESH_FAILURES = 3
+# Resolved playlist URLs remembered for the URLs they were resolved from, pruned beyond this count
+MAX_ALIASES = 1024
+
+
+def is_live_media_playlist(playlist: str) -> bool:
+    """
+    Returns whether a playlist is a live media playlist whose segments can be shared: not byte ranges, and not
+    LL-HLS, whose viewers follow the partial segments with blocking reloads.
+    """
+    return (
+        "#EXTINF" in playlist
+        and "#EXT-X-PART-INF" not in playlist
+        and "#EXT-X-ENDLIST" not in playlist
+        and "#EXT-X-STREAM-INF" not in playlist
+        and "#EXT-X-BYTERANGE" not in playlist
+    )
+
+
+class _Resource:
+    """Segment, init section or key of a channel, downloaded once for every viewer."""
+
+    __slots__ = ("url", "key", "task", "content_type")
+
+    def __init__(self, url: str, key: tuple):
+        self.url = url
+        # URL and upstream request headers, which the viewers requesting the resource must match
+        self.key = key
+        self.task: Optional[asyncio.Task] = None
+        self.content_type: Optional[str] = None
+
+
+class ChannelSession:
+    """
+    A live media playlist followed by a single poller on behalf of all its viewers.
+
+    The playlist is refreshed every target duration, or half of it when unchanged, with conditional requests
+    when the origin supports them. The segments, init sections and keys it lists are downloaded at most once
+    while they stay in the playlist: the new segments as soon as they appear, the others when first requested.
+    """
+
+    def __init__(self, manager: "HLSChannelManager", key: tuple, playlist_url: str, headers: Dict[str, str]):
+        self.manager = manager
+        self.key = key
+        self.playlist_url = playlist_url
+        self.headers = headers
+        # Latest playlist and its URL after redirects, which relative URLs are resolved against
+        self.playlist: Optional[str] = None
+        self.final_url = playlist_url
+        self.validators = None
+        self.target_duration = 6.0
+        self.changed = True
+        # Resources of the current playlist by URL
+        self.resources: Dict[str, _Resource] = {}
+        # Viewer identity -> time of its last request
+        self.viewers: Dict[str, float] = {}
+        self.last_access = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+
+    def touch(self, viewer_id: Optional[str] = None) -> None:
+        """Records a request of a viewer."""
+        self.last_access = time.monotonic()
+        if viewer_id is not None:
+            self.viewers[viewer_id] = self.last_access
+
+    def viewer_count(self) -> int:
+        """Returns the number of viewers seen within the idle timeout, forgetting the others."""
+        now = time.monotonic()
+        for viewer_id in [v for v, seen in self.viewers.items() if now - seen > self.manager.idle_timeout]:
+            del self.viewers[viewer_id]
+        return len(self.viewers)
+
+    def update(self, playlist: str, final_url: str) -> None:
+        """
+        Replaces the playlist with a refreshed one, forgets the resources that left it and starts downloading the
+        new segments, only the ones at the live edge for the first playlist.
+
+        Args:
+            playlist (str): The media playlist.
+            final_url (str): The URL of the playlist after redirects.
+        """
+        first = self.playlist is None
+        self.changed = playlist != self.playlist
+        self.playlist = playlist
+        self.final_url = final_url
+
+        segments: List[str] = []
+        attributes: List[str] = []
+        for line in playlist.splitlines():
+            if line.startswith("#EXT-X-TARGETDURATION:"):
+                try:
+                    self.target_duration = max(float(line.split(":", 1)[1]), 1.0)
+                except ValueError:
+                    pass
+            elif line.startswith("#"):
+                if "URI=" in line:
+                    match = M3U8Processor.URI_PATTERN.search(line)
+                    if match:
+                        attributes.append(M3U8Processor.resolve_url(match.group(1), final_url))
+            elif line.strip():
+                segments.append(M3U8Processor.resolve_url(line, final_url))
+
+        listed = set(segments)
+        listed.update(attributes)
+        for url in [url for url in self.resources if url not in listed]:
+            self.manager._unindex(self.resources.pop(url))
+
+        new_segments = [url for url in segments if url not in self.resources]
+        for url in attributes + new_segments:
+            if url not in self.resources:
+                self.resources[url] = resource = _Resource(url, (url, self.key[1]))
+                self.manager._index(self, resource)
+
+        if first:
+            new_segments = new_segments[-self.manager.live_edge_segments :] if self.manager.live_edge_segments else []
+        for url in new_segments:
+            self.fetch(self.resources[url])
+
+    def fetch(self, resource: _Resource) -> asyncio.Task:
+        """Returns the download of a resource, started unless already done or in progress."""
+        if resource.task is None:
+            resource.task = asyncio.create_task(self._download(resource))
+            resource.task.add_done_callback(_retrieve_exception)
+        return resource.task
+
+    async def _download(self, resource: _Resource) -> bytes:
+        response = await get_http_client().get(resource.url, headers=self.headers, follow_redirects=True)
+        response.raise_for_status()
+        resource.content_type = response.headers.get("content-type")
+        self.manager.upstream_fetches += 1
+        if self.resources.get(resource.url) is resource:
+            self.manager._store(resource, len(response.content))
+        return response.content
+
+    async def _refresh(self) -> None:
+        """Downloads the playlist again, only if it changed when the origin supports conditional requests."""
+        headers = self.headers
+        if self.validators is not None:
+            headers = {**headers, **ManifestCache.conditional_headers(self.validators)}
+        response = await get_http_client().get(self.playlist_url, headers=headers, follow_redirects=True)
+        self.manager.upstream_fetches += 1
+        if response.status_code == 304:
+            self.changed = False
+            return
+        response.raise_for_status()
+        self.validators = ManifestCache.validators(response.headers)
+        self.update(response.text, str(response.url))
+
+    async def run(self) -> None:
+        """Refreshes the playlist until every viewer has gone idle, the stream ended or the origin keeps failing."""
+        failures = 0
+        try:
+            while True:
+                # Half the target duration when the playlist did not change, as players do (RFC 8216 6.3.4)
+                await asyncio.sleep(self.target_duration if self.changed else self.target_duration / 2)
+                if time.monotonic() - self.last_access > self.manager.idle_timeout:
+                    logger.info(f"Closed idle HLS channel session: {self.playlist_url}")
+                    return
+                try:
+                    await self._refresh()
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    logger.warning(f"Failed to refresh HLS channel {self.playlist_url} ({failures}): {e}")
+                    if failures >= MAX_REFRESH_FAILURES:
+                        return
+                if not is_live_media_playlist(self.playlist):
+                    logger.info(f"HLS channel is no longer live: {self.playlist_url}")
+                    return
+        finally:
+            self.manager._remove(self)
+
+    def close(self) -> None:
+        """Stops refreshing the playlist."""
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+
+def _retrieve_exception(task: asyncio.Task) -> None:
+    if not task.cancelled():
+        task.exception()  # Mark as retrieved in case no viewer requested the resource
+
+
+class HLSChannelManager:
+    """
+    Shares the upstream traffic of live HLS channels between their viewers.
+
+    The first request of a live media playlist starts a session keyed by the playlist URL and the upstream request
+    headers. From then on, the playlist requests of every viewer sending the same headers are answered with the
+    latest playlist of the session, and their segment and key requests from the downloads of the session, so that
+    the load on the origin does not depend on the number of viewers. A session ends once it has had no request for
+    `idle_timeout` seconds.
+
+    The downloaded resources are kept in memory up to `max_bytes`, beyond which the oldest downloads are dropped
+    and fetched again if still requested. Sessions are per worker.
+    """
+
+    def __init__(self, idle_timeout: float, live_edge_segments: int, max_bytes: int):
+        """
+        Initializes the channel manager.
+
+        Args:
+            idle_timeout (float): Seconds without requests after which a session ends.
+            live_edge_segments (int): Number of segments at the live edge downloaded when a session starts.
+            max_bytes (int): Bytes of downloaded resources kept in memory across the sessions.
+        """
+        self.idle_timeout = idle_timeout
+        self.live_edge_segments = live_edge_segments
+        self.max_bytes = max_bytes
+        self._sessions: Dict[tuple, ChannelSession] = {}
+        # Resources of every session by URL and upstream request headers
+        self._resources: Dict[tuple, Tuple[ChannelSession, _Resource]] = {}
+        # Downloaded resources and their sizes, oldest first
+        self._stored: "OrderedDict[_Resource, int]" = OrderedDict()
+        self.stored_bytes = 0
+        # Session keys by the keys of the URLs they were resolved from, such as Vavoo links
+        self._aliases: Dict[tuple, tuple] = {}
+
+        # Metrics
+        self.playlist_hits = 0
+        self.resource_hits = 0
+        self.upstream_fetches = 0
+
+    @staticmethod
+    def viewer_id(request: Request) -> str:
+        """Returns the identity of the viewer making a request."""
+        return f"{EncryptionMiddleware.get_client_ip(request)}|{request.headers.get('user-agent', '')}"
+
+    @staticmethod
+    def upstream_headers(headers: Dict[str, str]) -> Dict[str, str]:
+        """Returns the headers of the upstream requests of a session, without those of the viewer's own range."""
+        return {key: value for key, value in headers.items() if key not in SUPPORTED_REQUEST_HEADERS}
+
+    @classmethod
+    def key(cls, playlist_url: str, headers: Dict[str, str]) -> tuple:
+        """Returns the key of the session of a playlist."""
+        return playlist_url, tuple(sorted(cls.upstream_headers(headers).items()))
+
+    def resolve(self, url: str, headers: Dict[str, str]) -> Optional[str]:
+        """
+        Returns the playlist URL of the session that `url` was resolved to by `add_alias`, if it is still running,
+        so that the viewers of a session skip resolving the URL again.
+        """
+        target = self._aliases.get(self.key(url, headers))
+        if target is None or target not in self._sessions:
+            return None
+        return target[0]
+
+    def add_alias(self, url: str, headers: Dict[str, str], playlist_url: str) -> None:
+        """Records that `url` resolves to the playlist at `playlist_url`, for `resolve`."""
+        if len(self._aliases) >= MAX_ALIASES:
+            for alias in [alias for alias, target in self._aliases.items() if target not in self._sessions]:
+                del self._aliases[alias]
+        if len(self._aliases) < MAX_ALIASES:
+            self._aliases[self.key(url, headers)] = self.key(playlist_url, headers)
+
+    def get_playlist(
+        self, playlist_url: str, headers: Dict[str, str], viewer_id: Optional[str] = None
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Returns the latest playlist of the session following `playlist_url`, if any.
+
+        Args:
+            playlist_url (str): The URL of the playlist.
+            headers (Dict[str, str]): The upstream request headers.
+            viewer_id (str, optional): The identity of the viewer.
+
+        Returns:
+            Optional[Tuple[str, str]]: The playlist and its URL after redirects.
+        """
+        session = self._sessions.get(self.key(playlist_url, headers))
+        if session is None or session.playlist is None:
+            return None
+        session.touch(viewer_id)
+        self.playlist_hits += 1
+        return session.playlist, session.final_url
+
+    async def observe(
+        self, playlist_url: str, headers: Dict[str, str], final_url: str, chunks: AsyncIterable[bytes]
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        Yields the chunks of a playlist fetched by a viewer, then starts a session if it is a live media playlist.
+
+        Args:
+            playlist_url (str): The URL of the playlist.
+            headers (Dict[str, str]): The upstream request headers.
+            final_url (str): The URL of the playlist after redirects.
+            chunks (AsyncIterable[bytes]): The playlist content.
+        """
+        parts = []
+        size = 0
+        async for chunk in chunks:
+            if parts is not None:
+                parts.append(chunk)
+                size += len(chunk)
+                if size > MAX_PLAYLIST_SIZE:
+                    parts = None
+            yield chunk
+        if parts is not None:
+            playlist = b"".join(parts).decode("utf-8", errors="replace")
+            if is_live_media_playlist(playlist):
+                self.start(playlist_url, headers, final_url, playlist)
+
+    def start(self, playlist_url: str, headers: Dict[str, str], final_url: str, playlist: str) -> ChannelSession:
+        """Starts following a live media playlist, unless a session already does."""
+        key = self.key(playlist_url, headers)
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = ChannelSession(self, key, playlist_url, self.upstream_headers(headers))
+            session.update(playlist, final_url)
+            session.task = asyncio.create_task(session.run())
+            logger.info(f"Started HLS channel session: {playlist_url}")
+        return session
+
+    async def get_resource(
+        self, url: str, headers: Dict[str, str], viewer_id: Optional[str] = None
+    ) -> Optional[Tuple[bytes, Optional[str]]]:
+        """
+        Returns a segment, init section or key listed in the playlist of a session with the same upstream request
+        headers, downloading it if needed.
+
+        Args:
+            url (str): The URL of the resource.
+            headers (Dict[str, str]): The upstream request headers.
+            viewer_id (str, optional): The identity of the viewer.
+
+        Returns:
+            Optional[Tuple[bytes, Optional[str]]]: The content and content type of the resource, None if no session
+                lists it or its download failed, in which case the viewer fetches it from the origin.
+        """
+        indexed = self._resources.get(self.key(url, headers))
+        if indexed is None:
+            return None
+        session, resource = indexed
+        session.touch(viewer_id)
+        task = session.fetch(resource)
+        try:
+            content = await asyncio.shield(task)
+        except Exception as e:
+            logger.warning(f"Failed to download HLS channel resource {url}: {e}")
+            if resource.task is task:
+                resource.task = None  # Retried by the next request
+            return None
+        self.resource_hits += 1
+        return content, resource.content_type
+
+    def _index(self, session: ChannelSession, resource: _Resource) -> None:
+        self._resources.setdefault(resource.key, (session, resource))
+
+    def _unindex(self, resource: _Resource) -> None:
+        indexed = self._resources.get(resource.key)
+        if indexed is not None and indexed[1] is resource:
+            del self._resources[resource.key]
+        size = self._stored.pop(resource, None)
+        if size is not None:
+            self.stored_bytes -= size
+
+    def _store(self, resource: _Resource, size: int) -> None:
+        """Accounts for a downloaded resource, dropping the oldest downloads beyond the memory budget."""
+        self._stored[resource] = size
+        self.stored_bytes += size
+        while self.stored_bytes > self.max_bytes and len(self._stored) > 1:
+            oldest, oldest_size = self._stored.popitem(last=False)
+            self.stored_bytes -= oldest_size
+            oldest.task = None  # Downloaded again if requested
+
+    def _remove(self, session: ChannelSession) -> None:
+        if self._sessions.get(session.key) is session:
+            del self._sessions[session.key]
+        for resource in session.resources.values():
+            self._unindex(resource)
+        session.resources.clear()
+        for alias in [alias for alias, target in self._aliases.items() if target == session.key]:
+            del self._aliases[alias]
+
+    async def close(self) -> None:
+        """Ends every session."""
+        for session in list(self._sessions.values()):
+            session.close()
+            self._remove(session)
+
+    def get_stats(self) -> dict:
+        """Returns the sessions with their viewer counts, and the requests answered from the sessions."""
+        return {
+            "sessions": {session.playlist_url: session.viewer_count() for session in self._sessions.values()},
+            "playlist_hits": self.playlist_hits,
+            "resource_hits": self.resource_hits,
+            "upstream_fetches": self.upstream_fetches,
+            "stored_bytes": self.stored_bytes,
+        }
+
+
+hls_channels = (
+    HLSChannelManager(
+        settings.hls_channel_idle_timeout, settings.hls_channel_live_edge_segments, settings.hls_channel_max_memory
+    )
+    if settings.hls_channel_sessions
+    else None
+)
@@ -1,21 +1,28 @@
 import asyncio
 import logging
-import psutil
 from typing import Dict, Optional, List
 from urllib.parse import urlparse
-import httpx
-from mediaflow_proxy.utils.http_utils import create_httpx_client
+from mediaflow_proxy.utils.http_utils import get_http_client
+from mediaflow_proxy.utils.cache_backends import CacheBackend, create_shared_cache_backend
+from mediaflow_proxy.utils.cache_utils import SingleFlight
+from mediaflow_proxy.utils.prebuffer_cache import prebuffer_cache
 from mediaflow_proxy.configs import settings
-from collections import OrderedDict
-import time
-from urllib.parse import urljoin
 
 logger = logging.getLogger(__name__)
 
+# Seconds a segment stays in the shared cache, long enough for every worker serving the stream to pick it up
+SHARED_SEGMENT_TTL = 60
+
 
 class HLSPreBuffer:
     """
     Pre-buffer system for HLS streams to reduce latency and improve streaming performance.
+
+    Every client fetching segments through /proxy/hls/segment is tracked as a viewer of the playlist, with the
+    media sequence number of the last segment it fetched. Live playlists are refreshed every target duration and,
+    on each refresh, the next segments ahead of the furthest active viewer are downloaded, with a bounded number
+    of concurrent downloads per origin. A playlist stops being refreshed and pre-buffered once all of its viewers
+    have gone idle.
     """
     
     def __init__(self, max_cache_size: Optional[int] = None, prebuffer_segments: Optional[int] = None):
@@ -23,34 +30,61 @@ class HLSPreBuffer:
         Initialize the HLS pre-buffer system.
         
         Args:
-            max_cache_size (int): Maximum number of segments to cache (uses config if None)
+            max_cache_size (int): Number of segments kept mapped per playlist (uses config if None)
             prebuffer_segments (int): Number of segments to pre-buffer ahead (uses config if None)
         """
-        from collections import OrderedDict
-        import time
-        from urllib.parse import urljoin
         self.max_cache_size = max_cache_size or settings.hls_prebuffer_cache_size
         self.prebuffer_segments = prebuffer_segments or settings.hls_prebuffer_segments
         self.max_memory_percent = settings.hls_prebuffer_max_memory_percent
         self.emergency_threshold = settings.hls_prebuffer_emergency_threshold
-        # Cache LRU
-        self.segment_cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self.idle_timeout = settings.hls_prebuffer_idle_timeout
+        self.max_concurrency_per_origin = settings.hls_prebuffer_max_concurrency_per_origin
+        # Cache condivisa con il prebuffer DASH, limitata in byte
+        self.segment_cache = prebuffer_cache
         # Mappa playlist -> lista segmenti
         self.segment_urls: Dict[str, List[str]] = {}
-        # Mappa inversa segmento -> (playlist_url, index)
+        # Mappa playlist -> EXT-X-MEDIA-SEQUENCE, per posizioni stabili tra un refresh e l'altro
+        self.media_sequences: Dict[str, int] = {}
+        # Mappa inversa segmento -> (playlist_url, media sequence number)
         self.segment_to_playlist: Dict[str, tuple[str, int]] = {}
-        # Stato per playlist: {headers, last_access, refresh_task, target_duration}
+        # Stato per playlist: {headers, last_access, refresh_task, prefetch_task, target_duration, is_live, viewers}
+        # viewers: viewer_id -> (media sequence dell'ultimo segmento richiesto, istante della richiesta)
         self.playlist_state: Dict[str, dict] = {}
-        self.client = create_httpx_client()
+        # Download concorrenti per origine (netloc)
+        self._origin_limits: Dict[str, asyncio.Semaphore] = {}
+        # Download in corso per segmento, condivisi tra prebuffer e richieste dei client
+        self._segment_flights = SingleFlight("hls_prebuffer_segment")
+        # Secondo livello condiviso tra i worker, creato al primo uso (None con il backend in memoria)
+        self._shared_cache: Optional[CacheBackend] = None
+        self._shared_cache_created = False
+
+    @property
+    def shared_cache(self) -> Optional[CacheBackend]:
+        """
+        The second cache tier shared between workers, None with the in-process cache backend. Created on first use,
+        so that its shared memory is only reserved when pre-buffering is enabled.
+        """
+        if not self._shared_cache_created and settings.enable_hls_prebuffer:
+            self._shared_cache_created = True
+            self._shared_cache = create_shared_cache_backend("hls_prebuffer", settings.cache_shm_size)
+        return self._shared_cache
         
     async def prebuffer_playlist(self, playlist_url: str, headers: Dict[str, str]) -> None:
         """
-        Pre-buffer segments from an HLS playlist.
+        Start pre-buffering an HLS playlist, or mark it as accessed if it is already being pre-buffered.
         
         Args:
             playlist_url (str): URL of the HLS playlist
             headers (Dict[str, str]): Headers to use for requests
         """
+        loop = asyncio.get_event_loop()
+        st = self.playlist_state.get(playlist_url)
+        if st and not st["refresh_task"].done():
+            # Il refresh loop segue già la playlist, niente richiesta upstream aggiuntiva
+            st["last_access"] = loop.time()
+            st["headers"] = headers
+            return
+
         try:
             logger.debug(f"Starting pre-buffer for playlist: {playlist_url}")
             response = await self.client.get(playlist_url, headers=headers)
@@ -69,31 +103,167 @@ class HLSPreBuffer:
                     logger.warning("No variants found in master playlist")
                 return
 
-            # Media playlist: estrai segmenti, salva stato e lancia refresh loop
-            segment_urls = self._extract_segment_urls(playlist_content, playlist_url)
-            self.segment_urls[playlist_url] = segment_urls
-            # aggiorna mappa inversa
-            for idx, u in enumerate(segment_urls):
-                self.segment_to_playlist[u] = (playlist_url, idx)
-
-            # prebuffer iniziale
-            await self._prebuffer_segments(segment_urls[:self.prebuffer_segments], headers)
-            logger.info(f"Pre-buffered {min(self.prebuffer_segments, len(segment_urls))} segments for {playlist_url}")
-
-            # setup refresh loop se non già attivo
-            target_duration = self._parse_target_duration(playlist_content) or 6
-            st = self.playlist_state.get(playlist_url, {})
-            if not st.get("refresh_task") or st["refresh_task"].done():
-                task = asyncio.create_task(self._refresh_playlist_loop(playlist_url, headers, target_duration))
-                self.playlist_state[playlist_url] = {
-                    "headers": headers,
-                    "last_access": asyncio.get_event_loop().time(),
-                    "refresh_task": task,
-                    "target_duration": target_duration,
-                }
+            # Media playlist: salva stato, lancia refresh loop e prebuffer iniziale
+            st = self.playlist_state.get(playlist_url)
+            if st and not st["refresh_task"].done():
+                # avviato da una richiesta concorrente nel frattempo
+                st["last_access"] = loop.time()
+                return
+            st = {
+                "headers": headers,
+                "last_access": loop.time(),
+                "refresh_task": None,
+                "prefetch_task": None,
+                "viewers": {},
+            }
+            self.playlist_state[playlist_url] = st
+            self._update_playlist(playlist_url, playlist_content)
+            st["refresh_task"] = asyncio.create_task(self._refresh_playlist_loop(playlist_url))
+            self._schedule_prefetch(playlist_url)
         except Exception as e:
             logger.warning(f"Failed to pre-buffer playlist {playlist_url}: {e}")
-    
+
+    def _update_playlist(self, playlist_url: str, playlist_content: str) -> None:
+        """
+        Store the segments of a fetched media playlist and follow its sliding window.
+
+        Args:
+            playlist_url (str): URL of the media playlist
+            playlist_content (str): Content of the media playlist
+        """
+        segment_urls = self._extract_segment_urls(playlist_content, playlist_url)
+        media_sequence = self._parse_media_sequence(playlist_content)
+        previous_urls = self.segment_urls.get(playlist_url, [])
+        self.segment_urls[playlist_url] = segment_urls
+        self.media_sequences[playlist_url] = media_sequence
+
+        # i segmenti usciti dalla finestra non sono più mappati
+        current = set(segment_urls)
+        for u in previous_urls:
+            if u not in current:
+                self.segment_to_playlist.pop(u, None)
+        for idx, u in enumerate(segment_urls):
+            self.segment_to_playlist[u] = (playlist_url, media_sequence + idx)
+
+        st = self.playlist_state[playlist_url]
+        st["target_duration"] = self._parse_target_duration(playlist_content) or 6
+        st["is_live"] = "#EXT-X-ENDLIST" not in playlist_content
+
+    @staticmethod
+    def _parse_target_duration(playlist_content: str) -> Optional[int]:
+        """
+        Parse EXT-X-TARGETDURATION from a media playlist and return duration in seconds.
+        Returns None if not present or unparsable.
+        """
+        for line in playlist_content.splitlines():
+            line = line.strip()
+            if line.startswith("#EXT-X-TARGETDURATION:"):
+                try:
+                    value = line.split(":", 1)[1].strip()
+                    return int(float(value))
+                except Exception:
+                    return None
+        return None
+
+    @staticmethod
+    def _parse_media_sequence(playlist_content: str) -> int:
+        """Return the EXT-X-MEDIA-SEQUENCE of a media playlist, 0 if missing."""
+        for line in playlist_content.splitlines():
+            if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+                try:
+                    return int(line.split(":", 1)[1].strip())
+                except ValueError:
+                    return 0
+        return 0
+
+    def _segment_position(self, segment_url: str) -> tuple[Optional[str], Optional[int]]:
+        """Return the playlist of a segment and its media sequence number, if mapped."""
+        return self.segment_to_playlist.get(segment_url, (None, None))
+
+    def _record_viewer(self, segment_url: str, viewer_id: Optional[str] = None) -> None:
+        """Record a client request for a segment: playlist access time, playhead and viewer position."""
+        playlist_url, position = self._segment_position(segment_url)
+        if playlist_url is None:
+            return
+        self.segment_cache.update_playhead(playlist_url, position, viewer_id)
+        st = self.playlist_state.get(playlist_url)
+        if st:
+            now = asyncio.get_event_loop().time()
+            st["last_access"] = now
+            if viewer_id is not None:
+                st["viewers"][viewer_id] = (position, now)
+
+    def _active_positions(self, st: dict, now: float) -> List[int]:
+        """Return the positions of the active viewers of a playlist, forgetting the idle ones."""
+        viewers = st["viewers"]
+        for viewer_id in [v for v, (_, seen) in viewers.items() if now - seen > self.idle_timeout]:
+            del viewers[viewer_id]
+        return [position for position, _ in viewers.values()]
+
+    def _prefetch_targets(self, playlist_url: str) -> List[str]:
+        """
+        Return the segments to pre-buffer for a playlist: the next ones ahead of the furthest active viewer, or
+        the live edge (the start for VOD) while no viewer has fetched a segment yet.
+        """
+        st = self.playlist_state[playlist_url]
+        segment_urls = self.segment_urls.get(playlist_url, [])
+        positions = self._active_positions(st, asyncio.get_event_loop().time())
+        if positions:
+            start = max(positions) + 1 - self.media_sequences.get(playlist_url, 0)
+        elif st["is_live"]:
+            start = len(segment_urls) - self.prebuffer_segments
+        else:
+            start = 0
+        start = max(start, 0)
+        return [u for u in segment_urls[start:start + self.prebuffer_segments] if u not in self.segment_cache]
+
+    def _schedule_prefetch(self, playlist_url: str) -> None:
+        """Start pre-buffering the segments ahead of the viewers of a playlist, unless already in progress."""
+        st = self.playlist_state.get(playlist_url)
+        if not st or (st["prefetch_task"] and not st["prefetch_task"].done()):
+            return
+        targets = self._prefetch_targets(playlist_url)
+        if targets:
+            st["prefetch_task"] = asyncio.create_task(self._prebuffer_segments(targets, st["headers"]))
+            logger.debug(f"Pre-buffering {len(targets)} segments for {playlist_url}")
+
+    async def _refresh_playlist_loop(self, playlist_url: str) -> None:
+        """
+        Aggiorna periodicamente la playlist per seguire la sliding window e prebufferizza davanti agli spettatori.
+        Interrompe e pulisce quando tutti gli spettatori sono inattivi.
+        """
+        while True:
+            st = self.playlist_state.get(playlist_url)
+            if not st:
+                return
+            await asyncio.sleep(max(2, min(15, int(st["target_duration"]))))
+
+            now = asyncio.get_event_loop().time()
+            # last_access copre sia le richieste della playlist sia quelle dei segmenti di ogni spettatore
+            if now - st["last_access"] > self.idle_timeout:
+                self._stop_playlist(playlist_url)
+                logger.info(f"Stopped HLS prebuffer for inactive playlist: {playlist_url}")
+                return
+
+            if st["is_live"]:
+                try:
+                    resp = await self.client.get(playlist_url, headers=st["headers"])
+                    resp.raise_for_status()
+                    self._update_playlist(playlist_url, resp.text)
+                except Exception as e:
+                    logger.debug(f"Playlist refresh error for {playlist_url}: {e}")
+            self._schedule_prefetch(playlist_url)
+
+    def _stop_playlist(self, playlist_url: str) -> None:
+        """Forget a playlist and drop its cached segments."""
+        st = self.playlist_state.pop(playlist_url, None)
+        if st and st["refresh_task"] and st["refresh_task"] is not asyncio.current_task():
+            st["refresh_task"].cancel()
+        self.segment_cache.remove_group(playlist_url)
+        for u in self.segment_urls.pop(playlist_url, []):
+            self.segment_to_playlist.pop(u, None)
+        self.media_sequences.pop(playlist_url, None)
+
     def _extract_segment_urls(self, playlist_content: str, base_url: str) -> List[str]:
         """
         Extract segment URLs from HLS playlist content.
@@ -180,17 +350,12 @@ class HLSPreBuffer:
     
     def _get_memory_usage_percent(self) -> float:
         """
-        Get current memory usage percentage.
+        Get current memory usage percentage, sampled at most once per PREBUFFER_MEMORY_SAMPLE_INTERVAL.
         
         Returns:
             float: Memory usage percentage
         """
-        try:
-            memory = psutil.virtual_memory()
-            return memory.percent
-        except Exception as e:
-            logger.warning(f"Failed to get memory usage: {e}")
-            return 0.0
+        return self.segment_cache.memory_percent()
     
     def _check_memory_threshold(self) -> bool:
         """
@@ -204,15 +369,11 @@ class HLSPreBuffer:
     
     def _emergency_cache_cleanup(self) -> None:
         """
-        Esegue cleanup LRU rimuovendo il 50% più vecchio.
+        Esegue cleanup dimezzando la cache, a partire dai segmenti già riprodotti.
         """
         if self._check_memory_threshold():
             logger.warning("Emergency cache cleanup triggered due to high memory usage")
-            to_remove = max(1, len(self.segment_cache) // 2)
-            removed = 0
-            while removed < to_remove and self.segment_cache:
-                self.segment_cache.popitem(last=False)  # rimuovi LRU
-                removed += 1
+            removed = self.segment_cache.shrink(0.5)
             logger.info(f"Emergency cleanup removed {removed} segments from cache")
     
     async def _download_segment(self, segment_url: str, headers: Dict[str, str]) -> None:
@@ -229,47 +390,65 @@ class HLSPreBuffer:
                 logger.warning(f"Memory usage {memory_percent}% exceeds limit {self.max_memory_percent}%, skipping download")
                 return
 
+            async with self._origin_limit(segment_url):
+                await self._segment_flights.do(segment_url, lambda: self._fetch_segment(segment_url, headers))
+            logger.debug(f"Cached segment: {segment_url}")
+        except Exception as e:
+            logger.warning(f"Failed to download segment {segment_url}: {e}")
+
+    def _origin_limit(self, segment_url: str) -> asyncio.Semaphore:
+        """Return the semaphore bounding the concurrent pre-buffer downloads from the origin of a segment."""
+        origin = urlparse(segment_url).netloc
+        limit = self._origin_limits.get(origin)
+        if limit is None:
+            limit = self._origin_limits[origin] = asyncio.Semaphore(self.max_concurrency_per_origin)
+        return limit
+
+    async def _fetch_segment(self, segment_url: str, headers: Dict[str, str]) -> bytes:
+        """
+        Get a segment from the shared cache or download it, and store it in the pre-buffer cache.
+
+        Args:
+            segment_url (str): URL of the segment to download
+            headers (Dict[str, str]): Headers to use for request
+
+        Returns:
+            bytes: The segment data
+        """
+        segment_data = await self.shared_cache.get(segment_url) if self.shared_cache else None
+        if segment_data is None:
             response = await self.client.get(segment_url, headers=headers)
             response.raise_for_status()
+            segment_data = response.content
+            if self.shared_cache:
+                await self.shared_cache.set(segment_url, segment_data, SHARED_SEGMENT_TTL)
 
-            # Cache LRU
-            self.segment_cache[segment_url] = response.content
-            self.segment_cache.move_to_end(segment_url, last=True)
-
-            if self._check_memory_threshold():
-                self._emergency_cache_cleanup()
-            elif len(self.segment_cache) > self.max_cache_size:
-                # Evict LRU finché non rientra
-                while len(self.segment_cache) > self.max_cache_size:
-                    self.segment_cache.popitem(last=False)
+        playlist_url, position = self._segment_position(segment_url)
+        self.segment_cache.put(segment_url, segment_data, playlist_url, position)
+        self._emergency_cache_cleanup()
 
-            logger.debug(f"Cached segment: {segment_url}")
-        except Exception as e:
-            logger.warning(f"Failed to download segment {segment_url}: {e}")
+        return segment_data
     
-    async def get_segment(self, segment_url: str, headers: Dict[str, str]) -> Optional[bytes]:
+    async def get_segment(
+        self, segment_url: str, headers: Dict[str, str], viewer_id: Optional[str] = None
+    ) -> Optional[bytes]:
         """
         Get a segment from cache or download it.
         
         Args:
             segment_url (str): URL of the segment
             headers (Dict[str, str]): Headers to use for request
+            viewer_id (str, optional): Identity of the requesting client, used to track its playback position
             
         Returns:
             Optional[bytes]: Cached segment data or None if not available
         """
         # Check cache first
-        if segment_url in self.segment_cache:
+        data = self.segment_cache.get(segment_url)
+        if data is not None:
             logger.debug(f"Cache hit for segment: {segment_url}")
-            # LRU touch
-            data = self.segment_cache[segment_url]
-            self.segment_cache.move_to_end(segment_url, last=True)
-            # aggiorna last_access per la playlist se mappata
-            pl = self.segment_to_playlist.get(segment_url)
-            if pl:
-                st = self.playlist_state.get(pl[0])
-                if st:
-                    st["last_access"] = asyncio.get_event_loop().time()
+            # aggiorna last_access, playhead e posizione dello spettatore per la playlist se mappata
+            self._record_viewer(segment_url, viewer_id)
             return data
 
         memory_percent = self._get_memory_usage_percent()
@@ -278,26 +457,13 @@ class HLSPreBuffer:
             return None
 
         try:
-            response = await self.client.get(segment_url, headers=headers)
-            response.raise_for_status()
-            segment_data = response.content
-
-            # Cache LRU
-            self.segment_cache[segment_url] = segment_data
-            self.segment_cache.move_to_end(segment_url, last=True)
+            # Se il segmento è già in download (prebuffer o altro client) attendi lo stesso download
+            segment_data = await self._segment_flights.do(
+                segment_url, lambda: self._fetch_segment(segment_url, headers)
+            )
 
-            if self._check_memory_threshold():
-                self._emergency_cache_cleanup()
-            elif len(self.segment_cache) > self.max_cache_size:
-                while len(self.segment_cache) > self.max_cache_size:
-                    self.segment_cache.popitem(last=False)
-
-            # aggiorna last_access per playlist
-            pl = self.segment_to_playlist.get(segment_url)
-            if pl:
-                st = self.playlist_state.get(pl[0])
-                if st:
-                    st["last_access"] = asyncio.get_event_loop().time()
+            # aggiorna last_access, playhead e posizione dello spettatore per playlist
+            self._record_viewer(segment_url, viewer_id)
 
             logger.debug(f"Downloaded and cached segment: {segment_url}")
             return segment_data
@@ -307,184 +473,36 @@ class HLSPreBuffer:
     
     async def prebuffer_from_segment(self, segment_url: str, headers: Dict[str, str]) -> None:
         """
-        Dato un URL di segmento, prebuffer i successivi in base alla playlist e all'indice mappato.
+        Dato un URL di segmento, prebuffer i successivi davanti allo spettatore più avanti della sua playlist.
         """
-        mapped = self.segment_to_playlist.get(segment_url)
-        if not mapped:
+        playlist_url, _ = self._segment_position(segment_url)
+        if playlist_url is None:
             return
-        playlist_url, idx = mapped
-        # aggiorna access time
         st = self.playlist_state.get(playlist_url)
         if st:
-            st["last_access"] = asyncio.get_event_loop().time()
-        await self.prebuffer_next_segments(playlist_url, idx, headers)
-    
-    async def prebuffer_next_segments(self, playlist_url: str, current_segment_index: int, headers: Dict[str, str]) -> None:
-        """
-        Pre-buffer next segments based on current playback position.
-        
-        Args:
-            playlist_url (str): URL of the playlist
-            current_segment_index (int): Index of current segment
-            headers (Dict[str, str]): Headers to use for requests
-        """
-        if playlist_url not in self.segment_urls:
-            return
-        segment_urls = self.segment_urls[playlist_url]
-        next_segments = segment_urls[current_segment_index + 1:current_segment_index + 1 + self.prebuffer_segments]
-        if next_segments:
-            await self._prebuffer_segments(next_segments, headers)
+            st["headers"] = headers
+        self._schedule_prefetch(playlist_url)
     
     def clear_cache(self) -> None:
-        """Clear the segment cache."""
-        self.segment_cache.clear()
+        """Clear the segment cache and stop pre-buffering every playlist."""
+        for playlist_url in list(self.playlist_state):
+            self._stop_playlist(playlist_url)
+        for playlist_url in self.segment_urls:
+            self.segment_cache.remove_group(playlist_url)
         self.segment_urls.clear()
+        self.media_sequences.clear()
         self.segment_to_playlist.clear()
-        self.playlist_state.clear()
         logger.info("HLS pre-buffer cache cleared")
     
+    @property
+    def client(self):
+        """Shared upstream client; pooled connections are owned by the application lifespan."""
+        return get_http_client()
+
     async def close(self) -> None:
         """Close the pre-buffer system."""
-        await self.client.aclose()
+        self.clear_cache()
 
 
 # Global pre-buffer instance
 hls_prebuffer = HLSPreBuffer()
-
-
-class HLSPreBuffer:
-    def _parse_target_duration(self, playlist_content: str) -> Optional[int]:
-        """
-        Parse EXT-X-TARGETDURATION from a media playlist and return duration in seconds.
-        Returns None if not present or unparsable.
-        """
-        for line in playlist_content.splitlines():
-            line = line.strip()
-            if line.startswith("#EXT-X-TARGETDURATION:"):
-                try:
-                    value = line.split(":", 1)[1].strip()
-                    return int(float(value))
-                except Exception:
-                    return None
-        return None
-    
-    async def _refresh_playlist_loop(self, playlist_url: str, headers: Dict[str, str], target_duration: int) -> None:
-        """
-        Aggiorna periodicamente la playlist per seguire la sliding window e mantenere la cache coerente.
-        Interrompe e pulisce dopo inattività prolungata.
-        """
-        sleep_s = max(2, min(15, int(target_duration)))
-        inactivity_timeout = 600  # 10 minuti
-        while True:
-            try:
-                st = self.playlist_state.get(playlist_url)
-                now = asyncio.get_event_loop().time()
-                if not st:
-                    return
-                if now - st.get("last_access", now) > inactivity_timeout:
-                    # cleanup specifico della playlist
-                    urls = set(self.segment_urls.get(playlist_url, []))
-                    if urls:
-                        # rimuovi dalla cache solo i segmenti di questa playlist
-                        for u in list(self.segment_cache.keys()):
-                            if u in urls:
-                                self.segment_cache.pop(u, None)
-                        # rimuovi mapping
-                        for u in urls:
-                            self.segment_to_playlist.pop(u, None)
-                    self.segment_urls.pop(playlist_url, None)
-                    self.playlist_state.pop(playlist_url, None)
-                    logger.info(f"Stopped HLS prebuffer for inactive playlist: {playlist_url}")
-                    return
-
-                # refresh manifest
-                resp = await self.client.get(playlist_url, headers=headers)
-                resp.raise_for_status()
-                content = resp.text
-                new_target = self._parse_target_duration(content)
-                if new_target:
-                    sleep_s = max(2, min(15, int(new_target)))
-
-                new_urls = self._extract_segment_urls(content, playlist_url)
-                if new_urls:
-                    self.segment_urls[playlist_url] = new_urls
-                    # rebuild reverse map per gli ultimi N (limita la memoria)
-                    for idx, u in enumerate(new_urls[-(self.max_cache_size * 2):]):
-                        # rimappiando sovrascrivi eventuali entry
-                        real_idx = len(new_urls) - (self.max_cache_size * 2) + idx if len(new_urls) > (self.max_cache_size * 2) else idx
-                        self.segment_to_playlist[u] = (playlist_url, real_idx)
-
-                # tenta un prebuffer proattivo: se conosciamo l'ultimo segmento accessibile, anticipa i successivi
-                # Non conosciamo l'indice di riproduzione corrente qui, quindi non facciamo nulla di aggressivo.
-
-            except Exception as e:
-                logger.debug(f"Playlist refresh error for {playlist_url}: {e}")
-            await asyncio.sleep(sleep_s)
-    def _extract_segment_urls(self, playlist_content: str, base_url: str) -> List[str]:
-        """
-        Extract segment URLs from HLS playlist content.
-        
-        Args:
-            playlist_content (str): Content of the HLS playlist
-            base_url (str): Base URL for resolving relative URLs
-            
-        Returns:
-            List[str]: List of segment URLs
-        """
-        segment_urls = []
-        lines = playlist_content.split('\n')
-        
-        logger.debug(f"Analyzing playlist with {len(lines)} lines")
-        
-        for line in lines:
-            line = line.strip()
-            if line and not line.startswith('#'):
-                # Check if line contains a URL (http/https) or is a relative path
-                if 'http://' in line or 'https://' in line:
-                    segment_urls.append(line)
-                    logger.debug(f"Found absolute URL: {line}")
-                elif line and not line.startswith('#'):
-                    # This might be a relative path to a segment
-                    parsed_base = urlparse(base_url)
-                    # Ensure proper path joining
-                    if line.startswith('/'):
-                        segment_url = f"{parsed_base.scheme}://{parsed_base.netloc}{line}"
-                    else:
-                        # Get the directory path from base_url
-                        base_path = parsed_base.path.rsplit('/', 1)[0] if '/' in parsed_base.path else ''
-                        segment_url = f"{parsed_base.scheme}://{parsed_base.netloc}{base_path}/{line}"
-                    segment_urls.append(segment_url)
-                    logger.debug(f"Found relative path: {line} -> {segment_url}")
-        
-        logger.debug(f"Extracted {len(segment_urls)} segment URLs from playlist")
-        if segment_urls:
-            logger.debug(f"First segment URL: {segment_urls[0]}")
-        else:
-            logger.debug("No segment URLs found in playlist")
-            # Log first few lines for debugging
-            for i, line in enumerate(lines[:10]):
-                logger.debug(f"Line {i}: {line}")
-        
-        return segment_urls
-    
-    def _extract_variant_urls(self, playlist_content: str, base_url: str) -> List[str]:
-        """
-        Estrae le varianti dal master playlist. Corretto per gestire URI relativi:
-        prende la riga non-commento successiva a #EXT-X-STREAM-INF e la risolve rispetto a base_url.
-        """
-        from urllib.parse import urljoin
-        variant_urls = []
-        lines = [l.strip() for l in playlist_content.split('\n')]
-        take_next_uri = False
-        for line in lines:
-            if line.startswith("#EXT-X-STREAM-INF"):
-                take_next_uri = True
-                continue
-            if take_next_uri:
-                take_next_uri = False
-                if line and not line.startswith('#'):
-                    variant_urls.append(urljoin(base_url, line))
-        logger.debug(f"Extracted {len(variant_urls)} variant URLs from master playlist")
-        if variant_urls:
-            logger.debug(f"First variant URL: {variant_urls[0]}")
-        return variant_urls
\ No newline at end of file
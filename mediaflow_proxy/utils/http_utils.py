@@ -1,7 +1,12 @@
+import asyncio
+import importlib.util
 import logging
+import time
 import typing
+from collections import deque
 from dataclasses import dataclass
 from functools import partial
+from http.cookiejar import CookieJar
 from urllib import parse
 from urllib.parse import urlencode, urlparse
 
@@ -17,7 +22,7 @@ from starlette.types import Receive, Send, Scope
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 from tqdm.asyncio import tqdm as tqdm_asyncio
 
-from mediaflow_proxy.configs import settings
+from mediaflow_proxy.configs import settings, TransportConfig
 from mediaflow_proxy.const import SUPPORTED_REQUEST_HEADERS
 from mediaflow_proxy.utils.crypto_utils import EncryptionHandler
 
@@ -31,12 +36,205 @@ class DownloadError(Exception):
         super().__init__(message)
 
 
-def create_httpx_client(follow_redirects: bool = True, **kwargs) -> httpx.AsyncClient:
-    """Creates an HTTPX client with configured proxy routing"""
-    mounts = settings.transport_config.get_mounts()
-    kwargs.setdefault("timeout", settings.transport_config.timeout)
-    client = httpx.AsyncClient(mounts=mounts, follow_redirects=follow_redirects, **kwargs)
-    return client
+# Connection-specific headers are forbidden in HTTP/2 and make the h2 state machine reject the request
+_HOP_BY_HOP_HEADERS = ("connection", "keep-alive", "proxy-connection", "upgrade")
+
+
+async def _strip_hop_by_hop_headers(request: httpx.Request) -> None:
+    for header in _HOP_BY_HOP_HEADERS:
+        request.headers.pop(header, None)
+
+
+class _NoCookieJar(CookieJar):
+    """Cookie jar that never stores cookies, so shared clients don't leak upstream sessions between requests."""
+
+    def set_cookie(self, cookie):
+        pass
+
+    def extract_cookies(self, response, request):
+        pass
+
+
+# Request extension holding the cookies set by the redirects of a single request, shared by the redirect requests
+_REDIRECT_COOKIES = "mediaflow_redirect_cookies"
+
+
+async def _send_redirect_cookies(request: httpx.Request) -> None:
+    cookies = request.extensions.get(_REDIRECT_COOKIES)
+    if cookies is None:
+        request.extensions[_REDIRECT_COOKIES] = httpx.Cookies()
+    elif cookies:
+        cookies.set_cookie_header(request)
+
+
+async def _store_redirect_cookies(response: httpx.Response) -> None:
+    cookies = response.request.extensions.get(_REDIRECT_COOKIES)
+    if cookies is not None and response.has_redirect_location:
+        cookies.extract_cookies(response)
+
+
+class _ReleasingByteStream(httpx.AsyncByteStream):
+    """Response stream wrapper that releases a host connection slot once the body is closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release: typing.Callable[[], None]):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    async def __aiter__(self) -> typing.AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._release()
+
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+    """Transport wrapper that caps the number of concurrent in-flight requests per origin host."""
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        get_semaphore: typing.Callable[[str], typing.Optional[asyncio.Semaphore]],
+    ):
+        self._transport = transport
+        self._get_semaphore = get_semaphore
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        semaphore = self._get_semaphore(request.url.host)
+        if semaphore is None:
+            return await self._transport.handle_async_request(request)
+
+        await semaphore.acquire()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+        response.stream = _ReleasingByteStream(response.stream, semaphore.release)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class HTTPClientRegistry:
+    """
+    Process-wide registry of long-lived HTTPX clients.
+
+    Transports are pooled per transport route (proxy URL + verify flag), so every client and mount that
+    resolves to the same route reuses the same warm keep-alive connections. Clients are created lazily
+    and closed from the application lifespan.
+    """
+
+    def __init__(self, transport_config: TransportConfig):
+        self.transport_config = transport_config
+        self._transports: dict[tuple[typing.Optional[str], bool], httpx.AsyncBaseTransport] = {}
+        self._clients: dict[bool, httpx.AsyncClient] = {}
+        self._host_semaphores: dict[str, typing.Optional[asyncio.Semaphore]] = {}
+        self._http2 = transport_config.enable_http2 and importlib.util.find_spec("h2") is not None
+        if transport_config.enable_http2 and not self._http2:
+            logger.info("HTTP/2 requested but the 'h2' package is not installed; using HTTP/1.1 only")
+
+    def _get_host_limit(self, host: str) -> int:
+        for pattern, limit in self.transport_config.host_connection_limits.items():
+            pattern = pattern.lstrip("*.")
+            if host == pattern or host.endswith(f".{pattern}"):
+                return limit
+        return self.transport_config.max_connections_per_host
+
+    def _get_host_semaphore(self, host: str) -> typing.Optional[asyncio.Semaphore]:
+        if host not in self._host_semaphores:
+            limit = self._get_host_limit(host)
+            self._host_semaphores[host] = asyncio.Semaphore(limit) if limit > 0 else None
+        return self._host_semaphores[host]
+
+    def get_transport(self, proxy: typing.Optional[str], verify: bool) -> httpx.AsyncBaseTransport:
+        """
+        Returns the pooled transport for a transport route, creating it on first use.
+
+        Args:
+            proxy (str, optional): The proxy URL of the route.
+            verify (bool): Whether SSL certificates are verified on this route.
+
+        Returns:
+            httpx.AsyncBaseTransport: The shared transport for the route.
+        """
+        key = (proxy, verify)
+        transport = self._transports.get(key)
+        if transport is None:
+            config = self.transport_config
+            transport = httpx.AsyncHTTPTransport(
+                verify=verify,
+                proxy=proxy,
+                http2=self._http2,
+                limits=httpx.Limits(
+                    max_connections=config.max_connections,
+                    max_keepalive_connections=config.max_keepalive_connections,
+                    keepalive_expiry=config.keepalive_expiry,
+                ),
+            )
+            if config.max_connections_per_host > 0 or config.host_connection_limits:
+                transport = HostLimitedTransport(transport, self._get_host_semaphore)
+            self._transports[key] = transport
+        return transport
+
+    def get_client(self, verify: bool = True) -> httpx.AsyncClient:
+        """
+        Returns the shared client for the given default SSL verification flag.
+
+        Callers must not close the returned client; per-request options such as headers,
+        timeout and follow_redirects should be passed to the request methods instead.
+
+        Args:
+            verify (bool): SSL verification for origins not covered by a configured route. Defaults to True.
+
+        Returns:
+            httpx.AsyncClient: The shared client.
+        """
+        client = self._clients.get(verify)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                transport=self.get_transport(None, verify),
+                mounts=self.transport_config.get_mounts(transport_factory=self.get_transport),
+                follow_redirects=True,
+                timeout=self.transport_config.timeout,
+                # Cookies are only kept across the redirects of a request, as a client per request would
+                cookies=_NoCookieJar(),
+                event_hooks={
+                    "request": [_send_redirect_cookies] + ([_strip_hop_by_hop_headers] if self._http2 else []),
+                    "response": [_store_redirect_cookies],
+                },
+            )
+            self._clients[verify] = client
+        return client
+
+    def is_shared(self, client: httpx.AsyncClient) -> bool:
+        """Returns True if the client is owned by the registry and must not be closed by callers."""
+        return any(client is shared for shared in self._clients.values())
+
+    async def aclose(self) -> None:
+        """Closes all shared clients and their pooled transports."""
+        clients, self._clients = list(self._clients.values()), {}
+        transports, self._transports = list(self._transports.values()), {}
+        self._host_semaphores.clear()
+        for client in clients:
+            await client.aclose()
+        for transport in transports:
+            await transport.aclose()
+
+
+http_client_registry = HTTPClientRegistry(settings.transport_config)
+
+
+def get_http_client(verify: bool = True) -> httpx.AsyncClient:
+    """Returns the process-wide shared HTTPX client with configured proxy routing and connection pooling."""
+    return http_client_registry.get_client(verify)
 
 
 @retry(
@@ -44,7 +242,7 @@ def create_httpx_client(follow_redirects: bool = True, **kwargs) -> httpx.AsyncC
     wait=wait_exponential(multiplier=1, min=4, max=10),
     retry=retry_if_exception_type(DownloadError),
 )
-async def fetch_with_retry(client, method, url, headers, follow_redirects=True, **kwargs):
+async def fetch_with_retry(client, method, url, headers, follow_redirects=True, allow_not_modified=False, **kwargs):
     """
     Fetches a URL with retry logic.
 
@@ -54,6 +252,8 @@ async def fetch_with_retry(client, method, url, headers, follow_redirects=True,
         url (str): The URL to fetch.
         headers (dict): The headers to include in the request.
         follow_redirects (bool, optional): Whether to follow redirects. Defaults to True.
+        allow_not_modified (bool, optional): Whether to return a 304 answer to a conditional request rather than
+            failing. Defaults to False.
         **kwargs: Additional arguments to pass to the request.
 
     Returns:
@@ -64,7 +264,8 @@ async def fetch_with_retry(client, method, url, headers, follow_redirects=True,
     """
     try:
         response = await client.request(method, url, headers=headers, follow_redirects=follow_redirects, **kwargs)
-        response.raise_for_status()
+        if not (allow_not_modified and response.status_code == 304):  # The caller keeps its copy
+            response.raise_for_status()
         return response
     except httpx.TimeoutException:
         logger.warning(f"Timeout while downloading {url}")
@@ -85,6 +286,18 @@ class Streamer:
     _PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
     _PNG_IEND_MARKER = b"\x49\x45\x4E\x44\xAE\x42\x60\x82"
 
+    # Errors of an upstream connection lost mid-transfer, after which the stream can be resumed with a range request
+    _RESUMABLE_ERRORS = (httpx.RemoteProtocolError, httpx.ReadError, httpx.ReadTimeout)
+
+    # Reconnect metrics of every streamer in this process
+    _stats = {"reconnects": 0, "resumed": 0, "failed": 0}
+
+    # Bounds of the part size of parallel range downloads, and how long downloading a part should take
+    PARALLEL_MIN_PART_SIZE = 256 * 1024
+    PARALLEL_PART_TARGET_SECONDS = 2.0
+    # Concurrent parallel range requests per origin, shared by every streamer in this process
+    _origin_limits: dict[str, asyncio.Semaphore] = {}
+
     def __init__(self, client):
         """
         Initializes the Streamer with an HTTP client.
@@ -99,25 +312,36 @@ class Streamer:
         self.start_byte = 0
         self.end_byte = 0
         self.total_size = 0
+        self.request_headers = None
+        self.reconnects = 0
+        # Bytes of fake PNG wrapper removed from the start of the body, which shifts it from the upstream offsets
+        self.stripped_bytes = 0
+        # Whether an interrupted body without range support is downloaded again from the start, skipping the bytes
+        # already received. Only for resources that do not change, such as media segments.
+        self.restartable = False
 
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=4, max=10),
         retry=retry_if_exception_type(DownloadError),
     )
-    async def create_streaming_response(self, url: str, headers: dict):
+    async def create_streaming_response(self, url: str, headers: dict, allow_not_modified: bool = False):
         """
         Creates and sends a streaming request.
 
         Args:
             url (str): The URL to stream from.
             headers (dict): The headers to include in the request.
+            allow_not_modified (bool, optional): Whether to keep a 304 answer to a conditional request rather than
+                failing. Defaults to False.
 
         """
+        self.request_headers = headers
         try:
             request = self.client.build_request("GET", url, headers=headers)
             self.response = await self.client.send(request, stream=True, follow_redirects=True)
-            self.response.raise_for_status()
+            if not (allow_not_modified and self.response.status_code == 304):  # The caller keeps its copy
+                self.response.raise_for_status()
         except httpx.TimeoutException:
             logger.warning("Timeout while creating streaming response")
             raise DownloadError(409, "Timeout while creating streaming response")
@@ -176,8 +400,6 @@ class Streamer:
         if not self.response:
             raise RuntimeError("No response available for streaming")
 
-        is_first_chunk = True
-
         try:
             self.parse_content_range()
 
@@ -192,20 +414,12 @@ class Streamer:
                     ncols=100,
                     mininterval=1,
                 ) as self.progress_bar:
-                    async for chunk in self.response.aiter_bytes():
-                        if is_first_chunk:
-                            is_first_chunk = False
-                            chunk = self._strip_fake_png_wrapper(chunk)
-
+                    async for chunk in self._iter_upstream():
                         yield chunk
                         self.bytes_transferred += len(chunk)
                         self.progress_bar.update(len(chunk))
             else:
-                async for chunk in self.response.aiter_bytes():
-                    if is_first_chunk:
-                        is_first_chunk = False
-                        chunk = self._strip_fake_png_wrapper(chunk)
-
+                async for chunk in self._iter_upstream():
                     yield chunk
                     self.bytes_transferred += len(chunk)
 
@@ -234,7 +448,322 @@ class Streamer:
             logger.error(f"Error streaming content: {e}")
             raise
 
-            
+    async def _iter_upstream(self) -> typing.AsyncGenerator[bytes, None]:
+        """
+        Yields the upstream body, transparently resuming it with a range request from the first missing byte when the
+        connection is lost mid-transfer.
+
+        Up to `stream_reconnect_attempts` consecutive reconnects are made, with an exponential backoff starting at
+        `stream_reconnect_backoff` seconds, and the budget is restored as soon as a reconnect delivers data.
+        Upstreams that do not support ranges are downloaded again from the start when the streamer is `restartable`,
+        and fail as before otherwise.
+
+        Raises:
+            DownloadError: If the connection is lost and every reconnect failed.
+        """
+        is_first_chunk = True
+        # Body bytes received from upstream, before the fake PNG wrapper is stripped. They are decoded bytes, which are
+        # also the offset to resume at since only bodies without a content encoding are resumed, see is_resumable()
+        received = 0
+        # Bytes of a restarted body that were already received
+        skip = 0
+        attempts = 0
+        resumable = self.restartable or self.is_resumable()
+
+        while True:
+            try:
+                async for chunk in self.response.aiter_bytes():
+                    if skip:
+                        if len(chunk) <= skip:
+                            skip -= len(chunk)
+                            continue
+                        chunk = chunk[skip:]
+                        skip = 0
+                    received += len(chunk)
+                    attempts = 0
+                    if is_first_chunk:
+                        is_first_chunk = False
+                        stripped = self._strip_fake_png_wrapper(chunk)
+                        self.stripped_bytes = len(chunk) - len(stripped)
+                        chunk = stripped
+                    yield chunk
+                return
+            except self._RESUMABLE_ERRORS as e:
+                if not resumable or settings.stream_reconnect_attempts <= 0:
+                    raise
+                error = e
+
+            while True:
+                if attempts >= settings.stream_reconnect_attempts:
+                    self._stats["failed"] += 1
+                    logger.error(f"Giving up on the upstream stream after {attempts} reconnects: {error}")
+                    raise DownloadError(502, f"Upstream connection lost after {attempts} reconnects: {error}")
+                attempts += 1
+                self.reconnects += 1
+                self._stats["reconnects"] += 1
+                await asyncio.sleep(settings.stream_reconnect_backoff * 2 ** (attempts - 1))
+                logger.warning(
+                    f"Upstream connection lost ({error!r}) after {received} bytes, reconnecting "
+                    f"(attempt {attempts}/{settings.stream_reconnect_attempts})"
+                )
+                try:
+                    if self.is_resumable():
+                        resumed = await self._resume(received)
+                    else:
+                        resumed = await self._restart()
+                        skip = received if resumed else 0
+                except (httpx.HTTPError, DownloadError) as e:
+                    error = e
+                    continue
+                if not resumed:
+                    self._stats["failed"] += 1
+                    raise DownloadError(502, f"Upstream could not resume the stream at byte {received}: {error}")
+                self._stats["resumed"] += 1
+                break
+
+    def is_resumable(self) -> bool:
+        """Whether the upstream response can be continued with a range request."""
+        if self.response.headers.get("Content-Encoding", "identity").strip().lower() != "identity":
+            # Ranges refer to the encoded body, which cannot be decoded from the middle
+            return False
+        return (
+            self.response.status_code == 206
+            or self.response.headers.get("Accept-Ranges", "").strip().lower() == "bytes"
+        )
+
+    def _range_headers(self, start: int, end: typing.Optional[int]) -> httpx.Headers:
+        """
+        Returns the request headers for a range of the current upstream response, with an `If-Range` validator when
+        one is available, so that a resource that changed in the meantime is returned whole instead of as a range.
+        """
+        headers = httpx.Headers(self.request_headers)
+        headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+        etag = self.response.headers.get("ETag")
+        validator = etag if etag and not etag.startswith("W/") else self.response.headers.get("Last-Modified")
+        if validator:
+            headers["If-Range"] = validator
+        return headers
+
+    async def _resume(self, received: int) -> bool:
+        """
+        Replaces the current upstream response with the continuation of its body from `received` bytes onwards.
+
+        The request is made to the final URL of the original response, and the continuation must start exactly where
+        the body stopped, so a resource that changed in the meantime is never stitched.
+
+        Returns:
+            bool: Whether the stream was resumed, False if the upstream answered with anything but the expected range.
+
+        Raises:
+            DownloadError: If the upstream responded with an error status.
+        """
+        offset = self.start_byte + received
+        headers = self._range_headers(offset, self.end_byte if self.total_size > 0 else None)
+        request = self.client.build_request("GET", self.response.url, headers=headers)
+        response = await self.client.send(request, stream=True, follow_redirects=True)
+        if response.status_code >= 400:
+            await response.aclose()
+            raise DownloadError(response.status_code, f"HTTP error {response.status_code} while resuming the stream")
+        if response.status_code != 206 or not response.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+            await response.aclose()
+            return False
+
+        await self.response.aclose()
+        self.response = response
+        return True
+
+    async def _restart(self) -> bool:
+        """
+        Replaces the current upstream response with a new download of the same request, for `restartable` streams.
+
+        Returns:
+            bool: Whether the stream was restarted, False if the upstream answered with a different status or range.
+
+        Raises:
+            DownloadError: If the upstream responded with an error status.
+        """
+        request = self.client.build_request("GET", self.response.url, headers=self.request_headers)
+        response = await self.client.send(request, stream=True, follow_redirects=True)
+        if response.status_code >= 400:
+            await response.aclose()
+            raise DownloadError(response.status_code, f"HTTP error {response.status_code} while restarting the stream")
+        content_range = self.response.headers.get("Content-Range")
+        if response.status_code != self.response.status_code or response.headers.get("Content-Range") != content_range:
+            await response.aclose()
+            return False
+
+        await self.response.aclose()
+        self.response = response
+        return True
+
+    async def stream_content_parallel(self) -> typing.AsyncGenerator[bytes, None]:
+        """
+        Streams the upstream body by downloading consecutive parts of it over up to `stream_parallel_connections`
+        concurrent range requests, for origins that limit the throughput of each connection.
+
+        The first part is read from the already open response. Parts are yielded in order and at most
+        `stream_parallel_buffer_size` bytes are downloaded ahead of the client. The size of the parts follows the
+        measured throughput of a connection so that each part takes about `PARALLEL_PART_TARGET_SECONDS`. Falls
+        back to `stream_content` when disabled, or when the upstream does not support ranges or the body is too small
+        to split.
+        """
+        if not self.response:
+            raise RuntimeError("No response available for streaming")
+
+        self.parse_content_range()
+        connections = settings.stream_parallel_connections
+        part_size = max(settings.stream_parallel_chunk_size, self.PARALLEL_MIN_PART_SIZE)
+        if (
+            connections <= 1
+            or self.total_size <= 0
+            or self.end_byte - self.start_byte + 1 <= part_size
+            or not self.is_resumable()
+        ):
+            async for chunk in self.stream_content():
+                yield chunk
+            return
+
+        max_part_size = max(part_size, settings.stream_parallel_buffer_size // connections)
+        limit = self._origin_limit(self.response.url.host)
+        rate = None  # Smoothed throughput of a single connection in bytes per second
+        next_start = self.start_byte + part_size
+        buffered = part_size
+        parts: deque[tuple[asyncio.Task, int]] = deque(
+            [(asyncio.create_task(self._read_first_part(part_size, limit)), part_size)]
+        )
+        is_first_part = True
+
+        def on_part_done(size: int, elapsed: float):
+            nonlocal rate, part_size
+            if elapsed <= 0:
+                return
+            rate = size / elapsed if rate is None else 0.7 * rate + 0.3 * size / elapsed
+            target = int(rate * self.PARALLEL_PART_TARGET_SECONDS) // self.PARALLEL_MIN_PART_SIZE
+            part_size = min(max(target * self.PARALLEL_MIN_PART_SIZE, self.PARALLEL_MIN_PART_SIZE), max_part_size)
+
+        try:
+            while parts:
+                # Keep every connection busy as long as the reorder buffer has room
+                while next_start <= self.end_byte:
+                    size = min(part_size, self.end_byte - next_start + 1)
+                    in_flight = sum(1 for task, _ in parts if not task.done())
+                    if in_flight >= connections or buffered + size > settings.stream_parallel_buffer_size:
+                        break
+                    task = asyncio.create_task(
+                        self._download_part(next_start, next_start + size - 1, limit, on_part_done)
+                    )
+                    parts.append((task, size))
+                    next_start += size
+                    buffered += size
+
+                head = parts[0][0]
+                if not head.done():
+                    await asyncio.wait(
+                        [task for task, _ in parts if not task.done()], return_when=asyncio.FIRST_COMPLETED
+                    )
+                    continue
+
+                _, size = parts.popleft()
+                buffered -= size
+                data = head.result()
+                if is_first_part:
+                    is_first_part = False
+                    stripped = self._strip_fake_png_wrapper(data)
+                    self.stripped_bytes = len(data) - len(stripped)
+                    data = stripped
+                yield data
+                self.bytes_transferred += len(data)
+        except GeneratorExit:
+            logger.info("Streaming session stopped by the user")
+        except Exception as e:
+            logger.error(f"Error streaming content: {e}")
+            raise
+        finally:
+            for task, _ in parts:
+                task.cancel()
+            await asyncio.gather(*(task for task, _ in parts), return_exceptions=True)
+
+    async def _read_first_part(self, size: int, limit: asyncio.Semaphore) -> bytes:
+        """Reads the first `size` bytes of the open upstream response, downloading the rest if it is interrupted."""
+        chunks = []
+        received = 0
+        try:
+            async for chunk in self.response.aiter_bytes():
+                chunks.append(chunk)
+                received += len(chunk)
+                if received >= size:
+                    break
+        except self._RESUMABLE_ERRORS as e:
+            logger.warning(
+                f"Upstream connection lost after {received} bytes of the first part, downloading the rest: {e}"
+            )
+        finally:
+            # The remainder of the body is fetched by the other parts
+            await self.response.aclose()
+
+        data = b"".join(chunks)[:size]
+        if len(data) < size:
+            data += await self._download_part(self.start_byte + len(data), self.start_byte + size - 1, limit)
+        return data
+
+    async def _download_part(
+        self,
+        start: int,
+        end: int,
+        limit: asyncio.Semaphore,
+        on_done: typing.Optional[typing.Callable[[int, float], None]] = None,
+    ) -> bytes:
+        """
+        Downloads the bytes `start` to `end` of the upstream response, retrying up to `stream_reconnect_attempts` times.
+
+        Raises:
+            DownloadError: If the range could not be downloaded.
+        """
+        attempts = 0
+        while True:
+            try:
+                async with limit:
+                    started_at = time.monotonic()
+                    headers = self._range_headers(start, end)
+                    request = self.client.build_request("GET", self.response.url, headers=headers)
+                    response = await self.client.send(request, stream=True, follow_redirects=True)
+                    try:
+                        if response.status_code >= 400:
+                            raise DownloadError(response.status_code, f"HTTP error {response.status_code} for a range")
+                        content_range = response.headers.get("Content-Range", "")
+                        if response.status_code != 206 or not content_range.startswith(f"bytes {start}-"):
+                            raise DownloadError(502, f"Upstream did not return the range {start}-{end}")
+                        data = await response.aread()
+                    finally:
+                        await response.aclose()
+                if len(data) != end - start + 1:
+                    raise DownloadError(502, f"Upstream returned {len(data)} bytes for the range {start}-{end}")
+                if on_done is not None:
+                    on_done(len(data), time.monotonic() - started_at)
+                return data
+            except (httpx.HTTPError, DownloadError) as e:
+                if attempts >= settings.stream_reconnect_attempts:
+                    self._stats["failed"] += 1
+                    raise DownloadError(502, f"Failed to download the range {start}-{end}: {e}")
+                attempts += 1
+                self.reconnects += 1
+                self._stats["reconnects"] += 1
+                logger.warning(f"Failed to download the range {start}-{end}, retrying (attempt {attempts}): {e}")
+                await asyncio.sleep(settings.stream_reconnect_backoff * 2 ** (attempts - 1))
+
+    @classmethod
+    def _origin_limit(cls, origin: str) -> asyncio.Semaphore:
+        """Returns the semaphore bounding the concurrent parallel range requests to an origin."""
+        limit = cls._origin_limits.get(origin)
+        if limit is None:
+            limit = cls._origin_limits[origin] = asyncio.Semaphore(settings.stream_parallel_max_per_origin)
+        return limit
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        """Returns the number of upstream reconnects attempted, the streams resumed and those that gave up."""
+        return dict(cls._stats)
+
     @staticmethod
     def format_bytes(size) -> str:
         power = 2**10
@@ -280,7 +809,8 @@ class Streamer:
             await self.response.aclose()
         if self.progress_bar:
             self.progress_bar.close()
-        await self.client.aclose()
+        if not http_client_registry.is_shared(self.client):
+            await self.client.aclose()
 
 
 async def download_file_with_retry(url: str, headers: dict):
@@ -297,15 +827,15 @@ async def download_file_with_retry(url: str, headers: dict):
     Raises:
         DownloadError: If the download fails after retries.
     """
-    async with create_httpx_client() as client:
-        try:
-            response = await fetch_with_retry(client, "GET", url, headers)
-            return response.content
-        except DownloadError as e:
-            logger.error(f"Failed to download file: {e}")
-            raise e
-        except tenacity.RetryError as e:
-            raise DownloadError(502, f"Failed to download file: {e.last_attempt.result()}")
+    client = get_http_client()
+    try:
+        response = await fetch_with_retry(client, "GET", url, headers)
+        return response.content
+    except DownloadError as e:
+        logger.error(f"Failed to download file: {e}")
+        raise e
+    except tenacity.RetryError as e:
+        raise DownloadError(502, f"Failed to download file: {e.last_attempt.result()}")
 
 
 async def request_with_retry(method: str, url: str, headers: dict, **kwargs) -> httpx.Response:
@@ -324,13 +854,15 @@ async def request_with_retry(method: str, url: str, headers: dict, **kwargs) ->
     Raises:
         DownloadError: If the request fails after retries.
     """
-    async with create_httpx_client() as client:
-        try:
-            response = await fetch_with_retry(client, method, url, headers, **kwargs)
-            return response
-        except DownloadError as e:
-            logger.error(f"Failed to download file: {e}")
-            raise
+    client = get_http_client()
+    try:
+        response = await fetch_with_retry(client, method, url, headers, **kwargs)
+        return response
+    except DownloadError as e:
+        logger.error(f"Failed to download file: {e}")
+        raise
+    except tenacity.RetryError as e:
+        raise DownloadError(502, f"Failed to download file: {e.last_attempt.exception()}")
 
 
 def encode_mediaflow_proxy_url(
@@ -557,6 +1089,9 @@ def get_proxy_headers(request: Request) -> ProxyRequestHeaders:
 class EnhancedStreamingResponse(Response):
     body_iterator: typing.AsyncIterable[typing.Any]
 
+    # Throughput metrics of every streamed response in this process
+    _stats = {"responses": 0, "bytes": 0, "writes": 0, "seconds": 0.0}
+
     def __init__(
         self,
         content: typing.Union[typing.AsyncIterable[typing.Any], typing.Iterable[typing.Any]],
@@ -564,6 +1099,7 @@ class EnhancedStreamingResponse(Response):
         headers: typing.Optional[typing.Mapping[str, str]] = None,
         media_type: typing.Optional[str] = None,
         background: typing.Optional[BackgroundTask] = None,
+        output_chunk_size: typing.Optional[int] = None,
     ) -> None:
         if isinstance(content, typing.AsyncIterable):
             self.body_iterator = content
@@ -572,8 +1108,14 @@ class EnhancedStreamingResponse(Response):
         self.status_code = status_code
         self.media_type = self.media_type if media_type is None else media_type
         self.background = background
+        # Size of the merged client writes, see `coalesce_chunks`. Live media passes 0, as merging holds a chunk
+        # until the next one arrives, which would delay every part by up to one upstream chunk interval
+        self.output_chunk_size = settings.stream_output_chunk_size if output_chunk_size is None else output_chunk_size
         self.init_headers(headers)
         self.actual_content_length = 0
+        self.writes = 0
+        self.started_at = None
+        self.finished_at = None
 
     @staticmethod
     async def listen_for_disconnect(receive: Receive) -> None:
@@ -615,16 +1157,26 @@ class EnhancedStreamingResponse(Response):
             data_sent = False
 
             try:
-                async for chunk in self.body_iterator:
-                    if not isinstance(chunk, (bytes, memoryview)):
-                        chunk = chunk.encode(self.charset)
-                    try:
-                        await send({"type": "http.response.body", "body": chunk, "more_body": True})
-                        data_sent = True
-                        self.actual_content_length += len(chunk)
-                    except (ConnectionResetError, anyio.BrokenResourceError):
-                        logger.info("Client disconnected during streaming")
-                        return
+                self.started_at = time.monotonic()
+                output = self.coalesce_chunks(
+                    self.body_iterator,
+                    self.output_chunk_size,
+                    settings.stream_output_max_delay,
+                    self.charset,
+                )
+                try:
+                    async for chunk in output:
+                        try:
+                            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                            data_sent = True
+                            self.actual_content_length += len(chunk)
+                            self.writes += 1
+                        except (ConnectionResetError, anyio.BrokenResourceError):
+                            logger.info("Client disconnected during streaming")
+                            return
+                finally:
+                    # Closes the body iterator when the client went away
+                    await output.aclose()
 
                 # Successfully streamed all content
                 await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -662,6 +1214,88 @@ class EnhancedStreamingResponse(Response):
                     # If we can't send an error response, just log it
                     pass
 
+    @staticmethod
+    async def coalesce_chunks(
+        chunks: typing.AsyncIterable[typing.Any], target_size: int, max_delay: float, charset: str = "utf-8"
+    ) -> typing.AsyncGenerator[bytes, None]:
+        """
+        Merges consecutive chunks into chunks of about `target_size` bytes, so that a body read in small pieces is
+        written to the client in fewer and larger writes.
+
+        Chunks are passed through as is while their moving average size is at least half of `target_size`, as
+        merging them would cost more than it saves. Below it, e.g. for TLS upstreams delivering one record at a time,
+        chunks are accumulated and written once they reach `target_size` bytes, at the end of the body, or when a
+        chunk arrives `max_delay` seconds or more after the oldest buffered one, so that a slow live stream is not
+        held back. The body is read in the task writing the response, so the upstream iterator is never resumed from
+        another task, and it is closed here when the response stops early.
+
+        Args:
+            chunks (AsyncIterable): The body chunks, as bytes, memoryviews or strings.
+            target_size (int): Size in bytes of the merged chunks, chunks are passed through as is below 2.
+            max_delay (float): Maximum number of seconds a buffered chunk waits for the next ones.
+            charset (str): Encoding of string chunks.
+        """
+        iterator = chunks.__aiter__()
+        average_size = float(target_size)
+        buffer = []
+        buffered = 0
+        buffered_at = 0.0
+        try:
+            try:
+                async for chunk in iterator:
+                    if not isinstance(chunk, (bytes, memoryview)):
+                        chunk = chunk.encode(charset)
+                    average_size += (len(chunk) - average_size) / 8
+                    if not buffer:
+                        if target_size < 2 or average_size >= target_size / 2:
+                            yield chunk
+                            continue
+                        buffered_at = time.monotonic()
+                    buffer.append(chunk)
+                    buffered += len(chunk)
+                    if buffered >= target_size or time.monotonic() - buffered_at >= max_delay:
+                        data = b"".join(buffer)
+                        buffer.clear()
+                        buffered = 0
+                        yield data
+            except Exception:
+                # The chunks read before an upstream error are still written, as they would be without merging
+                if buffer:
+                    yield b"".join(buffer)
+                raise
+            if buffer:
+                yield b"".join(buffer)
+        finally:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    @property
+    def transfer_rate(self) -> float:
+        """Bytes per second sent to the client, so far if the response is still streaming."""
+        if self.started_at is None:
+            return 0.0
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return self.actual_content_length / elapsed if elapsed > 0 else 0.0
+
+    def _record_transfer(self) -> None:
+        if self.started_at is None:
+            return
+        self.finished_at = time.monotonic()
+        self._stats["responses"] += 1
+        self._stats["bytes"] += self.actual_content_length
+        self._stats["writes"] += self.writes
+        self._stats["seconds"] += self.finished_at - self.started_at
+        logger.debug(
+            f"Streamed {self.actual_content_length} bytes in {self.writes} writes over "
+            f"{self.finished_at - self.started_at:.2f}s ({self.transfer_rate / 1024 / 1024:.2f} MiB/s)"
+        )
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        """Returns the number of streamed responses with the bytes, writes and seconds they took together."""
+        return dict(cls._stats)
+
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         async with anyio.create_task_group() as task_group:
             streaming_completed = False
@@ -694,5 +1328,6 @@ class EnhancedStreamingResponse(Response):
             # Listen for disconnect events
             await wrap(listen_func)
 
+        self._record_transfer()
         if self.background is not None:
             await self.background()
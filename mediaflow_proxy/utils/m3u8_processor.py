@@ -1,7 +1,7 @@
 import asyncio
 import codecs
 import re
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Iterable, List
 from urllib import parse
 
 from mediaflow_proxy.configs import settings
@@ -11,6 +11,13 @@ from mediaflow_proxy.utils.hls_prebuffer import hls_prebuffer
 
 
 class M3U8Processor:
+    # Quoted URI attribute of tags such as EXT-X-KEY, EXT-X-MAP and EXT-X-MEDIA
+    URI_PATTERN = re.compile(r'URI="([^"]+)"')
+    # LL-HLS tags whose URI attribute is a partial segment or a rendition's playlist, proxied like the URL lines
+    CONTENT_URI_TAGS = ("#EXT-X-PART:", "#EXT-X-PRELOAD-HINT:", "#EXT-X-RENDITION-REPORT:")
+    PLAYLIST_EXTENSIONS = (".m3u", ".m3u8", ".m3u_plus")
+    PLAYLIST_TYPES = ("m3u", "m3u8", "m3u_plus")
+
     def __init__(self, request, key_url: str = None, force_playlist_proxy: bool = None, key_only_proxy: bool = False, no_proxy: bool = False):
         """
         Initializes the M3U8Processor with the request and URL prefix.
@@ -31,6 +38,36 @@ class M3U8Processor:
             request.url_for("hls_manifest_proxy").replace(scheme=get_original_scheme(request))
         )
         self.playlist_url = None  # Will be set when processing starts
+        self.routing_strategy = settings.m3u8_content_routing
+        self._prepare_proxy_params()
+
+    def _prepare_proxy_params(self):
+        """
+        Computes the parts of the proxied URLs that are the same for every line, once per playlist, so that proxying
+        a URL only has to quote it and append it to a prefix.
+        """
+        query_params = dict(self.request.query_params)
+        self.has_encrypted = bool(query_params.pop("has_encrypted", False))
+        # Remove the response headers from the query params to avoid it being added to the consecutive requests
+        [query_params.pop(key, None) for key in list(query_params.keys()) if key.startswith("r_")]
+        # Remove force_playlist_proxy to avoid it being added to subsequent requests
+        query_params.pop("force_playlist_proxy", None)
+        # The destination is set per URL
+        query_params.pop("d", None)
+        # LL-HLS delivery directives only apply to the playlist being requested
+        [query_params.pop(key) for key in list(query_params.keys()) if key.startswith("_HLS_")]
+        self.proxy_query_params = query_params
+
+        if self.has_encrypted:
+            # Every URL gets its own token
+            self.proxy_url_prefix = None
+        else:
+            proxy_url = encode_mediaflow_proxy_url(self.mediaflow_proxy_url, "", query_params=dict(query_params))
+            self.proxy_url_prefix = proxy_url + ("&d=" if "?" in proxy_url else "?d=")
+
+        all_params = self.request.query_params
+        self.request_headers = {key[2:]: value for key, value in all_params.items() if key.startswith("h_")}
+        self.response_headers = {key[2:]: value for key, value in all_params.items() if key.startswith("r_")}
 
     async def process_m3u8(self, content: str, base_url: str) -> str:
         """
@@ -46,31 +83,15 @@ class M3U8Processor:
         # Store the playlist URL for prebuffering
         self.playlist_url = base_url
         
-        lines = content.splitlines()
-        processed_lines = []
-        for line in lines:
-            if "URI=" in line:
-                processed_lines.append(await self.process_key_line(line, base_url))
-            elif not line.startswith("#") and line.strip():
-                processed_lines.append(await self.proxy_content_url(line, base_url))
-            else:
-                processed_lines.append(line)
+        processed_lines = self.process_lines(content.splitlines(), base_url)
         
         # Pre-buffer segments if enabled and this is a playlist
         if (settings.enable_hls_prebuffer and 
             "#EXTM3U" in content and
             self.playlist_url):
             
-            # Extract headers from request for pre-buffering
-            headers = {}
-            for key, value in self.request.query_params.items():
-                if key.startswith("h_"):
-                    headers[key[2:]] = value
-            
             # Start pre-buffering in background using the actual playlist URL
-            asyncio.create_task(
-                hls_prebuffer.prebuffer_playlist(self.playlist_url, headers)
-            )
+            self.start_prebuffer(self.playlist_url)
         
         return "\n".join(processed_lines)
 
@@ -86,7 +107,7 @@ class M3U8Processor:
             base_url (str): The base URL to resolve relative URLs.
 
         Yields:
-            str: Processed lines of the m3u8 content.
+            str: Processed lines of the m3u8 content, all the complete lines of each chunk at once.
         """
         # Store the playlist URL for prebuffering
         self.playlist_url = base_url
@@ -111,15 +132,12 @@ class M3U8Processor:
 
             # Process complete lines
             lines = buffer.split("\n")
-            if len(lines) > 1:
-                # Process all complete lines except the last one
-                for line in lines[:-1]:
-                    if line:  # Skip empty lines
-                        processed_line = await self.process_line(line, base_url)
-                        yield processed_line + "\n"
-
-                # Keep the last line in the buffer (it might be incomplete)
-                buffer = lines[-1]
+            # Keep the last line in the buffer (it might be incomplete)
+            buffer = lines.pop()
+            # Process all complete lines of the chunk in one batch, skipping empty lines
+            processed_lines = self.process_lines([line for line in lines if line], base_url)
+            if processed_lines:
+                yield "\n".join(processed_lines) + "\n"
 
             # Start pre-buffering early once we detect this is a playlist
             # This avoids waiting until the entire playlist is processed
@@ -128,16 +146,8 @@ class M3U8Processor:
                 not is_prebuffer_started and
                 self.playlist_url):
                 
-                # Extract headers from request for pre-buffering
-                headers = {}
-                for key, value in self.request.query_params.items():
-                    if key.startswith("h_"):
-                        headers[key[2:]] = value
-                
                 # Start pre-buffering in background using the actual playlist URL
-                asyncio.create_task(
-                    hls_prebuffer.prebuffer_playlist(self.playlist_url, headers)
-                )
+                self.start_prebuffer(self.playlist_url)
                 is_prebuffer_started = True
 
         # Process any remaining data in the buffer plus final bytes
@@ -146,10 +156,27 @@ class M3U8Processor:
             buffer += final_chunk
 
         if buffer:  # Process the last line if it's not empty
-            processed_line = await self.process_line(buffer, base_url)
-            yield processed_line
+            yield self.process_line(buffer, base_url)
+
+    def start_prebuffer(self, playlist_url: str) -> None:
+        """Starts pre-buffering the playlist in background, or marks it as accessed if it already is."""
+        asyncio.create_task(hls_prebuffer.prebuffer_playlist(playlist_url, dict(self.request_headers)))
+
+    def process_lines(self, lines: Iterable[str], base_url: str) -> List[str]:
+        """
+        Processes a batch of lines from the m3u8 content.
+
+        Args:
+            lines (Iterable[str]): The lines to process.
+            base_url (str): The base URL to resolve relative URLs.
+
+        Returns:
+            List[str]: The processed lines.
+        """
+        process_line = self.process_line
+        return [process_line(line, base_url) for line in lines]
 
-    async def process_line(self, line: str, base_url: str) -> str:
+    def process_line(self, line: str, base_url: str) -> str:
         """
         Process a single line from the m3u8 content.
 
@@ -161,13 +188,15 @@ class M3U8Processor:
             str: The processed line.
         """
         if "URI=" in line:
-            return await self.process_key_line(line, base_url)
+            if line.startswith(self.CONTENT_URI_TAGS):
+                return self.process_content_uri_line(line, base_url)
+            return self.process_key_line(line, base_url)
         elif not line.startswith("#") and line.strip():
-            return await self.proxy_content_url(line, base_url)
+            return self.proxy_content_url(line, base_url)
         else:
             return line
 
-    async def process_key_line(self, line: str, base_url: str) -> str:
+    def process_key_line(self, line: str, base_url: str) -> str:
         """
         Processes a key line in the m3u8 content, proxying the URI.
 
@@ -180,24 +209,41 @@ class M3U8Processor:
         """
         # If no_proxy is enabled, just resolve relative URLs without proxying
         if self.no_proxy:
-            uri_match = re.search(r'URI="([^"]+)"', line)
+            uri_match = self.URI_PATTERN.search(line)
             if uri_match:
                 original_uri = uri_match.group(1)
                 full_url = parse.urljoin(base_url, original_uri)
                 line = line.replace(f'URI="{original_uri}"', f'URI="{full_url}"')
             return line
         
-        uri_match = re.search(r'URI="([^"]+)"', line)
+        uri_match = self.URI_PATTERN.search(line)
         if uri_match:
             original_uri = uri_match.group(1)
             uri = parse.urlparse(original_uri)
             if self.key_url:
                 uri = uri._replace(scheme=self.key_url.scheme, netloc=self.key_url.netloc)
-            new_uri = await self.proxy_url(uri.geturl(), base_url)
+            new_uri = self.proxy_url(uri.geturl(), base_url)
             line = line.replace(f'URI="{original_uri}"', f'URI="{new_uri}"')
         return line
 
-    async def proxy_content_url(self, url: str, base_url: str) -> str:
+    def process_content_uri_line(self, line: str, base_url: str) -> str:
+        """
+        Processes an LL-HLS part, preload hint or rendition report line, routing its URI like a URL line.
+
+        Args:
+            line (str): The line to process.
+            base_url (str): The base URL to resolve relative URLs.
+
+        Returns:
+            str: The processed line.
+        """
+        uri_match = self.URI_PATTERN.search(line)
+        if uri_match:
+            original_uri = uri_match.group(1)
+            line = line.replace(f'URI="{original_uri}"', f'URI="{self.proxy_content_url(original_uri, base_url)}"')
+        return line
+
+    def proxy_content_url(self, url: str, base_url: str) -> str:
         """
         Proxies a content URL based on the configured routing strategy.
 
@@ -208,7 +254,7 @@ class M3U8Processor:
         Returns:
             str: The proxied URL.
         """
-        full_url = parse.urljoin(base_url, url)
+        full_url = self.resolve_url(url, base_url)
 
         # If no_proxy is enabled, return the direct URL without any proxying
         if self.no_proxy:
@@ -219,18 +265,16 @@ class M3U8Processor:
             return full_url
 
         # Determine routing strategy based on configuration
-        routing_strategy = settings.m3u8_content_routing
+        routing_strategy = self.routing_strategy
 
         # Check if we should force MediaFlow proxy for all playlist URLs
         if self.force_playlist_proxy:
-            return await self.proxy_url(full_url, base_url, use_full_url=True)
+            return self.proxy_url(full_url, base_url, use_full_url=True)
 
-        # For playlist URLs, always use MediaFlow proxy regardless of strategy
+        # For playlist URLs, always use MediaFlow proxy regardless of strategy (the mediaflow strategy proxies them anyway)
         # Check for actual playlist file extensions, not just substring matches
-        parsed_url = parse.urlparse(full_url)
-        if (parsed_url.path.endswith((".m3u", ".m3u8", ".m3u_plus")) or
-            parse.parse_qs(parsed_url.query).get("type", [""])[0] in ["m3u", "m3u8", "m3u_plus"]):
-            return await self.proxy_url(full_url, base_url, use_full_url=True)
+        if routing_strategy != "mediaflow" and self.is_playlist_url(full_url):
+            return self.proxy_url(full_url, base_url, use_full_url=True)
 
         # Route non-playlist content URLs based on strategy
         if routing_strategy == "direct":
@@ -238,21 +282,34 @@ class M3U8Processor:
             return full_url
         elif routing_strategy == "stremio" and settings.stremio_proxy_url:
             # Use Stremio proxy for content URLs
-            query_params = dict(self.request.query_params)
-            request_headers = {k[2:]: v for k, v in query_params.items() if k.startswith("h_")}
-            response_headers = {k[2:]: v for k, v in query_params.items() if k.startswith("r_")}
-
             return encode_stremio_proxy_url(
                 settings.stremio_proxy_url,
                 full_url,
-                request_headers=request_headers if request_headers else None,
-                response_headers=response_headers if response_headers else None,
+                request_headers=self.request_headers if self.request_headers else None,
+                response_headers=self.response_headers if self.response_headers else None,
             )
         else:
             # Default to MediaFlow proxy (routing_strategy == "mediaflow" or fallback)
-            return await self.proxy_url(full_url, base_url, use_full_url=True)
+            return self.proxy_url(full_url, base_url, use_full_url=True)
+
+    @staticmethod
+    def resolve_url(url: str, base_url: str) -> str:
+        """Resolves a URL against the base URL, absolute HTTP URLs (most lines of IPTV playlists) are returned as is."""
+        # Like urljoin, drop the carriage return of CRLF playlists, other control characters take the slow path
+        if url.startswith(("http://", "https://")) and "\t" not in url and "\r" not in url[:-1]:
+            return url.rstrip("\r")
+        return parse.urljoin(base_url, url)
+
+    def is_playlist_url(self, url: str) -> bool:
+        """Returns whether the URL points to a playlist, by its extension or its `type` query parameter."""
+        parsed_url = parse.urlsplit(url)
+        if parsed_url.path.endswith(self.PLAYLIST_EXTENSIONS):
+            return True
+        return "type=" in parsed_url.query and (
+            parse.parse_qs(parsed_url.query).get("type", [""])[0] in self.PLAYLIST_TYPES
+        )
 
-    async def proxy_url(self, url: str, base_url: str, use_full_url: bool = False) -> str:
+    def proxy_url(self, url: str, base_url: str, use_full_url: bool = False) -> str:
         """
         Proxies a URL, encoding it with the MediaFlow proxy URL.
 
@@ -269,17 +326,13 @@ class M3U8Processor:
         else:
             full_url = parse.urljoin(base_url, url)
 
-        query_params = dict(self.request.query_params)
-        has_encrypted = query_params.pop("has_encrypted", False)
-        # Remove the response headers from the query params to avoid it being added to the consecutive requests
-        [query_params.pop(key, None) for key in list(query_params.keys()) if key.startswith("r_")]
-        # Remove force_playlist_proxy to avoid it being added to subsequent requests
-        query_params.pop("force_playlist_proxy", None)
+        if self.proxy_url_prefix is not None:
+            return self.proxy_url_prefix + parse.quote_plus(full_url)
 
         return encode_mediaflow_proxy_url(
             self.mediaflow_proxy_url,
             "",
             full_url,
-            query_params=query_params,
-            encryption_handler=encryption_handler if has_encrypted else None,
+            query_params=dict(self.proxy_query_params),
+            encryption_handler=encryption_handler,
         )
@@ -0,0 +1,211 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import AsyncGenerator, AsyncIterable, Hashable, Optional, Tuple, Union
+
+import httpx
+from fastapi import Request, Response
+
+from mediaflow_proxy.configs import settings
+from mediaflow_proxy.utils.http_utils import get_original_scheme
+
+logger = logging.getLogger(__name__)
+
+# ETag and Last-Modified of an origin manifest
+Validators = Tuple[Optional[str], Optional[str]]
+
+
+class _Manifest:
+    __slots__ = ("source", "body", "etag")
+
+    def __init__(self, source: Hashable, body: bytes, etag: str):
+        self.source = source
+        self.body = body
+        self.etag = etag
+
+
+class ManifestCache:
+    """
+    Per-worker LRU cache of rewritten manifests, so that the refreshes of a live manifest that did not change skip
+    the rewrite, and the download when the origin supports conditional requests.
+
+    An entry is keyed by everything its output depends on, the origin URL and the proxy request URL, and records the
+    version of the origin manifest it was rewritten from: its validators (ETag and Last-Modified), which are sent
+    back to the origin in a conditional request, or any other identifier of the origin content. An entry is only
+    served while the origin content has the same version.
+
+    Rewritten manifests are identified to clients by an ETag derived from their content, so that a tag is valid
+    whichever worker answers, and requests with a matching `If-None-Match` header are answered with 304.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Initializes the manifest cache.
+
+        Args:
+            max_bytes (int): Maximum total size of the cached manifests in bytes.
+        """
+        self.max_bytes = max_bytes
+        # Larger manifests are not cached, so that a few huge VOD playlists cannot take over the budget
+        self.max_entry_bytes = max_bytes // 8
+        self._entries: "OrderedDict[str, _Manifest]" = OrderedDict()
+        self.size = 0
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @staticmethod
+    def key(request: Request, url: str) -> str:
+        """Returns the cache key of the manifest at `url` rewritten for `request`."""
+        raw = "\n".join((get_original_scheme(request), str(request.url), url))
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def validators(headers: httpx.Headers) -> Optional[Validators]:
+        """Returns the ETag and Last-Modified of an origin response, or None if it has neither."""
+        etag = headers.get("etag")
+        last_modified = headers.get("last-modified")
+        if etag is None and last_modified is None:
+            return None
+        return etag, last_modified
+
+    @staticmethod
+    def conditional_headers(validators: Validators) -> dict:
+        """Returns the headers asking the origin to answer with 304 if its manifest still has these validators."""
+        etag, last_modified = validators
+        headers = {}
+        if etag is not None:
+            headers["if-none-match"] = etag
+        if last_modified is not None:
+            headers["if-modified-since"] = last_modified
+        return headers
+
+    @staticmethod
+    def entity_tag(body: bytes) -> str:
+        """Returns the ETag of a rewritten manifest."""
+        return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+    @staticmethod
+    def is_not_modified(request: Request, etag: str) -> bool:
+        """Returns whether the `If-None-Match` header of the request matches the ETag."""
+        if_none_match = request.headers.get("if-none-match")
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+
+    @classmethod
+    def not_modified_or(cls, request: Request, response: Response) -> Response:
+        """Tags a manifest response generated in full, and returns 304 instead if the client already has it."""
+        etag = cls.entity_tag(response.body)
+        if cls.is_not_modified(request, etag):
+            headers = {key: value for key, value in response.headers.items() if key != "content-length"}
+            return Response(status_code=304, headers={**headers, "etag": etag})
+        response.headers["etag"] = etag
+        return response
+
+    def get(self, key: str, source: Optional[Hashable] = None) -> Optional[_Manifest]:
+        """
+        Returns the cached manifest of `key` and marks it as recently used, or None if it is not cached.
+
+        Args:
+            key (str): The cache key, see `key`.
+            source (Hashable, optional): Version of the origin content, the manifest is only returned if it was
+                rewritten from the same version. Defaults to None, any version.
+        """
+        entry = self._entries.get(key)
+        if entry is None or (source is not None and entry.source != source):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, source: Hashable, body: bytes) -> _Manifest:
+        """
+        Caches a rewritten manifest, evicting the least recently used ones to stay within the budget.
+
+        Args:
+            key (str): The cache key, see `key`.
+            source (Hashable): Version of the origin content the manifest was rewritten from.
+            body (bytes): The rewritten manifest.
+
+        Returns:
+            _Manifest: The entry, also returned when the manifest is too large to be cached.
+        """
+        entry = _Manifest(source, body, self.entity_tag(body))
+        self.remove(key)
+        if len(body) > self.max_entry_bytes:
+            return entry
+        while self._entries and self.size + len(body) > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.body)
+        self._entries[key] = entry
+        self.size += len(body)
+        return entry
+
+    def remove(self, key: str) -> None:
+        """Removes a manifest if cached."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry.body)
+
+    async def tee(
+        self, key: str, source: Hashable, chunks: AsyncIterable[Union[str, bytes]]
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        Yields the chunks of a manifest being rewritten, and caches it once complete.
+
+        Args:
+            key (str): The cache key, see `key`.
+            source (Hashable): Version of the origin content the manifest is rewritten from.
+            chunks (AsyncIterable[Union[str, bytes]]): The rewritten manifest.
+
+        Yields:
+            bytes: The chunks of the rewritten manifest.
+        """
+        parts = []
+        size = 0
+        async for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            if parts is not None:
+                parts.append(chunk)
+                size += len(chunk)
+                if size > self.max_entry_bytes:
+                    parts = None
+            yield chunk
+        if parts is not None:
+            self.put(key, source, b"".join(parts))
+
+    def respond(self, request: Request, entry: _Manifest, headers: dict, media_type: str) -> Response:
+        """
+        Returns the response serving a cached manifest, 304 if the client already has it.
+
+        Args:
+            request (Request): The incoming HTTP request.
+            entry (_Manifest): The cached manifest.
+            headers (dict): The headers of the response.
+            media_type (str): The media type of the manifest.
+        """
+        headers = {**headers, "etag": entry.etag}
+        if self.is_not_modified(request, entry.etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type=media_type, headers=headers)
+
+    def get_stats(self) -> dict:
+        """Returns the cache footprint, and the number of manifests served from the cache and answered with 304."""
+        return {
+            "size": self.size,
+            "max_bytes": self.max_bytes,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+
+manifest_cache = ManifestCache(settings.manifest_cache_max_size) if settings.manifest_cache_max_size > 0 else None
@@ -1,8 +1,11 @@
+import hashlib
 import logging
 import math
 import re
+from array import array
+from bisect import bisect_left
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Optional, Union
+from typing import List, Dict, Optional, Tuple, Union
 from urllib.parse import urljoin
 
 import xmltodict
@@ -24,7 +27,11 @@ def parse_mpd(mpd_content: Union[str, bytes]) -> dict:
 
 
 def parse_mpd_dict(
-    mpd_dict: dict, mpd_url: str, parse_drm: bool = True, parse_segment_profile_id: Optional[str] = None
+    mpd_dict: dict,
+    mpd_url: str,
+    parse_drm: bool = True,
+    parse_segment_profile_id: Optional[str] = None,
+    timelines: Optional[Dict[str, "LiveTimeline"]] = None,
 ) -> dict:
     """
     Parses the MPD dictionary and extracts relevant information.
@@ -34,6 +41,8 @@ def parse_mpd_dict(
         mpd_url (str): The URL of the MPD manifest.
         parse_drm (bool, optional): Whether to parse DRM information. Defaults to True.
         parse_segment_profile_id (str, optional): The profile ID to parse segments for. Defaults to None.
+        timelines (Dict[str, LiveTimeline], optional): Segment timelines of a live MPD from its previous parse, by
+            profile ID, updated in place instead of rebuilding the segments. Defaults to None.
 
     Returns:
         dict: The parsed MPD information including profiles and DRM info.
@@ -78,6 +87,7 @@ def parse_mpd_dict(
                     source,
                     media_presentation_duration,
                     parse_segment_profile_id,
+                    timelines,
                 )
                 if profile:
                     profiles.append(profile)
@@ -92,6 +102,97 @@ def parse_mpd_dict(
     return parsed_dict
 
 
+def uses_wall_clock(mpd_dict: dict) -> bool:
+    """
+    Checks whether the segments of a manifest depend on the current time, as for a live manifest with `@duration`
+    segment templates, whose segment window advances without the manifest changing.
+
+    Args:
+        mpd_dict (dict): The MPD content as a dictionary.
+
+    Returns:
+        bool: True if parsing the segments of the manifest gives a different result over time.
+    """
+    if mpd_dict["MPD"].get("@type", "static").lower() != "dynamic":
+        return False
+
+    periods = mpd_dict["MPD"]["Period"]
+    for period in periods if isinstance(periods, list) else [periods]:
+        adaptations = period.get("AdaptationSet", [])
+        for adaptation in adaptations if isinstance(adaptations, list) else [adaptations]:
+            representations = adaptation.get("Representation", [])
+            representations = representations if isinstance(representations, list) else [representations]
+            for item in [adaptation, *representations]:
+                template = item.get("SegmentTemplate")
+                if template and "@duration" in template and "SegmentTimeline" not in template:
+                    return True
+    return False
+
+
+class MPDModel:
+    """
+    Parsed state of an MPD URL. Parse results are reused until the manifest changes, and the segment timelines of a
+    live manifest are updated incrementally when it is refreshed rather than rebuilt. Segments of a live manifest
+    computed from the current time, see `uses_wall_clock`, are parsed again on every call.
+
+    Parse results are shared between callers and must not be modified.
+    """
+
+    def __init__(self, mpd_url: str):
+        self.mpd_url = mpd_url
+        # Serialized manifest the parse results belong to, and its digest
+        self.version: Optional[bytes] = None
+        self.digest: Optional[bytes] = None
+        # ETag and Last-Modified of the origin manifest, sent back to the origin when the manifest is refreshed
+        self.validators: Optional[Tuple[Optional[str], Optional[str]]] = None
+        self.timelines: Dict[str, LiveTimeline] = {}
+        self._mpd_dict: Optional[dict] = None
+        # Whether the segments of the manifest depend on the current time, see `uses_wall_clock`
+        self.uses_wall_clock = False
+        # Seconds after which a live manifest should be refreshed, None for a static one
+        self.minimum_update_period: Optional[float] = None
+        self._results: Dict[tuple, dict] = {}
+
+    def update(self, version: bytes, mpd_dict: dict) -> None:
+        """
+        Replaces the manifest with a refreshed one.
+
+        Args:
+            version (bytes): The serialized manifest, compared to tell whether a cached manifest changed.
+            mpd_dict (dict): The MPD content as a dictionary.
+        """
+        self.version = version
+        self.digest = hashlib.blake2b(version, digest_size=16).digest()
+        self._mpd_dict = mpd_dict
+        self.uses_wall_clock = uses_wall_clock(mpd_dict)
+        self.minimum_update_period = None
+        if mpd_dict["MPD"].get("@type", "static").lower() == "dynamic":
+            self.minimum_update_period = parse_duration(mpd_dict["MPD"].get("@minimumUpdatePeriod", "PT0S"))
+        self._results.clear()
+
+    def parse(self, parse_drm: bool = True, parse_segment_profile_id: Optional[str] = None) -> dict:
+        """
+        Parses the manifest, see `parse_mpd_dict`, reusing the result of a previous call with the same arguments
+        unless its segments depend on the current time.
+
+        Args:
+            parse_drm (bool, optional): Whether to parse DRM information. Defaults to True.
+            parse_segment_profile_id (str, optional): The profile ID to parse segments for. Defaults to None.
+
+        Returns:
+            dict: The parsed MPD information including profiles and DRM info.
+        """
+        if self.uses_wall_clock and parse_segment_profile_id is not None:
+            return parse_mpd_dict(self._mpd_dict, self.mpd_url, parse_drm, parse_segment_profile_id, self.timelines)
+
+        key = (parse_drm, parse_segment_profile_id)
+        result = self._results.get(key)
+        if result is None:
+            result = parse_mpd_dict(self._mpd_dict, self.mpd_url, parse_drm, parse_segment_profile_id, self.timelines)
+            self._results[key] = result
+        return result
+
+
 def pad_base64(encoded_key_id):
     """
     Pads a base64 encoded key ID to make its length a multiple of 4.
@@ -198,6 +299,7 @@ def parse_representation(
     source: str,
     media_presentation_duration: str,
     parse_segment_profile_id: Optional[str],
+    timelines: Optional[Dict[str, "LiveTimeline"]] = None,
 ) -> Optional[dict]:
     """
     Parses a representation and extracts profile information.
@@ -209,6 +311,7 @@ def parse_representation(
         source (str): The source URL.
         media_presentation_duration (str): The media presentation duration.
         parse_segment_profile_id (str, optional): The profile ID to parse segments for. Defaults to None.
+        timelines (Dict[str, LiveTimeline], optional): Segment timelines of a live MPD by profile ID. Defaults to None.
 
     Returns:
         Optional[dict]: The parsed profile information or None if not applicable.
@@ -263,12 +366,24 @@ def parse_representation(
     else:
         profile["segment_template_start_number"] = 1
 
+    # Seconds before the end of a segment from which the origin serves it, while it is still being produced
+    availability_time_offset = (segment_template_data or {}).get("@availabilityTimeOffset") or _get_key(
+        adaptation, representation, "@availabilityTimeOffset"
+    )
+    try:
+        profile["availabilityTimeOffset"] = float(availability_time_offset or 0)
+    except ValueError:
+        profile["availabilityTimeOffset"] = 0.0
+
     if parse_segment_profile_id is None or profile["id"] != parse_segment_profile_id:
         return profile
 
     item = adaptation.get("SegmentTemplate") or representation.get("SegmentTemplate")
     if item:
-        profile["segments"] = parse_segment_template(parsed_dict, item, profile, source)
+        live_timeline = None
+        if timelines is not None and parsed_dict["isLive"]:
+            live_timeline = timelines.setdefault(profile["id"], LiveTimeline())
+        profile["segments"] = parse_segment_template(parsed_dict, item, profile, source, live_timeline)
     else:
         profile["segments"] = parse_segment_base(representation, profile, source)
 
@@ -290,7 +405,9 @@ def _get_key(adaptation: dict, representation: dict, key: str) -> Optional[str]:
     return representation.get(key, adaptation.get(key, None))
 
 
-def parse_segment_template(parsed_dict: dict, item: dict, profile: dict, source: str) -> List[Dict]:
+def parse_segment_template(
+    parsed_dict: dict, item: dict, profile: dict, source: str, live_timeline: Optional["LiveTimeline"] = None
+) -> "SegmentSequence":
     """
     Parses a segment template and extracts segment information.
 
@@ -299,11 +416,11 @@ def parse_segment_template(parsed_dict: dict, item: dict, profile: dict, source:
         item (dict): The segment template data.
         profile (dict): The profile information.
         source (str): The source URL.
+        live_timeline (LiveTimeline, optional): The segment timeline from the previous parse of a live MPD.
 
     Returns:
-        List[Dict]: The list of parsed segments.
+        SegmentSequence: The parsed segments.
     """
-    segments = []
     timescale = int(item.get("@timescale", 1))
 
     # Initialization
@@ -317,14 +434,208 @@ def parse_segment_template(parsed_dict: dict, item: dict, profile: dict, source:
 
     # Segments
     if "SegmentTimeline" in item:
-        segments.extend(parse_segment_timeline(parsed_dict, item, profile, source, timescale))
+        return parse_segment_timeline(parsed_dict, item, profile, source, timescale, live_timeline)
     elif "@duration" in item:
-        segments.extend(parse_segment_duration(parsed_dict, item, profile, source, timescale))
+        return parse_segment_duration(parsed_dict, item, profile, source, timescale)
+
+    return SegmentSequence(segment_media_template(item, profile, source), timescale)
+
+
+def segment_media_template(item: dict, profile: dict, source: str) -> str:
+    """
+    Resolves the per-representation parts of a segment URL template, leaving `$Number$` and `$Time$` to be
+    substituted per segment.
+
+    Args:
+        item (dict): The segment template data.
+        profile (dict): The profile information.
+        source (str): The source URL.
+
+    Returns:
+        str: The absolute segment URL template of the representation.
+    """
+    media = item.get("@media", "")
+    media = media.replace("$RepresentationID$", profile["id"])
+    media = media.replace("$Bandwidth$", str(profile["bandwidth"]))
+    if not media.startswith("http"):
+        media = f"{source}/{media}"
+    return media
+
+
+def format_segment_url(media: str, number: int, time: Optional[int] = None) -> str:
+    """
+    Substitutes the number and time of a segment in a segment URL template.
 
-    return segments
+    Args:
+        media (str): The segment URL template, see `segment_media_template`.
+        number (int): The segment number.
+        time (int, optional): The presentation time of the segment.
+
+    Returns:
+        str: The segment URL.
+    """
+    if "$Number" in media:
+        media = media.replace("$Number%04d$", f"{number:04d}").replace("$Number$", str(number))
+    if time is not None and "$Time$" in media:
+        media = media.replace("$Time$", str(time))
+    return media
+
+
+class SegmentSequence:
+    """
+    Media segments of a representation, stored as columns.
+
+    Segment numbers, presentation times and durations, in timescale units, are kept in `array('q')` columns, while
+    URLs, durations in seconds and program date times are formatted on demand. A long timeline or a multi-hour VOD
+    therefore holds three integers per segment instead of a dict with datetimes and strings.
+    """
+
+    def __init__(
+        self,
+        media: str,
+        timescale: int,
+        numbers: Optional[array] = None,
+        times: Optional[array] = None,
+        durations: Optional[array] = None,
+        period_start: Optional[datetime] = None,
+        byte_range: Optional[str] = None,
+    ):
+        """
+        Args:
+            media (str): The segment URL template, see `segment_media_template`.
+            timescale (int): The timescale of the times and durations.
+            numbers (array, optional): The segment numbers.
+            times (array, optional): The presentation times of the segments.
+            durations (array, optional): The durations of the segments.
+            period_start (datetime, optional): Wall clock time of presentation time 0, for program date times.
+            byte_range (str, optional): The byte range of the single segment of a SegmentBase representation.
+        """
+        self.media = media
+        self.timescale = timescale
+        self.numbers = numbers if numbers is not None else array("q")
+        self.times = times if times is not None else array("q")
+        self.durations = durations if durations is not None else array("q")
+        self.period_start = period_start
+        self.byte_range = byte_range
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union["SegmentSequence", Dict]:
+        if isinstance(index, slice):
+            return SegmentSequence(
+                self.media,
+                self.timescale,
+                self.numbers[index],
+                self.times[index],
+                self.durations[index],
+                self.period_start,
+                self.byte_range,
+            )
+        return self.segment(index)
+
+    @property
+    def uses_time(self) -> bool:
+        """Whether segment URLs depend on the segment time, not only on the segment number."""
+        return "$Time$" in self.media
+
+    def media_url(self, index: int) -> str:
+        """Returns the URL of a segment."""
+        return format_segment_url(self.media, self.numbers[index], self.times[index])
+
+    def extinf(self, index: int) -> float:
+        """Returns the duration of a segment in seconds."""
+        return self.durations[index] / self.timescale
+
+    def max_extinf(self) -> float:
+        """Returns the longest segment duration in seconds."""
+        return max(self.durations) / self.timescale if self.durations else 0.0
+
+    def start_time(self, index: int) -> Optional[datetime]:
+        """Returns the wall clock start time of a segment, if known."""
+        if self.period_start is None:
+            return None
+        return self.period_start + timedelta(seconds=self.times[index] / self.timescale)
+
+    def program_date_time(self, index: int) -> Optional[str]:
+        """Returns the EXT-X-PROGRAM-DATE-TIME value of a segment, if known."""
+        start_time = self.start_time(index)
+        return start_time.isoformat() + "Z" if start_time else None
+
+    def end_timestamp(self) -> Optional[float]:
+        """Returns the wall clock end time of the last segment as a Unix timestamp, if known."""
+        if self.period_start is None or not self.numbers:
+            return None
+        return self.period_start.timestamp() + (self.times[-1] + self.durations[-1]) / self.timescale
+
+    def extend(self, until: float) -> "SegmentSequence":
+        """
+        Returns the sequence followed by the segments expected after its last one, with the same duration, that end
+        before `until`. Used for live representations whose manifest is refreshed less often than segments appear.
+
+        Args:
+            until (float): Unix timestamp.
+
+        Returns:
+            SegmentSequence: The extended sequence, or this one if no further segment has ended yet.
+        """
+        end = self.end_timestamp()
+        if end is None or not self.durations[-1]:
+            return self
+        count = math.floor((until - end) * self.timescale / self.durations[-1])
+        if count <= 0:
+            return self
+        number, time, duration = self.numbers[-1] + 1, self.times[-1] + self.durations[-1], self.durations[-1]
+        return SegmentSequence(
+            self.media,
+            self.timescale,
+            self.numbers + array("q", range(number, number + count)),
+            self.times + array("q", range(time, time + duration * count, duration)),
+            self.durations + array("q", [duration]) * count,
+            self.period_start,
+            self.byte_range,
+        )
+
+    def segment(self, index: int) -> Dict:
+        """
+        Returns a single segment as a dict, for callers needing only a few of them.
+
+        Args:
+            index (int): The index of the segment, negative values count from the end.
+
+        Returns:
+            Dict: The segment URL and metadata.
+        """
+        segment_data = {
+            "type": "segment",
+            "media": self.media_url(index),
+            "number": self.numbers[index],
+            "time": self.times[index],
+            "duration_mpd_timescale": self.durations[index],
+            "extinf": self.extinf(index),
+        }
+        start_time = self.start_time(index)
+        if start_time:
+            segment_data.update(
+                {
+                    "start_time": start_time,
+                    "end_time": start_time + timedelta(seconds=segment_data["extinf"]),
+                    "program_date_time": start_time.isoformat() + "Z",
+                }
+            )
+        if self.byte_range:
+            segment_data["range"] = self.byte_range
+        return segment_data
 
 
-def parse_segment_timeline(parsed_dict: dict, item: dict, profile: dict, source: str, timescale: int) -> List[Dict]:
+def parse_segment_timeline(
+    parsed_dict: dict,
+    item: dict,
+    profile: dict,
+    source: str,
+    timescale: int,
+    live_timeline: Optional["LiveTimeline"] = None,
+) -> SegmentSequence:
     """
     Parses a segment timeline and extracts segment information.
 
@@ -334,9 +645,11 @@ def parse_segment_timeline(parsed_dict: dict, item: dict, profile: dict, source:
         profile (dict): The profile information.
         source (str): The source URL.
         timescale (int): The timescale for the segments.
+        live_timeline (LiveTimeline, optional): The segment timeline from the previous parse of a live MPD, only
+            the segments it does not know yet are expanded.
 
     Returns:
-        List[Dict]: The list of parsed segments.
+        SegmentSequence: The parsed segments.
     """
     timelines = item["SegmentTimeline"]["S"]
     timelines = timelines if isinstance(timelines, list) else [timelines]
@@ -345,59 +658,154 @@ def parse_segment_timeline(parsed_dict: dict, item: dict, profile: dict, source:
     )
     presentation_time_offset = int(item.get("@presentationTimeOffset", 0))
     start_number = int(item.get("@startNumber", 1))
-
-    segments = [
-        create_segment_data(timeline, item, profile, source, timescale)
-        for timeline in preprocess_timeline(timelines, start_number, period_start, presentation_time_offset, timescale)
-    ]
-    return segments
+    media = segment_media_template(item, profile, source)
+
+    if live_timeline is not None:
+        return live_timeline.update(timelines, media, timescale, start_number, period_start, presentation_time_offset)
+
+    numbers, times, durations = preprocess_timeline(timelines, start_number, presentation_time_offset)
+    return SegmentSequence(media, timescale, numbers, times, durations, period_start)
+
+
+class LiveTimeline:
+    """
+    Segments of a live SegmentTimeline representation, kept across refreshes of the MPD.
+
+    On refresh, only the timeline entries after the last known segment are expanded and the segments that left the
+    timeline are dropped, instead of expanding every segment again. Each update returns a new sequence, so playlists
+    being built from a previous one are not affected.
+    """
+
+    def __init__(self):
+        self.segments = SegmentSequence("", 1)
+        # Start time of the segment following the last known one, in timescale units
+        self.end_time: Optional[int] = None
+        self._signature = None
+
+    def update(
+        self,
+        timelines: List[Dict],
+        media: str,
+        timescale: int,
+        start_number: int,
+        period_start: datetime,
+        presentation_time_offset: int,
+    ) -> SegmentSequence:
+        """
+        Updates the segments from the `S` entries of the refreshed timeline.
+
+        Args:
+            timelines (List[Dict]): The `S` entries of the segment timeline.
+            media (str): The segment URL template, see `segment_media_template`.
+            timescale (int): The timescale for the segments.
+            start_number (int): The number of the first segment of the timeline.
+            period_start (datetime): The start time of the period.
+            presentation_time_offset (int): The presentation time offset.
+
+        Returns:
+            SegmentSequence: The segments of the refreshed timeline.
+        """
+        signature = (media, timescale, period_start, presentation_time_offset)
+        if signature != self._signature:
+            self._signature = signature
+            self._reset()
+
+        # Walk the entries without expanding them, keeping only the part after the last known segment
+        new_entries = []
+        new_start_number = None
+        first_time = None
+        current_time = 0
+        number = start_number
+        for timeline in timelines:
+            repeat = int(timeline.get("@r", 0))
+            duration = int(timeline["@d"])
+            start_time = int(timeline.get("@t", current_time))
+            count = repeat + 1
+            if first_time is None:
+                first_time = start_time
+
+            skip = 0
+            if self.end_time is not None and start_time < self.end_time:
+                skip = min(-(-(self.end_time - start_time) // duration), count)
+            if skip < count:
+                if new_start_number is None:
+                    new_start_number = number + skip
+                new_entries.append({"@t": start_time + skip * duration, "@d": duration, "@r": count - skip - 1})
+
+            current_time = start_time + duration * count
+            number += count
+
+        kept = self.segments
+        if kept and (
+            first_time is None or current_time < self.end_time or first_time < kept.times[0] + presentation_time_offset
+        ):
+            # The timeline went back or was replaced, rebuild it
+            self._reset()
+            return self.update(timelines, media, timescale, start_number, period_start, presentation_time_offset)
+
+        numbers, times, durations = preprocess_timeline(new_entries, new_start_number, presentation_time_offset)
+        if (
+            kept
+            and numbers
+            and (numbers[0] != kept.numbers[-1] + 1 or times[0] + presentation_time_offset != self.end_time)
+        ):
+            # Numbering or timing is not continuous with the known segments, rebuild the timeline
+            self._reset()
+            return self.update(timelines, media, timescale, start_number, period_start, presentation_time_offset)
+
+        # Drop the segments that left the timeline, slicing copies the columns so the previous sequence is unchanged
+        drop = bisect_left(kept.times, first_time - presentation_time_offset) if kept else 0
+        kept_numbers, kept_times, kept_durations = kept.numbers[drop:], kept.times[drop:], kept.durations[drop:]
+        kept_numbers.extend(numbers)
+        kept_times.extend(times)
+        kept_durations.extend(durations)
+
+        self.segments = SegmentSequence(media, timescale, kept_numbers, kept_times, kept_durations, period_start)
+        self.end_time = current_time
+        return self.segments
+
+    def _reset(self) -> None:
+        self.segments = SegmentSequence("", 1)
+        self.end_time = None
 
 
 def preprocess_timeline(
-    timelines: List[Dict], start_number: int, period_start: datetime, presentation_time_offset: int, timescale: int
-) -> List[Dict]:
+    timelines: List[Dict], start_number: int, presentation_time_offset: int
+) -> Tuple[array, array, array]:
     """
-    Preprocesses the segment timeline data.
+    Expands the segment timeline entries into columns.
 
     Args:
         timelines (List[Dict]): The list of timeline segments.
         start_number (int): The starting segment number.
-        period_start (datetime): The start time of the period.
         presentation_time_offset (int): The presentation time offset.
-        timescale (int): The timescale for the segments.
 
     Returns:
-        List[Dict]: The list of preprocessed timeline segments.
+        Tuple[array, array, array]: The numbers, presentation times and durations of the segments.
     """
-    processed_data = []
+    numbers, times, durations = array("q"), array("q"), array("q")
     current_time = 0
     for timeline in timelines:
         repeat = int(timeline.get("@r", 0))
         duration = int(timeline["@d"])
         start_time = int(timeline.get("@t", current_time))
+        count = repeat + 1
 
-        for _ in range(repeat + 1):
-            segment_start_time = period_start + timedelta(seconds=(start_time - presentation_time_offset) / timescale)
-            segment_end_time = segment_start_time + timedelta(seconds=duration / timescale)
+        if count > 0:
+            numbers.extend(range(start_number, start_number + count))
             presentation_time = start_time - presentation_time_offset
-            processed_data.append(
-                {
-                    "number": start_number,
-                    "start_time": segment_start_time,
-                    "end_time": segment_end_time,
-                    "duration": duration,
-                    "time": presentation_time,
-                }
-            )
-            start_time += duration
-            start_number += 1
+            times.extend(range(presentation_time, presentation_time + duration * count, duration))
+            durations.extend(array("q", [duration]) * count)
 
-        current_time = start_time
+        start_number += max(count, 0)
+        current_time = start_time + duration * max(count, 0)
 
-    return processed_data
+    return numbers, times, durations
 
 
-def parse_segment_duration(parsed_dict: dict, item: dict, profile: dict, source: str, timescale: int) -> List[Dict]:
+def parse_segment_duration(
+    parsed_dict: dict, item: dict, profile: dict, source: str, timescale: int
+) -> SegmentSequence:
     """
     Parses segment duration and extracts segment information.
     This is used for static or live MPD manifests.
@@ -410,21 +818,31 @@ def parse_segment_duration(parsed_dict: dict, item: dict, profile: dict, source:
         timescale (int): The timescale for the segments.
 
     Returns:
-        List[Dict]: The list of parsed segments.
+        SegmentSequence: The parsed segments.
     """
     duration = int(item["@duration"])
     start_number = int(item.get("@startNumber", 1))
     segment_duration_sec = duration / timescale
 
     if parsed_dict["isLive"]:
-        segments = generate_live_segments(parsed_dict, segment_duration_sec, start_number)
+        segment_numbers = generate_live_segments(parsed_dict, segment_duration_sec, start_number)
+        period_start = parsed_dict["availabilityStartTime"]
     else:
-        segments = generate_vod_segments(profile, duration, timescale, start_number)
-
-    return [create_segment_data(seg, item, profile, source, timescale) for seg in segments]
+        segment_numbers = generate_vod_segments(profile, duration, timescale, start_number)
+        period_start = None
+
+    first_time = (segment_numbers.start - start_number) * duration
+    return SegmentSequence(
+        segment_media_template(item, profile, source),
+        timescale,
+        array("q", segment_numbers),
+        array("q", range(first_time, first_time + duration * len(segment_numbers), duration)),
+        array("q", [duration]) * len(segment_numbers),
+        period_start,
+    )
 
 
-def generate_live_segments(parsed_dict: dict, segment_duration_sec: float, start_number: int) -> List[Dict]:
+def generate_live_segments(parsed_dict: dict, segment_duration_sec: float, start_number: int) -> range:
     """
     Generates live segments based on the segment duration and start number.
     This is used for live MPD manifests.
@@ -435,30 +853,21 @@ def generate_live_segments(parsed_dict: dict, segment_duration_sec: float, start
         start_number (int): The starting segment number.
 
     Returns:
-        List[Dict]: The list of generated live segments.
+        range: The numbers of the segments in the time shift buffer.
     """
     time_shift_buffer_depth = timedelta(seconds=parsed_dict.get("timeShiftBufferDepth", 60))
     segment_count = math.ceil(time_shift_buffer_depth.total_seconds() / segment_duration_sec)
     current_time = datetime.now(tz=timezone.utc)
-    earliest_segment_number = max(
-        start_number
-        + math.floor((current_time - parsed_dict["availabilityStartTime"]).total_seconds() / segment_duration_sec)
-        - segment_count,
-        start_number,
+    # Number of the segment being produced, the last complete segment is the one before it
+    live_segment_number = start_number + math.floor(
+        (current_time - parsed_dict["availabilityStartTime"]).total_seconds() / segment_duration_sec
     )
+    earliest_segment_number = max(live_segment_number - segment_count, start_number)
 
-    return [
-        {
-            "number": number,
-            "start_time": parsed_dict["availabilityStartTime"]
-            + timedelta(seconds=(number - start_number) * segment_duration_sec),
-            "duration": segment_duration_sec,
-        }
-        for number in range(earliest_segment_number, earliest_segment_number + segment_count)
-    ]
+    return range(earliest_segment_number, live_segment_number)
 
 
-def generate_vod_segments(profile: dict, duration: int, timescale: int, start_number: int) -> List[Dict]:
+def generate_vod_segments(profile: dict, duration: int, timescale: int, start_number: int) -> range:
     """
     Generates VOD segments based on the segment duration and start number.
     This is used for static MPD manifests.
@@ -470,84 +879,17 @@ def generate_vod_segments(profile: dict, duration: int, timescale: int, start_nu
         start_number (int): The starting segment number.
 
     Returns:
-        List[Dict]: The list of generated VOD segments.
+        range: The numbers of the segments.
     """
     total_duration = profile.get("mediaPresentationDuration") or 0
     if isinstance(total_duration, str):
         total_duration = parse_duration(total_duration)
     segment_count = math.ceil(total_duration * timescale / duration)
 
-    return [{"number": start_number + i, "duration": duration / timescale} for i in range(segment_count)]
-
-
-def create_segment_data(segment: Dict, item: dict, profile: dict, source: str, timescale: Optional[int] = None) -> Dict:
-    """
-    Creates segment data based on the segment information. This includes the segment URL and metadata.
-
-    Args:
-        segment (Dict): The segment information.
-        item (dict): The segment template data.
-        profile (dict): The profile information.
-        source (str): The source URL.
-        timescale (int, optional): The timescale for the segments. Defaults to None.
-
-    Returns:
-        Dict: The created segment data.
-    """
-    media_template = item["@media"]
-    media = media_template.replace("$RepresentationID$", profile["id"])
-    media = media.replace("$Number%04d$", f"{segment['number']:04d}")
-    media = media.replace("$Number$", str(segment["number"]))
-    media = media.replace("$Bandwidth$", str(profile["bandwidth"]))
+    return range(start_number, start_number + segment_count)
 
-    if "time" in segment and timescale is not None:
-        media = media.replace("$Time$", str(int(segment["time"])))
 
-    if not media.startswith("http"):
-        media = f"{source}/{media}"
-
-    segment_data = {
-        "type": "segment",
-        "media": media,
-        "number": segment["number"],
-    }
-
-    # Add time and duration metadata for adaptive sequence calculation
-    if "time" in segment:
-        segment_data["time"] = segment["time"]
-    if "duration" in segment:
-        segment_data["duration_mpd_timescale"] = segment["duration"]
-
-    if "start_time" in segment and "end_time" in segment:
-        segment_data.update(
-            {
-                "start_time": segment["start_time"],
-                "end_time": segment["end_time"],
-                "extinf": (segment["end_time"] - segment["start_time"]).total_seconds(),
-                "program_date_time": segment["start_time"].isoformat() + "Z",
-            }
-        )
-    elif "start_time" in segment and "duration" in segment:
-        duration_seconds = segment["duration"] / timescale
-        segment_data.update(
-            {
-                "start_time": segment["start_time"],
-                "end_time": segment["start_time"] + timedelta(seconds=duration_seconds),
-                "extinf": duration_seconds,
-                "program_date_time": segment["start_time"].isoformat() + "Z",
-            }
-        )
-    elif "duration" in segment and timescale is not None:
-        # Convert duration from timescale units to seconds
-        segment_data["extinf"] = segment["duration"] / timescale
-    elif "duration" in segment:
-        # If no timescale is provided, assume duration is already in seconds
-        segment_data["extinf"] = segment["duration"]
-
-    return segment_data
-
-
-def parse_segment_base(representation: dict, profile: dict, source: str) -> List[Dict]:
+def parse_segment_base(representation: dict, profile: dict, source: str) -> SegmentSequence:
     """
     Parses segment base information and extracts segment data. This is used for single-segment representations.
 
@@ -556,7 +898,7 @@ def parse_segment_base(representation: dict, profile: dict, source: str) -> List
         source (str): The source URL.
 
     Returns:
-        List[Dict]: The list of parsed segments.
+        SegmentSequence: The single segment, spanning the whole presentation.
     """
     segment = representation["SegmentBase"]
     start, end = map(int, segment["@indexRange"].split("-"))
@@ -569,13 +911,18 @@ def parse_segment_base(representation: dict, profile: dict, source: str) -> List
     else:
         profile["initUrl"] = representation['BaseURL']
 
-    return [
-        {
-            "type": "segment",
-            "range": f"{start}-{end}",
-            "media": f"{source}/{representation['BaseURL']}",
-        }
-    ]
+    total_duration = profile.get("mediaPresentationDuration") or 0
+    if isinstance(total_duration, str):
+        total_duration = parse_duration(total_duration)
+
+    return SegmentSequence(
+        f"{source}/{representation['BaseURL']}",
+        1000,
+        array("q", [1]),
+        array("q", [0]),
+        array("q", [round(total_duration * 1000)]),
+        byte_range=f"{start}-{end}",
+    )
 
 
 def parse_duration(duration_str: str) -> float:
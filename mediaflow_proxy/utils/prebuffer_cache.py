@@ -0,0 +1,248 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Union
+
+import psutil
+
+from mediaflow_proxy.configs import settings
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("data", "group", "position")
+
+    def __init__(self, data: bytes, group: Optional[str], position: Optional[int]):
+        self.data = data
+        self.group = group
+        self.position = position
+
+
+class _Group:
+    __slots__ = ("size", "playheads", "floor")
+
+    def __init__(self):
+        self.size = 0
+        # Last requested position of each recent viewer and when, keyed by the viewer identity when known,
+        # otherwise by the position itself
+        self.playheads: Dict[Union[str, int], Tuple[int, float]] = {}
+        # Slowest active playhead, segments before it have been played by every viewer
+        self.floor: Optional[int] = None
+
+
+class PrebufferCache:
+    """
+    Byte-budgeted in-memory cache for pre-buffered segments, shared by the HLS and DASH pre-buffers.
+
+    Entries belong to a group (a playlist or manifest) and may carry their position in it (e.g. the media
+    sequence number). The footprint is accounted per entry as it is added or removed, both in total and per
+    group, and each group is limited to its own quota so that a single high bitrate stream cannot take over the
+    whole budget. When space is needed, segments behind the playhead of every recent viewer of their group are
+    evicted first, in LRU order, then the least recently used segments.
+
+    Host memory usage is sampled with psutil at most once per `sample_interval` seconds.
+    """
+
+    # Number of least recently used entries inspected when looking for a segment behind the playheads
+    EVICTION_SCAN_LIMIT = 64
+
+    def __init__(
+        self,
+        max_bytes: int,
+        group_max_bytes: int,
+        playhead_window: float = 30.0,
+        sample_interval: float = 1.0,
+    ):
+        """
+        Initializes the pre-buffer cache.
+
+        Args:
+            max_bytes (int): Maximum total size of the cached segments in bytes.
+            group_max_bytes (int): Maximum size of the cached segments of a single group in bytes.
+            playhead_window (float): Seconds a requested position counts as the playhead of an active viewer.
+            sample_interval (float): Minimum seconds between two samples of the host memory usage.
+        """
+        self.max_bytes = max_bytes
+        self.group_max_bytes = min(group_max_bytes, max_bytes)
+        self.playhead_window = playhead_window
+        self.sample_interval = sample_interval
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._groups: Dict[str, _Group] = {}
+        self.size = 0
+
+        self._memory_percent = 0.0
+        self._memory_sampled_at = float("-inf")
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evictions_behind_playhead = 0
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, url: str) -> Optional[bytes]:
+        """Returns the cached segment and marks it as recently used, or None if it is not cached."""
+        entry = self._entries.get(url)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(url)
+        return entry.data
+
+    def put(self, url: str, data: bytes, group: Optional[str] = None, position: Optional[int] = None) -> bool:
+        """
+        Adds a segment, evicting others as needed to stay within the group quota and the total budget.
+
+        Args:
+            url (str): URL of the segment.
+            data (bytes): Content of the segment.
+            group (str, optional): Playlist or manifest the segment belongs to.
+            position (int, optional): Position of the segment in its group, used for playhead-aware eviction.
+
+        Returns:
+            bool: Whether the segment was cached, segments larger than the group quota are not.
+        """
+        size = len(data)
+        if size > (self.group_max_bytes if group is not None else self.max_bytes):
+            return False
+
+        self.remove(url)
+        if group is not None:
+            group_state = self._groups.setdefault(group, _Group())
+            while group_state.size + size > self.group_max_bytes:
+                self._evict(group)
+        while self.size + size > self.max_bytes:
+            self._evict()
+
+        self._entries[url] = _Entry(data, group, position)
+        self._account(group, size)
+        return True
+
+    def remove(self, url: str) -> None:
+        """Removes a segment if cached."""
+        entry = self._entries.pop(url, None)
+        if entry is not None:
+            self._account(entry.group, -len(entry.data))
+
+    def remove_group(self, group: str) -> None:
+        """Removes every segment of a group along with its playheads."""
+        if self._groups.pop(group, None) is None:
+            return
+        for url in [url for url, entry in self._entries.items() if entry.group == group]:
+            self.size -= len(self._entries.pop(url).data)
+
+    def clear(self) -> None:
+        """Removes every segment."""
+        self._entries.clear()
+        self._groups.clear()
+        self.size = 0
+
+    def _account(self, group: Optional[str], delta: int) -> None:
+        self.size += delta
+        if group is not None:
+            self._groups[group].size += delta
+
+    def update_playhead(self, group: str, position: int, viewer_id: Optional[str] = None) -> None:
+        """
+        Records that a viewer requested the segment at `position` of `group`.
+
+        Args:
+            group (str): Playlist or manifest of the segment.
+            position (int): Position of the segment in its group.
+            viewer_id (str, optional): Identity of the viewer. Without it a request for the segment following a
+                recorded position is assumed to come from the same viewer.
+        """
+        group_state = self._groups.setdefault(group, _Group())
+        now = time.monotonic()
+        playheads = group_state.playheads
+        if viewer_id is not None:
+            playheads[viewer_id] = (position, now)
+        else:
+            # A viewer moving forward replaces its previous position
+            playheads.pop(position - 1, None)
+            playheads[position] = (position, now)
+        # Stale playheads are viewers that left
+        for stale in [key for key, (_, seen) in playheads.items() if now - seen > self.playhead_window]:
+            del playheads[stale]
+        group_state.floor = min(playhead for playhead, _ in playheads.values())
+
+    def _is_behind_playheads(self, entry: _Entry) -> bool:
+        if entry.group is None or entry.position is None:
+            return False
+        floor = self._groups[entry.group].floor
+        return floor is not None and entry.position < floor
+
+    def _evict(self, group: Optional[str] = None) -> None:
+        """Evicts one segment, from `group` only if given, preferring segments already played by every viewer."""
+        victim = None
+        for scanned, (url, entry) in enumerate(self._entries.items()):
+            if scanned >= self.EVICTION_SCAN_LIMIT:
+                break
+            if group is not None and entry.group != group:
+                continue
+            if self._is_behind_playheads(entry):
+                victim = url
+                self.evictions_behind_playhead += 1
+                break
+            if victim is None:
+                victim = url
+        if victim is None:
+            # Fall back to the least recently used segment, of the group if given
+            victim = next(url for url, entry in self._entries.items() if group is None or entry.group == group)
+        self.remove(victim)
+        self.evictions += 1
+
+    def memory_percent(self) -> float:
+        """Returns the host memory usage percentage, sampled at most once per `sample_interval` seconds."""
+        now = time.monotonic()
+        if now - self._memory_sampled_at >= self.sample_interval:
+            self._memory_sampled_at = now
+            try:
+                self._memory_percent = psutil.virtual_memory().percent
+            except Exception as e:
+                logger.warning(f"Failed to get memory usage: {e}")
+                self._memory_percent = 0.0
+        return self._memory_percent
+
+    def shrink(self, fraction: float = 0.5) -> int:
+        """
+        Evicts segments until the cache is reduced by `fraction` of its current size, used under memory pressure.
+
+        Returns:
+            int: The number of evicted segments.
+        """
+        target = self.size * (1 - fraction)
+        evicted = 0
+        while self._entries and self.size > target:
+            self._evict()
+            evicted += 1
+        return evicted
+
+    def get_stats(self) -> dict:
+        """Returns the cache footprint and hit, miss and eviction counters."""
+        return {
+            "size": self.size,
+            "max_bytes": self.max_bytes,
+            "entries": len(self._entries),
+            "groups": len(self._groups),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "evictions_behind_playhead": self.evictions_behind_playhead,
+        }
+
+
+# Shared by the HLS and DASH pre-buffers
+prebuffer_cache = PrebufferCache(
+    max_bytes=settings.prebuffer_cache_max_bytes,
+    group_max_bytes=settings.prebuffer_playlist_max_bytes,
+    sample_interval=settings.prebuffer_memory_sample_interval,
+)
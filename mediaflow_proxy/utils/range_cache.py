@@ -0,0 +1,665 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import AsyncGenerator, Iterable, Optional, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from mediaflow_proxy.configs import settings
+from mediaflow_proxy.const import SUPPORTED_RESPONSE_HEADERS
+from mediaflow_proxy.utils.http_utils import DownloadError, Streamer, get_http_client
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Upstream response headers stored with a resource, the others depend on the requested range
+_STORED_HEADERS = tuple(
+    header
+    for header in SUPPORTED_RESPONSE_HEADERS
+    if header not in ("content-length", "content-range", "connection", "transfer-encoding")
+)
+# Request headers identifying the user, whose responses are only shared between requests with the same values
+_CREDENTIAL_HEADERS = ("authorization", "cookie")
+_RANGE_HEADER = re.compile(r"^bytes=(\d*)-(\d*)$")
+_DATA_NAME = re.compile(r"^([0-9a-f]{32})\.([0-9a-f]{16})\.data$")
+
+
+class RangeSet:
+    """Sorted, non-overlapping and non-adjacent half-open byte ranges."""
+
+    __slots__ = ("ranges",)
+
+    def __init__(self, ranges: Iterable[Iterable[int]] = ()):
+        self.ranges: list[tuple[int, int]] = []
+        for start, end in ranges:
+            self.add(start, end)
+
+    def add(self, start: int, end: int) -> None:
+        """Adds the range [start, end), merging it with the overlapping and adjacent ones."""
+        if start >= end:
+            return
+        merged = []
+        placed = False
+        for range_start, range_end in self.ranges:
+            if range_end < start:
+                merged.append((range_start, range_end))
+            elif range_start > end:
+                if not placed:
+                    merged.append((start, end))
+                    placed = True
+                merged.append((range_start, range_end))
+            else:
+                start = min(start, range_start)
+                end = max(end, range_end)
+        if not placed:
+            merged.append((start, end))
+        self.ranges = merged
+
+    def next_piece(self, start: int, end: int) -> tuple[int, bool]:
+        """
+        Returns where the piece of [start, end) beginning at `start` ends, and whether it is covered by the set.
+        """
+        for range_start, range_end in self.ranges:
+            if range_end <= start:
+                continue
+            if range_start <= start:
+                return min(range_end, end), True
+            return min(range_start, end), False
+        return end, False
+
+    @property
+    def size(self) -> int:
+        return sum(end - start for start, end in self.ranges)
+
+
+class _Resource:
+    __slots__ = ("key", "id", "url", "size", "validator", "headers", "ranges", "verified_at", "meta_mtime", "unsaved")
+
+    def __init__(self, key: str, resource_id: str, url: str, size: int, validator: str, headers: dict):
+        self.key = key
+        self.id = resource_id
+        self.url = url
+        self.size = size
+        self.validator = validator
+        self.headers = headers
+        self.ranges = RangeSet()
+        self.verified_at = 0.0
+        # Modification time of the metadata file as last read or written by this process
+        self.meta_mtime = 0
+        # Bytes written to the data file and not yet recorded in the metadata file
+        self.unsaved = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "url": self.url,
+            "size": self.size,
+            "validator": self.validator,
+            "headers": self.headers,
+            "ranges": self.ranges.ranges,
+            "verified_at": self.verified_at,
+        }
+
+    @classmethod
+    def from_dict(cls, key: str, data: dict) -> "_Resource":
+        resource = cls(key, data["id"], data["url"], data["size"], data["validator"], data["headers"])
+        resource.ranges = RangeSet(data["ranges"])
+        resource.verified_at = data["verified_at"]
+        return resource
+
+
+class RangeCache:
+    """
+    Read-through disk cache of the byte ranges of files proxied by `/proxy/stream`.
+
+    Each upstream resource is stored in a sparse data file holding only the byte ranges fetched so far, along with a
+    metadata file recording those ranges, the size and validator (ETag or Last-Modified) of the resource and the
+    response headers to replay. Resources are keyed by their URL without the query parameters that change between
+    requests for the same file (signatures, expiry, tokens), and by the credentials sent in request headers, so
+    that data fetched for one user is never served to another. A response whose size or validator differs from the
+    stored ones replaces the resource.
+
+    Requests for a resource validated in the last `revalidate_interval` seconds are answered from the cache: cached
+    pieces of the requested range are read from disk, and the missing ones are fetched from the origin with range
+    requests and written to disk on the way. Otherwise the request goes to the origin and its response is written
+    to disk as it is streamed. Disk I/O and the directory lock are only used from the executor, never from the
+    event loop.
+
+    Data files are named after a unique id of the resource they belong to, so that a file removed by eviction, or
+    replaced because the upstream resource changed, is never read with the ranges of another. Several processes can
+    share the directory: metadata updates are serialised with POSIX record locks and merged, and the disk budget is
+    enforced by dropping the least recently used resources.
+    """
+
+    READ_SIZE = 1024 * 1024
+    WRITE_SIZE = 1024 * 1024
+    # Bytes written to a resource after which its metadata is saved even though the transfer is still running
+    SAVE_INTERVAL_BYTES = 16 * 1024 * 1024
+    # Minimum seconds between two updates of the last access time of a resource
+    TOUCH_INTERVAL = 30
+    # Minimum seconds between two scans of the directory for the disk budget, unless enough data was written
+    BUDGET_SCAN_INTERVAL = 60
+    # Seconds after which a data file no longer referenced by any metadata file is removed
+    ORPHAN_TTL = 600
+    MAX_RESOURCES_IN_MEMORY = 1024
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        max_size: int,
+        revalidate_interval: float,
+        ignored_params: Iterable[str] = (),
+        executor: Optional[Executor] = None,
+    ):
+        """
+        Initializes the range cache.
+
+        Args:
+            directory (str | Path): Directory holding the data and metadata files.
+            max_size (int): Maximum disk space in bytes used by the data files together.
+            revalidate_interval (float): Seconds a validated resource is served without contacting the origin.
+            ignored_params (Iterable[str]): Query parameters left out of the resource keys, case-insensitive.
+            executor (Executor, optional): Executor running the disk I/O, defaults to the loop's.
+        """
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.revalidate_interval = revalidate_interval
+        self.ignored_params = {param.lower() for param in ignored_params}
+        self.executor = executor
+
+        self._resources: OrderedDict[str, _Resource] = OrderedDict()
+        self._touched_at: dict[str, float] = {}
+        self._lock = threading.RLock()
+        self._written_since_scan = 0
+        self._scanned_at = 0.0
+
+        # Metrics
+        self.hits = 0
+        self.bytes_from_disk = 0
+        self.bytes_from_origin = 0
+        self.evictions = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_fd = os.open(self.directory / "cache.lock", os.O_RDWR | os.O_CREAT, 0o600)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """Holds the lock of the directory shared by every process, along with the lock of this process."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_UN)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def resource_key(self, url: str, request_headers: dict) -> str:
+        """
+        Returns the key of the resource at `url` as requested with `request_headers`, ignoring the volatile query
+        parameters.
+        """
+        parts = urlsplit(url)
+        query = sorted(
+            (name, value)
+            for name, value in parse_qsl(parts.query, keep_blank_values=True)
+            if name.lower() not in self.ignored_params
+        )
+        normalized = urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ""))
+        credentials = [(header, request_headers[header]) for header in _CREDENTIAL_HEADERS if header in request_headers]
+        if credentials:
+            normalized += "\n" + json.dumps(credentials)
+        return hashlib.sha256(normalized.encode()).hexdigest()[:32]
+
+    def _meta_path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _data_path(self, resource: _Resource) -> Path:
+        return self.directory / f"{resource.key}.{resource.id}.data"
+
+    def _read_meta(self, key: str) -> Optional[tuple[dict, int]]:
+        try:
+            with open(self._meta_path(key), "rb") as file:
+                mtime = os.fstat(file.fileno()).st_mtime_ns
+                return json.loads(file.read()), mtime
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, resource: _Resource) -> None:
+        """Atomically replaces the metadata file of a resource, the file lock must be held."""
+        path = self._meta_path(resource.key)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as file:
+            json.dump(resource.to_dict(), file, separators=(",", ":"))
+        os.replace(tmp_path, path)
+        resource.meta_mtime = os.stat(path).st_mtime_ns
+        resource.unsaved = 0
+
+    def _remember(self, resource: _Resource) -> None:
+        self._resources[resource.key] = resource
+        self._resources.move_to_end(resource.key)
+        while len(self._resources) > self.MAX_RESOURCES_IN_MEMORY:
+            key, _ = self._resources.popitem(last=False)
+            self._touched_at.pop(key, None)
+
+    def _forget(self, key: str) -> None:
+        self._resources.pop(key, None)
+        self._touched_at.pop(key, None)
+
+    def _load(self, key: str) -> Optional[_Resource]:
+        """Returns the resource as known to this process, reloading its metadata if another process changed it."""
+        with self._lock:
+            resource = self._resources.get(key)
+            try:
+                mtime = os.stat(self._meta_path(key)).st_mtime_ns
+            except OSError:
+                # Evicted or invalidated, possibly by another process
+                self._forget(key)
+                return None
+            if resource is not None and resource.meta_mtime == mtime:
+                self._resources.move_to_end(key)
+                return resource
+
+            meta = self._read_meta(key)
+            if meta is None:
+                self._forget(key)
+                return None
+            data, mtime = meta
+            loaded = _Resource.from_dict(key, data)
+            loaded.meta_mtime = mtime
+            if resource is not None and resource.id == loaded.id:
+                # Keep the ranges written by this process and not saved yet
+                for start, end in resource.ranges.ranges:
+                    loaded.ranges.add(start, end)
+                loaded.unsaved = resource.unsaved
+            self._remember(loaded)
+            return loaded
+
+    def _touch(self, resource: _Resource) -> None:
+        """Records an access to a resource for the LRU eviction, at most once per `TOUCH_INTERVAL` seconds."""
+        now = time.time()
+        if now - self._touched_at.get(resource.key, 0) < self.TOUCH_INTERVAL:
+            return
+        self._touched_at[resource.key] = now
+        try:
+            os.utime(self._meta_path(resource.key))
+            resource.meta_mtime = os.stat(self._meta_path(resource.key)).st_mtime_ns
+        except OSError:
+            pass
+
+    def lookup(self, url: str, request_headers: dict) -> Optional[_Resource]:
+        """Returns the resource at `url` if it was validated against the origin recently enough to be served."""
+        resource = self._load(self.resource_key(url, request_headers))
+        if resource is None or time.time() - resource.verified_at > self.revalidate_interval:
+            return None
+        self._touch(resource)
+        return resource
+
+    def _validate(self, key: str, url: str, size: int, validator: str, headers: dict) -> _Resource:
+        with self._file_lock():
+            meta = self._read_meta(key)
+            if meta is not None and meta[0]["size"] == size and meta[0]["validator"] == validator:
+                resource = self._load(key)
+                if resource is not None:
+                    resource.url = url
+                    resource.headers = headers
+                    resource.verified_at = time.time()
+                    self._write_meta(resource)
+                    return resource
+
+            # New or changed resource, the data of a previous version is dropped with its id
+            resource = _Resource(key, secrets.token_hex(8), url, size, validator, headers)
+            resource.verified_at = time.time()
+            self._write_meta(resource)
+            self._remember(resource)
+            if meta is not None:
+                self._remove_data(key, meta[0]["id"])
+            return resource
+
+    async def validate(self, url: str, streamer: Streamer) -> Optional[_Resource]:
+        """
+        Records that the origin served the resource at `url` with the open response of `streamer`, replacing the
+        cached data if the resource changed.
+
+        Returns:
+            The resource, or None if the response cannot be cached, i.e. it has no validator or known size, or the
+            origin does not support ranges.
+        """
+        response = streamer.response
+        streamer.parse_content_range()
+        etag = response.headers.get("ETag")
+        validator = etag if etag and not etag.startswith("W/") else response.headers.get("Last-Modified")
+        if not validator or streamer.total_size <= 0 or response.status_code not in (200, 206):
+            return None
+        if not streamer.is_resumable():
+            return None
+        headers = {header: response.headers[header] for header in _STORED_HEADERS if header in response.headers}
+        key = self.resource_key(url, streamer.request_headers or {})
+        try:
+            return await self._run(self._validate, key, url, streamer.total_size, validator, headers)
+        except OSError as e:
+            logger.error(f"Error updating range cache {self.directory}: {e}")
+            return None
+
+    def _invalidate(self, resource: _Resource) -> None:
+        with self._file_lock():
+            meta = self._read_meta(resource.key)
+            if meta is not None and meta[0]["id"] == resource.id:
+                self._remove_resource(resource.key, resource.id)
+            self._forget(resource.key)
+
+    async def invalidate(self, resource: _Resource) -> None:
+        """Drops a resource whose upstream version changed."""
+        await self._run(self._invalidate, resource)
+
+    def _remove_data(self, key: str, resource_id: str) -> None:
+        try:
+            os.remove(self.directory / f"{key}.{resource_id}.data")
+        except FileNotFoundError:
+            pass
+
+    def _remove_resource(self, key: str, resource_id: str) -> None:
+        """Removes the metadata then the data of a resource, the file lock must be held."""
+        try:
+            os.remove(self._meta_path(key))
+        except FileNotFoundError:
+            pass
+        self._remove_data(key, resource_id)
+
+    def _write(self, resource: _Resource, fd: int, offset: int, data: bytes, final: bool = False) -> bool:
+        """
+        Writes data at `offset` of the data file of a resource, and records the range once it is on disk.
+
+        The metadata is saved every `SAVE_INTERVAL_BYTES` and on the `final` write.
+
+        Returns:
+            bool: Whether the resource is still cached, False once it was evicted or replaced.
+        """
+        view = memoryview(data)
+        position = offset
+        while view:
+            written = os.pwrite(fd, view, position)
+            view = view[written:]
+            position += written
+        if os.fstat(fd).st_nlink == 0:
+            return False
+        with self._lock:
+            resource.ranges.add(offset, offset + len(data))
+            resource.unsaved += len(data)
+            self._written_since_scan += len(data)
+            save = resource.unsaved >= self.SAVE_INTERVAL_BYTES or (final and resource.unsaved > 0)
+        if not save:
+            return True
+        if not self._save(resource, fd):
+            return False
+
+        now = time.monotonic()
+        if self._written_since_scan >= self.max_size // 64 or now - self._scanned_at >= self.BUDGET_SCAN_INTERVAL:
+            self._enforce_budget()
+        return True
+
+    def _finish_write(self, resource: _Resource, fd: int, offset: int, data: bytes) -> None:
+        """Writes the last data of a transfer to the data file of a resource and closes the file."""
+        try:
+            self._write(resource, fd, offset, data, final=True)
+        except OSError as e:
+            logger.error(f"Error writing range cache file of {resource.url}: {e}")
+        finally:
+            os.close(fd)
+
+    def _save(self, resource: _Resource, fd: int) -> bool:
+        """
+        Merges the ranges written by this process into the metadata file of a resource.
+
+        Returns:
+            bool: Whether the resource is still cached, False once it was evicted or replaced.
+        """
+        with self._file_lock():
+            meta = self._read_meta(resource.key)
+            if meta is None or meta[0]["id"] != resource.id or os.fstat(fd).st_nlink == 0:
+                self._forget(resource.key)
+                return False
+            for start, end in meta[0]["ranges"]:
+                resource.ranges.add(start, end)
+            resource.verified_at = max(resource.verified_at, meta[0]["verified_at"])
+            self._write_meta(resource)
+        return True
+
+    def _enforce_budget(self) -> None:
+        """Removes the least recently used resources until the data files fit in the disk budget."""
+        with self._file_lock():
+            self._written_since_scan = 0
+            self._scanned_at = time.monotonic()
+            resources = {}
+            data_files = []
+            for entry in os.scandir(self.directory):
+                name = entry.name
+                try:
+                    if name.endswith(".json"):
+                        resources[name[:-5]] = entry.stat().st_mtime
+                    elif _DATA_NAME.match(name):
+                        stat = entry.stat()
+                        data_files.append((name, stat.st_blocks * 512, stat.st_mtime))
+                except FileNotFoundError:
+                    continue
+
+            usage = {}
+            now = time.time()
+            for name, allocated, mtime in data_files:
+                key, resource_id = _DATA_NAME.match(name).groups()
+                meta = self._read_meta(key) if key in resources else None
+                if meta is None or meta[0]["id"] != resource_id:
+                    if now - mtime > self.ORPHAN_TTL:
+                        self._remove_data(key, resource_id)
+                    continue
+                usage[key] = (resource_id, allocated)
+
+            total = sum(allocated for _, allocated in usage.values())
+            for key in sorted(usage, key=lambda k: resources[k]):
+                if total <= self.max_size:
+                    break
+                resource_id, allocated = usage[key]
+                self._remove_resource(key, resource_id)
+                self._forget(key)
+                total -= allocated
+                self.evictions += 1
+
+    async def read(self, resource: _Resource, start: int, end: int) -> AsyncGenerator[bytes, None]:
+        """
+        Yields the cached bytes [start, end) of a resource.
+
+        Raises:
+            FileNotFoundError: If the data file was removed before it could be opened.
+        """
+        fd = await self._run(os.open, self._data_path(resource), os.O_RDONLY)
+        try:
+            position = start
+            while position < end:
+                chunk = await self._run(os.pread, fd, min(self.READ_SIZE, end - position), position)
+                if not chunk:
+                    raise DownloadError(502, f"Cached data of {resource.url} is truncated at byte {position}")
+                position += len(chunk)
+                self.bytes_from_disk += len(chunk)
+                yield chunk
+        finally:
+            os.close(fd)
+
+    async def write(
+        self, resource: _Resource, offset: int, content: AsyncGenerator[bytes, None], streamer: Streamer
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        Yields `content`, the body of the resource from `offset` as produced by `streamer`, writing it to the data
+        file of the resource on the way.
+
+        Writing stops once the resource is evicted or replaced, or if the streamer altered the body.
+        """
+        try:
+            fd = await self._run(os.open, self._data_path(resource), os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError as e:
+            logger.error(f"Error opening range cache file of {resource.url}: {e}")
+            fd = None
+
+        buffer = []
+        buffered = 0
+        try:
+            async for chunk in content:
+                if fd is not None and streamer.stripped_bytes:
+                    # The body no longer matches the upstream offsets
+                    buffer.clear()
+                    os.close(fd)
+                    fd = None
+                if fd is not None:
+                    buffer.append(chunk)
+                    buffered += len(chunk)
+                    if buffered >= self.WRITE_SIZE:
+                        data = b"".join(buffer)
+                        buffer.clear()
+                        buffered = 0
+                        try:
+                            cached = await self._run(self._write, resource, fd, offset, data)
+                        except OSError as e:
+                            logger.error(f"Error writing range cache file of {resource.url}: {e}")
+                            cached = False
+                        if not cached:
+                            os.close(fd)
+                            fd = None
+                        offset += len(data)
+                self.bytes_from_origin += len(chunk)
+                yield chunk
+        finally:
+            if fd is not None:
+                # Shielded as the response may be cancelled, the write then completes in the executor on its own
+                await asyncio.shield(self._run(self._finish_write, resource, fd, offset, b"".join(buffer)))
+
+    async def fetch(
+        self, resource: _Resource, url: str, start: int, end: int, request_headers: dict
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        Yields the bytes [start, end) of a resource fetched from the origin with a range request, caching them.
+
+        Raises:
+            DownloadError: If the origin no longer serves the same version of the resource.
+        """
+        headers = {k: v for k, v in request_headers.items() if k not in ("range", "if-range")}
+        headers["range"] = f"bytes={start}-{end - 1}"
+        headers["if-range"] = resource.validator
+        streamer = Streamer(get_http_client())
+        try:
+            await streamer.create_streaming_response(url, headers)
+            content_range = streamer.response.headers.get("Content-Range", "")
+            if streamer.response.status_code != 206 or not content_range.startswith(f"bytes {start}-"):
+                await self.invalidate(resource)
+                raise DownloadError(502, f"Upstream resource changed while serving cached ranges of {url}")
+            async for chunk in self.write(resource, start, streamer.stream_content_parallel(), streamer):
+                yield chunk
+        finally:
+            await streamer.close()
+
+    async def serve(self, url: str, request_headers: dict) -> Optional[tuple[int, dict, AsyncGenerator[bytes, None]]]:
+        """
+        Answers a request for the resource at `url` from the cache, if it was validated recently enough.
+
+        Args:
+            url (str): URL of the upstream resource.
+            request_headers (dict): Headers of the request to the origin, including the client range if any.
+
+        Returns:
+            The status code, headers and body of the response, or None if the request must go to the origin, e.g.
+            for an unknown resource, a multi-range or unsatisfiable request, or a mismatching `If-Range`.
+        """
+        try:
+            resource = await self._run(self.lookup, url, request_headers)
+        except OSError as e:
+            logger.error(f"Error reading range cache {self.directory}: {e}")
+            return None
+        if resource is None:
+            return None
+        if_range = request_headers.get("if-range")
+        if if_range and if_range != resource.validator:
+            return None
+
+        range_header = request_headers.get("range")
+        if range_header:
+            match = _RANGE_HEADER.match(range_header.strip().replace(" ", ""))
+            if match is None or match.group(1) == match.group(2) == "":
+                return None
+            first, last = match.groups()
+            if first:
+                start = int(first)
+                end = min(int(last) + 1, resource.size) if last else resource.size
+            else:
+                start = max(resource.size - int(last), 0)
+                end = resource.size
+            if start >= end:
+                return None
+            status_code = 206
+        else:
+            start, end = 0, resource.size
+            status_code = 200
+
+        headers = dict(resource.headers)
+        headers["accept-ranges"] = "bytes"
+        headers["content-length"] = str(end - start)
+        if status_code == 206:
+            headers["content-range"] = f"bytes {start}-{end - 1}/{resource.size}"
+        self.hits += 1
+        return status_code, headers, self._iter_range(resource, url, start, end, request_headers)
+
+    async def _iter_range(
+        self, resource: _Resource, url: str, start: int, end: int, request_headers: dict
+    ) -> AsyncGenerator[bytes, None]:
+        position = start
+        while position < end:
+            # RangeSet.add replaces its list of ranges, so it is read without waiting for the lock held by writers
+            piece_end, cached = resource.ranges.next_piece(position, end)
+            if cached:
+                try:
+                    async for chunk in self.read(resource, position, piece_end):
+                        yield chunk
+                except FileNotFoundError:
+                    # Evicted meanwhile, the piece is fetched from the origin instead
+                    cached = False
+            if not cached:
+                async for chunk in self.fetch(resource, url, position, piece_end, request_headers):
+                    yield chunk
+            position = piece_end
+
+    def get_stats(self) -> dict:
+        """Returns the number of requests answered from the cache and the bytes served from disk and origin."""
+        return {
+            "hits": self.hits,
+            "bytes_from_disk": self.bytes_from_disk,
+            "bytes_from_origin": self.bytes_from_origin,
+            "evictions": self.evictions,
+            "resources_in_memory": len(self._resources),
+        }
+
+
+stream_range_cache = (
+    RangeCache(
+        Path(tempfile.gettempdir()) / "stream_range_cache",
+        max_size=settings.stream_range_cache_max_size,
+        revalidate_interval=settings.stream_range_cache_revalidate_interval,
+        ignored_params=settings.stream_range_cache_ignored_params,
+    )
+    if settings.stream_range_cache_max_size > 0
+    else None
+)
@@ -0,0 +1,401 @@
+import asyncio
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import NamedTuple, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_SLAB_MAGIC = b"MFSLAB01"
+_SLAB_HEADER = struct.Struct(">8sQ")  # magic, end of the last committed record
+_SLAB_HEADER_SIZE = 64
+_RECORD = struct.Struct(">IHId")  # crc32 of the rest of the header and key, key length, data length, expiry
+_SLAB_NAME = re.compile(r"^(\d{8})\.slab$")
+_LEGACY_NAME = re.compile(r"^[0-9a-f]{32}(\.tmp)?$")
+_GENERATION = struct.Struct(">Q")
+
+
+class SlabEntry(NamedTuple):
+    """A value read from the store, `data` is a view on the memory-mapped slab."""
+
+    data: memoryview
+    expires_at: float
+
+
+class _Slab:
+    __slots__ = ("id", "path", "size", "mmap", "view", "scanned")
+
+    def __init__(self, slab_id: int, path: Path, mapped: mmap.mmap):
+        self.id = slab_id
+        self.path = path
+        self.size = len(mapped)
+        self.mmap = mapped
+        self.view = memoryview(mapped)
+        self.scanned = _SLAB_HEADER_SIZE  # Offset up to which records have been indexed
+
+    @property
+    def end(self) -> int:
+        return _SLAB_HEADER.unpack_from(self.mmap, 0)[1]
+
+
+class _IndexEntry:
+    __slots__ = ("slab_id", "offset", "length", "expires_at", "last_access")
+
+    def __init__(self, slab_id: int, offset: int, length: int, expires_at: float):
+        self.slab_id = slab_id
+        self.offset = offset
+        self.length = length
+        self.expires_at = expires_at
+        self.last_access = time.time()
+
+
+class SlabStore:
+    """
+    Log-structured on-disk store for cache values.
+
+    Values are appended to large preallocated slab files which are memory-mapped, so reads are served as
+    views on the mapping without copying. An in-memory index maps each key to the location and expiry of its
+    latest record. Only the newest slab is written to; when it is full a new one is started and, to stay within
+    the byte budget, the slab holding the least recently used data is dropped as a whole. Slabs in which most
+    records are stale (overwritten, deleted or expired) are compacted by moving their live records forward, in
+    the background after the write that started a new slab.
+
+    Several processes (e.g. gunicorn workers) can share a directory: writes are serialised with POSIX record
+    locks, other processes pick up new records on their next miss, and a generation counter bumped whenever a
+    slab is removed makes them rebuild their index. The index is rebuilt on startup by walking record headers.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        max_size: int,
+        slab_size: int = 64 * 1024 * 1024,
+        executor: Optional[Executor] = None,
+    ):
+        """
+        Initializes the slab store.
+
+        Args:
+            directory (str | Path): Directory holding the slab files.
+            max_size (int): Maximum size in bytes of all slab files together.
+            slab_size (int): Size in bytes of each slab file, capped to a quarter of `max_size`. Defaults to 64 MiB.
+            executor (Executor, optional): Executor running disk writes and index refreshes, defaults to the loop's.
+        """
+        self.directory = Path(directory)
+        self.slab_size = max(1024 * 1024, min(slab_size, max_size // 4))
+        self.max_slabs = max(2, max_size // self.slab_size)
+        self.executor = executor
+
+        self._index: OrderedDict[str, _IndexEntry] = OrderedDict()
+        self._slabs: dict[int, _Slab] = {}
+        self._generation = -1
+        self._lock = threading.RLock()
+        # Set when a new slab was started, the compaction then runs after the write that started it
+        self._compaction_due = False
+        self._compaction: Optional[asyncio.Task] = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_fd = os.open(self.directory / "store.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        with self._file_lock(exclusive=True):
+            self._remove_legacy_files()
+            self._refresh_locked()
+
+    def _file_lock(self, exclusive: bool):
+        return _FileLock(self._lock_fd, exclusive)
+
+    def _remove_legacy_files(self) -> None:
+        """Removes the one file per key entries written by previous versions."""
+        for name in os.listdir(self.directory):
+            if _LEGACY_NAME.match(name):
+                try:
+                    os.remove(self.directory / name)
+                except OSError:
+                    pass
+
+    def _read_generation(self) -> int:
+        os.lseek(self._lock_fd, 0, os.SEEK_SET)
+        data = os.read(self._lock_fd, _GENERATION.size)
+        return _GENERATION.unpack(data)[0] if len(data) == _GENERATION.size else 0
+
+    def _bump_generation(self) -> None:
+        self._generation = self._read_generation() + 1
+        os.lseek(self._lock_fd, 0, os.SEEK_SET)
+        os.write(self._lock_fd, _GENERATION.pack(self._generation))
+
+    def _open_slab(self, slab_id: int, create: bool = False) -> _Slab:
+        path = self.directory / f"{slab_id:08d}.slab"
+        fd = os.open(path, os.O_RDWR | (os.O_CREAT | os.O_EXCL if create else 0), 0o600)
+        try:
+            if create:
+                try:
+                    # Reserve the blocks up front so that running out of disk fails here rather than on a write
+                    if hasattr(os, "posix_fallocate"):
+                        os.posix_fallocate(fd, 0, self.slab_size)
+                    else:
+                        os.ftruncate(fd, self.slab_size)
+                except OSError:
+                    os.close(fd)
+                    fd = None
+                    os.remove(path)
+                    raise
+                os.write(fd, _SLAB_HEADER.pack(_SLAB_MAGIC, _SLAB_HEADER_SIZE))
+            mapped = mmap.mmap(fd, 0)
+        finally:
+            if fd is not None:
+                os.close(fd)
+        if mapped[: len(_SLAB_MAGIC)] != _SLAB_MAGIC:
+            mapped.close()
+            raise ValueError(f"Invalid slab file {path}")
+        return _Slab(slab_id, path, mapped)
+
+    def _refresh_locked(self) -> None:
+        """Brings the index up to date with the records written by other processes. Requires the file lock."""
+        generation = self._read_generation()
+        if generation != self._generation:
+            # Slabs were removed elsewhere, start over
+            self._index.clear()
+            self._slabs.clear()
+            self._generation = generation
+
+        slab_ids = sorted(int(m.group(1)) for m in map(_SLAB_NAME.match, os.listdir(self.directory)) if m)
+        for slab_id in slab_ids:
+            slab = self._slabs.get(slab_id)
+            if slab is None:
+                try:
+                    slab = self._slabs[slab_id] = self._open_slab(slab_id)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Skipping slab {slab_id} in {self.directory}: {e}")
+                    continue
+            self._scan(slab)
+
+    def _scan(self, slab: _Slab) -> None:
+        """Indexes the records committed to a slab since it was last scanned."""
+        mapped, end, position = slab.mmap, slab.end, slab.scanned
+        while position + _RECORD.size <= end:
+            crc, key_length, data_length, expires_at = _RECORD.unpack_from(mapped, position)
+            key_start = position + _RECORD.size
+            if zlib.crc32(mapped[position + 4 : key_start + key_length]) != crc:
+                logger.warning(f"Corrupted record in {slab.path} at offset {position}, ignoring the rest of the slab")
+                position = end
+                break
+            key = mapped[key_start : key_start + key_length].decode()
+            self._apply(key, slab.id, key_start + key_length, data_length, expires_at)
+            position = key_start + key_length + data_length
+        slab.scanned = position
+
+    def _apply(self, key: str, slab_id: int, offset: int, length: int, expires_at: float) -> None:
+        self._index.pop(key, None)
+        if expires_at:  # 0 marks a deletion
+            self._index[key] = _IndexEntry(slab_id, offset, length, expires_at)
+
+    def _append(self, key: bytes, data, expires_at: float) -> bool:
+        """Appends a record to the newest slab, starting a new slab if needed. Requires the file lock."""
+        record_size = _RECORD.size + len(key) + len(data)
+        if record_size > self.slab_size - _SLAB_HEADER_SIZE:
+            return False
+
+        slab = self._slabs[max(self._slabs)] if self._slabs else None
+        if slab is None or slab.size - slab.end < record_size:
+            slab = self._new_slab()
+
+        position = slab.end
+        header_tail = _RECORD.pack(0, len(key), len(data), expires_at)[4:] + key
+        _RECORD.pack_into(slab.mmap, position, zlib.crc32(header_tail), len(key), len(data), expires_at)
+        key_start = position + _RECORD.size
+        slab.mmap[key_start : key_start + len(key)] = key
+        data_start = key_start + len(key)
+        slab.mmap[data_start : data_start + len(data)] = data
+        # Commit point, readers ignore anything past the end recorded in the header
+        _SLAB_HEADER.pack_into(slab.mmap, 0, _SLAB_MAGIC, data_start + len(data))
+        self._scan(slab)
+        return True
+
+    def _new_slab(self) -> _Slab:
+        while len(self._slabs) >= self.max_slabs:
+            self._evict_slab()
+        slab_id = max(self._slabs, default=-1) + 1
+        slab = self._slabs[slab_id] = self._open_slab(slab_id, create=True)
+        self._compaction_due = True
+        return slab
+
+    def _evict_slab(self) -> None:
+        """Removes the slab whose most recently used record is the oldest, the oldest slab on ties."""
+        recency = dict.fromkeys(self._slabs, 0.0)
+        for entry in self._index.values():
+            recency[entry.slab_id] = max(recency[entry.slab_id], entry.last_access)
+        self._remove_slab(min(recency, key=lambda slab_id: (recency[slab_id], slab_id)))
+
+    def _remove_slab(self, slab_id: int) -> None:
+        slab = self._slabs.pop(slab_id)
+        for key in [key for key, entry in self._index.items() if entry.slab_id == slab_id]:
+            del self._index[key]
+        try:
+            os.remove(slab.path)
+        except OSError:
+            pass
+        # The mapping stays valid for views still held by readers and is released with the last of them
+        self._bump_generation()
+
+    def _compact(self) -> None:
+        """
+        Moves the live records of the most fragmented older slab into the newest one when less than half of
+        the older slab is still live, then removes it.
+        """
+        with self._lock, self._file_lock(exclusive=True):
+            self._refresh_locked()
+            self._compact_locked()
+
+    def _compact_locked(self) -> None:
+        newest = self._slabs[max(self._slabs)]
+        candidates = [slab_id for slab_id in self._slabs if slab_id != newest.id]
+        if not candidates:
+            return
+
+        now = time.time()
+        live_bytes = dict.fromkeys(candidates, 0)
+        for entry in self._index.values():
+            if entry.slab_id in live_bytes and entry.expires_at > now:
+                live_bytes[entry.slab_id] += _RECORD.size + 32 + entry.length
+        slab_id = min(candidates, key=lambda i: live_bytes[i] / self._slabs[i].size)
+        if live_bytes[slab_id] * 2 > self._slabs[slab_id].size:
+            return
+        if newest.end + live_bytes[slab_id] > newest.size:
+            return
+
+        victim = self._slabs[slab_id]
+        moved = [
+            (key, entry) for key, entry in self._index.items() if entry.slab_id == slab_id and entry.expires_at > now
+        ]
+        for key, entry in moved:
+            self._append(key.encode(), victim.view[entry.offset : entry.offset + entry.length], entry.expires_at)
+            self._index[key].last_access = entry.last_access
+        logger.debug(f"Compacted slab {slab_id} of {self.directory}, moved {len(moved)} records")
+        self._remove_slab(slab_id)
+
+    def _get_locked(self, key: str) -> Optional[SlabEntry]:
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        now = time.time()
+        if entry.expires_at <= now:
+            del self._index[key]
+            return None
+        slab = self._slabs.get(entry.slab_id)
+        if slab is None:
+            return None
+        entry.last_access = now
+        self._index.move_to_end(key)
+        return SlabEntry(slab.view[entry.offset : entry.offset + entry.length], entry.expires_at)
+
+    def _refresh_and_get(self, key: str) -> Optional[SlabEntry]:
+        with self._lock, self._file_lock(exclusive=False):
+            self._refresh_locked()
+            return self._get_locked(key)
+
+    def _set(self, key: str, data, expires_at: float) -> bool:
+        with self._lock, self._file_lock(exclusive=True):
+            self._refresh_locked()
+            return self._append(key.encode(), data, expires_at)
+
+    def _delete(self, key: str) -> None:
+        with self._lock, self._file_lock(exclusive=True):
+            self._refresh_locked()
+            if key in self._index:
+                self._append(key.encode(), b"", 0)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _schedule_compaction(self) -> None:
+        if self._compaction_due and self._compaction is None:
+            self._compaction_due = False
+            self._compaction = asyncio.create_task(self._run_compaction())
+
+    async def _run_compaction(self) -> None:
+        try:
+            await self._run(self._compact)
+        except OSError as e:
+            logger.error(f"Error compacting slab store {self.directory}: {e}")
+        finally:
+            self._compaction = None
+
+    async def get(self, key: str) -> Optional[SlabEntry]:
+        """
+        Returns the value stored for `key`, or None if it is missing or expired.
+
+        Hits on records known to this process are served without any I/O, misses first look for records
+        written by other processes. While a write holds the store, the lookup waits for it in the executor.
+        """
+        entry = None
+        if self._lock.acquire(blocking=False):
+            try:
+                entry = self._get_locked(key)
+            finally:
+                self._lock.release()
+        if entry is None:
+            entry = await self._run(self._refresh_and_get, key)
+        return entry
+
+    async def set(self, key: str, data: Union[bytes, bytearray, memoryview], expires_at: float) -> bool:
+        """
+        Appends a value for `key`, replacing any previous one.
+
+        Returns:
+            bool: Whether the value was stored, values larger than a slab are not.
+        """
+        try:
+            return await self._run(self._set, key, data, expires_at)
+        except OSError as e:
+            logger.error(f"Error writing to slab store {self.directory}: {e}")
+            return False
+        finally:
+            self._schedule_compaction()
+
+    async def delete(self, key: str) -> None:
+        """Removes `key` from the store."""
+        try:
+            await self._run(self._delete, key)
+        except OSError as e:
+            logger.error(f"Error deleting from slab store {self.directory}: {e}")
+        finally:
+            self._schedule_compaction()
+
+    def get_stats(self) -> dict:
+        """Returns the number of slabs and entries known to this process and the disk space they use."""
+        with self._lock:
+            return {
+                "slabs": len(self._slabs),
+                "entries": len(self._index),
+                "disk_bytes": sum(slab.size for slab in self._slabs.values()),
+                "max_bytes": self.max_slabs * self.slab_size,
+            }
+
+
+class _FileLock:
+    """Context manager holding a POSIX record lock on a file, a no-op where those are not available."""
+
+    def __init__(self, fd: int, exclusive: bool):
+        self.fd = fd
+        self.exclusive = exclusive
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
@@ -0,0 +1,62 @@
+import asyncio
+import subprocess
+import sys
+import time
+
+import pytest
+
+from mediaflow_proxy.utils.cache_backends import SharedMemoryCacheBackend, fcntl
+
+pytestmark = pytest.mark.skipif(fcntl is None, reason="requires POSIX file locking")
+
+HOLD_LOCK = """
+import fcntl, os, sys, time
+fd = os.open(sys.argv[1], os.O_RDWR)
+fcntl.lockf(fd, fcntl.LOCK_EX)
+print("locked", flush=True)
+time.sleep(float(sys.argv[2]))
+"""
+
+
+def test_values_round_trip(tmp_path):
+    async def run():
+        backend = SharedMemoryCacheBackend("test", 1024 * 1024, directory=str(tmp_path))
+        stored = await backend.set("a", b"value", ttl=60)
+        value = await backend.get("a")
+        await backend.delete("a")
+        missing = await backend.get("a")
+        await backend.close()
+        return stored, value, missing
+
+    assert asyncio.run(run()) == (True, b"value", None)
+
+
+def test_lock_held_by_another_process_does_not_block_the_loop(tmp_path):
+    async def run():
+        backend = SharedMemoryCacheBackend("test", 1024 * 1024, directory=str(tmp_path))
+        await backend.set("a", b"value", ttl=60)
+        holder = subprocess.Popen([sys.executable, "-c", HOLD_LOCK, backend.path, "0.5"], stdout=subprocess.PIPE)
+        assert holder.stdout.readline() == b"locked\n"
+
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        started = time.monotonic()
+        value = await backend.get("a")
+        waited = time.monotonic() - started
+        ticker.cancel()
+        holder.wait()
+        await backend.close()
+        return value, waited, ticks
+
+    value, waited, ticks = asyncio.run(run())
+    assert value == b"value"
+    assert waited > 0.2
+    # The loop kept running while the lock was awaited
+    assert ticks > 10
@@ -0,0 +1,216 @@
+import asyncio
+import tempfile
+import time
+from collections import OrderedDict
+
+import httpx
+import pytest
+
+from mediaflow_proxy.utils import cache_utils, mpd_utils
+from mediaflow_proxy.utils.cache_backends import MemoryCacheBackend
+from mediaflow_proxy.utils.cache_utils import (
+    AsyncMemoryCache,
+    HybridCache,
+    SharedStream,
+    SingleFlight,
+    get_cached_mpd,
+    get_stream_context,
+    register_stream_context,
+)
+from mediaflow_proxy.utils.crypto_utils import EncryptionHandler
+
+CONTEXT = {
+    "params": {"init_url": "https://example.com/v1/init.mp4", "mime_type": "video/mp4"},
+    "media": "https://example.com/v1/$Number$.m4s",
+}
+SECRET_CONTEXT = {
+    **CONTEXT,
+    "params": {**CONTEXT["params"], "key_id": "00" * 16, "key": "11" * 16, "h_authorization": "Bearer SECRET"},
+}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controls the wall clock the cache tiers compute expiry times from."""
+    now = {"time": time.time()}
+    monkeypatch.setattr(time, "time", lambda: now["time"])
+    return now
+
+
+@pytest.fixture
+def context_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    cache = HybridCache("stream_context_cache", ttl=60, max_memory_size=1024 * 1024, max_file_size=4 * 1024 * 1024)
+    monkeypatch.setattr(cache_utils, "STREAM_CONTEXT_CACHE", cache)
+    monkeypatch.setattr(cache_utils, "STREAM_CONTEXT_SECRETS", MemoryCacheBackend(1024 * 1024))
+    monkeypatch.setattr(cache_utils, "encryption_handler", None)
+    return cache
+
+
+@pytest.mark.parametrize("context", [CONTEXT, SECRET_CONTEXT])
+def test_registration_refreshes_the_context_ttl(clock, context_cache, context):
+    async def scenario():
+        context_id = await register_stream_context(context)
+        clock["time"] += 45
+        # The playlist is generated again, segments must stay resolvable for a full TTL from now
+        assert await register_stream_context(context) == context_id
+        clock["time"] += 45
+        refreshed = await get_stream_context(context_id)
+        clock["time"] += 30
+        expired = await get_stream_context(context_id)
+        return refreshed, expired
+
+    refreshed, expired = asyncio.run(scenario())
+    assert refreshed == context
+    assert expired is None
+
+
+def test_context_id_depends_on_the_content(clock, context_cache):
+    async def scenario():
+        return (
+            await register_stream_context(CONTEXT),
+            await register_stream_context(dict(reversed(list(CONTEXT.items())))),
+            await register_stream_context({**CONTEXT, "media": "https://example.com/v2/$Number$.m4s"}),
+        )
+
+    first, reordered, other = asyncio.run(scenario())
+    assert first == reordered
+    assert first != other
+
+
+def test_secret_contexts_stay_in_memory_without_an_api_password(clock, context_cache):
+    async def scenario():
+        public_id = await register_stream_context(CONTEXT)
+        secret_id = await register_stream_context(SECRET_CONTEXT)
+        return (
+            await context_cache.get(public_id),
+            await context_cache.get(secret_id),
+            await get_stream_context(secret_id),
+        )
+
+    public, stored, secret = asyncio.run(scenario())
+    assert public is not None
+    assert stored is None
+    assert secret == SECRET_CONTEXT
+
+
+def test_contexts_are_encrypted_with_the_api_password(clock, context_cache, monkeypatch):
+    monkeypatch.setattr(cache_utils, "encryption_handler", EncryptionHandler("secret"))
+
+    async def scenario():
+        context_id = await register_stream_context(SECRET_CONTEXT)
+        return await context_cache.get(context_id), await get_stream_context(context_id)
+
+    stored, context = asyncio.run(scenario())
+    assert b"SECRET" not in stored and b"11" * 16 not in stored
+    assert context == SECRET_CONTEXT
+
+
+STATIC_MPD = b"""<?xml version="1.0"?>
+<MPD type="static" mediaPresentationDuration="PT4S">
+  <Period start="PT0S">
+    <AdaptationSet mimeType="video/mp4">
+      <SegmentTemplate timescale="1000" duration="2000" startNumber="1"
+                       initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/$Number$.m4s"/>
+      <Representation id="v1" codecs="avc1.64001f" bandwidth="1000000" width="1280" height="720"/>
+    </AdaptationSet>
+    <AdaptationSet mimeType="audio/mp4" lang="en">
+      <SegmentTemplate timescale="1000" duration="2000" startNumber="1"
+                       initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/$Number$.m4s"/>
+      <Representation id="a1" codecs="mp4a.40.2" bandwidth="128000" audioSamplingRate="48000"/>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+
+def test_downloaded_mpd_is_parsed_once(monkeypatch):
+    parses = []
+    parse_mpd_dict = mpd_utils.parse_mpd_dict
+
+    def counting_parse(*args, **kwargs):
+        parses.append(args[2:4])
+        return parse_mpd_dict(*args, **kwargs)
+
+    async def download(method, url, headers, **kwargs):
+        return httpx.Response(200, content=STATIC_MPD)
+
+    monkeypatch.setattr(mpd_utils, "parse_mpd_dict", counting_parse)
+    monkeypatch.setattr(cache_utils, "request_with_retry", download)
+    monkeypatch.setattr(cache_utils, "MPD_CACHE", AsyncMemoryCache(1024 * 1024))
+    monkeypatch.setattr(cache_utils, "MPD_MODELS", OrderedDict())
+
+    mpd = asyncio.run(get_cached_mpd("https://example.com/vod/manifest.mpd", {}, parse_drm=True))
+    assert [profile["id"] for profile in mpd["profiles"]] == ["v1", "a1"]
+    assert parses == [(True, None)]
+
+
+def test_shared_stream_producer_is_cancelled_when_the_last_reader_disconnects():
+    async def run():
+        stream = SharedStream()
+
+        async def produce():
+            while True:
+                stream.append(b"x")
+                await asyncio.sleep(0.01)
+
+        stream.producer = asyncio.create_task(produce())
+        stream.subscribe()
+        stream.subscribe()
+        await asyncio.sleep(0.05)
+        # A reader that got everything it needed does not stop the producer
+        stream.release(disconnected=False)
+        await asyncio.sleep(0)
+        kept = not stream.producer.done()
+        stream.release(disconnected=True)
+        await asyncio.sleep(0)
+        return kept, stream.producer.cancelled(), stream.abandoned
+
+    assert asyncio.run(run()) == (True, True, True)
+
+
+def test_single_flight_coalesces_concurrent_fetches():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        call = len(calls)
+        await asyncio.sleep(0.01)
+        return call
+
+    async def run():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(*(flight.do("a", fetch) for _ in range(3)), flight.do("b", fetch))
+        # A fetch started once the previous one completed is executed again
+        later = await flight.do("a", fetch)
+        return results, later, flight.get_stats()
+
+    results, later, stats = asyncio.run(run())
+    assert results == [1, 1, 1, 2]
+    assert later == 3
+    assert stats == {"executions": 3, "coalesced": 2, "in_flight": 0}
+
+
+def test_single_flight_shares_errors_and_survives_cancelled_callers():
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("origin down")
+
+    async def slow():
+        await asyncio.sleep(0.02)
+        return "value"
+
+    async def run():
+        flight = SingleFlight("test")
+        errors = await asyncio.gather(flight.do("a", failing), flight.do("a", failing), return_exceptions=True)
+
+        first = asyncio.create_task(flight.do("b", slow))
+        second = asyncio.create_task(flight.do("b", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        return errors, await second, first.cancelled()
+
+    errors, value, cancelled = asyncio.run(run())
+    assert [str(error) for error in errors] == ["origin down", "origin down"]
+    assert value == "value"
+    assert cancelled
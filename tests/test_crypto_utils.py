@@ -0,0 +1,41 @@
+import base64
+
+import pytest
+from fastapi import HTTPException
+
+from mediaflow_proxy.utils.crypto_utils import EncryptionHandler
+
+DATA = {"d": "https://example.com/stream.m3u8", "h_referer": "https://example.com/"}
+
+
+@pytest.mark.parametrize("token_format", ["compact", "cbc"])
+def test_tokens_round_trip(token_format):
+    handler = EncryptionHandler("secret", token_format)
+    token = handler.encrypt_data(dict(DATA), expiration=60, ip="10.0.0.1")
+
+    assert token.startswith(EncryptionHandler.COMPACT_PREFIX) == (token_format == "compact")
+    assert handler.decrypt_data(token, "10.0.0.1") == DATA
+    with pytest.raises(HTTPException) as error:
+        handler.decrypt_data(token, "10.0.0.2")
+    assert error.value.status_code == 403
+
+
+def test_tokens_of_either_format_are_decoded_by_any_handler():
+    compact = EncryptionHandler("secret", "compact")
+    cbc = EncryptionHandler("secret", "cbc")
+
+    assert cbc.decrypt_data(compact.encrypt_data(dict(DATA)), "10.0.0.1") == DATA
+    assert compact.decrypt_data(cbc.encrypt_data(dict(DATA)), "10.0.0.1") == DATA
+
+
+def test_compact_tokens_reject_tampering_and_other_keys():
+    handler = EncryptionHandler("secret", "compact")
+    token = handler.encrypt_data(dict(DATA))
+    body = token[len(EncryptionHandler.COMPACT_PREFIX) :]
+    raw = bytearray(base64.urlsafe_b64decode(body + "=" * (-len(body) % 4)))
+    raw[EncryptionHandler.COMPACT_NONCE_SIZE] ^= 1
+    tampered = EncryptionHandler.COMPACT_PREFIX + base64.urlsafe_b64encode(bytes(raw)).decode().rstrip("=")
+
+    for bad_token, bad_handler in ((tampered, handler), (token, EncryptionHandler("other", "compact"))):
+        with pytest.raises(ValueError):
+            bad_handler.decode_token(bad_token)
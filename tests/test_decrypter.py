@@ -0,0 +1,373 @@
+import array
+import asyncio
+import random
+import struct
+
+import httpx
+import pytest
+from Crypto.Cipher import AES
+
+from mediaflow_proxy import mpd_processor
+from mediaflow_proxy.drm import decrypter as decrypter_module
+from mediaflow_proxy.drm.decrypter import (
+    CENCSampleAuxiliaryDataFormat,
+    MP4Atom,
+    MP4Decrypter,
+    MP4Parser,
+    MP4StreamDecrypter,
+    TrackEncryptionInfo,
+)
+from mediaflow_proxy.drm.executor import DecryptionExecutor
+from mediaflow_proxy.utils.http_utils import Streamer
+
+KEY_ID = bytes(range(16))
+KEY = bytes(range(16, 32))
+CONSTANT_IV = bytes(range(32, 48))
+
+
+def box(box_type: bytes, payload: bytes = b"") -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type: bytes, version: int, flags: int, payload: bytes = b"") -> bytes:
+    return box(box_type, struct.pack(">I", version << 24 | flags) + payload)
+
+
+def protected_regions(sample_size: int, sub_samples: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Returns the protected (offset, length) regions of a sample, the data after the last sub-sample included."""
+    regions, offset = [], 0
+    for clear_bytes, encrypted_bytes in sub_samples:
+        regions.append((offset + clear_bytes, encrypted_bytes))
+        offset += clear_bytes + encrypted_bytes
+    if offset < sample_size:
+        regions.append((offset, sample_size - offset))
+    return regions
+
+
+def encrypt_sample(
+    sample: bytes, iv: bytes, sub_samples: list[tuple[int, int]], scheme: bytes = b"cenc", pattern=(0, 0)
+) -> bytes:
+    """Reference encryption of a single sample, with a fresh AES-CTR or AES-CBC cipher per sample."""
+    output = bytearray(sample)
+    regions = protected_regions(len(sample), sub_samples)
+    if scheme == b"cenc":
+        # The counter runs over the protected bytes of the whole sample
+        cipher = AES.new(KEY, AES.MODE_CTR, initial_value=iv.ljust(16, b"\0"), nonce=b"")
+        for offset, length in regions:
+            output[offset : offset + length] = cipher.encrypt(sample[offset : offset + length])
+        return bytes(output)
+
+    crypt_blocks, skip_blocks = pattern
+    for offset, length in regions:
+        # The chain restarts from the IV for every sub-sample, skipped blocks and partial blocks stay clear
+        cipher = AES.new(KEY, AES.MODE_CBC, iv)
+        full_blocks = length // 16
+        step = crypt_blocks + skip_blocks if crypt_blocks and skip_blocks else full_blocks or 1
+        crypt = crypt_blocks if crypt_blocks and skip_blocks else full_blocks
+        for block in range(0, full_blocks, step):
+            start = offset + block * 16
+            end = start + min(crypt, full_blocks - block) * 16
+            output[start:end] = cipher.encrypt(sample[start:end])
+    return bytes(output)
+
+
+def sinf_box(scheme: bytes = b"cenc", iv_size: int = 8, pattern=(0, 0), tenc_version=None, with_schm=True) -> bytes:
+    """Returns a 'sinf' box, the 'tenc' is version 1 for 'cbcs' unless given."""
+    constant_iv = bytes([len(CONSTANT_IV)]) + CONSTANT_IV if iv_size == 0 else b""
+    tenc_payload = bytes([0, pattern[0] << 4 | pattern[1], 1, iv_size]) + KEY_ID + constant_iv
+    if tenc_version is None:
+        tenc_version = 1 if scheme == b"cbcs" else 0
+    tenc = full_box(b"tenc", tenc_version, 0, tenc_payload)
+    schm = full_box(b"schm", 0, 0, scheme + struct.pack(">I", 0x10000)) if with_schm else b""
+    return box(b"sinf", box(b"frma", b"avc1") + schm + box(b"schi", tenc))
+
+
+def init_segment(scheme: bytes = b"cenc", iv_size: int = 8, pattern=(0, 0)) -> bytes:
+    """Returns an init segment with one protected video track, track ID 1."""
+    sinf = sinf_box(scheme, iv_size, pattern)
+    stsd = full_box(b"stsd", 0, 0, struct.pack(">I", 1) + box(b"encv", bytes(78) + sinf))
+    tkhd = full_box(b"tkhd", 0, 0, struct.pack(">III", 0, 0, 1) + bytes(68))
+    trak = box(b"trak", tkhd + box(b"mdia", box(b"minf", box(b"stbl", stsd))))
+    return box(b"ftyp", b"isom" + bytes(4)) + box(b"moov", trak + full_box(b"pssh", 0, 0, bytes(20)))
+
+
+def fragment(samples: list[bytes], ivs: list[bytes], sub_samples, scheme=b"cenc", pattern=(0, 0), open_ended=False):
+    """Returns an encrypted 'moof' and 'mdat' pair for the samples, with a 'senc' carrying their IVs."""
+    encrypted = [encrypt_sample(s, iv, subs, scheme, pattern) for s, iv, subs in zip(samples, ivs, sub_samples)]
+    senc_payload = struct.pack(">I", len(samples))
+    for iv, subs in zip(ivs, sub_samples):
+        senc_payload += iv if scheme == b"cenc" else b""
+        senc_payload += struct.pack(">H", len(subs)) + b"".join(struct.pack(">HI", *sub) for sub in subs)
+
+    def moof(data_offset: int) -> bytes:
+        trun = full_box(
+            b"trun",
+            0,
+            0x201,
+            struct.pack(">Ii", len(samples), data_offset) + b"".join(struct.pack(">I", len(s)) for s in samples),
+        )
+        traf = (
+            full_box(b"tfhd", 0, 0, struct.pack(">I", 1))
+            + trun
+            + full_box(b"senc", 0, 2, senc_payload)
+            + full_box(b"saiz", 0, 0, bytes([0]) + struct.pack(">I", len(samples)))
+            + full_box(b"saio", 0, 0, struct.pack(">II", 1, 0))
+        )
+        return box(b"moof", full_box(b"mfhd", 0, 0, struct.pack(">I", 1)) + box(b"traf", traf))
+
+    payload = b"".join(encrypted)
+    mdat = struct.pack(">I4s", 0, b"mdat") + payload if open_ended else box(b"mdat", payload)
+    return moof(len(moof(0)) + 8) + mdat
+
+
+def sidx(referenced_size: int) -> bytes:
+    return full_box(b"sidx", 1, 0, struct.pack(">IIQQHHIII", 1, 1000, 0, 0, 0, 1, referenced_size, 2000, 0))
+
+
+def stream_decrypt(init: bytes, segment: bytes, seed: int) -> bytes:
+    """Decrypts a segment fed in random chunks of 1 to 3000 bytes."""
+    rng = random.Random(seed)
+    decrypter = MP4StreamDecrypter({KEY_ID: KEY})
+    output = decrypter.process_init(init)
+    position = 0
+    while position < len(segment):
+        size = rng.randint(1, 3000)
+        output += decrypter.feed(segment[position : position + size])
+        position += size
+    return output + decrypter.flush()
+
+
+def mdat_payloads(data: bytes) -> list[bytes]:
+    return [bytes(atom.data) for atom in MP4Parser(memoryview(data)).list_atoms() if atom.atom_type == b"mdat"]
+
+
+def random_samples(rng: random.Random, count: int) -> list[bytes]:
+    return [rng.randbytes(rng.randint(1200, 5000)) for _ in range(count)]
+
+
+SCHEMES = [
+    pytest.param(b"cenc", 8, (0, 0), id="cenc"),
+    pytest.param(b"cbcs", 0, (1, 9), id="cbcs"),
+]
+
+
+def segment_samples(scheme: bytes, rng: random.Random, count: int):
+    samples = random_samples(rng, count)
+    ivs = [rng.randbytes(8) if scheme == b"cenc" else CONSTANT_IV for _ in samples]
+    sub_samples = [[(rng.randint(0, 64), rng.randint(16, 1000)), (rng.randint(0, 64), 0)] for _ in samples]
+    return samples, ivs, sub_samples
+
+
+@pytest.mark.parametrize("scheme, iv_size, pattern", SCHEMES)
+def test_streamed_decryption_matches_whole_segment_decryption(scheme, iv_size, pattern):
+    rng = random.Random(1)
+    init = init_segment(scheme, iv_size, pattern)
+    samples, ivs, sub_samples = segment_samples(scheme, rng, 12)
+    media = fragment(samples, ivs, sub_samples, scheme, pattern)
+    segment = full_box(b"styp", 0, 0, b"cmfc") + sidx(len(media)) + media
+
+    expected = MP4Decrypter({KEY_ID: KEY}).decrypt_segment(init + segment)
+    assert mdat_payloads(expected) == [b"".join(samples)]
+    for seed in range(20):
+        assert stream_decrypt(init, segment, seed) == expected
+
+
+@pytest.mark.parametrize("scheme, iv_size, pattern", SCHEMES)
+def test_every_fragment_and_open_ended_mdat_is_decrypted(scheme, iv_size, pattern):
+    rng = random.Random(2)
+    init = init_segment(scheme, iv_size, pattern)
+    fragments = [segment_samples(scheme, rng, 5) for _ in range(3)]
+    segment = b"".join(
+        fragment(*samples, scheme, pattern, open_ended=index == len(fragments) - 1)
+        for index, samples in enumerate(fragments)
+    )
+
+    for seed in range(10):
+        output = stream_decrypt(init, segment, seed)
+        # The open-ended 'mdat' keeps its size 0 header and runs to the end of the output
+        last_mdat = output.rindex(b"\0\0\0\0mdat")
+        assert mdat_payloads(output[:last_mdat]) == [b"".join(samples) for samples, _, _ in fragments[:-1]]
+        assert output[last_mdat + 8 :] == b"".join(fragments[-1][0])
+        assert b"senc" not in output and b"pssh" not in output
+
+
+def test_segments_are_decrypted_as_they_stream(monkeypatch):
+    rng = random.Random(3)
+    init = init_segment()
+    samples, ivs, sub_samples = segment_samples(b"cenc", rng, 8)
+    segment = fragment(samples, ivs, sub_samples)
+
+    class RandomChunks(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            position = 0
+            while position < len(segment):
+                size = rng.randint(1, 3000)
+                yield segment[position : position + size]
+                position += size
+
+    client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, stream=RandomChunks()))
+    )
+    monkeypatch.setattr(mpd_processor, "decrypt_executor", DecryptionExecutor(mode="thread", max_workers=2))
+
+    async def run():
+        streamer = Streamer(client)
+        await streamer.create_streaming_response("https://example.com/v1/1.m4s", {})
+        chunks = mpd_processor.iter_processed_segment(init, streamer, "video/mp4", KEY_ID.hex(), KEY.hex())
+        output = b"".join([chunk async for chunk in chunks])
+        await streamer.close()
+        return output
+
+    assert asyncio.run(run()) == MP4Decrypter({KEY_ID: KEY}).decrypt_segment(init + segment)
+
+
+@pytest.fixture
+def ciphers(monkeypatch):
+    """Records the mode of every AES cipher the decrypter creates."""
+    modes = []
+
+    class RecordingAES:
+        MODE_ECB, MODE_CBC, MODE_CTR = AES.MODE_ECB, AES.MODE_CBC, AES.MODE_CTR
+
+        @staticmethod
+        def new(key, mode, *args, **kwargs):
+            modes.append(mode)
+            return AES.new(key, mode, *args, **kwargs)
+
+    monkeypatch.setattr(decrypter_module, "AES", RecordingAES)
+    return modes
+
+
+def decrypt_samples(samples, ivs, sub_samples, encryption, encrypted=None):
+    """Encrypts the samples with the reference cipher and decrypts them back to back with '_decrypt_samples'."""
+    scheme = encryption.scheme_type if encryption else b"cenc"
+    pattern = (encryption.crypt_byte_block, encryption.skip_byte_block) if encryption else (0, 0)
+    encrypted = encrypted or [True] * len(samples)
+    ciphertext = b"".join(
+        encrypt_sample(sample, iv, subs, scheme, pattern) if is_encrypted else sample
+        for sample, iv, subs, is_encrypted in zip(samples, ivs, sub_samples, encrypted)
+    )
+    sample_info = [
+        CENCSampleAuxiliaryDataFormat(is_encrypted, iv, subs)
+        for iv, subs, is_encrypted in zip(ivs, sub_samples, encrypted)
+    ]
+    sample_sizes = array.array("I", [len(sample) for sample in samples])
+    return ciphertext, MP4Decrypter._decrypt_samples(ciphertext, sample_info, sample_sizes, KEY, encryption)
+
+
+def track_encryption(scheme: bytes, iv_size: int, pattern=(0, 0)) -> TrackEncryptionInfo:
+    constant_iv = CONSTANT_IV if iv_size == 0 else b""
+    return TrackEncryptionInfo(scheme, True, iv_size, KEY_ID, constant_iv, *pattern)
+
+
+SUB_SAMPLES = [
+    pytest.param(lambda rng: [], id="whole-sample"),
+    pytest.param(lambda rng: [(rng.randint(0, 64), rng.randint(0, 600))], id="one-sub-sample"),
+    pytest.param(
+        lambda rng: [(rng.randint(0, 64), rng.randint(0, 300)) for _ in range(rng.randint(2, 4))],
+        id="multi-sub-sample",
+    ),
+]
+
+
+@pytest.mark.parametrize("sub_samples", SUB_SAMPLES)
+@pytest.mark.parametrize(
+    "encryption",
+    [
+        pytest.param(track_encryption(b"cenc", 8), id="cenc-iv8"),
+        pytest.param(track_encryption(b"cenc", 16), id="cenc-iv16"),
+        pytest.param(None, id="cenc-default"),
+        pytest.param(track_encryption(b"cbcs", 16, (1, 9)), id="cbcs-iv16-1:9"),
+        pytest.param(track_encryption(b"cbcs", 0, (1, 9)), id="cbcs-constant-iv-1:9"),
+        pytest.param(track_encryption(b"cbcs", 16, (0, 0)), id="cbcs-iv16-0:0"),
+    ],
+)
+def test_decrypt_samples_matches_reference_encryption(encryption, sub_samples):
+    rng = random.Random(4)
+    samples = random_samples(rng, 10)
+    iv_size = encryption.per_sample_iv_size if encryption else 8
+    ivs = [rng.randbytes(iv_size) if iv_size else encryption.constant_iv for _ in samples]
+    subs = [sub_samples(rng) for _ in samples]
+    encrypted = [index != 3 for index in range(len(samples))]
+
+    ciphertext, plaintext = decrypt_samples(samples, ivs, subs, encryption, encrypted)
+
+    assert ciphertext != b"".join(samples)
+    assert plaintext == b"".join(samples)
+
+
+def test_decrypt_samples_leaves_bytes_after_the_last_sample():
+    rng = random.Random(5)
+    samples = random_samples(rng, 2)
+    ivs = [rng.randbytes(8) for _ in samples]
+    ciphertext = b"".join(encrypt_sample(sample, iv, []) for sample, iv in zip(samples, ivs)) + b"trailing"
+    sample_info = [CENCSampleAuxiliaryDataFormat(True, iv, []) for iv in ivs]
+    sample_sizes = array.array("I", [len(sample) for sample in samples])
+
+    plaintext = MP4Decrypter._decrypt_samples(ciphertext, sample_info, sample_sizes, KEY)
+
+    assert plaintext == b"".join(samples) + b"trailing"
+
+
+def test_ctr_samples_with_contiguous_counters_share_one_cipher(ciphers):
+    rng = random.Random(6)
+    # Every sample protects 30 blocks, so the next IV continues the counter where the sample ends
+    sub_samples = [[(5, 320), (7, 160)]] * 4
+    samples = [rng.randbytes(492) for _ in sub_samples]
+    counter = int.from_bytes(rng.randbytes(16), "big") % (1 << 127)
+    ivs = [(counter + 30 * index).to_bytes(16, "big") for index in range(3)] + [rng.randbytes(16)]
+
+    _, plaintext = decrypt_samples(samples, ivs, sub_samples, track_encryption(b"cenc", 16))
+
+    assert plaintext == b"".join(samples)
+    assert ciphers == [AES.MODE_CTR, AES.MODE_CTR]
+
+
+def test_cbcs_samples_are_decrypted_in_a_single_ecb_pass(ciphers):
+    rng = random.Random(7)
+    samples = random_samples(rng, 6)
+    sub_samples = [[(rng.randint(0, 64), rng.randint(100, 400)) for _ in range(3)] for _ in samples]
+
+    _, plaintext = decrypt_samples(
+        samples, [CONSTANT_IV] * len(samples), sub_samples, track_encryption(b"cbcs", 0, (1, 9))
+    )
+
+    assert plaintext == b"".join(samples)
+    assert ciphers == [AES.MODE_ECB]
+
+
+@pytest.mark.parametrize(
+    "sinf, expected",
+    [
+        pytest.param(
+            sinf_box(b"cenc", 8),
+            TrackEncryptionInfo(b"cenc", True, 8, KEY_ID, b"", 0, 0),
+            id="cenc",
+        ),
+        pytest.param(
+            sinf_box(b"cbcs", 0, (1, 9)),
+            TrackEncryptionInfo(b"cbcs", True, 0, KEY_ID, CONSTANT_IV, 1, 9),
+            id="cbcs-constant-iv",
+        ),
+        pytest.param(
+            sinf_box(b"cbcs", 16, (0, 0)),
+            TrackEncryptionInfo(b"cbcs", True, 16, KEY_ID, b"", 0, 0),
+            id="cbcs-iv16-0:0",
+        ),
+        pytest.param(
+            sinf_box(b"cens", 16, (1, 9), tenc_version=0),
+            TrackEncryptionInfo(b"cens", True, 16, KEY_ID, b"", 0, 0),
+            id="pattern-ignored-before-tenc-v1",
+        ),
+        pytest.param(
+            sinf_box(b"cbcs", 8, with_schm=False),
+            TrackEncryptionInfo(b"cenc", True, 8, KEY_ID, b"", 0, 0),
+            id="cenc-without-schm",
+        ),
+        pytest.param(box(b"sinf", box(b"frma", b"avc1")), None, id="without-tenc"),
+    ],
+)
+def test_parse_sinf(sinf, expected):
+    atom = MP4Parser(memoryview(sinf)).read_atom()
+    assert isinstance(atom, MP4Atom)
+    assert MP4Decrypter._parse_sinf(atom) == expected
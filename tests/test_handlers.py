@@ -0,0 +1,158 @@
+import asyncio
+from collections import OrderedDict
+
+import httpx
+import pytest
+from starlette.requests import Request
+from starlette.routing import Route, Router
+
+from mediaflow_proxy import handlers
+from mediaflow_proxy.handlers import _iter_shared_segment, _segment_cache_key, _subscribe_shared_segment
+from mediaflow_proxy.schemas import HLSManifestParams, MPDSegmentParams
+from mediaflow_proxy.utils.http_utils import DownloadError, ProxyRequestHeaders
+
+SEGMENT = {
+    "init_url": "https://example.com/v1/init.mp4",
+    "segment_url": "https://example.com/v1/1.m4s",
+    "mime_type": "video/mp4",
+    "key_id": "00" * 16,
+}
+
+
+class SlowBody(httpx.AsyncByteStream):
+    def __init__(self, sent):
+        self.sent = sent
+
+    async def __aiter__(self):
+        while True:
+            self.sent.append(b"x")
+            yield b"x"
+            await asyncio.sleep(0.01)
+
+
+def test_segment_cache_key_depends_on_the_decryption_key():
+    first = _segment_cache_key(MPDSegmentParams(**SEGMENT, key="11" * 16))
+    same = _segment_cache_key(MPDSegmentParams(**SEGMENT, key="11" * 16))
+    other = _segment_cache_key(MPDSegmentParams(**SEGMENT, key="22" * 16))
+    assert first == same
+    assert first != other
+    assert "11" * 16 not in first
+
+
+def test_shared_segment_download_stops_when_every_reader_disconnects(monkeypatch):
+    sent = []
+
+    async def no_init_segment(segment_params, proxy_headers):
+        return b""
+
+    client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, stream=SlowBody(sent)))
+    )
+    monkeypatch.setattr(handlers, "get_http_client", lambda: client)
+    monkeypatch.setattr(handlers, "_get_init_segment", no_init_segment)
+
+    async def run():
+        segment_params = MPDSegmentParams(**SEGMENT)
+        cache_key = _segment_cache_key(segment_params)
+        readers = []
+        for _ in range(2):
+            shared_stream = await _subscribe_shared_segment(cache_key, segment_params, ProxyRequestHeaders({}, {}))
+            readers.append(_iter_shared_segment(shared_stream, shared_stream.iter_chunks()))
+        for reader in readers:
+            assert await reader.__anext__() == b"x"
+        await readers[0].aclose()
+        await asyncio.sleep(0.05)
+        running = not shared_stream.producer.done()
+        await readers[1].aclose()
+        await asyncio.sleep(0.05)
+        received = len(sent)
+        await asyncio.sleep(0.05)
+        return (
+            running,
+            shared_stream.producer.cancelled(),
+            received,
+            len(sent),
+            cache_key in handlers._inflight_segments,
+        )
+
+    running, cancelled, received, later, inflight = asyncio.run(run())
+    assert running
+    assert cancelled
+    assert later == received
+    assert not inflight
+
+
+def test_refused_blocking_reload_is_answered_without_retries(monkeypatch):
+    requests = []
+
+    def handler(request):
+        requests.append(str(request.url))
+        return httpx.Response(400, content=b"_HLS_msn is too far ahead")
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(handlers, "get_http_client", lambda: client)
+
+    url = "https://example.com/live/index.m3u8"
+    response = asyncio.run(handlers.fetch_playlist_reload(f"{url}?_HLS_msn=100", url, {}))
+    assert response.status_code == 400
+    assert requests == [f"{url}?_HLS_msn=100"]
+
+
+def test_blocking_reload_is_held_for_a_few_part_targets(monkeypatch):
+    timeouts = []
+    playlist = "#EXTM3U\n#EXT-X-TARGETDURATION:4\n#EXT-X-PART-INF:PART-TARGET=0.5\n"
+
+    def handler(request):
+        timeouts.append(request.extensions["timeout"]["read"])
+        if len(timeouts) > 1:
+            raise httpx.ReadTimeout("held for too long", request=request)
+        return httpx.Response(200, text=playlist)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(handlers, "get_http_client", lambda: client)
+    monkeypatch.setattr(handlers, "_reload_part_targets", OrderedDict())
+
+    url = "https://example.com/live/index.m3u8"
+    assert asyncio.run(handlers.fetch_playlist_reload(f"{url}?_HLS_msn=1", url, {})).text == playlist
+    with pytest.raises(DownloadError) as error:
+        asyncio.run(handlers.fetch_playlist_reload(f"{url}?_HLS_msn=2", url, {}))
+    assert error.value.status_code == 504
+    assert timeouts == [3 * handlers.RELOAD_DEFAULT_PART_TARGET, 1.5]
+
+
+def test_delivery_directives_are_forwarded_upstream_only(monkeypatch):
+    requests = []
+    playlist = '#EXTM3U\n#EXT-X-PART-INF:PART-TARGET=1.0\n#EXT-X-PART:DURATION=1.0,URI="seg101.0.ts"\nseg100.ts\n'
+
+    def handler(request):
+        requests.append(str(request.url))
+        return httpx.Response(200, text=playlist)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(handlers, "get_http_client", lambda: client)
+    monkeypatch.setattr(handlers, "hls_channels", None)
+    monkeypatch.setattr(handlers, "_reload_part_targets", OrderedDict())
+    monkeypatch.setattr(handlers.settings, "m3u8_content_routing", "mediaflow")
+
+    url = "https://example.com/live/index.m3u8"
+    router = Router([Route("/proxy/hls/manifest.m3u8", lambda request: None, name="hls_manifest_proxy")])
+    request = Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "scheme": "http",
+            "server": ("localhost", 8888),
+            "path": "/proxy/hls/manifest.m3u8",
+            "query_string": b"d=https%3A%2F%2Fexample.com%2Flive%2Findex.m3u8&_HLS_msn=101&_HLS_part=0",
+            "headers": [],
+            "router": router,
+        }
+    )
+    response = asyncio.run(
+        handlers.handle_hls_stream_proxy(request, HLSManifestParams(d=url), ProxyRequestHeaders({}, {}))
+    )
+
+    assert requests == [f"{url}?_HLS_msn=101&_HLS_part=0"]
+    body = response.body.decode()
+    assert "seg101.0.ts" in body and "seg100.ts" in body
+    assert "_HLS_" not in body
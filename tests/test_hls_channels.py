@@ -0,0 +1,78 @@
+import asyncio
+
+import httpx
+
+from mediaflow_proxy.utils import hls_channels
+from mediaflow_proxy.utils.hls_channels import HLSChannelManager
+
+PLAYLIST_URL = "https://origin.example.com/live/index.m3u8"
+PLAYLIST = "#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXTINF:6,\ns1.ts\n#EXTINF:6,\ns2.ts\n#EXTINF:6,\ns3.ts\n"
+HEADERS = {"referer": "https://a.example.com/", "range": "bytes=0-"}
+
+
+def mock_client(monkeypatch, requests):
+    def handler(request):
+        requests.append(str(request.url))
+        return httpx.Response(200, content=b"x" * 100, headers={"content-type": "video/mp2t"})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(hls_channels, "get_http_client", lambda: client)
+
+
+def test_resources_are_shared_by_viewers_with_the_same_headers_only(monkeypatch):
+    requests = []
+    mock_client(monkeypatch, requests)
+
+    async def run():
+        manager = HLSChannelManager(idle_timeout=30, live_edge_segments=0, max_bytes=1024)
+        manager.start(PLAYLIST_URL, HEADERS, PLAYLIST_URL, PLAYLIST)
+        segment = "https://origin.example.com/live/s1.ts"
+        first = await manager.get_resource(segment, {**HEADERS, "range": "bytes=0-"}, "viewer 1")
+        second = await manager.get_resource(segment, dict(HEADERS), "viewer 2")
+        other = await manager.get_resource(segment, {"referer": "https://b.example.com/"}, "viewer 3")
+        await manager.close()
+        return first, second, other
+
+    first, second, other = asyncio.run(run())
+    assert first == second == (b"x" * 100, "video/mp2t")
+    assert other is None
+    assert requests == ["https://origin.example.com/live/s1.ts"]
+
+
+def test_oldest_downloads_are_dropped_beyond_the_memory_budget(monkeypatch):
+    requests = []
+    mock_client(monkeypatch, requests)
+
+    async def run():
+        manager = HLSChannelManager(idle_timeout=30, live_edge_segments=0, max_bytes=250)
+        manager.start(PLAYLIST_URL, HEADERS, PLAYLIST_URL, PLAYLIST)
+        for name in ("s1", "s2", "s3", "s1"):
+            assert await manager.get_resource(f"https://origin.example.com/live/{name}.ts", HEADERS) is not None
+        stored = manager.stored_bytes
+        await manager.close()
+        return stored, manager.stored_bytes
+
+    stored, after_close = asyncio.run(run())
+    assert stored == 200
+    assert after_close == 0
+    # s1 was dropped when s3 arrived, and downloaded again
+    assert [url.rsplit("/", 1)[1] for url in requests] == ["s1.ts", "s2.ts", "s3.ts", "s1.ts"]
+
+
+def test_aliases_resolve_to_running_sessions_only(monkeypatch):
+    mock_client(monkeypatch, [])
+
+    async def run():
+        manager = HLSChannelManager(idle_timeout=30, live_edge_segments=0, max_bytes=1024)
+        alias = "https://vavoo.to/play/1/index.m3u8"
+        manager.add_alias(alias, HEADERS, PLAYLIST_URL)
+        before = manager.resolve(alias, HEADERS)
+        manager.start(PLAYLIST_URL, HEADERS, PLAYLIST_URL, PLAYLIST)
+        running = manager.resolve(alias, HEADERS), manager.resolve(alias, {"referer": "https://b.example.com/"})
+        await manager.close()
+        return before, running, manager.resolve(alias, HEADERS)
+
+    before, running, after = asyncio.run(run())
+    assert before is None
+    assert running == (PLAYLIST_URL, None)
+    assert after is None
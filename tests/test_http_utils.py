@@ -0,0 +1,282 @@
+import asyncio
+
+import httpx
+import pytest
+from tenacity import stop_after_attempt, wait_none
+
+from mediaflow_proxy.configs import TransportConfig, settings
+from mediaflow_proxy.utils.http_utils import (
+    DownloadError,
+    EnhancedStreamingResponse,
+    HTTPClientRegistry,
+    Streamer,
+    fetch_with_retry,
+)
+
+# A single attempt, the retry policy itself is not under test
+fetch_once = fetch_with_retry.retry_with(stop=stop_after_attempt(1), wait=wait_none(), reraise=True)
+
+
+def not_modified_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(304)))
+
+
+def test_not_modified_is_returned_to_revalidating_callers():
+    async def fetch():
+        async with not_modified_client() as client:
+            return await fetch_once(client, "GET", "https://example.com/a.m3u8", {}, allow_not_modified=True)
+
+    assert asyncio.run(fetch()).status_code == 304
+
+
+def test_not_modified_fails_other_callers():
+    async def fetch():
+        async with not_modified_client() as client:
+            return await fetch_once(client, "GET", "https://example.com/a.m3u8", {"if-none-match": '"x"'})
+
+    with pytest.raises(DownloadError) as error:
+        asyncio.run(fetch())
+    assert error.value.status_code == 304
+
+
+async def iterate(chunks, error=None, closed=None):
+    try:
+        for chunk in chunks:
+            await asyncio.sleep(0)
+            yield chunk
+        if error is not None:
+            raise error
+    finally:
+        if closed is not None:
+            closed.append(asyncio.current_task())
+
+
+def coalesce(chunks, target_size=64 * 1024, max_delay=1.0, **kwargs):
+    async def collect():
+        return [
+            chunk
+            async for chunk in EnhancedStreamingResponse.coalesce_chunks(
+                iterate(chunks, **kwargs), target_size, max_delay
+            )
+        ]
+
+    return asyncio.run(collect())
+
+
+def test_small_chunks_are_merged_in_order():
+    chunks = [bytes([i]) * 1000 for i in range(200)]
+    output = coalesce(chunks)
+
+    assert b"".join(output) == b"".join(chunks)
+    # A few chunks pass through before their average size drops, the rest are merged into 64 KiB writes
+    assert len(output) < 10
+
+
+def test_large_chunks_and_strings_pass_through():
+    chunks = [b"x" * 70000] * 3
+    assert all(a is b for a, b in zip(coalesce(chunks), chunks))
+    assert coalesce(["ab", "cd"], target_size=0) == [b"ab", b"cd"]
+
+
+def test_buffered_chunks_are_written_before_an_upstream_error():
+    received = []
+
+    async def collect():
+        output = EnhancedStreamingResponse.coalesce_chunks(
+            iterate([b"y" * 100] * 50, error=ValueError("upstream")), 64 * 1024, 1.0
+        )
+        async for chunk in output:
+            received.append(chunk)
+
+    with pytest.raises(ValueError):
+        asyncio.run(collect())
+    assert sum(map(len, received)) == 5000
+
+
+def test_upstream_is_closed_in_the_writing_task():
+    async def scenario():
+        closed = []
+        output = EnhancedStreamingResponse.coalesce_chunks(iterate([b"z" * 10] * 100, closed=closed), 64 * 1024, 1.0)
+        async for _ in output:
+            break
+        await output.aclose()
+        return closed, asyncio.current_task()
+
+    closed, task = asyncio.run(scenario())
+    assert closed == [task]
+
+
+def test_live_responses_write_each_chunk_as_it_arrives():
+    async def written(**kwargs):
+        bodies = []
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message["body"]:
+                bodies.append(message["body"])
+
+        await EnhancedStreamingResponse(iterate([b"p" * 100] * 20), **kwargs).stream_response(send)
+        return bodies
+
+    assert len(asyncio.run(written(output_chunk_size=0))) == 20
+    assert len(asyncio.run(written())) < 20
+
+
+def test_shared_client_keeps_cookies_across_redirects_of_a_request_only(monkeypatch):
+    sent = []
+
+    def handler(request):
+        sent.append((request.url.path, request.headers.get("cookie")))
+        if request.url.path == "/login":
+            return httpx.Response(302, headers={"location": "/stream", "set-cookie": "session=abc; Path=/"})
+        return httpx.Response(200)
+
+    registry = HTTPClientRegistry(TransportConfig())
+    monkeypatch.setattr(registry, "get_transport", lambda proxy, verify: httpx.MockTransport(handler))
+
+    async def fetch():
+        client = registry.get_client()
+        await client.get("https://example.com/login")
+        await client.get("https://example.com/stream")
+        await registry.aclose()
+
+    asyncio.run(fetch())
+    assert sent == [("/login", None), ("/stream", "session=abc"), ("/stream", None)]
+
+
+class InterruptedStream(httpx.AsyncByteStream):
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def __aiter__(self):
+        yield self.data
+        raise httpx.ReadError("connection lost")
+
+
+def interrupted_once_client() -> httpx.AsyncClient:
+    responses = iter([InterruptedStream(b"0123"), httpx.ByteStream(b"0123456789")])
+    return httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, stream=next(responses))))
+
+
+def test_restartable_stream_is_downloaded_again_when_the_origin_lacks_ranges(monkeypatch):
+    monkeypatch.setattr(settings, "stream_reconnect_backoff", 0)
+
+    async def fetch(restartable):
+        async with interrupted_once_client() as client:
+            streamer = Streamer(client)
+            streamer.restartable = restartable
+            await streamer.create_streaming_response("https://example.com/segment.m4s", {})
+            return b"".join([chunk async for chunk in streamer.stream_content()])
+
+    assert asyncio.run(fetch(restartable=True)) == b"0123456789"
+    with pytest.raises(httpx.ReadError):
+        asyncio.run(fetch(restartable=False))
+
+
+BODY = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def parallel_settings(monkeypatch):
+    """Splits a 1 KiB body into parts of 100 bytes downloaded over 4 connections."""
+    monkeypatch.setattr(Streamer, "PARALLEL_MIN_PART_SIZE", 100)
+    monkeypatch.setattr(Streamer, "_origin_limits", {})
+    monkeypatch.setattr(settings, "stream_parallel_connections", 4)
+    monkeypatch.setattr(settings, "stream_parallel_chunk_size", 100)
+    monkeypatch.setattr(settings, "stream_parallel_buffer_size", 400)
+    monkeypatch.setattr(settings, "stream_reconnect_attempts", 1)
+    monkeypatch.setattr(settings, "stream_reconnect_backoff", 0)
+
+
+def ranged_client(download_range) -> httpx.AsyncClient:
+    """Returns a client for BODY, whose range requests are answered by `download_range(start, end)`."""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if "Range" not in request.headers:
+            return httpx.Response(200, headers={"Accept-Ranges": "bytes"}, content=BODY)
+        start, end = map(int, request.headers["Range"].removeprefix("bytes=").split("-"))
+        return await download_range(start, end)
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def partial_response(start: int, end: int) -> httpx.Response:
+    return httpx.Response(
+        206, headers={"Content-Range": f"bytes {start}-{end}/{len(BODY)}"}, content=BODY[start : end + 1]
+    )
+
+
+async def parallel_stream(client: httpx.AsyncClient):
+    streamer = Streamer(client)
+    await streamer.create_streaming_response("https://example.com/video.mp4", {})
+    return streamer.stream_content_parallel()
+
+
+def test_parallel_parts_are_yielded_in_order(parallel_settings):
+    completed = []
+
+    async def download_range(start, end):
+        # Later parts complete first
+        await asyncio.sleep((len(BODY) - start) / len(BODY) * 0.05)
+        completed.append(start)
+        return partial_response(start, end)
+
+    async def run():
+        async with ranged_client(download_range) as client:
+            chunks = [chunk async for chunk in await parallel_stream(client)]
+        return chunks
+
+    chunks = asyncio.run(run())
+
+    assert b"".join(chunks) == BODY
+    assert [len(chunk) for chunk in chunks] == [100] * 10 + [24]
+    assert completed != sorted(completed)
+
+
+def test_closing_a_parallel_stream_cancels_the_pending_parts(parallel_settings):
+    started, cancelled = [], []
+
+    async def download_range(start, end):
+        started.append(start)
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(start)
+            raise
+
+    async def run():
+        async with ranged_client(download_range) as client:
+            chunks = await parallel_stream(client)
+            first = await chunks.__anext__()
+            await chunks.aclose()
+        return first
+
+    assert asyncio.run(run()) == BODY[:100]
+    assert started and sorted(cancelled) == sorted(started)
+
+
+def test_a_failing_parallel_part_fails_the_stream_after_the_parts_before_it(parallel_settings):
+    cancelled = []
+
+    async def download_range(start, end):
+        if start == 300:
+            # Fails once the following parts are in flight
+            await asyncio.sleep(0.01)
+            return httpx.Response(500)
+        if start > 300:
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.append(start)
+                raise
+        return partial_response(start, end)
+
+    async def run():
+        received = []
+        async with ranged_client(download_range) as client:
+            with pytest.raises(DownloadError):
+                async for chunk in await parallel_stream(client):
+                    received.append(chunk)
+        return b"".join(received)
+
+    assert asyncio.run(run()) == BODY[:300]
+    assert cancelled == [400, 500, 600]
@@ -0,0 +1,163 @@
+import asyncio
+import re
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlsplit
+
+import pytest
+from starlette.requests import Request
+from starlette.routing import Route, Router
+
+from mediaflow_proxy.configs import settings
+from mediaflow_proxy.utils import m3u8_processor
+from mediaflow_proxy.utils.crypto_utils import EncryptionHandler
+from mediaflow_proxy.utils.http_utils import encode_mediaflow_proxy_url
+from mediaflow_proxy.utils.m3u8_processor import M3U8Processor
+
+PLAYLIST_URL = "https://example.com/live/video/index.m3u8"
+PLAYLIST = """#EXTM3U
+#EXT-X-TARGETDURATION:4
+#EXT-X-PART-INF:PART-TARGET=1.000
+#EXT-X-MEDIA-SEQUENCE:100
+#EXTINF:4.000,
+seg100.ts
+#EXT-X-PART:DURATION=1.000,URI="seg101.0.ts",INDEPENDENT=YES
+#EXT-X-PRELOAD-HINT:TYPE=PART,URI="seg101.1.ts"
+#EXT-X-RENDITION-REPORT:URI="../audio/index.m3u8",LAST-MSN=101,LAST-PART=0"""
+
+
+def manifest_request(query_string: str) -> Request:
+    router = Router([Route("/proxy/hls/manifest.m3u8", lambda request: None, name="hls_manifest_proxy")])
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "scheme": "http",
+            "server": ("localhost", 8888),
+            "path": "/proxy/hls/manifest.m3u8",
+            "query_string": query_string.encode(),
+            "headers": [],
+            "router": router,
+        }
+    )
+
+
+def process(**kwargs) -> list[str]:
+    """Rewrites PLAYLIST as requested with LL-HLS delivery directives."""
+    request = manifest_request(
+        "d=https%3A%2F%2Fexample.com%2Flive%2Fvideo%2Findex.m3u8&api_password=secret"
+        "&h_referer=https%3A%2F%2Fexample.com%2F&_HLS_msn=101&_HLS_part=1"
+    )
+    processor = M3U8Processor(request, **kwargs)
+    return asyncio.run(processor.process_m3u8(PLAYLIST, PLAYLIST_URL)).splitlines()
+
+
+def uri(lines: list[str], tag: str) -> str:
+    return re.search(r'URI="([^"]+)"', next(line for line in lines if line.startswith(tag))).group(1)
+
+
+def proxied_params(url: str) -> dict[str, str]:
+    """Returns the query parameters of a proxied URL."""
+    parsed = urlsplit(url)
+    assert f"{parsed.scheme}://{parsed.netloc}{parsed.path}" == "http://localhost:8888/proxy/hls/manifest.m3u8"
+    return {key: values[0] for key, values in parse_qs(parsed.query).items()}
+
+
+def test_low_latency_uris_are_proxied_without_delivery_directives(monkeypatch):
+    monkeypatch.setattr(settings, "m3u8_content_routing", "mediaflow")
+    lines = process()
+
+    expected = {
+        "#EXT-X-PART:": "https://example.com/live/video/seg101.0.ts",
+        "#EXT-X-PRELOAD-HINT:": "https://example.com/live/video/seg101.1.ts",
+        "#EXT-X-RENDITION-REPORT:": "https://example.com/live/audio/index.m3u8",
+    }
+    for tag, destination in expected.items():
+        assert proxied_params(uri(lines, tag)) == {
+            "d": destination,
+            "api_password": "secret",
+            "h_referer": "https://example.com/",
+        }
+    # The other attributes of the tags are kept
+    assert lines[6].startswith("#EXT-X-PART:DURATION=1.000,URI=") and lines[6].endswith(",INDEPENDENT=YES")
+    assert lines[7].startswith("#EXT-X-PRELOAD-HINT:TYPE=PART,URI=")
+    assert lines[8].endswith('",LAST-MSN=101,LAST-PART=0')
+
+
+@pytest.mark.parametrize(
+    "routing, kwargs",
+    [
+        pytest.param("direct", {}, id="direct-routing"),
+        pytest.param("mediaflow", {"key_only_proxy": True}, id="key-only-proxy"),
+    ],
+)
+def test_low_latency_parts_are_routed_like_segments(monkeypatch, routing, kwargs):
+    monkeypatch.setattr(settings, "m3u8_content_routing", routing)
+    lines = process(**kwargs)
+
+    assert lines[5] == "https://example.com/live/video/seg100.ts"
+    assert uri(lines, "#EXT-X-PART:") == "https://example.com/live/video/seg101.0.ts"
+    assert uri(lines, "#EXT-X-PRELOAD-HINT:") == "https://example.com/live/video/seg101.1.ts"
+    # Rendition reports point to playlists, which are always proxied
+    assert proxied_params(uri(lines, "#EXT-X-RENDITION-REPORT:"))["d"] == "https://example.com/live/audio/index.m3u8"
+
+
+MANIFEST_PROXY_URL = "http://localhost:8888/proxy/hls/manifest.m3u8"
+QUERIES = [
+    pytest.param({"d": PLAYLIST_URL}, id="destination-only"),
+    pytest.param({"d": PLAYLIST_URL, "api_password": "secret"}, id="api-password"),
+    pytest.param(
+        {
+            "d": PLAYLIST_URL,
+            "api_password": "pässword&=",
+            "h_referer": "https://exämple.com/päge?a=1&b=2",
+            "h_user-agent": "Mozilla/5.0 (ü; 日本)",
+            "r_content-type": "application/vnd.apple.mpegurl",
+            "force_playlist_proxy": "true",
+            "_HLS_msn": "101",
+            "_HLS_part": "1",
+        },
+        id="headers-and-directives",
+    ),
+    pytest.param({"api_password": "secret", "h_origin": "https://example.com", "d": PLAYLIST_URL}, id="d-last"),
+]
+URLS = [
+    "seg100.ts",
+    "../audio/index.m3u8?token=a b&c=ä",
+    "https://cdn.exämple.com/vidéo/日本語 seg.ts?sig=%2B/=+&x=1#fragment",
+]
+
+
+def reference_params(query: dict) -> dict:
+    """Returns the request parameters carried over to the proxied URLs."""
+    return {
+        key: value
+        for key, value in query.items()
+        if key not in ("d", "has_encrypted", "force_playlist_proxy") and not key.startswith(("r_", "_HLS_"))
+    }
+
+
+@pytest.mark.parametrize("url", URLS)
+@pytest.mark.parametrize("query", QUERIES)
+def test_proxy_url_prefix_matches_encode_mediaflow_proxy_url(query, url):
+    processor = M3U8Processor(manifest_request(urlencode(query)))
+    full_url = M3U8Processor.resolve_url(url, PLAYLIST_URL)
+    expected = encode_mediaflow_proxy_url(MANIFEST_PROXY_URL, "", full_url, query_params=reference_params(query))
+
+    assert processor.proxy_url_prefix is not None
+    assert processor.proxy_url(url, PLAYLIST_URL) == expected
+    assert processor.proxy_url(full_url, PLAYLIST_URL, use_full_url=True) == expected
+    assert dict(parse_qsl(urlsplit(expected).query)) == {**reference_params(query), "d": full_url}
+
+
+@pytest.mark.parametrize("url", URLS)
+@pytest.mark.parametrize("query", QUERIES)
+def test_encrypted_proxy_urls_carry_the_same_parameters(monkeypatch, query, url):
+    handler = EncryptionHandler("secret")
+    monkeypatch.setattr(m3u8_processor, "encryption_handler", handler)
+    processor = M3U8Processor(manifest_request(urlencode({**query, "has_encrypted": "true"})))
+    full_url = M3U8Processor.resolve_url(url, PLAYLIST_URL)
+
+    assert processor.proxy_url_prefix is None
+    token_path = urlsplit(processor.proxy_url(url, PLAYLIST_URL)).path
+    assert token_path.startswith("/_token_") and token_path.endswith("/proxy/hls/manifest.m3u8")
+    token = token_path[len("/_token_") : -len("/proxy/hls/manifest.m3u8")]
+    assert handler.decode_token(token) == {**reference_params(query), "d": full_url}
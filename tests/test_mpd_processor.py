@@ -0,0 +1,113 @@
+import asyncio
+import struct
+
+import pytest
+from starlette.requests import Request
+from starlette.routing import Route, Router
+
+from mediaflow_proxy.mpd_processor import CMAFPartSplitter, iter_hls_playlist, iter_segment_part
+from mediaflow_proxy.utils.mpd_utils import MPDModel, parse_mpd
+
+MPD = """<?xml version="1.0"?>
+<MPD type="{type}" availabilityStartTime="2026-01-01T00:00:00Z" publishTime="2026-01-01T00:00:00Z"
+     mediaPresentationDuration="PT20S" minimumUpdatePeriod="PT2S" timeShiftBufferDepth="PT20S">
+  <Period start="PT0S">
+    <AdaptationSet mimeType="video/mp4">
+      <SegmentTemplate timescale="1000" duration="2000" startNumber="1" availabilityTimeOffset="{offset}"
+                       initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/$Number$.m4s"/>
+      <Representation id="v1" codecs="avc1.64001f" bandwidth="1000000" width="1280" height="720"/>
+    </AdaptationSet>
+    <AdaptationSet mimeType="audio/mp4" lang="en">
+      <SegmentTemplate timescale="1000" duration="2000" startNumber="1"
+                       initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/$Number$.m4s"/>
+      <Representation id="a1" codecs="mp4a.40.2" bandwidth="128000" audioSamplingRate="48000"/>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+
+def box(box_type: bytes, payload: bytes = b"") -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def chunk(decode_time: int, media: bytes) -> bytes:
+    """Returns a CMAF chunk, a 'moof' with the given decode time followed by its 'mdat'."""
+    tfdt = box(b"tfdt", struct.pack(">II", 0, decode_time))
+    return box(b"moof", box(b"traf", tfdt)) + box(b"mdat", media)
+
+
+# An init segment with a timescale of 1000
+MDHD = box(b"mdhd", struct.pack(">6I", 0, 0, 0, 1000, 0, 0))
+INIT = box(b"ftyp", b"cmfc") + box(b"moov", box(b"trak", box(b"mdia", MDHD)))
+CHUNKS = [chunk(10000 + 500 * i, bytes([i]) * 100) for i in range(4)]
+# A 'sidx' indexing the whole segment, and a 'styp' sent with the first chunk
+SEGMENT = INIT + box(b"sidx", b"\0" * 24) + box(b"styp", b"cmfc") + b"".join(CHUNKS)
+
+
+def split(data: bytes, read_size: int) -> dict[int, bytes]:
+    splitter = CMAFPartSplitter(part_duration=1.0, part_count=2)
+    parts: dict[int, bytes] = {}
+    outputs = [splitter.feed(data[i : i + read_size]) for i in range(0, len(data), read_size)]
+    for index, content in [item for output in outputs for item in output] + splitter.flush():
+        parts[index] = parts.get(index, b"") + content
+    return parts
+
+
+def test_chunks_are_assigned_to_parts_by_decode_time():
+    for read_size in (7, 64, len(SEGMENT)):
+        parts = split(SEGMENT, read_size)
+        assert parts == {
+            -1: INIT,
+            0: box(b"styp", b"cmfc") + CHUNKS[0] + CHUNKS[1],
+            1: CHUNKS[2] + CHUNKS[3],
+        }
+
+
+def test_part_is_streamed_with_the_init_segment():
+    async def chunks():
+        for i in range(0, len(SEGMENT), 50):
+            yield SEGMENT[i : i + 50]
+
+    async def read(part):
+        return b"".join([data async for data in iter_segment_part(chunks(), part, 2, 2.0)])
+
+    assert asyncio.run(read(1)) == INIT + CHUNKS[2] + CHUNKS[3]
+
+
+def playlist(mpd: str) -> list[str]:
+    """Returns the lines of the HLS playlist of the video profile of an MPD."""
+    model = MPDModel("https://example.com/live/manifest.mpd")
+    model.update(mpd.encode(), parse_mpd(mpd))
+    mpd_dict = model.parse(parse_drm=False, parse_segment_profile_id="v1")
+    router = Router([Route("/proxy/mpd/segment.mp4", lambda request: None, name="segment_endpoint")])
+    request = Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "scheme": "http",
+            "server": ("localhost", 8888),
+            "path": "/proxy/mpd/playlist.m3u8",
+            "query_string": b"d=https%3A%2F%2Fexample.com%2Flive%2Fmanifest.mpd&profile_id=v1",
+            "headers": [],
+            "router": router,
+        }
+    )
+    profiles = [profile for profile in mpd_dict["profiles"] if profile["id"] == "v1"]
+    return "\n".join(iter_hls_playlist(mpd_dict, profiles, request)).splitlines()
+
+
+@pytest.mark.parametrize(
+    "mpd_type, offset, expected",
+    [
+        pytest.param("static", 0, ["#EXT-X-PLAYLIST-TYPE:VOD"], id="vod"),
+        pytest.param("dynamic", 0, [], id="live"),
+        pytest.param("dynamic", 1.5, [], id="live-with-parts"),
+    ],
+)
+def test_only_vod_playlists_declare_a_playlist_type(mpd_type, offset, expected):
+    lines = playlist(MPD.format(type=mpd_type, offset=offset))
+
+    assert [line for line in lines if line.startswith("#EXT-X-PLAYLIST-TYPE")] == expected
+    assert any(line.startswith("#EXT-X-PART:") for line in lines) == bool(offset)
+    assert ("#EXT-X-ENDLIST" in lines) == (mpd_type == "static")
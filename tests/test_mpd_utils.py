@@ -0,0 +1,157 @@
+from array import array
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from mediaflow_proxy.utils import mpd_utils
+from mediaflow_proxy.utils.mpd_utils import MPDModel, SegmentSequence, parse_mpd
+
+MPD_URL = "https://example.com/live/manifest.mpd"
+AVAILABILITY_START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+DURATION_MPD = """<?xml version="1.0"?>
+<MPD type="dynamic" availabilityStartTime="2026-01-01T00:00:00Z" publishTime="2026-01-01T00:00:00Z"
+     minimumUpdatePeriod="PT2S" timeShiftBufferDepth="PT20S">
+  <Period start="PT0S">
+    <AdaptationSet mimeType="video/mp4">
+      <SegmentTemplate timescale="1000" duration="2000" startNumber="1"
+                       initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/$Number$.m4s"/>
+      <Representation id="v1" codecs="avc1.64001f" bandwidth="1000000" width="1280" height="720"/>
+    </AdaptationSet>
+    <AdaptationSet mimeType="audio/mp4" lang="en">
+      <SegmentTemplate timescale="1000" duration="2000" startNumber="1"
+                       initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/$Number$.m4s"/>
+      <Representation id="a1" codecs="mp4a.40.2" bandwidth="128000" audioSamplingRate="48000"/>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+TIMELINE_MPD = """<?xml version="1.0"?>
+<MPD type="dynamic" availabilityStartTime="2026-01-01T00:00:00Z" publishTime="2026-01-01T00:00:00Z"
+     minimumUpdatePeriod="PT2S" timeShiftBufferDepth="PT20S">
+  <Period start="PT0S">
+    <AdaptationSet mimeType="video/mp4">
+      <SegmentTemplate timescale="1000" startNumber="1"
+                       initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/$Time$.m4s">
+        <SegmentTimeline><S t="0" d="2000" r="{repeat}"/></SegmentTimeline>
+      </SegmentTemplate>
+      <Representation id="v1" codecs="avc1.64001f" bandwidth="1000000" width="1280" height="720"/>
+    </AdaptationSet>
+    <AdaptationSet mimeType="audio/mp4" lang="en">
+      <SegmentTemplate timescale="1000" startNumber="1"
+                       initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/$Time$.m4s">
+        <SegmentTimeline><S t="0" d="2000" r="{repeat}"/></SegmentTimeline>
+      </SegmentTemplate>
+      <Representation id="a1" codecs="mp4a.40.2" bandwidth="128000" audioSamplingRate="48000"/>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controls the current time seen by the live segment window, as seconds after the availability start time."""
+    now = {"elapsed": 100.0}
+
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return AVAILABILITY_START + timedelta(seconds=now["elapsed"])
+
+    monkeypatch.setattr(mpd_utils, "datetime", FrozenDatetime)
+    return now
+
+
+def model_for(mpd: str) -> MPDModel:
+    model = MPDModel(MPD_URL)
+    model.update(mpd.encode(), parse_mpd(mpd))
+    return model
+
+
+def test_duration_template_window_follows_the_clock(clock):
+    model = model_for(DURATION_MPD)
+
+    segments = model.parse(parse_drm=False, parse_segment_profile_id="v1")["profiles"][0]["segments"]
+    assert segments.numbers[-1] == 50  # 100 s at 2 s per segment, segment 51 is still being produced
+
+    clock["elapsed"] += 4.5
+    segments = model.parse(parse_drm=False, parse_segment_profile_id="v1")["profiles"][0]["segments"]
+    assert segments.numbers[-1] == 52
+    assert len(segments) == 10
+
+
+def test_duration_template_window_excludes_future_segments(clock):
+    clock["elapsed"] = 5.0
+    segments = model_for(DURATION_MPD).parse(parse_segment_profile_id="v1")["profiles"][0]["segments"]
+
+    assert list(segments.numbers) == [1, 2]
+
+
+def test_profiles_without_segments_are_reused(clock):
+    model = model_for(DURATION_MPD)
+
+    assert model.parse(parse_drm=False) is model.parse(parse_drm=False)
+
+
+def test_timeline_parse_is_reused_until_the_manifest_changes(clock):
+    model = model_for(TIMELINE_MPD.format(repeat=9))
+
+    first = model.parse(parse_segment_profile_id="v1")
+    assert model.parse(parse_segment_profile_id="v1") is first
+    assert first["profiles"][0]["segments"].numbers[-1] == 10
+
+    refreshed = TIMELINE_MPD.format(repeat=11)
+    model.update(refreshed.encode(), parse_mpd(refreshed))
+    segments = model.parse(parse_segment_profile_id="v1")["profiles"][0]["segments"]
+    assert list(segments.numbers) == list(range(1, 13))
+    assert segments.media_url(-1) == "https://example.com/live/v1/22000.m4s"
+
+
+def test_minimum_update_period_is_read_without_parsing():
+    assert model_for(DURATION_MPD).minimum_update_period == 2
+    static = DURATION_MPD.replace('type="dynamic"', 'type="static"')
+    assert model_for(static).minimum_update_period is None
+
+
+def sequence(media: str = "https://example.com/v1/$Number%04d$-$Time$.m4s") -> SegmentSequence:
+    return SegmentSequence(
+        media,
+        1000,
+        array("q", [5, 6, 7]),
+        array("q", [10000, 12000, 14000]),
+        array("q", [2000, 2000, 1500]),
+        AVAILABILITY_START,
+    )
+
+
+def test_segment_sequence_formats_segments_on_demand():
+    segments = sequence()
+
+    segment = segments[-1]
+    assert segment["media"] == "https://example.com/v1/0007-14000.m4s"
+    assert (segment["number"], segment["time"], segment["extinf"]) == (7, 14000, 1.5)
+    assert segment["start_time"] == AVAILABILITY_START + timedelta(seconds=14)
+    assert segment["end_time"] == AVAILABILITY_START + timedelta(seconds=15.5)
+    assert segments.program_date_time(0) == (AVAILABILITY_START + timedelta(seconds=10)).isoformat() + "Z"
+    assert segments.max_extinf() == 2.0
+    assert segments.uses_time
+
+    window = segments[1:]
+    assert isinstance(window, SegmentSequence)
+    assert list(window.numbers) == [6, 7]
+    assert window.media_url(0) == "https://example.com/v1/0006-12000.m4s"
+
+
+def test_segment_sequence_extends_with_segments_ended_since_the_manifest():
+    segments = sequence()
+    end = segments.end_timestamp()
+    assert end == AVAILABILITY_START.timestamp() + 15.5
+
+    assert segments.extend(end + 1.4) is segments
+    extended = segments.extend(end + 3.1)
+    assert list(extended.numbers) == [5, 6, 7, 8, 9]
+    assert list(extended.times[3:]) == [15500, 17000]
+    assert list(extended.durations[3:]) == [1500, 1500]
+    assert len(segments) == 3
@@ -0,0 +1,63 @@
+from mediaflow_proxy.utils import prebuffer_cache
+from mediaflow_proxy.utils.prebuffer_cache import PrebufferCache
+
+PLAYLIST = "https://example.com/live/playlist.m3u8"
+
+
+def floor(cache: PrebufferCache) -> int:
+    return cache._groups[PLAYLIST].floor
+
+
+def test_playheads_are_tracked_per_viewer():
+    cache = PrebufferCache(max_bytes=1000, group_max_bytes=1000)
+
+    cache.update_playhead(PLAYLIST, 10, "viewer-a")
+    cache.update_playhead(PLAYLIST, 5, "viewer-b")
+    assert floor(cache) == 5
+
+    # A viewer seeking ahead leaves no playhead behind, whatever the distance
+    cache.update_playhead(PLAYLIST, 6, "viewer-b")
+    cache.update_playhead(PLAYLIST, 20, "viewer-b")
+    assert floor(cache) == 10
+
+    # Two viewers at the same position keep their own playheads
+    cache.update_playhead(PLAYLIST, 20, "viewer-a")
+    cache.update_playhead(PLAYLIST, 21, "viewer-a")
+    assert floor(cache) == 20
+
+
+def test_playheads_without_viewer_follow_consecutive_positions():
+    cache = PrebufferCache(max_bytes=1000, group_max_bytes=1000)
+
+    cache.update_playhead(PLAYLIST, 5)
+    cache.update_playhead(PLAYLIST, 6)
+    assert floor(cache) == 6
+
+    cache.update_playhead(PLAYLIST, 10)
+    assert floor(cache) == 6
+
+
+def test_stale_playheads_are_forgotten(monkeypatch):
+    now = {"time": 100.0}
+    monkeypatch.setattr(prebuffer_cache.time, "monotonic", lambda: now["time"])
+    cache = PrebufferCache(max_bytes=1000, group_max_bytes=1000, playhead_window=30.0)
+
+    cache.update_playhead(PLAYLIST, 5, "viewer-a")
+    now["time"] += 31
+    cache.update_playhead(PLAYLIST, 12, "viewer-b")
+    assert floor(cache) == 12
+
+
+def test_segments_behind_every_viewer_are_evicted_first():
+    cache = PrebufferCache(max_bytes=300, group_max_bytes=300)
+    for position in (4, 5, 6):
+        cache.put(f"https://example.com/live/{position}.ts", bytes(100), PLAYLIST, position)
+    cache.get("https://example.com/live/4.ts")
+    cache.update_playhead(PLAYLIST, 6, "viewer-a")
+    cache.update_playhead(PLAYLIST, 6, "viewer-b")
+
+    cache.put("https://example.com/live/7.ts", bytes(100), PLAYLIST, 7)
+
+    assert "https://example.com/live/4.ts" in cache
+    assert "https://example.com/live/5.ts" not in cache
+    assert cache.evictions_behind_playhead == 1
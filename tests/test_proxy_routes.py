@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException, Request
+
+from mediaflow_proxy.routes import proxy
+
+CONTEXT = {
+    "params": {
+        "init_url": "https://origin.example.com/v1/init.mp4",
+        "mime_type": "video/mp4",
+        "is_live": "false",
+        "h_authorization": "Bearer SECRET",
+    },
+    "media": "https://origin.example.com/v1/$Number$.m4s",
+}
+
+
+@pytest.fixture(autouse=True)
+def stream_contexts(monkeypatch):
+    async def get_stream_context(context_id):
+        return CONTEXT if context_id == "abc" else None
+
+    monkeypatch.setattr(proxy, "get_stream_context", get_stream_context)
+
+
+def expand(query_string: str) -> Request:
+    scope = {"type": "http", "method": "GET", "path": "/proxy/mpd/segment.mp4", "headers": []}
+    request = Request({**scope, "query_string": query_string.encode()})
+    asyncio.run(proxy.expand_stream_context(request))
+    return request
+
+
+def test_stream_context_restores_the_segment_parameters():
+    request = expand("ctx=abc&n=7&duration=2.000&api_password=pass&has_encrypted=True")
+
+    assert dict(request.query_params) == {
+        **CONTEXT["params"],
+        "segment_url": "https://origin.example.com/v1/7.m4s",
+        "duration": "2.000",
+        "api_password": "pass",
+        "has_encrypted": "True",
+    }
+
+
+@pytest.mark.parametrize("extra", ["init_url=https://attacker.example/x", "h_authorization=other", "key=00", "d=x"])
+def test_stream_context_rejects_other_parameters(extra):
+    with pytest.raises(HTTPException) as error:
+        expand(f"ctx=abc&n=7&{extra}")
+    assert error.value.status_code == 400
@@ -0,0 +1,46 @@
+import pytest
+
+from mediaflow_proxy.utils.range_cache import RangeCache, RangeSet
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return RangeCache(tmp_path, max_size=1024 * 1024, revalidate_interval=60, ignored_params=["sig", "Expires"])
+
+
+def test_range_set_merges_overlapping_and_adjacent_ranges():
+    ranges = RangeSet([(10, 20), (30, 40)])
+    ranges.add(20, 25)
+    ranges.add(50, 60)
+    ranges.add(35, 52)
+
+    assert ranges.ranges == [(10, 25), (30, 60)]
+    assert ranges.size == 45
+
+
+def test_range_set_splits_requests_into_cached_and_missing_pieces():
+    ranges = RangeSet([(10, 20), (30, 40)])
+
+    assert ranges.next_piece(0, 100) == (10, False)
+    assert ranges.next_piece(10, 100) == (20, True)
+    assert ranges.next_piece(15, 18) == (18, True)
+    assert ranges.next_piece(20, 100) == (30, False)
+    assert ranges.next_piece(40, 100) == (100, False)
+
+
+def test_resource_key_ignores_volatile_parameters(cache):
+    key = cache.resource_key("https://cdn.example.com/v.mp4?id=1&sig=a&Expires=1", {})
+
+    assert cache.resource_key("HTTPS://CDN.example.com/v.mp4?expires=2&sig=b&id=1", {}) == key
+    assert cache.resource_key("https://cdn.example.com/v.mp4?id=2&sig=a", {}) != key
+
+
+def test_resource_key_separates_credentials(cache):
+    url = "https://cdn.example.com/v.mp4"
+    anonymous = cache.resource_key(url, {"referer": "https://example.com/"})
+
+    assert cache.resource_key(url, {}) == anonymous
+    alice = cache.resource_key(url, {"authorization": "Bearer alice"})
+    bob = cache.resource_key(url, {"authorization": "Bearer bob"})
+    assert len({anonymous, alice, bob, cache.resource_key(url, {"cookie": "session=alice"})}) == 4
+    assert cache.resource_key(url, {"authorization": "Bearer alice", "range": "bytes=0-"}) == alice
@@ -0,0 +1,46 @@
+import asyncio
+
+from mediaflow_proxy.utils.slab_store import SlabStore
+
+RECORD = 300 * 1024
+
+
+def test_mostly_stale_slab_is_compacted_after_the_write_starting_a_new_one(tmp_path):
+    async def run():
+        store = SlabStore(tmp_path, max_size=8 * 1024 * 1024)
+        for i in range(6):
+            assert await store.set(f"k{i}", bytes([i]) * RECORD, expires_at=4e9)
+        for i in range(5):
+            await store.delete(f"k{i}")
+        assert store.get_stats()["slabs"] == 1
+
+        # The first slab is full, the next record starts a new one and leaves only k5 live in the first
+        assert await store.set("k6", b"\x06" * RECORD, expires_at=4e9)
+        compaction = store._compaction
+        assert compaction is not None
+        await compaction
+
+        k5 = await store.get("k5")
+        return store.get_stats(), bytes(k5.data), await store.get("k0")
+
+    stats, k5, k0 = asyncio.run(run())
+    assert stats["slabs"] == 1
+    assert stats["entries"] == 2
+    assert k5 == b"\x05" * RECORD
+    assert k0 is None
+
+
+def test_records_survive_a_restart(tmp_path):
+    async def write():
+        store = SlabStore(tmp_path, max_size=8 * 1024 * 1024)
+        await store.set("a", b"value", expires_at=4e9)
+        await store.set("b", b"gone", expires_at=4e9)
+        await store.delete("b")
+
+    async def read():
+        store = SlabStore(tmp_path, max_size=8 * 1024 * 1024)
+        a = await store.get("a")
+        return bytes(a.data), await store.get("b")
+
+    asyncio.run(write())
+    assert asyncio.run(read()) == (b"value", None)